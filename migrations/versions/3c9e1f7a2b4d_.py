@@ -0,0 +1,49 @@
+"""v3.11: Add table serialcounter
+
+Revision ID: 3c9e1f7a2b4d
+Revises: 7b2d4e6f8a1c
+Create Date: 2026-10-19 16:12:40.207113
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3c9e1f7a2b4d'
+down_revision = '7b2d4e6f8a1c'
+
+from alembic import op, context
+import sqlalchemy as sa
+from sqlalchemy.schema import Sequence, CreateSequence
+
+
+def dialect_supports_sequences():
+    migration_context = context.get_context()
+    return migration_context.dialect.supports_sequences
+
+
+def create_seq(seq):
+    if dialect_supports_sequences():
+        op.execute(CreateSequence(seq))
+
+
+def upgrade():
+    try:
+        seq = Sequence('serialcounter_seq')
+        try:
+            create_seq(seq)
+        except Exception as _e:
+            pass
+        op.create_table('serialcounter',
+        sa.Column('id', sa.Integer(), seq, nullable=False),
+        sa.Column('prefix', sa.Unicode(length=40), nullable=False),
+        sa.Column('value', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('prefix'),
+        mysql_row_format='DYNAMIC'
+        )
+    except Exception as exx:
+        print("Could not add table 'serialcounter' - probably already exists!")
+        print(exx)
+
+
+def downgrade():
+    op.drop_table('serialcounter')
@@ -0,0 +1,34 @@
+"""v3.11: Add the keyed digest column to the authcache table
+
+Revision ID: 5f8a3b1c9d2e
+Revises: 2100d1fad908
+Create Date: 2026-10-19 10:12:31.443152
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5f8a3b1c9d2e'
+down_revision = '2100d1fad908'
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.exc import OperationalError, ProgrammingError
+
+
+def upgrade():
+    try:
+        op.add_column('authcache', sa.Column('auth_digest', sa.Unicode(length=64), nullable=True))
+        op.create_index(op.f('ix_authcache_auth_digest'), 'authcache', ['auth_digest'], unique=False)
+    except (OperationalError, ProgrammingError) as exx:
+        if "already exists" in str(exx.orig).lower():
+            print("Ok, column 'auth_digest' already exists.")
+        else:
+            print(exx)
+    except Exception as exx:
+        print("Could not add column 'auth_digest' to table 'authcache'")
+        print(exx)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_authcache_auth_digest'), table_name='authcache')
+    op.drop_column('authcache', 'auth_digest')
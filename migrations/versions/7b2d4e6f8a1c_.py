@@ -0,0 +1,55 @@
+"""v3.11: Add table authcounter
+
+Revision ID: 7b2d4e6f8a1c
+Revises: 5f8a3b1c9d2e
+Create Date: 2026-10-19 14:02:11.518734
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '7b2d4e6f8a1c'
+down_revision = '5f8a3b1c9d2e'
+
+from alembic import op, context
+import sqlalchemy as sa
+from sqlalchemy.schema import Sequence, CreateSequence
+
+
+def dialect_supports_sequences():
+    migration_context = context.get_context()
+    return migration_context.dialect.supports_sequences
+
+
+def create_seq(seq):
+    if dialect_supports_sequences():
+        op.execute(CreateSequence(seq))
+
+
+def upgrade():
+    try:
+        seq = Sequence('authcounter_seq')
+        try:
+            create_seq(seq)
+        except Exception as _e:
+            pass
+        op.create_table('authcounter',
+        sa.Column('id', sa.Integer(), seq, nullable=False),
+        sa.Column('username', sa.Unicode(length=64), nullable=False),
+        sa.Column('realm', sa.Unicode(length=120), nullable=False),
+        sa.Column('resolver', sa.Unicode(length=120), nullable=False),
+        sa.Column('success', sa.Boolean(), nullable=False),
+        sa.Column('resolution', sa.Integer(), nullable=False),
+        sa.Column('bucket', sa.BigInteger(), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('username', 'realm', 'resolver', 'success',
+                            'resolution', 'bucket', name='acix_1'),
+        mysql_row_format='DYNAMIC'
+        )
+    except Exception as exx:
+        print("Could not add table 'authcounter' - probably already exists!")
+        print(exx)
+
+
+def downgrade():
+    op.drop_table('authcounter')
@@ -0,0 +1,32 @@
+"""v3.11: Add last_reset column to eventcounter table
+
+Revision ID: 8d4f2a6c1e3b
+Revises: 3c9e1f7a2b4d
+Create Date: 2026-10-20 09:14:52.318206
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '8d4f2a6c1e3b'
+down_revision = '3c9e1f7a2b4d'
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.exc import OperationalError, ProgrammingError, InternalError
+
+
+def upgrade():
+    try:
+        op.add_column('eventcounter', sa.Column('last_reset', sa.DateTime(), nullable=True))
+    except (OperationalError, ProgrammingError, InternalError) as exx:
+        if "duplicate column name" in str(exx.orig).lower():
+            print("Good. Column last_reset already exists.")
+        else:
+            print(exx)
+    except Exception as exx:
+        print("Could not add the column 'last_reset' to table 'eventcounter'")
+        print(exx)
+
+
+def downgrade():
+    op.drop_column('eventcounter', 'last_reset')
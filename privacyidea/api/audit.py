@@ -58,6 +58,10 @@ def search_audit():
 
     :httpparam timelimit: A timelimit, that limits the recent audit entries.
         This param gets overwritten by a policy auditlog_age. Can be 1d, 1m, 1h.
+    :httpparam lazy_verify: If set to "1", the response does not wait for the
+        verification of the signatures. Entries, whose signature is verified in
+        the background, have the ``sig_check`` "PENDING". This requires
+        ``PI_AUDIT_VERIFY_CACHE_SIZE``.
 
     **Example request**:
 
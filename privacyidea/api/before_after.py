@@ -36,9 +36,12 @@ from flask import current_app
 from privacyidea.lib.policy import PolicyClass
 from privacyidea.lib.event import EventConfiguration
 from privacyidea.lib.lifecycle import call_finalizers
+from privacyidea.lib.profiling import (start_request_profile, finish_request_profile,
+                                       get_request_profile, measure, PHASE)
 from privacyidea.api.auth import (user_required, admin_required, jwtauth)
 from privacyidea.lib.config import get_from_config, SYSCONF, ensure_no_config_object, get_privacyidea_node
-from privacyidea.lib.token import get_token_type, get_token_owner
+from privacyidea.lib.token import (get_token_type, get_token_owner, enable_token_identity_map,
+                                   disable_token_identity_map)
 from privacyidea.api.ttype import ttype_blueprint
 from privacyidea.api.validate import validate_blueprint
 from .resolver import resolver_blueprint
@@ -85,19 +88,34 @@ log = logging.getLogger(__name__)
 def log_begin_request():
     log.debug("Begin handling of request {!r}".format(request.full_path))
     g.startdate = datetime.datetime.now()
+    start_request_profile()
+
+
+@token_blueprint.after_app_request
+def add_server_timing(response):
+    profile = get_request_profile()
+    if profile and get_app_config_value("PI_PROFILING_SERVER_TIMING", False):
+        response.headers["Server-Timing"] = profile.get_server_timing()
+    return response
 
 
 @token_blueprint.teardown_app_request
 def teardown_request(exc):
     try:
         if g.audit_object.has_data:
-            g.audit_object.finalize_log()
+            with measure(PHASE.AUDIT):
+                g.audit_object.finalize_log()
     except AttributeError:
         # In certain error cases the before_request was not handled
         # completely so that we do not have an audit_object
         # Also during calling webui, there is not audit_object, yet.
         pass
     call_finalizers()
+    disable_token_identity_map()
+    if request.url_rule:
+        finish_request_profile("{0!s} {1!s}".format(request.method, request.url_rule.rule))
+    else:
+        finish_request_profile("{0!s} unknown".format(request.method))
     log.debug("End handling of request {!r}".format(request.full_path))
 
 
@@ -156,6 +174,8 @@ def before_request():
     # remove session from param and gather all parameters, either
     # from the Form data or from JSON in the request body.
     ensure_no_config_object()
+    # Tokens are only loaded once per request
+    enable_token_identity_map()
     request.all_data = get_all_params(request)
     if g.logged_in_user.get("role") == "user":
         # A user is calling this API. First thing we do is restricting the user parameter.
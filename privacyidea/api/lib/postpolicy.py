@@ -57,7 +57,7 @@ import functools
 import json
 import re
 import netaddr
-from privacyidea.lib.crypto import Sign
+from privacyidea.lib.crypto import get_sign_object
 from privacyidea.api.lib.utils import get_all_params
 from privacyidea.lib.auth import ROLE
 from privacyidea.lib.user import User
@@ -176,10 +176,10 @@ def sign_response(request, response):
     # Disable the costly checking of private RSA keys when loading them.
     check_private_key = not current_app.config.get("PI_RESPONSE_NO_PRIVATE_KEY_CHECK", False)
     try:
-        with open(priv_file_name, 'rb') as priv_file:
-            priv_key = priv_file.read()
-        sign_object = Sign(priv_key, public_key=None,
-                           check_private_key=check_private_key)
+        if not priv_file_name:
+            raise IOError("No private key file configured.")
+        sign_object = get_sign_object(priv_file_name,
+                                      check_private_key=check_private_key)
     except (IOError, ValueError, TypeError) as e:
         log.info('Could not load private key from '
                  'file {0!s}: {1!r}!'.format(priv_file_name, e))
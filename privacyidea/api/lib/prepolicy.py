@@ -890,6 +890,7 @@ def check_max_token_realm(request=None, action=None):
 
     This decorator can wrap:
         /token/init  (with a realm and user)
+        /token/bulkinit  (with the tokenrealms and the count of the tokens)
         /token/assign
         /token/tokenrealms
 
@@ -902,20 +903,27 @@ def check_max_token_realm(request=None, action=None):
     ERROR = "The number of tokens in this realm is limited!"
     params = request.all_data
     user_object = get_user_from_param(params)
+    new_tokens = 1
     if user_object:
-        realm = user_object.realm
+        realms = [user_object.realm]
+    elif params.get("tokenrealms"):
+        # A number of tokens is enrolled into the token realms
+        realms = [r.strip() for r in params.get("tokenrealms").split(",")]
+        count = str(params.get("count") or "1")
+        new_tokens = int(count) if count.isdigit() else 1
     else:  # pragma: no cover
-        realm = params.get("realm")
+        realms = [params.get("realm")]
 
-    if realm:
+    for realm in realms:
+        if not realm:
+            continue
         limit_list = Match.realm(g, scope=SCOPE.ENROLL, action=ACTION.MAXTOKENREALM,
                                  realm=realm).action_values(unique=False, write_to_audit_log=False)
         if limit_list:
             # we need to check how many tokens the realm already has assigned!
-            tokenobject_list = get_tokens(realm=realm)
-            already_assigned_tokens = len(tokenobject_list)
+            already_assigned_tokens = get_tokens(realm=realm, count=True)
             max_value = max([int(x) for x in limit_list])
-            if already_assigned_tokens >= max_value:
+            if already_assigned_tokens + new_tokens > max_value:
                 g.audit_object.add_policy(limit_list.get(str(max_value)))
                 raise PolicyError(ERROR)
     return True
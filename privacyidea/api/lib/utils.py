@@ -35,10 +35,11 @@ import logging
 import json
 import jwt
 import threading
+import traceback
 import re
 from copy import copy
 from urllib.parse import unquote
-from flask import (jsonify,
+from flask import (jsonify, json, Response, stream_with_context,
                    current_app)
 
 log = logging.getLogger(__name__)
@@ -118,6 +119,49 @@ def send_result(obj, rid=1, details=None):
     return jsonify(prepare_result(obj, rid, details))
 
 
+def send_result_stream(iterable, rid=1, details=None):
+    """
+    Return a json result document like ``send_result``, whose value is a list
+    with the items of ``iterable``. The document is streamed, so that the
+    items are serialized one after another and do not need to be held in
+    memory at the same time.
+
+    The status is written after the value. If the iterable raises an
+    exception, the list is closed and the document contains the status
+    ``false`` and the error, like a document of ``send_error``. The HTTP
+    status code has already been sent at this point, so it remains 200.
+
+    :param iterable: iterable of simple result objects like dicts
+    :param rid: id value, for future versions
+    :type rid: int
+    :param details: optional parameter, which allows to provide more detail
+    :type  details: None or simple type like dict, list or string/unicode
+
+    :return: streamed response
+    """
+    placeholder = "__STREAMED_VALUE__"
+    res = prepare_result(placeholder, rid, details)
+    res["result"]["status"] = res["result"].pop("status")
+    prefix, suffix = json.dumps(res, sort_keys=False).split(json.dumps(placeholder), 1)
+
+    def generate():
+        yield prefix + "["
+        try:
+            for i, item in enumerate(iterable):
+                yield ("," if i else "") + json.dumps(item)
+        except Exception as e:
+            log.error("Could not write the streamed result: {0!r}".format(e))
+            log.debug("{0!s}".format(traceback.format_exc()))
+            res["result"]["status"] = False
+            res["result"]["error"] = {"code": getattr(e, "id", -500),
+                                      "message": str(e)}
+            yield "]" + json.dumps(res, sort_keys=False).split(json.dumps(placeholder), 1)[1]
+        else:
+            yield "]" + suffix
+
+    return Response(stream_with_context(generate()), mimetype="application/json")
+
+
 def send_error(errstring, rid=1, context=None, error_code=-311, details=None):
     """
     sendError - return a json error result document
@@ -28,6 +28,7 @@ from privacyidea.lib.utils import parse_legacy_time
 from privacyidea.lib.log import log_with
 from privacyidea.lib.monitoringstats import (get_stats_keys, get_values,
                                    get_last_value, delete_stats)
+from privacyidea.lib.profiling import get_profile_statistics
 from privacyidea.lib.tokenclass import AUTH_DATE_FORMAT
 from flask import g
 import logging
@@ -40,6 +41,27 @@ log = logging.getLogger(__name__)
 monitoring_blueprint = Blueprint('monitoring_blueprint', __name__)
 
 
+@monitoring_blueprint.route('/profiling/requests', methods=['GET'])
+@log_with(log)
+@prepolicy(check_base_action, request, ACTION.STATISTICSREAD)
+def get_profiling():
+    """
+    Return the request timings of this worker process, if ``PI_PROFILING``
+    is set in ``pi.cfg``.
+
+    For each endpoint the number of requests, the number of SQL queries and
+    a histogram of the durations (in milliseconds) of the phases
+    *policy*, *resolver*, *event*, *audit*, *db* and *total* are returned.
+    The list *slow_requests* contains the timings of the last requests, that
+    took longer than ``PI_PROFILING_SLOW_REQUEST`` milliseconds.
+
+    .. note:: The statistics are kept in the memory of each worker process.
+       So the result depends on the process, which handles the request.
+    """
+    g.audit_object.log({"success": True})
+    return send_result(get_profile_statistics().get())
+
+
 @monitoring_blueprint.route('/', methods=['GET'])
 @monitoring_blueprint.route('/<stats_key>', methods=['GET'])
 @log_with(log)
@@ -40,7 +40,9 @@ from .lib.utils import (getParam,
 from ..lib.log import log_with
 from ..lib.resolver import (get_resolver_list,
                             save_resolver,
-                            delete_resolver, pretestresolver)
+                            delete_resolver, pretestresolver,
+                            get_resolver_cache_statistics,
+                            clear_resolver_cache)
 from flask import g
 import logging
 from ..api.lib.prepolicy import prepolicy, check_base_action
@@ -175,6 +177,62 @@ def delete_resolver_api(resolver=None):
     return send_result(res)
 
 
+@resolver_blueprint.route('/<resolver>/cache', methods=['GET'])
+@log_with(log)
+@prepolicy(check_base_action, request, ACTION.RESOLVERREAD)
+def get_resolver_cache_api(resolver=None):
+    """
+    Return the statistics of the user cache of a resolver in the current
+    worker process, i.e. the number of cached entries, hits, misses and
+    evictions per cached function. Only the LDAP resolver has such a cache.
+
+    :param resolver: the name of the resolver
+    :return: json with the cache statistics
+
+    **Example response**:
+
+       .. sourcecode:: http
+
+           HTTP/1.1 200 OK
+           Content-Type: application/json
+
+            {
+              "id": 1,
+              "jsonrpc": "2.0",
+              "result": {
+                "status": true,
+                "value": {
+                  "getUserId": {"size": 1, "maxsize": 10000, "hits": 12,
+                                "misses": 1, "evictions": 0, "expirations": 0}
+                }
+              },
+              "version": "privacyIDEA unknown"
+            }
+    """
+    res = get_resolver_cache_statistics(resolver)
+    g.audit_object.log({"success": True,
+                        "info": resolver})
+    return send_result(res)
+
+
+@resolver_blueprint.route('/<resolver>/cache', methods=['DELETE'])
+@log_with(log)
+@prepolicy(check_base_action, request, ACTION.RESOLVERWRITE)
+def clear_resolver_cache_api(resolver=None):
+    """
+    Flush the user cache of a resolver. The in-memory cache is only flushed
+    in the worker process, which handles this request. Entries of the user
+    cache in the database are deleted for all processes.
+
+    :param resolver: the name of the resolver
+    :return: json with success or fail
+    """
+    res = clear_resolver_cache(resolver)
+    g.audit_object.log({"success": res,
+                        "info": resolver})
+    return send_result(res)
+
+
 @resolver_blueprint.route('/test', methods=["POST"])
 @log_with(log)
 @prepolicy(check_base_action, request, ACTION.RESOLVERWRITE)
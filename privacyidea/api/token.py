@@ -66,19 +66,22 @@ from ..lib.token import (init_token, get_tokens_paginate, assign_token,
                          set_sync_window, set_count_auth,
                          set_hashlib, set_max_failcount, set_realms,
                          copy_token_user, copy_token_pin, lost_token,
-                         get_serial_by_otp, get_tokens,
+                         get_tokens,
                          set_validity_period_end, set_validity_period_start, add_tokeninfo,
-                         delete_tokeninfo, import_token,
+                         delete_tokeninfo, import_token, init_tokens_bulk,
                          assign_tokengroup, unassign_tokengroup, set_tokengroups)
 from werkzeug.datastructures import FileStorage
 from cgi import FieldStorage
 from privacyidea.lib.error import (ParameterError, TokenAdminError)
+from privacyidea.lib.framework import get_app_config_value
 from privacyidea.lib.importotp import (parseOATHcsv, parseSafeNetXML,
                                        parseYubicoCSV, parsePSKCdata, GPGImport)
 import logging
 from privacyidea.lib.utils import to_unicode
 from privacyidea.lib.policy import ACTION
 from privacyidea.lib.challenge import get_challenges_paginate
+from privacyidea.lib.otpsearch import find_serials_by_otp
+from privacyidea.lib import _
 from privacyidea.api.lib.prepolicy import (prepolicy, check_base_action,
                                            check_token_init, check_token_upload,
                                            check_max_token_user,
@@ -110,6 +113,9 @@ from privacyidea.lib.subscriptions import CheckSubscription
 token_blueprint = Blueprint('token_blueprint', __name__)
 log = logging.getLogger(__name__)
 
+# The maximum number of tokens, which can be enrolled with /token/bulkinit
+DEFAULT_BULKINIT_MAX_TOKENS = 1000
+
 __doc__ = """
 The token API can be accessed via /token.
 
@@ -1042,6 +1048,86 @@ def loadtokens_api(filename=None):
     return send_result({'n_imported': len(TOKENS), 'n_not_imported': len(not_imported_serials)})
 
 
+@token_blueprint.route('/bulkinit', methods=['POST'])
+@admin_required
+@log_with(log, log_exit=False)
+@prepolicy(check_max_token_realm, request)
+@prepolicy(require_description, request)
+@prepolicy(check_token_init, request)
+@prepolicy(check_token_upload, request)
+@prepolicy(init_token_defaults, request)
+@prepolicy(init_token_length_contents, request)
+@event("token_bulkinit", request, g)
+def bulkinit_api():
+    """
+    Enroll a number of unassigned HOTP or TOTP tokens with generated OTP keys
+    at once, e.g. to create the tokens of new hardware. The serials and OTP
+    keys of the tokens are returned, so that they can be written to the
+    devices.
+
+    The administrator needs the right to enroll the token type and to import
+    tokens into the given realms. As with ``/token/init`` the policies
+    ``max_token_per_realm``, ``require_description`` and the default settings
+    of the token type are applied.
+
+    :jsonparam count: The number of tokens. At most ``PI_BULKINIT_MAX_TOKENS``
+        (default 1000) tokens can be enrolled at once.
+    :jsonparam type: The token type "hotp" or "totp". Defaults to "hotp".
+    :jsonparam prefix: The prefix of the serials
+    :jsonparam tokenrealms: comma separated list of realms.
+    :jsonparam tokenkind: The kind of the tokens like "hardware"
+    :jsonparam otplen: The OTP length of the tokens
+    :jsonparam hashlib: The hash algorithm of the tokens
+    :jsonparam timeStep: The time step of TOTP tokens
+    :jsonparam description: The description of the tokens
+    :return: The number of tokens and the list of the serials and OTP keys
+
+    **Example response**:
+
+       .. sourcecode:: http
+
+           HTTP/1.1 200 OK
+           Content-Type: application/json
+
+            {
+              "id": 1,
+              "jsonrpc": "2.0",
+              "result": {
+                "status": true,
+                "value": {
+                  "count": 2,
+                  "tokens": [{"serial": "OATH0001A1B2", "otpkey": "3132..."},
+                             {"serial": "OATH0002C3D4", "otpkey": "3334..."}]
+                }
+              },
+              "version": "privacyIDEA unknown"
+            }
+    """
+    try:
+        count = int(getParam(request.all_data, "count", required))
+    except ValueError:
+        raise ParameterError(_("The number of tokens must be an integer."))
+    max_count = int(get_app_config_value("PI_BULKINIT_MAX_TOKENS", DEFAULT_BULKINIT_MAX_TOKENS))
+    if count > max_count:
+        raise ParameterError(_("At most {0!s} tokens can be enrolled at once.").format(max_count))
+    trealms = getParam(request.all_data, "tokenrealms") or ""
+    tokenrealms = trealms.split(",") if trealms else []
+    tokenkind = getParam(request.all_data, "tokenkind")
+    param = {key: value for key, value in request.all_data.items()
+             if key not in ["count", "tokenrealms", "tokenkind"]}
+
+    tokens = init_tokens_bulk(count, param=param, tokenrealms=tokenrealms,
+                              tokenkind=tokenkind)
+
+    g.audit_object.log({'info': "{0!s} (enrolled: {1:d})".format(param.get("type") or "hotp",
+                                                                 len(tokens)),
+                        'serial': ', '.join(serial for serial, _otpkey in tokens),
+                        'success': True})
+    return send_result({"count": len(tokens),
+                        "tokens": [{"serial": serial, "otpkey": otpkey}
+                                   for serial, otpkey in tokens]})
+
+
 @token_blueprint.route('/copypin', methods=['POST'])
 @admin_required
 @log_with(log)
@@ -1144,7 +1230,9 @@ def get_serial_by_otp_api(otp=None):
         searched
     :query serial: This can be a substring of serial numbers to search in.
     :query window: The number of OTP look ahead (default=10)
-    :return: The serial number of the token found
+    :return: The serial number of the token found, the number of tokens, the
+        number of searched tokens and whether all tokens were searched
+        before the time limit ``PI_GETSERIAL_TIMEOUT`` was reached
     """
     ttype = getParam(request.all_data, "type")
     unassigned_param = getParam(request.all_data, "unassigned")
@@ -1164,18 +1252,28 @@ def get_serial_by_otp_api(otp=None):
 
     count = get_tokens(tokentype=ttype, serial_wildcard="*{0!s}*".format(
             serial_substr), assigned=assigned, count=True)
+    result = {"serial": serial,
+              "count": count}
     if not count_only:
-        tokenobj_list = get_tokens(tokentype=ttype,
-                                   serial_wildcard="*{0!s}*".format(serial_substr),
-                                   assigned=assigned)
-        serial = get_serial_by_otp(tokenobj_list, otp=otp, window=window)
+        # The tokens are searched page by page and the search stops, if a
+        # second matching token is found
+        search = find_serials_by_otp(otp, window=window, tokentype=ttype,
+                                     serial_wildcard="*{0!s}*".format(serial_substr),
+                                     assigned=assigned, max_matches=2)
+        if len(search["serials"]) > 1:
+            raise TokenAdminError(_('multiple tokens are matching this OTP value!'),
+                                  id=1200)
+        if search["serials"]:
+            serial = search["serials"][0]
+        result.update({"serial": serial,
+                       "searched": search["searched"],
+                       "complete": search["complete"]})
 
     g.audit_object.log({"success": True,
                         "info": "get {0!s} by OTP. {1!s} tokens".format(
                             serial, count)})
 
-    return send_result({"serial": serial,
-                        "count": count})
+    return send_result(result)
 
 
 @token_blueprint.route('/info/<serial>/<key>', methods=['POST'])
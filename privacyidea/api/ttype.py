@@ -45,6 +45,7 @@ from privacyidea.lib.audit import getAudit
 from privacyidea.lib.config import (get_token_class, get_from_config,
                                     SYSCONF, ensure_no_config_object, get_privacyidea_node)
 from privacyidea.lib.user import get_user_from_param
+from privacyidea.lib.token import enable_token_identity_map
 from privacyidea.lib.utils import get_client_ip, get_plugin_info_from_useragent
 import json
 
@@ -59,6 +60,7 @@ def before_request():
     This is executed before the request
     """
     ensure_no_config_object()
+    enable_token_identity_map()
     request.all_data = get_all_params(request)
     privacyidea_server = get_app_config_value("PI_AUDIT_SERVERNAME", get_privacyidea_node(request.host))
     # Create a policy_object, that reads the database audit settings
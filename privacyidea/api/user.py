@@ -26,7 +26,7 @@
 from flask import (Blueprint,
                    request)
 from .lib.utils import (getParam,
-                        send_result)
+                        send_result, send_result_stream)
 from ..api.lib.prepolicy import (prepolicy, check_base_action, realmadmin,
                                  check_custom_user_attributes)
 from ..lib.policy import ACTION, get_allowed_custom_attributes
@@ -36,7 +36,9 @@ from privacyidea.lib.event import event
 
 
 from flask import (g)
-from ..lib.user import get_user_list
+from ..lib.user import get_user_list, iter_user_list
+from ..lib.utils import is_true
+from ..lib.framework import get_app_config_value
 import logging
 
 
@@ -61,6 +63,14 @@ def get_users():
     :param realm: a realm that contains several resolvers. Only show users
                   from this realm
     :param resolver: a distinct resolvername
+    :param stream: Set to "1" to stream the userlist. The response has the
+                   same format, but the users are written to the response
+                   resolver by resolver instead of collecting all users
+                   before the response is sent. Since the signature of the
+                   response needs the complete document, the response is
+                   only streamed if ``PI_NO_RESPONSE_SIGN`` is set. If an
+                   error occurs while the list is written, the document
+                   ends with the status ``false`` and the error.
     :param <searchexpr>: a search expression, that depends on the ResolverClass
     
     :return: json result with "result": true and the userlist in "value".
@@ -102,9 +112,15 @@ def get_users():
           "version": "privacyIDEA unknown"
         }
     """
-    realm = getParam(request.all_data, "realm")
+    param = request.all_data.copy()
+    realm = getParam(param, "realm")
+    stream = is_true(param.pop("stream", False)) and get_app_config_value("PI_NO_RESPONSE_SIGN", False)
     attr = is_attribute_at_all()
-    users = get_user_list(request.all_data, custom_attributes=attr)
+    if stream:
+        g.audit_object.log({'info': "realm: {0!s}".format(realm)})
+        return send_result_stream(_audited_user_list(param, attr))
+
+    users = get_user_list(param, custom_attributes=attr)
 
     g.audit_object.log({'success': True,
                         'info': "realm: {0!s}".format(realm)})
@@ -112,6 +128,16 @@ def get_users():
     return send_result(users)
 
 
+def _audited_user_list(param, custom_attributes):
+    """
+    Yield the users of ``iter_user_list``. The request is audited as
+    successful, when all users have been written to the response.
+    """
+    for user in iter_user_list(param, custom_attributes=custom_attributes):
+        yield user
+    g.audit_object.log({'success': True})
+
+
 @user_blueprint.route('/attribute', methods=['POST'])
 @prepolicy(check_custom_user_attributes, request, "set")
 @user_required
@@ -109,7 +109,7 @@ from privacyidea.lib.challenge import get_challenges, extract_answered_challenge
 from privacyidea.lib.subscriptions import CheckSubscription
 from privacyidea.api.auth import admin_required
 from privacyidea.lib.policy import ACTION
-from privacyidea.lib.token import get_tokens
+from privacyidea.lib.token import get_tokens, enable_token_identity_map
 from privacyidea.lib.machine import list_machine_tokens
 from privacyidea.lib.applications.offline import MachineApplication
 import json
@@ -129,6 +129,7 @@ def before_request():
     This is executed before the request
     """
     ensure_no_config_object()
+    enable_token_identity_map()
     request.all_data = get_all_params(request)
     request.User = get_user_from_param(request.all_data)
     privacyidea_server = get_app_config_value("PI_AUDIT_SERVERNAME", get_privacyidea_node(request.host))
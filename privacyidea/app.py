@@ -69,6 +69,7 @@ from privacyidea.lib.log import DEFAULT_LOGGING_CONFIG
 from privacyidea.config import config
 from privacyidea.models import db, NodeName
 from privacyidea.lib.crypto import init_hsm
+from privacyidea.lib.profiling import register_sql_events
 
 
 ENV_KEY = "PRIVACYIDEA_CONFIGFILE"
@@ -234,6 +235,9 @@ def create_app(config_name="development",
 
     queue.register_app(app)
 
+    if app.config.get("PI_PROFILING"):
+        register_sql_events()
+
     if initialize_hsm:
         with app.app_context():
             init_hsm()
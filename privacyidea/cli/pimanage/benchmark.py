@@ -0,0 +1,129 @@
+# SPDX-License-Identifier: AGPL-3.0-or-later
+#
+# Info: https://privacyidea.org
+#
+# This code is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public License
+# as published by the Free Software Foundation, either
+# version 3 of the License, or any later version.
+#
+# This code is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import time
+import click
+from flask.cli import AppGroup
+
+benchmark_cli = AppGroup("benchmark", help="Measure the performance of CPU intensive operations")
+
+
+def _measure(func, *args):
+    """
+    Call the function with the given arguments and return the elapsed time
+    in milliseconds.
+    """
+    start = time.perf_counter()
+    func(*args)
+    return (time.perf_counter() - start) * 1000
+
+
+@benchmark_cli.command("offline")
+@click.option('-a', '--amount', type=int, multiple=True, default=[10, 100],
+              show_default=True, help="Number of offline OTP values. Can be given multiple times.")
+@click.option('-r', '--rounds', type=int, multiple=True, default=[6549],
+              show_default=True, help="Number of PBKDF2 rounds. Can be given multiple times.")
+def offline_benchmark(amount, rounds):
+    """
+    Measure the hashing of offline OTP values for all combinations of amount
+    and rounds. The hashing uses the thread pool configured with
+    PI_OFFLINE_HASH_WORKERS.
+    """
+    from privacyidea.lib.applications.offline import MachineApplication
+    for r in rounds:
+        for a in amount:
+            otps = {counter: "{0:06d}".format(counter) for counter in range(a)}
+            # Use a new serial for each run, so that no precomputed hashes are used
+            serial = "BENCHMARK-{0!s}-{1!s}".format(a, r)
+            elapsed = _measure(MachineApplication._hash_otps, serial, otps, "pin", r)
+            click.echo("amount={0:>6d} rounds={1:>8d}: {2:10.1f} ms".format(a, r, elapsed))
+
+
+@benchmark_cli.command("pin")
+@click.option('-t', '--tokens', type=int, multiple=True, default=[1, 5, 10],
+              show_default=True, help="Number of tokens of a user. Can be given multiple times.")
+@click.option('-r', '--rounds', type=int, multiple=True, default=[9],
+              show_default=True, help="Number of argon2 rounds. Can be given multiple times.")
+@click.option('-m', '--memory', type=int, multiple=True, default=[65536],
+              show_default=True, help="argon2 memory cost in KiB. Can be given multiple times.")
+@click.option('-w', '--workers', type=int,
+              help="Number of worker threads. Defaults to PI_PIN_VERIFY_WORKERS.")
+def pin_benchmark(tokens, rounds, memory, workers):
+    """
+    Measure the verification of the token PINs during an authentication for
+    all combinations of the number of tokens and the argon2 parameters. Each
+    PIN is verified one after another and in parallel in the thread pool
+    configured with PI_PIN_VERIFY_WORKERS.
+    """
+    from flask import current_app
+    from passlib.context import CryptContext
+    from privacyidea.lib.crypto import verify_pass_hash, verify_pass_hashes, forget_pass_hashes
+    if workers:
+        current_app.config["PI_PIN_VERIFY_WORKERS"] = workers
+
+    def verify_sequential(candidates):
+        for candidate in candidates:
+            verify_pass_hash(*candidate)
+
+    for r in rounds:
+        for m in memory:
+            pass_ctx = CryptContext(["argon2"], argon2__rounds=r, argon2__memory_cost=m)
+            for t in tokens:
+                # The password does not match any PIN, so that all hashes are verified
+                candidates = [("benchmark", pass_ctx.hash("pin{0!s}".format(i))) for i in range(t)]
+                sequential = _measure(verify_sequential, candidates)
+                parallel = _measure(verify_pass_hashes, candidates)
+                forget_pass_hashes()
+                click.echo("tokens={0:>4d} rounds={1:>4d} memory={2:>8d}: "
+                           "sequential {3:10.1f} ms, parallel {4:10.1f} ms".format(t, r, m, sequential, parallel))
+
+
+@benchmark_cli.command("sign")
+@click.option('-n', '--number', type=int, default=100, show_default=True,
+              help="Number of signatures to create and verify.")
+def sign_benchmark(number):
+    """
+    Measure the loading of the signing keys and the creation and
+    verification of signatures for RSA (2048 bit), Ed25519 and ECDSA (P-256)
+    keys. The keys are created in memory.
+    """
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa, ec, ed25519
+    from privacyidea.lib.crypto import Sign
+    keys = [("rsa", rsa.generate_private_key(public_exponent=65537, key_size=2048)),
+            ("ed25519", ed25519.Ed25519PrivateKey.generate()),
+            ("ecdsa", ec.generate_private_key(ec.SECP256R1()))]
+    message = "privacyIDEA benchmark " * 10
+
+    def sign_and_verify(sign_object):
+        for _i in range(number):
+            sign_object.verify(message, sign_object.sign(message))
+
+    for name, key in keys:
+        priv_pem = key.private_bytes(encoding=serialization.Encoding.PEM,
+                                     format=serialization.PrivateFormat.PKCS8,
+                                     encryption_algorithm=serialization.NoEncryption())
+        pub_pem = key.public_key().public_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PublicFormat.SubjectPublicKeyInfo)
+        load_checked = _measure(Sign, priv_pem, pub_pem, True)
+        load = _measure(Sign, priv_pem, pub_pem, False)
+        sign_object = Sign(priv_pem, pub_pem, check_private_key=False)
+        elapsed = _measure(sign_and_verify, sign_object)
+        click.echo("{0:<8s}: load {1:8.2f} ms, load without check {2:8.2f} ms, "
+                   "{3:d} x sign and verify {4:10.1f} ms".format(name, load_checked, load,
+                                                                 number, elapsed))
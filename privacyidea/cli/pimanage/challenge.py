@@ -18,12 +18,10 @@
 # License along with this program. If not, see <http://www.gnu.org/licenses/>.
 
 import datetime
-import dateutil.tz
 import click
 from flask.cli import AppGroup
 
-from privacyidea.models import Challenge, db
-from privacyidea.lib.sqlutils import delete_matching_rows
+from privacyidea.lib.challenge import get_challenge_store
 
 
 challenge_cli = AppGroup("challenge", help="Manage challenge data")
@@ -40,25 +38,23 @@ challenge_cli = AppGroup("challenge", help="Manage challenge data")
               help="Do not actually delete, only show what would be done.")
 def cleanup_challenge(chunksize, age, dryrun=False):
     """
-    Delete all expired challenges from the challenge table
+    Delete all expired challenges from the challenge store
     """
     if chunksize is not None:
         chunksize = int(chunksize)
 
+    created_before = None
     if age:
         # Delete challenges created earlier than age minutes ago
-        now = datetime.datetime.utcnow() - datetime.timedelta(minutes=age)
-        click.echo("Deleting challenges older than {0!s}".format(now))
-        criterion = Challenge.timestamp < now
+        created_before = datetime.datetime.utcnow() - datetime.timedelta(minutes=age)
+        click.echo("Deleting challenges older than {0!s}".format(created_before))
     else:
         # Delete expired challenges
         click.echo("Deleting expired challenges.")
-        now = datetime.datetime.now(tz=dateutil.tz.tzlocal())
-        criterion = Challenge.expiration < now
 
+    r = get_challenge_store().delete_expired(created_before=created_before,
+                                             chunksize=chunksize, dryrun=dryrun)
     if dryrun:
-        r = Challenge.query.filter(criterion).count()
         click.echo("Would delete {0!s} challenge entries.".format(r))
     else:
-        r = delete_matching_rows(db.session, Challenge.__table__, criterion, chunksize)
         click.echo("{0!s} entries deleted.".format(r))
@@ -23,7 +23,7 @@ import pathlib
 import sys
 import click
 from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.asymmetric import rsa, ec, ed25519
 from cryptography.hazmat.primitives import serialization
 from flask.cli import AppGroup
 from flask import current_app
@@ -147,27 +147,43 @@ def create_pgp_keys(ctx, keysize, force):
 
 
 @setup_cli.command("create_audit_keys")
-@click.option("-k", "--keysize", type=int, default=2048, show_default=True,
-              help="Create keys with the given size in bits")
+@click.option("-k", "--keysize", type=int,
+              help="Create RSA keys with the given size in bits  [default: 2048]")
+@click.option("-t", "--keytype", type=click.Choice(["rsa", "ed25519", "ecdsa"],
+                                                   case_sensitive=False),
+              default="rsa", show_default=True,
+              help="The type of the keys. Ed25519 and ECDSA (P-256) keys are "
+                   "faster to load and to sign with than RSA keys, but clients "
+                   "may only verify RSA signatures of the responses.")
 @click.pass_context
-def create_audit_keys(ctx, keysize):
+def create_audit_keys(ctx, keysize, keytype):
     """
-    Create the RSA signing keys for the audit log.
+    Create the signing keys for the audit log and the responses.
 
-    You may specify a different key size.
+    You may specify a different key size for RSA keys.
     The default key size is 2048 bit.
     """
+    keytype = keytype.lower()
+    if keysize and keytype != "rsa":
+        click.secho("The key size can only be given for RSA keys.", fg="red")
+        ctx.exit(1)
     priv_key = pathlib.Path(current_app.config.get("PI_AUDIT_KEY_PRIVATE"))
     if priv_key.is_file():
         click.secho(f"The file \n\t{priv_key}\nalready exist. We do not overwrite it!",
                     fg="yellow")
         ctx.exit(1)
-    new_key = rsa.generate_private_key(public_exponent=65537,
-                                       key_size=keysize,
-                                       backend=default_backend())
+    if keytype == "ed25519":
+        new_key = ed25519.Ed25519PrivateKey.generate()
+    elif keytype == "ecdsa":
+        new_key = ec.generate_private_key(ec.SECP256R1(), backend=default_backend())
+    else:
+        new_key = rsa.generate_private_key(public_exponent=65537,
+                                           key_size=keysize or 2048,
+                                           backend=default_backend())
     priv_pem = new_key.private_bytes(
         encoding=serialization.Encoding.PEM,
-        format=serialization.PrivateFormat.TraditionalOpenSSL,
+        format=(serialization.PrivateFormat.TraditionalOpenSSL if keytype == "rsa"
+                else serialization.PrivateFormat.PKCS8),
         encryption_algorithm=serialization.NoEncryption())
     with open(priv_key, "wb") as f:
         f.write(priv_pem)
@@ -184,6 +200,10 @@ def create_audit_keys(ctx, keysize):
     priv_key.chmod(0o400)
     click.secho(f"The file permission of {priv_key} was set to 400!", fg="yellow")
     click.secho("Please ensure, that it is owned by the right user.", fg="yellow")
+    if keytype != "rsa" and not current_app.config.get("PI_NO_RESPONSE_SIGN"):
+        click.secho("The key also signs the responses. Please ensure, that your "
+                    "clients can verify {0!s} signatures.".format(keytype.upper()),
+                    fg="yellow")
 
 
 @setup_cli.command("create_tables")
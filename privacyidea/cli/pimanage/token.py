@@ -19,7 +19,7 @@
 """CLI commands for managing tokens"""
 import click
 from flask.cli import AppGroup
-from privacyidea.lib.token import import_token
+from privacyidea.lib.token import import_token, init_tokens_bulk, BULK_TOKEN_TYPES
 from privacyidea.lib.importotp import parseOATHcsv
 
 
@@ -44,3 +44,45 @@ def import_tokens(file, tokenrealm):
         print(u"{0!s}/{1!s} Importing token {2!s}".format(i, len(tokens), serial))
 
         import_token(serial, tokens[serial], tokenrealms=tokenrealm)
+
+
+@token_cli.command("enroll", short_help="Enroll a number of tokens with generated keys")
+@click.option("-c", "--count", type=int, required=True,
+              help="The number of tokens to enroll")
+@click.option("--type", "tokentype", type=click.Choice(BULK_TOKEN_TYPES), default="hotp",
+              show_default=True, help="The token type")
+@click.option("-p", "--prefix", help="The prefix of the serials")
+@click.option("-t", "--tokenrealm", multiple=True, default=[],
+              help="The realms of the tokens (can be used multiple times)")
+@click.option("--otplen", type=click.Choice(["6", "8"]), default="6", show_default=True,
+              help="The OTP length of the tokens")
+@click.option("--hashlib", type=click.Choice(["sha1", "sha256", "sha512"]), default="sha1",
+              show_default=True, help="The hash algorithm of the tokens")
+@click.option("--timestep", type=click.Choice(["30", "60"]), default="30", show_default=True,
+              help="The time step of TOTP tokens")
+@click.option("--tokenkind", help="The kind of the tokens like 'hardware'")
+@click.option("-d", "--description", default="", help="The description of the tokens")
+@click.option("-o", "--output", type=click.File("w"), default="-",
+              help="The file, to which the serials and OTP keys are written in the OATH "
+                   "CSV format. Defaults to stdout.")
+def enroll_tokens(count, tokentype, prefix, tokenrealm, otplen, hashlib, timestep,
+                  tokenkind, description, output):
+    """
+    Enroll a number of unassigned tokens with generated OTP keys. The tokens
+    are written to the database in batches.
+
+    The serials and OTP keys are written in the OATH CSV format, which can be
+    imported again with "pi-manage token import".
+    """
+    param = {"type": tokentype, "prefix": prefix, "otplen": otplen,
+             "hashlib": hashlib, "description": description}
+    if tokentype == "totp":
+        param["timeStep"] = timestep
+    tokens = init_tokens_bulk(count, param=param, tokenrealms=list(tokenrealm),
+                              tokenkind=tokenkind)
+    for serial, otpkey in tokens:
+        line = [serial, otpkey, tokentype, otplen]
+        if tokentype == "totp":
+            line.append(timestep)
+        output.write(", ".join(line) + "\n")
+    click.echo("Enrolled {0!s} tokens.".format(len(tokens)), err=True)
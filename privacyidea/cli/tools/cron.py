@@ -27,12 +27,14 @@ from datetime import datetime
 from dateutil import tz
 from flask import current_app
 import json
+import signal
 import sys
 import traceback
 import warnings
 
 from privacyidea.cli import create_silent_app, NoPluginsFlaskGroup
 from privacyidea.lib.config import get_privacyidea_node
+from privacyidea.lib.periodicscheduler import PeriodicTaskScheduler
 from privacyidea.lib.periodictask import (get_scheduled_periodic_tasks,
                                           execute_task, get_periodic_tasks,
                                           get_periodic_task_by_name,
@@ -207,5 +209,28 @@ def run_scheduled(node_string=None, dryrun=False, cron_mode=False):
         print_stdout("There are no tasks scheduled on node {!s}.".format(node))
 
 
+@cli.command()
+@click.option("-n", "--node", "node_string",
+              help="Override the node name (read from privacyIDEA config by default)")
+@click.option("-w", "--workers", default=4, show_default=True,
+              help="The number of tasks, which can run at the same time")
+@click.option("-t", "--timeout", default=3600, show_default=True,
+              help="The number of seconds, after which a running task is reported as failed")
+@click.option("-r", "--refresh", default=60, show_default=True,
+              help="The number of seconds, after which the tasks are read from the database again")
+def run_daemon(node_string=None, workers=4, timeout=3600, refresh=60):
+    """
+    Run the scheduled periodic tasks in a resident process instead of the system cron daemon.
+    Stop it with SIGTERM or SIGINT.
+    """
+    node = get_node_name(node_string)
+    scheduler = PeriodicTaskScheduler(current_app._get_current_object(), node,
+                                      workers=workers, timeout=timeout, refresh=refresh)
+    signal.signal(signal.SIGTERM, lambda signum, frame: scheduler.stop())
+    signal.signal(signal.SIGINT, lambda signum, frame: scheduler.stop())
+    print_stdout("Running the periodic tasks of node {!s}.".format(node))
+    scheduler.run()
+
+
 if __name__ == '__main__':
     cli()
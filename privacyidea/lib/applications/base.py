@@ -79,6 +79,11 @@ class MachineApplication(object):
     very host he is starting the request.
     '''
     allow_bulk_call = False
+    '''If cache_auth_items is true, the authentication items only depend on
+    the token and the options and do not change with each request, so that
+    they can be cached.
+    '''
+    cache_auth_items = False
 
     @classmethod
     def get_name(cls):
@@ -93,13 +98,16 @@ class MachineApplication(object):
                                 challenge=None,
                                 options=None,
                                 filter_param=None,
-                                user_agent=None):
+                                user_agent=None,
+                                db_token=None):
         """
         returns a dictionary of authentication items
         like public keys, challenges, responses...
 
         :param filter_param: Additional URL request parameters
         :type filter_param: dict
+        :param db_token: The database token, if it was already read with the
+            machine token. Otherwise the token is read by its serial.
         """
         return "nothing"
 
@@ -119,7 +127,8 @@ class MachineApplication(object):
 
 @log_with(log)
 def get_auth_item(application, token_type,serial,
-                  challenge=None, options=None, filter_param=None, user_agent=None):
+                  challenge=None, options=None, filter_param=None, user_agent=None,
+                  db_token=None):
 
     options = options or {}
     # application_module from application
@@ -131,7 +140,8 @@ def get_auth_item(application, token_type,serial,
                                                    challenge=challenge,
                                                    options=options,
                                                    filter_param=filter_param,
-                                                   user_agent=user_agent)
+                                                   user_agent=user_agent,
+                                                   db_token=db_token)
     return auth_item
 
 
@@ -19,7 +19,7 @@
 from privacyidea.lib.applications import MachineApplicationBase
 from privacyidea.lib.utils import hexlify_and_unicode
 from privacyidea.lib.crypto import geturandom
-from privacyidea.lib.token import get_tokens
+from privacyidea.lib.token import get_tokens, create_tokenclass_object
 from privacyidea.lib.policy import TYPE
 import logging
 log = logging.getLogger(__name__)
@@ -41,7 +41,8 @@ class MachineApplication(MachineApplicationBase):
                                 challenge=None,
                                 options=None,
                                 filter_param=None,
-                                user_agent=None):
+                                user_agent=None,
+                                db_token=None):
         """
         :param token_type: the type of the token. At the moment
                            we only support yubikeys, tokentype "TOTP".
@@ -51,6 +52,7 @@ class MachineApplication(MachineApplicationBase):
         :param challenge:  A challenge, for which a response get calculated.
                            If none is presented, we create one.
         :type challenge:   hex string
+        :param db_token:   the database token, if it is already loaded
         :return auth_item: For Yubikey token type it
                            returns a dictionary with a "challenge" and
                            a "response".
@@ -70,7 +72,10 @@ class MachineApplication(MachineApplicationBase):
             # create the response. We need to get
             # the HMAC key and calculate a HMAC response for
             # the challenge
-            toks = get_tokens(serial=serial, active=True)
+            if db_token is not None:
+                toks = [create_tokenclass_object(db_token)] if db_token.active else []
+            else:
+                toks = get_tokens(serial=serial, active=True)
             if len(toks) == 1:
                 # tokenclass is a TimeHmacTokenClass
                 (_r, _p, otp, _c) = toks[0].get_otp(challenge=challenge_hex,
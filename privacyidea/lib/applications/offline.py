@@ -24,9 +24,16 @@
 from privacyidea.lib.applications import MachineApplicationBase
 from privacyidea.lib.crypto import geturandom
 from privacyidea.lib.error import ValidateError, ParameterError
+from privacyidea.lib.framework import (get_app_local_store, get_app_config_value,
+                                       get_thread_pool)
+import hashlib
+import hmac
 import logging
+import os
+from collections import OrderedDict
+from threading import Lock
 from passlib.hash import pbkdf2_sha512
-from privacyidea.lib.token import get_one_token
+from privacyidea.lib.token import get_one_token, create_tokenclass_object
 from privacyidea.lib.config import get_prepend_pin
 from privacyidea.lib.policy import TYPE
 from privacyidea.lib.utils import get_plugin_info_from_useragent, get_computer_name_from_user_agent
@@ -34,6 +41,117 @@ from privacyidea.lib.utils import get_plugin_info_from_useragent, get_computer_n
 log = logging.getLogger(__name__)
 ROUNDS = 6549
 REFILLTOKEN_LENGTH = 40
+DEFAULT_CACHE_SIZE = 1000
+
+
+def hash_offline_otp(otppw, rounds=ROUNDS):
+    """
+    Return the salted PBKDF2-SHA512 hash of a password (PIN + OTP) in the
+    format expected by the offline clients.
+
+    passlib uses ``hashlib.pbkdf2_hmac`` of OpenSSL as backend, which releases
+    the GIL. So this function can run concurrently in several threads.
+
+    :param otppw: The password consisting of PIN and OTP value
+    :param rounds: Number of PBKDF2 rounds
+    :return: the hash as string
+    """
+    return pbkdf2_sha512.using(rounds=rounds, salt_size=10).hash(otppw)
+
+
+class OfflineOTPCache(object):
+    """
+    A process-wide cache of precomputed offline OTP hashes.
+
+    For each token serial the cache holds the hashes of the next OTP values,
+    indexed by the counter of the OTP value. Each entry also contains a keyed
+    digest of the password (PIN + OTP) and the number of rounds, so an entry is
+    only used if the requested password matches exactly. Entries with a
+    counter below the current token counter are dropped, i.e. the cache is
+    invalidated as soon as the counter moves.
+
+    The number of cached tokens is limited by ``max_tokens``. The least
+    recently used token is evicted first.
+    """
+
+    def __init__(self, max_tokens=DEFAULT_CACHE_SIZE):
+        self.max_tokens = max_tokens
+        self._lock = Lock()
+        self._entries = OrderedDict()
+        # The digest key only lives in the memory of this process
+        self._digest_key = os.urandom(32)
+
+    def digest(self, otppw):
+        return hmac.new(self._digest_key, otppw.encode("utf8"), hashlib.sha256).digest()
+
+    def put(self, serial, counter, otppw, rounds, hash_value):
+        """
+        Store the (possibly not yet computed) hash of the password with the
+        given counter.
+
+        :param hash_value: the hash string or a future, that returns the hash
+        """
+        with self._lock:
+            token_entries = self._entries.setdefault(serial, {})
+            token_entries[counter] = (self.digest(otppw), rounds, hash_value)
+            self._entries.move_to_end(serial)
+            while len(self._entries) > self.max_tokens:
+                self._entries.popitem(last=False)
+
+    def pop(self, serial, counter, otppw, rounds):
+        """
+        Return the cached hash of the password with the given counter. All
+        entries of the token with a counter lower or equal to the requested
+        one are removed from the cache.
+
+        :return: the hash string, a future or None
+        """
+        with self._lock:
+            token_entries = self._entries.get(serial)
+            if not token_entries:
+                return None
+            for old_counter in [c for c in token_entries if c < counter]:
+                del token_entries[old_counter]
+            entry = token_entries.pop(counter, None)
+            if not token_entries:
+                del self._entries[serial]
+        if entry and entry[1] == rounds and hmac.compare_digest(entry[0], self.digest(otppw)):
+            return entry[2]
+        return None
+
+    def invalidate(self, serial=None):
+        """
+        Remove the entries of the given token or all entries
+        """
+        with self._lock:
+            if serial:
+                self._entries.pop(serial, None)
+            else:
+                self._entries.clear()
+
+
+def get_offline_otp_cache():
+    """
+    Return the process-wide cache of precomputed offline OTP hashes.
+    The size of the cache can be configured with ``PI_OFFLINE_CACHE_SIZE``.
+    """
+    app_store = get_app_local_store()
+    try:
+        return app_store["offline_otp_cache"]
+    except KeyError:
+        cache_size = int(get_app_config_value("PI_OFFLINE_CACHE_SIZE", DEFAULT_CACHE_SIZE))
+        return app_store.setdefault("offline_otp_cache", OfflineOTPCache(cache_size))
+
+
+def get_offline_hash_executor():
+    """
+    Return the process-wide thread pool for hashing offline OTP values or
+    None, if ``PI_OFFLINE_HASH_WORKERS`` is not set to more than one worker.
+    """
+    workers = int(get_app_config_value("PI_OFFLINE_HASH_WORKERS", 1))
+    if workers <= 1:
+        return None
+    return get_thread_pool("offline-hash", workers)
 
 
 class MachineApplication(MachineApplicationBase):
@@ -95,22 +213,68 @@ class MachineApplication(MachineApplicationBase):
         if amount < 0:
             raise ParameterError("Invalid refill amount: {!r}".format(amount))
         (res, err, otp_dict) = token_obj.get_multi_otp(count=amount, counter_index=True)
-        otps = otp_dict.get("otp")
-        prepend_pin = get_prepend_pin()
-        for key, otp in otps.items():
-            # Return the hash of OTP PIN and OTP values
-            otppw = otppin + otp if prepend_pin else otp + otppin
-            otps[key] = pbkdf2_sha512.using(
-                rounds=rounds, salt_size=10).hash(otppw)
+        otps = MachineApplication._hash_otps(token_obj.token.serial, otp_dict.get("otp"),
+                                             otppin, rounds)
         # We do not disable the token, so if all offline OTP values
         # are used, the token can be used to authenticate online again.
         # token_obj.enable(False)
         # increase the counter by the consumed values and
         # also store it in tokeninfo.
         token_obj.inc_otp_counter(increment=amount)
+        if amount and get_app_config_value("PI_OFFLINE_PRECOMPUTE", False):
+            MachineApplication._precompute_otps(token_obj, otppin, amount, rounds)
 
         return otps
 
+    @staticmethod
+    def _hash_otps(serial, otps, otppin, rounds):
+        """
+        Hash the given OTP values together with the OTP PIN. Precomputed
+        hashes are taken from the cache, the remaining values are hashed
+        in the thread pool, if configured, or sequentially.
+
+        :param serial: The serial of the token
+        :param otps: dictionary of counter and OTP values
+        :param otppin: The OTP PIN
+        :param rounds: Number of PBKDF2 rounds
+        :return: dictionary of counter and hashed passwords
+        """
+        cache = get_offline_otp_cache()
+        executor = get_offline_hash_executor()
+        prepend_pin = get_prepend_pin()
+        hashes = {}
+        for counter, otp in otps.items():
+            # Return the hash of OTP PIN and OTP values
+            otppw = otppin + otp if prepend_pin else otp + otppin
+            hash_value = cache.pop(serial, counter, otppw, rounds)
+            if hash_value is None:
+                if executor:
+                    hash_value = executor.submit(hash_offline_otp, otppw, rounds)
+                else:
+                    hash_value = hash_offline_otp(otppw, rounds)
+            hashes[counter] = hash_value
+        return {counter: value if isinstance(value, str) else value.result()
+                for counter, value in hashes.items()}
+
+    @staticmethod
+    def _precompute_otps(token_obj, otppin, amount, rounds):
+        """
+        Compute the hashes of the next ``amount`` OTP values in the background
+        and store them in the cache, so that the next refill of the token
+        does not need to wait for the hash calculation.
+        This requires the thread pool, i.e. ``PI_OFFLINE_HASH_WORKERS``.
+        """
+        executor = get_offline_hash_executor()
+        if not executor:
+            return
+        cache = get_offline_otp_cache()
+        prepend_pin = get_prepend_pin()
+        (res, err, otp_dict) = token_obj.get_multi_otp(count=amount, counter_index=True)
+        for counter, otp in otp_dict.get("otp", {}).items():
+            otppw = otppin + otp if prepend_pin else otp + otppin
+            cache.put(token_obj.token.serial, counter, otppw, rounds,
+                      executor.submit(hash_offline_otp, otppw, rounds))
+
     @staticmethod
     def get_refill(token_obj, password, options=None):
         """
@@ -158,7 +322,8 @@ class MachineApplication(MachineApplicationBase):
                                 challenge=None,
                                 options=None,
                                 filter_param=None,
-                                user_agent=None):
+                                user_agent=None,
+                                db_token=None):
         """
         :param token_type: the type of the token. At the moment
                            we support "HOTP" tokens and "WebAuthn" tokens.
@@ -173,13 +338,17 @@ class MachineApplication(MachineApplicationBase):
         :param options: options
         :param filter_param: parameters
         :param user_agent: The user agent of the request
+        :param db_token: The database token, if it is already loaded
         :return auth_item: A list of hashed OTP values or pubKey, rpId and credentialId for WebAuthn token
         """
         ret = {}
         options = options or {}
         password = challenge
         if token_type.lower() in ["hotp", "webauthn"]:
-            token_obj = get_one_token(serial=serial)
+            if db_token is not None:
+                token_obj = create_tokenclass_object(db_token)
+            else:
+                token_obj = get_one_token(serial=serial)
             user_object = token_obj.user
             if user_object:
                 user_info = user_object.info
@@ -21,7 +21,7 @@ This file is tested in tests/test_lib_machinetokens.py
 """
 from privacyidea.lib.applications import MachineApplicationBase
 import logging
-from privacyidea.lib.token import get_tokens
+from privacyidea.lib.token import get_tokens, create_tokenclass_object
 from privacyidea.lib.policy import TYPE
 from privacyidea.lib.serviceid import get_serviceids
 from privacyidea.lib import _
@@ -44,6 +44,8 @@ class MachineApplication(MachineApplicationBase):
     If we would support OTP with SSH, this might be sensitive information!
     '''
     allow_bulk_call = True
+    # The SSH public keys do not change with each request
+    cache_auth_items = True
 
     @staticmethod
     def get_authentication_item(token_type,
@@ -51,11 +53,13 @@ class MachineApplication(MachineApplicationBase):
                                 challenge=None,
                                 options=None,
                                 filter_param=None,
-                                user_agent=None):
+                                user_agent=None,
+                                db_token=None):
         """
         :param token_type: the type of the token. At the moment
                            we support the tokenype "sshkey"
         :param serial:     the serial number of the token.
+        :param db_token:   the database token, if it is already loaded
         :return auth_item: Return the SSH pub keys.
         """
         options = options or {}
@@ -63,7 +67,10 @@ class MachineApplication(MachineApplicationBase):
         filter_param = filter_param or {}
         user_filter = filter_param.get("user")
         if token_type.lower() == "sshkey":
-            toks = get_tokens(serial=serial, active=True)
+            if db_token is not None:
+                toks = [create_tokenclass_object(db_token)] if db_token.active else []
+            else:
+                toks = get_tokens(serial=serial, active=True)
             if len(toks) == 1:
                 # We return this entry, either if no user_filter is requested
                 #  or if the user_filter matches the user
@@ -53,7 +53,7 @@ from collections import OrderedDict
 
 log = logging.getLogger(__name__)
 from privacyidea.lib.log import log_with
-from privacyidea.lib.utils import parse_timedelta, get_module_class
+from privacyidea.lib.utils import parse_timedelta, get_module_class, is_true
 
 
 @log_with(log, log_entry=False)
@@ -110,9 +110,11 @@ def search(config, param=None, user=None):
     if "hidden_columns" in param:
         hidden_columns = param["hidden_columns"]
         del param["hidden_columns"]
+    lazy_verify = is_true(param.pop("lazy_verify", False))
 
     pagination = audit.search(param, sortorder=sortorder, page=page,
-                              page_size=page_size, timelimit=timelimit)
+                              page_size=page_size, timelimit=timelimit,
+                              lazy_verify=lazy_verify)
 
     # delete hidden columns from response
     if hidden_columns:
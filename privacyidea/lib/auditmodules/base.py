@@ -229,11 +229,12 @@ class Audit(object):  # pragma: no cover
 #        pass
 
     def search(self, search_dict, page_size=15, page=1, sortorder="asc",
-               timelimit=None):
+               timelimit=None, lazy_verify=False):
         """
         This function is used to search audit events.
 
         :param: Search parameters can be passed.
+        :param lazy_verify: Do not wait for the verification of the signatures
         :return: A pagination object
         """
         return Paginate()
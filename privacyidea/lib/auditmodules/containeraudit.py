@@ -82,12 +82,13 @@ class Audit(AuditBase):
             module.add_policy(policyname)
 
     def search(self, search_dict, page_size=15, page=1, sortorder="asc",
-               timelimit=None):
+               timelimit=None, lazy_verify=False):
         """
         Call the search method for the one readable module
         """
         return self.read_module.search(search_dict, page_size=page_size, page=page,
-                                       sortorder=sortorder, timelimit=timelimit)
+                                       sortorder=sortorder, timelimit=timelimit,
+                                       lazy_verify=lazy_verify)
 
     def get_count(self, search_dict, timedelta=None, success=None):
         """
@@ -38,13 +38,17 @@ token database.
 """
 
 import logging
+import threading
 from collections import OrderedDict
+from concurrent.futures import wait
+from hashlib import sha256
 from privacyidea.lib.auditmodules.base import (Audit as AuditBase, Paginate)
-from privacyidea.lib.crypto import Sign
+from privacyidea.lib.crypto import get_sign_object
+from privacyidea.lib.framework import get_app_local_store, get_thread_pool
 from privacyidea.lib.pooling import get_engine
 from privacyidea.lib.utils import censor_connect_string
 from privacyidea.lib.lifecycle import register_finalizer
-from privacyidea.lib.utils import truncate_comma_list, is_true
+from privacyidea.lib.utils import truncate_comma_list, is_true, to_bytes
 from sqlalchemy import MetaData, cast, String
 from sqlalchemy import asc, desc, and_, or_
 from sqlalchemy.sql.expression import FunctionElement
@@ -88,6 +92,95 @@ def fn_to_isodate(element, compiler, **kw):
         element.clauses, **kw)
 
 
+# The number of audit entries, whose signatures are verified by a worker thread at once
+VERIFY_CHUNK_SIZE = 50
+# The number of audit entries, which are exported at once
+EXPORT_CHUNK_SIZE = 1000
+
+
+class SignatureVerdictCache(object):
+    """
+    The results of the signature verification of audit entries. Audit entries
+    are not changed, so the result of an entry is kept in the memory of the
+    process. A hash of the signed data and the signature is stored with the
+    result, so that a modified entry is verified again.
+    The least recently used results are removed, if the cache is full.
+    """
+
+    def __init__(self, sign_object, verify_old_sig, size):
+        self.sign_object = sign_object
+        self.verify_old_sig = verify_old_sig
+        self.size = size
+        self._lock = threading.Lock()
+        # audit id -> (hash, result)
+        self._verdicts = OrderedDict()
+
+    @staticmethod
+    def _digest(message, signature):
+        return sha256(to_bytes("{0!s}\n{1!s}".format(message, signature))).digest()
+
+    def get(self, audit_id, message, signature):
+        """
+        Return the result of the verification or None, if it is not known.
+        """
+        digest = self._digest(message, signature)
+        with self._lock:
+            entry = self._verdicts.get(audit_id)
+            if entry and entry[0] == digest:
+                self._verdicts.move_to_end(audit_id)
+                return entry[1]
+        return None
+
+    def set(self, audit_id, message, signature, verdict):
+        digest = self._digest(message, signature)
+        with self._lock:
+            self._verdicts[audit_id] = (digest, verdict)
+            self._verdicts.move_to_end(audit_id)
+            while len(self._verdicts) > self.size:
+                self._verdicts.popitem(last=False)
+
+
+def get_signature_verdict_cache(sign_object, verify_old_sig, size):
+    """
+    Return the process-wide cache of the verification results of the given
+    signing keys. If the keys are loaded again or the configuration changes,
+    a new cache is created.
+    """
+    app_store = get_app_local_store()
+    cache = app_store.get("audit_signature_verdicts")
+    if cache is None or cache.sign_object is not sign_object or \
+            (cache.verify_old_sig, cache.size) != (verify_old_sig, size):
+        cache = SignatureVerdictCache(sign_object, verify_old_sig, size)
+        app_store["audit_signature_verdicts"] = cache
+    return cache
+
+
+def _verify_signatures(sign_object, entries, verify_old_sig, cache=None):
+    """
+    Verify the signatures of the audit entries. This also runs in a worker
+    thread, so the audit entries are passed as tuples.
+
+    :param entries: list of tuples of the audit id, the signed string and the
+        signature
+    :return: dictionary of the audit ids and the results
+    """
+    verdicts = {}
+    for audit_id, message, signature in entries:
+        try:
+            verdict = sign_object.verify(message, signature, verify_old_sig)
+        except UnicodeDecodeError as _e:
+            # TODO: Unless we trace and eliminate the broken unicode in the
+            #  audit_entry, we will get issues when packing the response.
+            log.warning('Could not verify log entry! We get invalid values '
+                        'from the database, please check the encoding.')
+            log.debug('{0!s}'.format(traceback.format_exc()))
+            verdict = False
+        verdicts[audit_id] = verdict
+        if cache:
+            cache.set(audit_id, message, signature, verdict)
+    return verdicts
+
+
 class Audit(AuditBase):
     """
     This is the SQLAudit module, which writes the audit entries
@@ -115,9 +208,16 @@ class Audit(AuditBase):
     * ``PI_AUDIT_SQL_TRUNCATE``
     * ``PI_AUDIT_NO_SIGN``
     * ``PI_CHECK_OLD_SIGNATURES``
+    * ``PI_AUDIT_VERIFY_WORKERS``
+    * ``PI_AUDIT_VERIFY_CACHE_SIZE``
 
     You can use ``PI_AUDIT_NO_SIGN = True`` to avoid signing of the audit log.
 
+    With ``PI_AUDIT_VERIFY_WORKERS`` greater than 1 the signatures of the
+    searched and exported audit entries are verified in a thread pool of this
+    size. ``PI_AUDIT_VERIFY_CACHE_SIZE`` is the number of verification results,
+    which are kept in the memory of the process.
+
     If ``PI_CHECK_OLD_SIGNATURES = True`` old style signatures (text-book RSA) will
     be checked as well, otherwise they will be marked as ``FAIL``.
     """
@@ -130,13 +230,15 @@ class Audit(AuditBase):
         self.sign_data = not self.config.get("PI_AUDIT_NO_SIGN")
         self.sign_object = None
         self.verify_old_sig = self.config.get('PI_CHECK_OLD_SIGNATURES')
+        self.verify_workers = int(self.config.get("PI_AUDIT_VERIFY_WORKERS", 1))
+        self.verify_cache_size = int(self.config.get("PI_AUDIT_VERIFY_CACHE_SIZE", 0))
         # Disable the costly checking of private RSA keys when loading them.
         self.check_private_key = not self.config.get("PI_AUDIT_NO_PRIVATE_KEY_CHECK", False)
         if self.sign_data:
-            self.read_keys(self.config.get("PI_AUDIT_KEY_PUBLIC"),
-                           self.config.get("PI_AUDIT_KEY_PRIVATE"))
-            self.sign_object = Sign(self.private, self.public,
-                                    check_private_key=self.check_private_key)
+            # The keys are only read again, if the key files change
+            self.sign_object = get_sign_object(self.config.get("PI_AUDIT_KEY_PRIVATE"),
+                                               self.config.get("PI_AUDIT_KEY_PUBLIC"),
+                                               check_private_key=self.check_private_key)
         # Read column_length from the config file
         config_column_length = self.config.get("PI_AUDIT_SQL_COLUMN_LENGTH", {})
         # fill the missing parts with the default from the models
@@ -447,9 +549,12 @@ class Audit(AuditBase):
                                                timelimit=timelimit)
         logentries = self.session.query(LogEntry).filter(filter_condition).order_by(LogEntry.date).all()
 
-        for le in logentries:
-            audit_dict = self.audit_entry_to_dict(le)
-            yield ",".join(["'{0!s}'".format(x) for x in audit_dict.values()]) + "\n"
+        for i in range(0, len(logentries), EXPORT_CHUNK_SIZE):
+            chunk = logentries[i:i + EXPORT_CHUNK_SIZE]
+            verdicts = self.verify_signatures(chunk)
+            for le in chunk:
+                audit_dict = self._entry_to_dict(le, verdicts.get(le.id, False))
+                yield ",".join(["'{0!s}'".format(x) for x in audit_dict.values()]) + "\n"
 
     def get_count(self, search_dict, timedelta=None, success=None):
         # create filter condition
@@ -468,13 +573,18 @@ class Audit(AuditBase):
         return log_count
 
     def search(self, search_dict, page_size=15, page=1, sortorder="asc",
-               timelimit=None):
+               timelimit=None, lazy_verify=False):
         """
         This function returns the audit log as a Pagination object.
 
         :param timelimit: Only audit entries newer than this timedelta will
             be searched
         :type timelimit: timedelta
+        :param lazy_verify: Do not wait for the verification of the signatures.
+            If the verification results are cached, the entries, whose result
+            is not cached yet, get the ``sig_check`` "PENDING" and are verified
+            in the background.
+        :type lazy_verify: bool
         """
         page = int(page)
         page_size = int(page_size)
@@ -489,11 +599,10 @@ class Audit(AuditBase):
         auditIter = self.search_query(search_dict, page_size=page_size,
                                       page=page, sortorder=sortorder,
                                       timelimit=timelimit)
+        logentries = []
         while True:
             try:
-                le = next(auditIter)
-                # Fill the list
-                paging_object.auditdata.append(self.audit_entry_to_dict(le))
+                logentries.append(next(auditIter))
             except StopIteration as _e:
                 log.debug("Interation stopped.")
                 break
@@ -506,6 +615,10 @@ class Audit(AuditBase):
                             'Possible database encoding mismatch.')
                 log.debug("{0!s}".format(traceback.format_exc()))
 
+        verdicts = self.verify_signatures(logentries, lazy=lazy_verify)
+        # Fill the list
+        for le in logentries:
+            paging_object.auditdata.append(self._entry_to_dict(le, verdicts.get(le.id, False)))
         return paging_object
 
     def search_query(self, search_dict, page_size=15, page=1, sortorder="asc",
@@ -558,26 +671,80 @@ class Audit(AuditBase):
         self.session.query(LogEntry).delete()
         self.session.commit()
 
-    def audit_entry_to_dict(self, audit_entry):
-        sig = None
-        if self.sign_data:
+    def verify_signatures(self, audit_entries, lazy=False):
+        """
+        Verify the signatures of the audit entries. The signatures are
+        verified in a thread pool, if ``PI_AUDIT_VERIFY_WORKERS`` is greater
+        than 1. The results are cached, if ``PI_AUDIT_VERIFY_CACHE_SIZE`` is set.
+
+        :param audit_entries: list of LogEntry objects
+        :param lazy: If True and the cache is used, the signatures, whose results
+            are not cached, are verified in the background and their result is None.
+        :return: dictionary of the audit ids and the results. The result is
+            False for all entries, if the audit log is not signed.
+        """
+        verdicts = {}
+        if not self.sign_data:
+            return verdicts
+        cache = None
+        if self.verify_cache_size > 0:
+            cache = get_signature_verdict_cache(self.sign_object, self.verify_old_sig,
+                                                self.verify_cache_size)
+        pending = []
+        for le in audit_entries:
             try:
-                sig = self.sign_object.verify(self._log_to_string(audit_entry),
-                                              audit_entry.signature,
-                                              self.verify_old_sig)
+                message = self._log_to_string(le)
             except UnicodeDecodeError as _e:
-                # TODO: Unless we trace and eliminate the broken unicode in the
-                #  audit_entry, we will get issues when packing the response.
                 log.warning('Could not verify log entry! We get invalid values '
                             'from the database, please check the encoding.')
                 log.debug('{0!s}'.format(traceback.format_exc()))
+                verdicts[le.id] = False
+                continue
+            verdict = cache.get(le.id, message, le.signature) if cache else None
+            if verdict is None:
+                pending.append((le.id, message, le.signature))
+            else:
+                verdicts[le.id] = verdict
+        if not pending:
+            return verdicts
+
+        # Without the cache the results of the background verification would be lost
+        lazy = lazy and cache is not None
+        if not lazy and self.verify_workers <= 1:
+            verdicts.update(_verify_signatures(self.sign_object, pending,
+                                               self.verify_old_sig, cache))
+            return verdicts
+        workers = max(self.verify_workers, 1)
+        executor = get_thread_pool("audit-verify", workers)
+        # Distribute the entries on all workers
+        chunk_size = min(VERIFY_CHUNK_SIZE, -(-len(pending) // workers))
+        futures = [executor.submit(_verify_signatures, self.sign_object,
+                                   pending[i:i + chunk_size], self.verify_old_sig, cache)
+                   for i in range(0, len(pending), chunk_size)]
+        if lazy:
+            verdicts.update({audit_id: None for audit_id, _message, _signature in pending})
+        else:
+            wait(futures)
+            for future in futures:
+                verdicts.update(future.result())
+        return verdicts
 
+    def audit_entry_to_dict(self, audit_entry):
+        verdicts = self.verify_signatures([audit_entry])
+        return self._entry_to_dict(audit_entry, verdicts.get(audit_entry.id, False))
+
+    def _entry_to_dict(self, audit_entry, sig):
+        """
+        Return the audit entry as a dictionary with the given result of the
+        signature verification. The result None means, that the signature
+        is verified in the background.
+        """
         is_not_missing = self._check_missing(int(audit_entry.id))
         # is_not_missing = True
         audit_dict = OrderedDict()
         audit_dict['number'] = audit_entry.id
         audit_dict['date'] = audit_entry.date.isoformat()
-        audit_dict['sig_check'] = "OK" if sig else "FAIL"
+        audit_dict['sig_check'] = "PENDING" if sig is None else "OK" if sig else "FAIL"
         audit_dict['missing_line'] = "OK" if is_not_missing else "FAIL"
         audit_dict['action'] = audit_entry.action
         audit_dict['authentication'] = audit_entry.authentication
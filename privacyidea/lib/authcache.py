@@ -20,36 +20,129 @@
 # License along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 from ..models import AuthCache, db
-from sqlalchemy import and_
+from .framework import get_app_local_store, get_app_config_value
+from .cache.lru import TTLLRUCache
+from .utils import to_bytes
+from sqlalchemy import and_, or_
 from passlib.hash import argon2
+from threading import Lock
 import datetime
+import hashlib
+import hmac
 import logging
+import time
 
 ROUNDS = 9
+DEFAULT_MEMORY_TTL = 60
+DEFAULT_MEMORY_WRITE_INTERVAL = 10
 log = logging.getLogger(__name__)
+MEMORY_LOCK = Lock()
 
 
 def _hash_password(password):
     return argon2.using(rounds=ROUNDS).hash(password)
 
 
+def _get_digest(username, realm, resolver, password):
+    """
+    Return the keyed digest of the user and the password. The key is the
+    ``PI_PEPPER`` from the pi.cfg, so that the digest can not be computed
+    from the contents of the database alone.
+    The digest is used to find the authcache entry of the password, so that
+    the slow argon2 hash only needs to be verified for this entry.
+    """
+    key = get_app_config_value("PI_PEPPER", "missing")
+    message = "\x00".join([username or "", realm or "", resolver or "", password])
+    return hmac.new(to_bytes(key), to_bytes(message), hashlib.sha256).hexdigest()
+
+
+def get_memory_cache():
+    """
+    Return the process-wide in-memory tier of the authcache or None, if
+    ``PI_AUTHCACHE_MEMORY_SIZE`` is not set.
+    The entries expire after ``PI_AUTHCACHE_MEMORY_TTL`` seconds.
+    The memory tier is only used for entries without a maximum number of
+    authentications, since the authentications are not counted across
+    processes in memory.
+    """
+    size = int(get_app_config_value("PI_AUTHCACHE_MEMORY_SIZE", 0))
+    if size <= 0:
+        return None
+    app_store = get_app_local_store()
+    try:
+        return app_store["authcache_memory"]
+    except KeyError:
+        ttl = int(get_app_config_value("PI_AUTHCACHE_MEMORY_TTL", DEFAULT_MEMORY_TTL))
+        return app_store.setdefault("authcache_memory", TTLLRUCache(size, ttl))
+
+
+def _verify_in_memory(memory, digest, first_auth=None, last_auth=None):
+    """
+    Check the entry of the in-memory tier and count the authentication.
+    The authentications, which are counted in memory, are written to the
+    database at most every ``PI_AUTHCACHE_MEMORY_WRITE_INTERVAL`` seconds.
+    If the entry has been deleted in the database in the meantime, e.g. by
+    another process, it is also removed from memory.
+
+    :return: True, if the entry is valid, False if it is not valid anymore
+        and None, if there is no entry
+    """
+    write_interval = int(get_app_config_value("PI_AUTHCACHE_MEMORY_WRITE_INTERVAL",
+                                              DEFAULT_MEMORY_WRITE_INTERVAL))
+    with MEMORY_LOCK:
+        entry = memory.get(digest, None)
+        if entry is None:
+            return None
+        if (first_auth and entry["first_auth"] <= first_auth) \
+                or (last_auth and entry["last_auth"] <= last_auth):
+            memory.delete(digest)
+            return False
+        entry["pending"] += 1
+        entry["last_auth"] = datetime.datetime.utcnow()
+        if time.monotonic() - entry["written"] < write_interval:
+            return True
+        pending, entry["pending"] = entry["pending"], 0
+        entry["written"] = time.monotonic()
+    if update_cache(entry["id"], count=pending, last_auth=entry["last_auth"]):
+        return True
+    with MEMORY_LOCK:
+        memory.delete(digest)
+    return None
+
+
 def add_to_cache(username, realm, resolver, password):
     # Can not store timezone aware timestamps!
     first_auth = datetime.datetime.utcnow()
     auth_hash = _hash_password(password)
-    record = AuthCache(username, realm, resolver, auth_hash, first_auth, first_auth)
+    record = AuthCache(username, realm, resolver, auth_hash, first_auth, first_auth,
+                       auth_digest=_get_digest(username, realm, resolver, password))
     log.debug('Adding record to auth cache: ({!r}, {!r}, {!r}, {!r})'.format(
         username, realm, resolver, auth_hash))
     r = record.save()
     return r
 
 
-def update_cache(cache_id):
-    last_auth = datetime.datetime.utcnow()
-    db.session.query(AuthCache).filter(
-        AuthCache.id == cache_id).update({"last_auth": last_auth,
-                                          AuthCache.auth_count: AuthCache.auth_count + 1})
+def update_cache(cache_id, max_auths=0, count=1, last_auth=None):
+    """
+    Update the last_auth and increase the auth_count of the entry.
+
+    :param cache_id: The id of the authcache entry
+    :param max_auths: If greater than 0, the entry is only updated, if its
+        auth_count is lower than this value. Since this is checked in the
+        same statement, concurrent requests can not exceed the maximum.
+    :param count: The number of authentications to add to the auth_count
+    :param last_auth: The time of the last authentication, defaults to now
+    :return: True, if the entry was updated
+    """
+    last_auth = last_auth or datetime.datetime.utcnow()
+    query = db.session.query(AuthCache).filter(AuthCache.id == cache_id)
+    if max_auths > 0:
+        query = query.filter(AuthCache.auth_count < max_auths)
+    r = query.update({"last_auth": last_auth,
+                      AuthCache.auth_count: AuthCache.auth_count + count},
+                     synchronize_session=False)
     db.session.commit()
+    return r > 0
 
 
 def delete_from_cache(username, realm, resolver, password, last_valid_cache_time=None, max_auths=0):
@@ -65,21 +158,24 @@ def delete_from_cache(username, realm, resolver, password, last_valid_cache_time
     authentication of the entry is before this time point, it is not valid anymore.
     :param max_auths: Maximum number of allowed authentications.
     """
-    cached_auths = db.session.query(AuthCache).filter(AuthCache.username == username,
-                                                      AuthCache.realm == realm,
-                                                      AuthCache.resolver == resolver).all()
-    r = 0
-    for cached_auth in cached_auths:
-        delete_entry = False
-        # if the password matches or the entry is otherwise invalid, we deleted it.
+    digest = _get_digest(username, realm, resolver, password)
+    user_conditions = [AuthCache.username == username,
+                       AuthCache.realm == realm,
+                       AuthCache.resolver == resolver]
+    conditions = [AuthCache.auth_digest == digest]
+    if max_auths > 0:
+        conditions.append(AuthCache.auth_count >= max_auths)
+    if last_valid_cache_time:
+        conditions.append(AuthCache.first_auth < last_valid_cache_time)
+    r = db.session.query(AuthCache).filter(*user_conditions,
+                                           or_(*conditions)).delete(synchronize_session=False)
+    # Entries without a digest were written by older versions, so we need to
+    # verify the password hash of each of them.
+    legacy_auths = db.session.query(AuthCache).filter(*user_conditions,
+                                                      AuthCache.auth_digest.is_(None)).all()
+    for cached_auth in legacy_auths:
         try:
-            if max_auths > 0 and cached_auth.auth_count >= max_auths:
-                delete_entry = True
-            elif last_valid_cache_time and cached_auth.first_auth < last_valid_cache_time:
-                delete_entry = True
-            elif argon2.verify(password, cached_auth.authentication):
-                delete_entry = True
-
+            delete_entry = argon2.verify(password, cached_auth.authentication)
         except ValueError:
             log.debug("Old (non-argon2) authcache entry for user {0!s}@{1!s}.".format(username, realm))
             # Also delete old entries
@@ -88,6 +184,9 @@ def delete_from_cache(username, realm, resolver, password, last_valid_cache_time
             r += 1
             cached_auth.delete()
     db.session.commit()
+    memory = get_memory_cache()
+    if memory is not None:
+        memory.delete(digest)
     return r
 
 
@@ -103,6 +202,9 @@ def cleanup(minutes):
     cleanuptime = datetime.datetime.utcnow() - datetime.timedelta(minutes=minutes)
     r = db.session.query(AuthCache).filter(AuthCache.last_auth < cleanuptime).delete()
     db.session.commit()
+    memory = get_memory_cache()
+    if memory is not None:
+        memory.clear()
     return r
 
 
@@ -110,6 +212,11 @@ def verify_in_cache(username, realm, resolver, password, first_auth=None, last_a
                     max_auths=0):
     """
     Verify if the given credentials are cached and if the time is correct.
+
+    The entry is looked up by the keyed digest of the credentials, so that
+    at most one argon2 hash is verified. If ``PI_AUTHCACHE_MEMORY_SIZE`` is
+    set, verified entries without a maximum number of authentications are
+    also kept in memory, where the times are checked without a database query.
     
     :param username: 
     :param realm: 
@@ -125,11 +232,24 @@ def verify_in_cache(username, realm, resolver, password, first_auth=None, last_a
     :type max_auths: int
     :return: 
     """
+    digest = _get_digest(username, realm, resolver, password)
+    # A maximum number of authentications is only enforced in the database
+    memory = get_memory_cache() if max_auths <= 0 else None
+    if memory is not None:
+        result = _verify_in_memory(memory, digest, first_auth, last_auth)
+        if result is not None:
+            if not result:
+                delete_from_cache(username, realm, resolver, password, first_auth, max_auths)
+            return result
+
     conditions = []
     result = False
     conditions.append(AuthCache.username == username)
     conditions.append(AuthCache.realm == realm)
     conditions.append(AuthCache.resolver == resolver)
+    # Entries without a digest were written by older versions
+    conditions.append(or_(AuthCache.auth_digest == digest,
+                          AuthCache.auth_digest.is_(None)))
 
     if first_auth:
         conditions.append(AuthCache.first_auth > first_auth)
@@ -138,6 +258,8 @@ def verify_in_cache(username, realm, resolver, password, first_auth=None, last_a
 
     filter_condition = and_(*conditions)
     cached_auths = AuthCache.query.filter(filter_condition).all()
+    # Verify the entry with the matching digest first
+    cached_auths.sort(key=lambda cached_auth: cached_auth.auth_digest != digest)
 
     for cached_auth in cached_auths:
         try:
@@ -146,13 +268,20 @@ def verify_in_cache(username, realm, resolver, password, first_auth=None, last_a
             log.debug("Old (non-argon2) authcache entry for user {0!s}@{1!s}.".format(username, realm))
             result = False
 
-        if result and max_auths > 0:
-            # Check if auth_count allows this authentication too
-            result = cached_auth.auth_count < max_auths
-
         if result:
-            # Update the last_auth and the auth_count
-            update_cache(cached_auth.id)
+            if cached_auth.auth_digest is None:
+                cached_auth.auth_digest = digest
+                cached_auth.save()
+            entry = {"id": cached_auth.id,
+                     "first_auth": cached_auth.first_auth,
+                     "pending": 0}
+            # Update the last_auth and the auth_count, if the auth_count allows this authentication
+            result = update_cache(cached_auth.id, max_auths)
+            if result and memory is not None:
+                entry["last_auth"] = datetime.datetime.utcnow()
+                entry["written"] = time.monotonic()
+                with MEMORY_LOCK:
+                    memory.set(digest, entry)
             break
 
     if not result:
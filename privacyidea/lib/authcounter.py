@@ -0,0 +1,209 @@
+#
+#
+# This code is free software; you can redistribute it and/or
+# modify it under the terms of the GNU AFFERO GENERAL PUBLIC LICENSE
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or any later version.
+#
+# This code is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU AFFERO GENERAL PUBLIC LICENSE for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+This module counts the successful and failed authentications of the users
+for the policies ``auth_max_success`` and ``auth_max_fail``.
+
+By default, these policies count the entries in the audit log. With
+``PI_AUTH_COUNTER_STORE`` the authentications are counted in a dedicated
+store instead, so that checking the policies does not depend on the size of
+the audit log. The store ``sql`` uses the database table ``authcounter``,
+the store ``memory`` keeps the counters in the memory of the process.
+
+The authentications are counted in time buckets. A time window is divided
+into ``BUCKETS`` buckets, so the oldest bucket may contain authentications,
+which are up to a twentieth of the window older than the window. Old buckets
+are removed, when new buckets of the same user are created.
+
+The module is tested in tests/test_lib_authcounter.py
+"""
+
+import importlib
+import logging
+import math
+import time
+from abc import ABC, abstractmethod
+
+from sqlalchemy import delete, func, insert, update
+from sqlalchemy.exc import IntegrityError
+
+from privacyidea.lib.challenge import LocalKeyValueStore
+from privacyidea.lib.framework import get_app_local_store, get_app_config_value
+from privacyidea.models import AuthCounter, db
+
+log = logging.getLogger(__name__)
+
+# The number of buckets, into which a time window is divided
+BUCKETS = 20
+
+
+def get_buckets(window, now=None):
+    """
+    Return the resolution of the buckets for the given time window, the
+    current bucket and the first bucket, that belongs to the window.
+
+    :param window: The time window
+    :type window: timedelta
+    :return: tuple of resolution in seconds, current bucket and first bucket
+    """
+    now = time.time() if now is None else now
+    resolution = max(1, int(math.ceil(window.total_seconds() / BUCKETS)))
+    bucket = int(now // resolution)
+    first_bucket = int((now - window.total_seconds()) // resolution)
+    return resolution, bucket, first_bucket
+
+
+class BaseAuthCounterStore(ABC):
+    """
+    The base class of the authentication counter stores.
+    """
+
+    @abstractmethod
+    def count(self, user_object, success, window):
+        """
+        Return the number of successful or failed authentications of the user
+        within the time window.
+
+        :param user_object: The user
+        :type user_object: User
+        :param success: Count the successful or the failed authentications
+        :type success: bool
+        :param window: The time window
+        :type window: timedelta
+        :return: number of authentications
+        """
+
+    @abstractmethod
+    def increment(self, user_object, success, window):
+        """
+        Count a successful or failed authentication of the user. Buckets,
+        that are not needed for the time window anymore, are removed.
+
+        :param window: The time window of the policy, that uses the counter
+        :type window: timedelta
+        """
+
+
+class SQLAuthCounterStore(BaseAuthCounterStore):
+    """
+    Count the authentications in the database table ``authcounter``.
+    The authentications are written on a separate database connection, so
+    that they are committed independently of the request.
+    """
+
+    @staticmethod
+    def _filter(user_object, success, resolution):
+        return [AuthCounter.username == user_object.login,
+                AuthCounter.realm == user_object.realm,
+                AuthCounter.resolver == (user_object.resolver or ""),
+                AuthCounter.success == bool(success),
+                AuthCounter.resolution == resolution]
+
+    def count(self, user_object, success, window):
+        resolution, _bucket, first_bucket = get_buckets(window)
+        r = db.session.query(func.sum(AuthCounter.count)).filter(
+            *self._filter(user_object, success, resolution),
+            AuthCounter.bucket >= first_bucket).scalar()
+        return int(r or 0)
+
+    @staticmethod
+    def _update(connection, criteria, bucket):
+        counters = AuthCounter.__table__
+        return connection.execute(update(counters).where(
+            *criteria, counters.c.bucket == bucket).values(count=counters.c.count + 1)).rowcount
+
+    def increment(self, user_object, success, window):
+        resolution, bucket, _first_bucket = get_buckets(window)
+        criteria = self._filter(user_object, success, resolution)
+        counters = AuthCounter.__table__
+        try:
+            with db.engine.begin() as connection:
+                if not self._update(connection, criteria, bucket):
+                    # A new bucket starts, so we remove the old buckets of the user
+                    connection.execute(delete(counters).where(
+                        *criteria, counters.c.bucket < bucket - 2 * BUCKETS))
+                    connection.execute(insert(counters).values(
+                        username=user_object.login, realm=user_object.realm,
+                        resolver=user_object.resolver or "", success=bool(success),
+                        resolution=resolution, bucket=bucket, count=1))
+        except IntegrityError:
+            # Another request created the bucket in the meantime
+            with db.engine.begin() as connection:
+                self._update(connection, criteria, bucket)
+
+
+class KeyValueAuthCounterStore(BaseAuthCounterStore):
+    """
+    Count the authentications in a key-value store. The buckets of a user
+    are stored as one entry, which expires, if the user does not
+    authenticate anymore.
+    """
+
+    def __init__(self, kv_store=None):
+        self.kv_store = kv_store or LocalKeyValueStore()
+
+    @staticmethod
+    def _key(user_object, success, resolution):
+        return "authcounter:{0!s}:{1!s}:{2!s}:{3!s}:{4:d}".format(
+            user_object.realm, user_object.resolver or "", user_object.login,
+            int(bool(success)), resolution)
+
+    def count(self, user_object, success, window):
+        resolution, _bucket, first_bucket = get_buckets(window)
+        buckets = self.kv_store.get(self._key(user_object, success, resolution)) or {}
+        return sum(c for b, c in buckets.items() if b >= first_bucket)
+
+    def increment(self, user_object, success, window):
+        resolution, bucket, _first_bucket = get_buckets(window)
+
+        def add(buckets):
+            buckets = {b: c for b, c in (buckets or {}).items()
+                       if b >= bucket - 2 * BUCKETS}
+            buckets[bucket] = buckets.get(bucket, 0) + 1
+            return buckets
+
+        self.kv_store.update(self._key(user_object, success, resolution), add,
+                             lambda _buckets: 2 * BUCKETS * resolution)
+
+
+AUTH_COUNTER_STORES = {"sql": SQLAuthCounterStore,
+                       "memory": KeyValueAuthCounterStore}
+
+
+def get_auth_counter_store():
+    """
+    Return the authentication counter store of this process, which is defined
+    by ``PI_AUTH_COUNTER_STORE``. This can be ``audit`` (default), ``sql``,
+    ``memory`` or the module path of a class, that implements
+    ``BaseAuthCounterStore``.
+
+    :return: an authentication counter store object or None, if the
+        authentications are counted in the audit log
+    """
+    app_store = get_app_local_store()
+    try:
+        return app_store["auth_counter_store"]
+    except KeyError:
+        store_name = get_app_config_value("PI_AUTH_COUNTER_STORE", "audit")
+        store = None
+        if store_name != "audit":
+            store_class = AUTH_COUNTER_STORES.get(store_name)
+            if store_class is None:
+                mod_name, class_name = store_name.rsplit(".", 1)
+                store_class = getattr(importlib.import_module(mod_name), class_name)
+            log.debug("Using the authentication counter store {0!s}".format(store_class.__name__))
+            store = store_class()
+        return app_store.setdefault("auth_counter_store", store)
@@ -0,0 +1,112 @@
+# SPDX-License-Identifier: AGPL-3.0-or-later
+#
+# Info: https://privacyidea.org
+#
+# This code is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public License
+# as published by the Free Software Foundation, either
+# version 3 of the License, or any later version.
+#
+# This code is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+__doc__ = """A bounded, thread-safe in-memory cache, whose entries expire after
+a given time.
+
+This module is tested in tests/test_lib_cache.py
+"""
+import time
+from collections import OrderedDict
+from threading import Lock
+
+# Returned by ``TTLLRUCache.get`` if the key is not cached
+MISSING = object()
+
+
+class TTLLRUCache(object):
+    """
+    A cache with a maximum number of entries. If the cache is full, the least
+    recently used entry is evicted. Each entry expires after its time to live.
+    Expired entries are removed when they are read or when they are the least
+    recently used entries, so that each operation takes constant time.
+    """
+
+    def __init__(self, maxsize, ttl):
+        """
+        :param maxsize: The maximum number of entries
+        :param ttl: The default time to live of an entry in seconds
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=MISSING):
+        """
+        Return the cached value or ``default``, if the key is not contained
+        in the cache or if the entry has expired.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires = entry
+                if now < expires:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+                self.expirations += 1
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        """
+        Add the value to the cache.
+
+        :param ttl: The time to live of this entry. Defaults to the time to
+            live of the cache.
+        """
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        entry = self._entries.get(key)
+        return entry is not None and time.monotonic() < entry[1]
+
+    def get_statistics(self):
+        """
+        :return: dictionary with the size and the hits, misses, evictions and
+            expirations of the cache
+        """
+        return {"size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations}
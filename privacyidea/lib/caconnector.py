@@ -27,6 +27,8 @@ stored in the database table "caconnector".
 The code is tested in tests/test_lib_caconnector.py.
 """
 
+import hashlib
+import json
 import logging
 from .log import log_with
 from .config import (get_caconnector_types,
@@ -41,6 +43,7 @@ from .crypto import encryptPassword, decryptPassword
 from privacyidea.lib.utils import (sanity_name_check, get_data_from_params, fetch_one_resource)
 from privacyidea.lib.utils.export import (register_import, register_export)
 from privacyidea.lib.config import get_config_object
+from privacyidea.lib.framework import get_app_local_store
 
 log = logging.getLogger(__name__)
 
@@ -112,6 +115,7 @@ def save_caconnector(params):
                         Value=value,
                         Type=types.get(key, ""),
                         Description=desc.get(key, "")).save()
+    _forget_caconnector_object(connector_name)
     return connector_id
 
 
@@ -183,7 +187,25 @@ def delete_caconnector(connector_name):
     :return: The Id of the resolver
     :rtype: int
     """
-    return fetch_one_resource(CAConnector, name=connector_name).delete()
+    r = fetch_one_resource(CAConnector, name=connector_name).delete()
+    _forget_caconnector_object(connector_name)
+    return r
+
+
+def _forget_caconnector_object(connector_name):
+    """
+    Remove the cached object of the CA connector from this process.
+    """
+    get_app_local_store().get("caconnector_objects", {}).pop(connector_name.lower(), None)
+
+
+def _get_config_signature(connector_type, connector_config):
+    """
+    Return a hash of the type and the configuration of a CA connector, so that
+    the cached objects are not kept with the decrypted passwords.
+    """
+    config = json.dumps([connector_type, sorted(connector_config.items())])
+    return hashlib.sha256(config.encode("utf-8")).hexdigest()
 
 
 @log_with(log)
@@ -260,11 +282,14 @@ def get_caconnector_type(connector_name):
     return c_type
 
 
-def get_caconnector_object(connector_name):
+def get_caconnector_object(connector_name, cached=False):
     """
     create a CA Connector object from a connector_name
 
     :param connector_name: the name of the CA connector
+    :param cached: If True, the CA Connector object is kept in the process and
+        reused as long as its configuration does not change. This way the
+        connections of the CA Connector to the CA are reused.
     :return: instance of the CA Connector with the loaded config
     """
     c_obj = None
@@ -277,17 +302,26 @@ def get_caconnector_object(connector_name):
         if c_obj_class is None:
             log.error("unknown CA connector class {0!s} ".format(connector_name))
         else:
+            connector_config = {}
+            for conf in conn.caconfig:
+                # Handle passwords
+                value = conf.Value
+                if conf.Type == "password":
+                    value = decryptPassword(value)
+                connector_config[conf.Key] = value
+            if cached:
+                signature = _get_config_signature(conn.catype, connector_config)
+                c_objects = get_app_local_store().setdefault("caconnector_objects", {})
+                entry = c_objects.get(conn.name.lower())
+                if entry is not None and entry[0] == signature:
+                    c_obj = entry[1]
+                    continue
             # create the resolver instance and load the config
             c_obj = c_obj_class(connector_name)
             if c_obj is not None:
-                connector_config = {}
-                for conf in conn.caconfig:
-                    # Handle passwords
-                    value = conf.Value
-                    if conf.Type == "password":
-                        value = decryptPassword(value)
-                    connector_config[conf.Key] = value
                 c_obj.set_config(connector_config)
+                if cached:
+                    c_objects[conn.name.lower()] = (signature, c_obj)
 
     if not c_obj:
         log.warning("A CA connector with the name {0!s} could not be found!".format(connector_name))
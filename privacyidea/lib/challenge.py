@@ -22,43 +22,396 @@
 This is a helper module for the challenges database table.
 It is used by the lib.tokenclass
 
+The challenges are stored in a challenge store, which is defined by
+``PI_CHALLENGE_STORE``. By default, the challenges are stored in the database
+table. The store ``memory`` keeps the challenges in a key-value store in the
+memory of the process, whose entries expire with the challenges.
+
 The method is tested in test_lib_challenges
 """
 
+import heapq
+import importlib
+import json
 import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime
+from fnmatch import fnmatchcase
+
+from .framework import get_app_config_value, get_app_local_store
 from .log import log_with
-from ..models import Challenge
+from .sqlutils import delete_matching_rows
+from ..models import Challenge, MethodsMixin, db, cleanup_challenges as _cleanup_db_challenges
 
 log = logging.getLogger(__name__)
 
 
+class BaseChallengeStore(ABC):
+    """
+    The interface of a challenge store. The store saves, finds and deletes
+    the challenge objects of ``privacyidea.models.Challenge``.
+    """
+
+    @abstractmethod
+    def save(self, challenge):
+        """
+        Add the challenge to the store or update it.
+
+        :return: the id of the challenge
+        """
+
+    @abstractmethod
+    def delete(self, challenge):
+        """
+        Delete the challenge from the store.
+
+        :return: the id of the challenge
+        """
+
+    @abstractmethod
+    def find(self, serial=None, transaction_id=None, challenge=None):
+        """
+        :return: list of the challenge objects, that match the given values
+        """
+
+    def delete_transaction(self, transaction_id):
+        """
+        Delete all challenges with the given transaction id.
+        """
+        for chal in self.find(transaction_id=transaction_id):
+            self.delete(chal)
+
+    def delete_serial(self, serial):
+        """
+        Delete all challenges of the given token.
+        """
+        for chal in self.find(serial=serial):
+            self.delete(chal)
+
+    def delete_expired(self, created_before=None, chunksize=None, dryrun=False):
+        """
+        Delete the expired challenges or, if ``created_before`` is given, the
+        challenges, that were created before this time.
+
+        :param chunksize: Delete the challenges in chunks of this size
+        :param dryrun: Only count the challenges, that would be deleted
+        :return: the number of deleted challenges
+        """
+        now = datetime.utcnow()
+        challenges = [chal for chal in self.find()
+                      if (chal.timestamp < created_before if created_before
+                          else chal.expiration < now)]
+        if not dryrun:
+            for chal in challenges:
+                self.delete(chal)
+        return len(challenges)
+
+    def cleanup(self, serial):
+        """
+        Delete the expired challenges of the given token.
+        """
+        pass
+
+
+class SQLChallengeStore(BaseChallengeStore):
+    """
+    Store the challenges in the database table ``challenge``.
+    """
+
+    def save(self, challenge):
+        return MethodsMixin.save(challenge)
+
+    def delete(self, challenge):
+        return MethodsMixin.delete(challenge)
+
+    def find(self, serial=None, transaction_id=None, challenge=None):
+        sql_query = Challenge.query
+
+        if serial is not None:
+            # filter for serial
+            sql_query = sql_query.filter(Challenge.serial == serial)
+
+        if transaction_id is not None:
+            # filter for transaction id
+            sql_query = sql_query.filter(Challenge.transaction_id ==
+                                         transaction_id)
+
+        if challenge is not None:
+            # filter for this challenge
+            sql_query = sql_query.filter(Challenge.challenge == challenge)
+
+        return sql_query.all()
+
+    def delete_transaction(self, transaction_id):
+        Challenge.query.filter(Challenge.transaction_id == transaction_id).delete()
+
+    def delete_serial(self, serial):
+        Challenge.query.filter(Challenge.serial == serial).delete()
+
+    def delete_expired(self, created_before=None, chunksize=None, dryrun=False):
+        if created_before:
+            criterion = Challenge.timestamp < created_before
+        else:
+            criterion = Challenge.expiration < datetime.utcnow()
+        if dryrun:
+            return Challenge.query.filter(criterion).count()
+        return delete_matching_rows(db.session, Challenge.__table__, criterion, chunksize)
+
+    def cleanup(self, serial):
+        _cleanup_db_challenges(serial)
+
+
+class LocalKeyValueStore(object):
+    """
+    A key-value store in the memory of the process, whose entries expire
+    after a time to live. Expired entries are removed during the next write,
+    so that no cleanup job is required.
+
+    This stands in for a key-value store, that is shared by several nodes.
+    Such a store needs to provide the same methods.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._entries = {}
+        self._expirations = []
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None or entry[1] <= time.monotonic():
+            return None
+        return entry[0]
+
+    def set(self, key, value, ttl):
+        expires = time.monotonic() + ttl
+        with self._lock:
+            self._expire()
+            self._entries[key] = (value, expires)
+            heapq.heappush(self._expirations, (expires, key))
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def incr(self, key):
+        """
+        Increase the counter of the key atomically. The counter does not expire.
+
+        :return: the new value of the counter
+        """
+        with self._lock:
+            value = (self.get(key) or 0) + 1
+            self._entries[key] = (value, float("inf"))
+            return value
+
+    def update(self, key, func, ttl):
+        """
+        Replace the value of the key by ``func(value)`` atomically. If the new
+        value is None, the key is deleted.
+
+        :param ttl: function, that returns the time to live for the new value
+        """
+        with self._lock:
+            value = func(self.get(key))
+            if value is None:
+                self.delete(key)
+            else:
+                self.set(key, value, ttl(value))
+            return value
+
+    def keys(self, prefix=""):
+        now = time.monotonic()
+        return [key for key, (_value, expires) in list(self._entries.items())
+                if expires > now and key.startswith(prefix)]
+
+    def _expire(self):
+        now = time.monotonic()
+        while self._expirations and self._expirations[0][0] <= now:
+            expires, key = heapq.heappop(self._expirations)
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] == expires:
+                del self._entries[key]
+
+
+class KeyValueChallengeStore(BaseChallengeStore):
+    """
+    Store the challenges in a key-value store. The challenges of a
+    transaction are stored with the key ``challenge:<transaction_id>``, the
+    transaction ids of a token with the key ``serial:<serial>``. The entries
+    expire with the challenges. The ids of the challenges are counted in the
+    key-value store, so that they are unique for all processes, which share
+    the store.
+    """
+
+    def __init__(self, kv_store=None):
+        self.kv_store = kv_store or LocalKeyValueStore()
+
+    @staticmethod
+    def _ttl(records):
+        expiration = max(datetime.fromisoformat(record["expiration"]) for record in records)
+        return max((expiration - datetime.utcnow()).total_seconds(), 1)
+
+    def _to_record(self, challenge):
+        return {"id": challenge.id,
+                "transaction_id": challenge.transaction_id,
+                "data": challenge.data,
+                "challenge": challenge.challenge,
+                "session": challenge.session,
+                "serial": challenge.serial,
+                "timestamp": challenge.timestamp.isoformat(),
+                "expiration": challenge.expiration.isoformat(),
+                "received_count": challenge.received_count,
+                "otp_valid": challenge.otp_valid}
+
+    def _from_record(self, record):
+        chal = Challenge(record["serial"], transaction_id=record["transaction_id"],
+                         challenge=record["challenge"], data=record["data"],
+                         session=record["session"])
+        chal.id = record["id"]
+        chal.timestamp = datetime.fromisoformat(record["timestamp"])
+        chal.expiration = datetime.fromisoformat(record["expiration"])
+        chal.received_count = record["received_count"]
+        chal.otp_valid = record["otp_valid"]
+        chal.store = self
+        return chal
+
+    def _load(self, key):
+        value = self.kv_store.get(key)
+        return json.loads(value) if value else []
+
+    def _update(self, key, func):
+        """
+        Replace the records of the key by ``func(records)`` atomically.
+
+        :return: the new records
+        """
+        def update_records(value):
+            records = func(json.loads(value) if value else [])
+            return json.dumps(records) if records else None
+        value = self.kv_store.update(key, update_records, lambda value: self._ttl(json.loads(value)))
+        return json.loads(value) if value else []
+
+    def _remove_transaction(self, serial, transaction_id):
+        self._update("serial:{0!s}".format(serial),
+                     lambda records: [r for r in records if r["transaction_id"] != transaction_id])
+
+    def save(self, challenge):
+        if challenge.id is None:
+            challenge.id = self.kv_store.incr("counter:challenge_id")
+        record = self._to_record(challenge)
+
+        def add_challenge(records):
+            return [r for r in records if r["id"] != record["id"]] + [record]
+        self._update("challenge:{0!s}".format(challenge.transaction_id), add_challenge)
+
+        def add_transaction(records):
+            transaction = {"transaction_id": record["transaction_id"],
+                           "expiration": record["expiration"]}
+            return [r for r in records if r["transaction_id"] != record["transaction_id"]] \
+                + [transaction]
+        self._update("serial:{0!s}".format(challenge.serial), add_transaction)
+        challenge.store = self
+        return challenge.id
+
+    def delete(self, challenge):
+        records = self._update("challenge:{0!s}".format(challenge.transaction_id),
+                               lambda records: [r for r in records if r["id"] != challenge.id])
+        if not any(r["serial"] == challenge.serial for r in records):
+            # This was the last challenge of the token in the transaction
+            self._remove_transaction(challenge.serial, challenge.transaction_id)
+        return challenge.id
+
+    def find(self, serial=None, transaction_id=None, challenge=None):
+        if transaction_id is not None:
+            transaction_ids = [transaction_id]
+        elif serial is not None:
+            transaction_ids = [t["transaction_id"] for t in
+                               self._load("serial:{0!s}".format(serial))]
+        else:
+            transaction_ids = [key[len("challenge:"):] for key in self.kv_store.keys("challenge:")]
+        challenges = []
+        for t_id in transaction_ids:
+            for record in self._load("challenge:{0!s}".format(t_id)):
+                if serial is not None and record["serial"] != serial:
+                    continue
+                if challenge is not None and record["challenge"] != challenge:
+                    continue
+                challenges.append(self._from_record(record))
+        return sorted(challenges, key=lambda c: c.id)
+
+    def delete_transaction(self, transaction_id):
+        records = self._load("challenge:{0!s}".format(transaction_id))
+        self.kv_store.delete("challenge:{0!s}".format(transaction_id))
+        for serial in {r["serial"] for r in records}:
+            self._remove_transaction(serial, transaction_id)
+
+    def delete_serial(self, serial):
+        for transaction in self._load("serial:{0!s}".format(serial)):
+            self._update("challenge:{0!s}".format(transaction["transaction_id"]),
+                         lambda records: [r for r in records if r["serial"] != serial])
+        self.kv_store.delete("serial:{0!s}".format(serial))
+
+
+CHALLENGE_STORES = {"sql": SQLChallengeStore,
+                    "memory": KeyValueChallengeStore}
+
+
+def get_challenge_store():
+    """
+    Return the challenge store of this process, which is defined by
+    ``PI_CHALLENGE_STORE``. This can be ``sql`` (default), ``memory`` or the
+    module path of a class, that implements ``BaseChallengeStore``.
+
+    :return: a challenge store object
+    """
+    app_store = get_app_local_store()
+    try:
+        return app_store["challenge_store"]
+    except KeyError:
+        store_name = get_app_config_value("PI_CHALLENGE_STORE", "sql")
+        store_class = CHALLENGE_STORES.get(store_name)
+        if store_class is None:
+            mod_name, class_name = store_name.rsplit(".", 1)
+            store_class = getattr(importlib.import_module(mod_name), class_name)
+        log.debug("Using the challenge store {0!s}".format(store_class.__name__))
+        return app_store.setdefault("challenge_store", store_class())
+
+
 @log_with(log)
 def get_challenges(serial=None, transaction_id=None, challenge=None):
     """
-    This returns a list of database challenge objects.
+    This returns a list of challenge objects from the challenge store.
 
     :param serial: challenges for this very serial number
     :param transaction_id: challenges with this very transaction id
     :param challenge: The challenge to be found
     :return: list of objects
     """
-    sql_query = Challenge.query
+    return get_challenge_store().find(serial=serial, transaction_id=transaction_id,
+                                      challenge=challenge)
 
-    if serial is not None:
-        # filter for serial
-        sql_query = sql_query.filter(Challenge.serial == serial)
 
-    if transaction_id is not None:
-        # filter for transaction id
-        sql_query = sql_query.filter(Challenge.transaction_id ==
-                                     transaction_id)
+def delete_challenges(transaction_id):
+    """
+    Delete all challenges with the given transaction id.
+    """
+    get_challenge_store().delete_transaction(transaction_id)
+
+
+def delete_token_challenges(serial):
+    """
+    Delete all challenges of the given token.
+    """
+    get_challenge_store().delete_serial(serial)
 
-    if challenge is not None:
-        # filter for this challenge
-        sql_query = sql_query.filter(Challenge.challenge == challenge)
 
-    challenges = sql_query.all()
-    return challenges
+def cleanup_challenges(serial):
+    """
+    Delete the expired challenges of the given token.
+    """
+    get_challenge_store().cleanup(serial)
 
 
 @log_with(log)
@@ -85,14 +438,19 @@ def get_challenges_paginate(serial=None, transaction_id=None,
     :return: dict with challenges, prev, next and count
     :rtype: dict
     """
-    sql_query = _create_challenge_query(serial=serial,
-                                        transaction_id=transaction_id)
-
     if isinstance(sortby, str):
         # convert the string to a Challenge column
         cols = Challenge.__table__.columns
         sortby = cols.get(sortby)
 
+    challenge_store = get_challenge_store()
+    if not isinstance(challenge_store, SQLChallengeStore):
+        return _get_stored_challenges_paginate(challenge_store, serial, transaction_id,
+                                               sortby, sortdir, psize, page)
+
+    sql_query = _create_challenge_query(serial=serial,
+                                        transaction_id=transaction_id)
+
     if sortdir == "desc":
         sql_query = sql_query.order_by(sortby.desc())
     else:
@@ -120,6 +478,27 @@ def get_challenges_paginate(serial=None, transaction_id=None,
     return ret
 
 
+def _get_stored_challenges_paginate(challenge_store, serial, transaction_id,
+                                    sortby, sortdir, psize, page):
+    """
+    Paginate the challenges of a challenge store, that can not be queried
+    with SQL.
+    """
+    challenges = challenge_store.find()
+    if serial is not None and serial.strip("*"):
+        challenges = [c for c in challenges if fnmatchcase(c.serial, serial)]
+    if transaction_id is not None and transaction_id.strip("*"):
+        challenges = [c for c in challenges if fnmatchcase(c.transaction_id, transaction_id)]
+    challenges.sort(key=lambda c: getattr(c, sortby.name), reverse=sortdir == "desc")
+    count = len(challenges)
+    page_challenges = challenges[(page - 1) * psize:page * psize]
+    return {"challenges": [challenge.get() for challenge in page_challenges],
+            "prev": page - 1 if page > 1 else None,
+            "next": page + 1 if page * psize < count else None,
+            "current": page,
+            "count": count}
+
+
 def _create_challenge_query(serial=None, transaction_id=None):
     """
     This function create the sql query for fetching transaction_ids. It is
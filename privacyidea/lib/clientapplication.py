@@ -20,21 +20,168 @@
 __doc__ = """Save and list client application information.
 Client Application information was saved during authentication requests.
 
+If ``PI_CLIENTAPPLICATION_RESOLUTION`` is set, the client applications are
+collected in a process-wide "last seen" table and written in bulk at most
+once per resolution interval.
+
 The code is tested in tests/test_lib_clientapplication.py.
 """
 
-from sqlalchemy import func
+from sqlalchemy import func, select, update, insert, and_, bindparam
+from sqlalchemy.exc import IntegrityError
+import atexit
 import logging
 import datetime
+import time
+from threading import Lock
+from flask import current_app
 from .log import log_with
 from ..models import ClientApplication, Subscription, db
 from privacyidea.lib.config import get_privacyidea_node
+from privacyidea.lib.framework import get_app_config_value, get_app_local_store
 from netaddr import IPAddress
 
 
 log = logging.getLogger(__name__)
 
 
+class LastSeenTable(object):
+    """
+    A process-wide table of the client applications, that have been seen since
+    the last write to the database.
+
+    Several sightings of the same client (IP and clienttype) are collapsed to
+    one entry with the most recent timestamp. A client, that has been written
+    less than ``resolution`` seconds ago, is not written again until the
+    resolution interval has passed.
+    """
+
+    def __init__(self, resolution):
+        self.resolution = resolution
+        self._lock = Lock()
+        self._pending = {}
+        self._written = {}
+        self._last_flush = time.monotonic()
+
+    def add(self, ip, clienttype, lastseen):
+        with self._lock:
+            self._pending[(ip, clienttype)] = lastseen
+
+    def needs_flush(self):
+        return time.monotonic() - self._last_flush >= self.resolution
+
+    def pop_pending(self, force=False):
+        """
+        Return the pending clients, that have not been written within the
+        resolution interval, and remove them from the table.
+
+        :param force: return all pending clients
+
+        :return: dictionary with tuples of (ip, clienttype) as keys and the
+            lastseen timestamp as value
+        """
+        now = time.monotonic()
+        with self._lock:
+            due = {key: lastseen for key, lastseen in self._pending.items()
+                   if force or now - self._written.get(key, -self.resolution) >= self.resolution}
+            for key in due:
+                del self._pending[key]
+                self._written[key] = now
+            # Forget clients, that have not been seen for a while
+            self._written = {key: written for key, written in self._written.items()
+                             if now - written < self.resolution}
+            self._last_flush = now
+        return due
+
+
+def get_last_seen_table():
+    """
+    Return the process-wide table of client applications or None, if
+    ``PI_CLIENTAPPLICATION_RESOLUTION`` is not set.
+    The table is written to the database when the process exits.
+    """
+    resolution = int(get_app_config_value("PI_CLIENTAPPLICATION_RESOLUTION", 0))
+    if resolution <= 0:
+        return None
+    app_store = get_app_local_store()
+    try:
+        return app_store["clientapplication_table"]
+    except KeyError:
+        table = app_store.setdefault("clientapplication_table", LastSeenTable(resolution))
+        atexit.register(_flush_at_exit, current_app._get_current_object())
+        return table
+
+
+def _flush_at_exit(app):
+    with app.app_context():
+        flush_clientapplications(force=True)
+
+
+def flush_clientapplications(force=False):
+    """
+    Write the pending client applications of the "last seen" table to the
+    database. Existing rows are updated and missing rows are inserted in bulk.
+
+    The clients are written with a connection of their own, so that the
+    session of the current request is neither committed nor rolled back.
+    If the bulk insert fails, since another process has inserted some of the
+    clients in the meantime, the clients are written one by one.
+
+    :param force: write all pending clients, even if they have been written
+        within the resolution interval
+    :return: the number of written clients
+    """
+    table = get_app_local_store().get("clientapplication_table")
+    if table is None:
+        return 0
+    pending = table.pop_pending(force)
+    if not pending:
+        return 0
+    node = get_privacyidea_node()
+    try:
+        with db.engine.begin() as connection:
+            _write_clientapplications(connection, node, pending)
+    except IntegrityError as e:
+        log.info('Unable to write ClientApplication entries in bulk, '
+                 'writing them one by one: {0!s}'.format(e))
+        for (ip, clienttype), lastseen in pending.items():
+            try:
+                with db.engine.begin() as connection:
+                    _write_clientapplications(connection, node,
+                                              {(ip, clienttype): lastseen})
+            except IntegrityError as e:  # pragma: no cover
+                log.info('Unable to write ClientApplication entry to db: {0!s}'.format(e))
+    return len(pending)
+
+
+def _write_clientapplications(connection, node, pending):
+    """
+    Update the existing and insert the missing client applications.
+
+    :param connection: the database connection to use
+    :param node: the name of the privacyIDEA node
+    :param pending: dictionary with tuples of (ip, clienttype) as keys and the
+        lastseen timestamp as value
+    """
+    apps = ClientApplication.__table__
+    existing = connection.execute(
+        select(apps.c.id, apps.c.ip, apps.c.clienttype).where(
+            and_(apps.c.node == node, apps.c.ip.in_({ip for ip, _ in pending}))))
+    missing = dict(pending)
+    updates = []
+    for app in existing:
+        lastseen = missing.pop((app.ip, app.clienttype), None)
+        if lastseen:
+            updates.append({"app_id": app.id, "lastseen": lastseen})
+    inserts = [{"ip": ip, "clienttype": clienttype, "node": node, "lastseen": lastseen}
+               for (ip, clienttype), lastseen in missing.items()]
+    if updates:
+        connection.execute(update(apps).where(apps.c.id == bindparam("app_id"))
+                           .values(lastseen=bindparam("lastseen")), updates)
+    if inserts:
+        connection.execute(insert(apps), inserts)
+
+
 @log_with(log)
 def save_clientapplication(ip, clienttype):
     """
@@ -46,9 +193,15 @@ def save_clientapplication(ip, clienttype):
     :type ip: basestring
     :return: None
     """
-    node = get_privacyidea_node()
     # Check for a valid IP address
     ip = IPAddress(ip)
+    table = get_last_seen_table()
+    if table:
+        table.add("{0!s}".format(ip), clienttype, datetime.datetime.now())
+        if table.needs_flush():
+            flush_clientapplications()
+        return
+    node = get_privacyidea_node()
     # TODO: resolve hostname
     app = ClientApplication(ip="{0!s}".format(ip),
                             clienttype=clienttype,
@@ -73,6 +226,8 @@ def get_clientapplication(ip=None, clienttype=None, group_by="clienttype"):
     }
     """
     clients = {}
+    # Write the clients of this process, that have not been written yet
+    flush_clientapplications(force=True)
     # We group the results by IP, hostname and clienttype. Then, the rows in each group
     # only differ in the respective node names and the "lastseen" timestamp. Hence, we
     # then fetch MAX(lastseen) of each group to retrieve the most recent timestamp at
@@ -20,12 +20,168 @@
 #
 """
 This module is used to modify counters in the database
+
+Counters are modified with a single atomic ``UPDATE`` statement. Each
+privacyIDEA node writes to its own table row. With ``PI_COUNTER_SHARDS`` the
+row of a node is split into several rows, which are written by different
+threads, to reduce lock contention. ``read`` always returns the sum of all rows
+and can be cached for ``PI_COUNTER_READ_CACHE`` seconds.
+
+If ``PI_MONITORING_BUFFER`` is set, increments are collected in the
+statistics buffer of :mod:`privacyidea.lib.monitoringstats` and written
+in batches.
 """
+import datetime
+import itertools
+import logging
+import threading
+import time
+
 from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
 
 from privacyidea.lib.config import get_privacyidea_node
+from privacyidea.lib.framework import get_app_config_value, get_app_local_store
+from privacyidea.lib.monitoringstats import get_stats_buffer, flush_stats, flush_stats_if_needed
 from privacyidea.models import EventCounter, db
 
+log = logging.getLogger(__name__)
+
+# Each thread is assigned a shard number on its first counter update
+_shard_local = threading.local()
+_shard_numbers = itertools.count()
+# Protects the process-wide cache of counter values
+_read_cache_lock = threading.Lock()
+
+
+def _get_counter_node():
+    """
+    Return the value of the node column of the table row, that the current
+    thread writes to. If ``PI_COUNTER_SHARDS`` is greater than 1, the node name
+    is extended by the shard number of the current thread, like ``node1#2``.
+    """
+    node = get_privacyidea_node()
+    shards = int(get_app_config_value("PI_COUNTER_SHARDS", 1))
+    if shards <= 1:
+        return node
+    if not hasattr(_shard_local, "number"):
+        _shard_local.number = next(_shard_numbers)
+    return "{0!s}#{1!s}".format(node, _shard_local.number % shards)
+
+
+def _get_read_cache():
+    """
+    Return the process-wide dictionary of cached counter values.
+    It is only accessed while holding ``_read_cache_lock``.
+    """
+    return get_app_local_store().setdefault("counter_read_cache", {})
+
+
+def _update_read_cache(counter_name, value=None, increment=0):
+    """
+    Adapt a cached counter value to a change of the current process.
+    If ``value`` is given, the cached value is replaced.
+    """
+    read_cache = _get_read_cache()
+    with _read_cache_lock:
+        entry = read_cache.get(counter_name)
+        if entry:
+            if value is not None:
+                read_cache[counter_name] = (value, entry[1])
+            elif entry[0] is not None:
+                read_cache[counter_name] = (entry[0] + increment, entry[1])
+            else:
+                read_cache.pop(counter_name, None)
+
+
+def _get_reset_generation(counter_name):
+    """
+    Return the time of the last reset of the counter, which discards the
+    buffered increments of all processes. If the counter was never reset
+    like this, ``datetime.datetime.min`` is returned.
+    """
+    last_reset = db.session.query(func.max(EventCounter.last_reset))\
+        .filter(EventCounter.counter_name == counter_name).one()[0]
+    return last_reset or datetime.datetime.min
+
+
+def _update_counter_row(counter_name, value):
+    """
+    Atomically add the value to the counter row of the current node (and shard).
+    If the row does not exist, it is created. The change is not committed.
+
+    :param counter_name: The name/identifier of the counter
+    :param value: The value to add, may be negative
+    :return: None
+    """
+    node = _get_counter_node()
+    counter_row = EventCounter.query.filter_by(counter_name=counter_name, node=node)
+    update = {'counter_value': EventCounter.counter_value + value}
+    if not counter_row.update(update, synchronize_session=False):
+        try:
+            # Insert the row in a savepoint, so that a failed insert does not
+            # roll back the other changes of the request
+            with db.session.begin_nested():
+                db.session.execute(EventCounter.__table__.insert().values(
+                    counter_name=counter_name, counter_value=value, node=node))
+        except IntegrityError:
+            # A concurrent request has created the row in the meantime
+            log.debug("Counter {0!s} for node {1!s} already exists.".format(counter_name, node))
+            counter_row.update(update, synchronize_session=False)
+
+
+def _add_to_counter(counter_name, value):
+    """
+    Add the value to the counter of the current node and commit the change.
+
+    :param counter_name: The name/identifier of the counter
+    :param value: The value to add, may be negative
+    :return: None
+    """
+    _update_counter_row(counter_name, value)
+    db.session.commit()
+    _update_read_cache(counter_name, increment=value)
+
+
+def add_to_counters(increments):
+    """
+    Add the given values to the counters of the current node.
+    Counters, that do not exist yet, are created. Each counter is written in
+    its own savepoint, so that a failing counter does not roll back the
+    other counters or the other changes of the request.
+
+    :param increments: list of tuples of the counter name, the value to add and
+        the reset generation of the counter, when the value was counted
+        (see ``_get_reset_generation``). Values of counters, which were reset
+        later by any process, are discarded.
+    :return: list of the tuples, which could not be written
+    """
+    failed = []
+    written = []
+    for counter_name, value, generation in increments:
+        try:
+            with db.session.begin_nested():
+                if _get_reset_generation(counter_name) > generation:
+                    log.info("Discarding {0!s} buffered increments of counter {1!s}, which "
+                             "was reset afterwards.".format(value, counter_name))
+                    continue
+                _update_counter_row(counter_name, value)
+            written.append((counter_name, value, generation))
+        except Exception as e:
+            log.warning("Could not write counter {0!s}: {1!r}".format(counter_name, e))
+            failed.append((counter_name, value, generation))
+    try:
+        db.session.commit()
+    except Exception as e:
+        # The database has rolled back the transaction, so the session needs
+        # to be rolled back as well
+        log.warning("Could not write {0!s} counters: {1!r}".format(len(written), e))
+        db.session.rollback()
+        return failed + written
+    for counter_name, value, _generation in written:
+        _update_read_cache(counter_name, increment=value)
+    return failed
+
 
 def increase(counter_name):
     """
@@ -35,23 +191,28 @@ def increase(counter_name):
     :param counter_name: The name/identifier of the counter
     :return: None
     """
-    # If there is no table row for the current node, create one.
-    node = get_privacyidea_node()
-    counter = EventCounter.query.filter_by(counter_name=counter_name, node=node).first()
-    if not counter:
-        counter = EventCounter(counter_name, 0, node=node)
-        counter.save()
-    counter.increase()
+    stats_buffer = get_stats_buffer()
+    if stats_buffer:
+        stats_buffer.add_increment(counter_name, 1, _get_reset_generation(counter_name))
+        flush_stats_if_needed()
+        return
+    _add_to_counter(counter_name, 1)
 
 
-def _reset_counter_on_all_nodes(counter_name):
+def _reset_counter_on_all_nodes(counter_name, discard_buffered=False):
     """
     Reset all EventCounter rows that set a value for ``counter_name`` to zero,
     regardless of the node column.
     :param counter_name:  The name/identifier of the counter
+    :param discard_buffered: Whether the other processes should discard the
+        increments, which they counted before and did not write yet
     """
-    EventCounter.query.filter_by(counter_name=counter_name).update({'counter_value': 0})
+    update = {'counter_value': 0}
+    if discard_buffered:
+        update['last_reset'] = datetime.datetime.utcnow()
+    EventCounter.query.filter_by(counter_name=counter_name).update(update)
     db.session.commit()
+    _update_read_cache(counter_name, value=0)
 
 
 def decrease(counter_name, allow_negative=False):
@@ -65,17 +226,22 @@ def decrease(counter_name, allow_negative=False):
                            the counter may become negative due to concurrent queries.
     :return: None
     """
-    node = get_privacyidea_node()
-    counter = EventCounter.query.filter_by(counter_name=counter_name, node=node).first()
-    if not counter:
-        counter = EventCounter(counter_name, 0, node=node)
-        counter.save()
-    # We are allowed to decrease the current counter object only if the overall
+    stats_buffer = get_stats_buffer()
+    if stats_buffer:
+        if allow_negative:
+            stats_buffer.add_increment(counter_name, -1, _get_reset_generation(counter_name))
+            flush_stats_if_needed()
+            return
+        # We need to know the current value, so write the buffered increments
+        flush_stats()
+    # We are allowed to decrease the counter only if the overall
     # counter value is positive (because individual rows may be negative then),
     # or if we allow negative values. Otherwise, we need to reset all rows of all nodes.
-    if read(counter_name) > 0 or allow_negative:
-        counter.decrease()
+    if allow_negative or (read(counter_name) or 0) > 0:
+        _add_to_counter(counter_name, -1)
     else:
+        # Create the counter, if it does not exist
+        _add_to_counter(counter_name, 0)
         _reset_counter_on_all_nodes(counter_name)
 
 
@@ -86,22 +252,43 @@ def reset(counter_name):
     :param counter_name: The name/identifier of the counter
     :return:
     """
-    node = get_privacyidea_node()
+    stats_buffer = get_stats_buffer()
+    if stats_buffer:
+        stats_buffer.discard_increment(counter_name)
     counters = EventCounter.query.filter_by(counter_name=counter_name).count()
     if not counters:
-        counter = EventCounter(counter_name, 0, node=node)
-        counter.save()
+        _add_to_counter(counter_name, 0)
     else:
-        _reset_counter_on_all_nodes(counter_name)
+        _reset_counter_on_all_nodes(counter_name, discard_buffered=True)
 
 
-def read(counter_name):
+def read(counter_name, cached=True):
     """
     Read the counter value from the database.
     If the counter_name does not exist, 'None' is returned.
 
+    If ``PI_COUNTER_READ_CACHE`` is set to a number of seconds, the sum
+    is cached for this time. Changes of the current process are applied to
+    the cached value, changes of other processes and nodes become visible
+    after the cache expired.
+
     :param counter_name: The name of the counter
+    :param cached: Whether a cached value may be returned
     :return: The value of the counter
     """
-    return db.session.query(func.sum(EventCounter.counter_value))\
-        .filter(EventCounter.counter_name == counter_name).one()[0]
+    cache_time = int(get_app_config_value("PI_COUNTER_READ_CACHE", 0))
+    with _read_cache_lock:
+        entry = _get_read_cache().get(counter_name) if cached and cache_time > 0 else None
+    if entry and entry[1] > time.monotonic():
+        value = entry[0]
+    else:
+        value = db.session.query(func.sum(EventCounter.counter_value))\
+            .filter(EventCounter.counter_name == counter_name).one()[0]
+        if cache_time > 0:
+            with _read_cache_lock:
+                _get_read_cache()[counter_name] = (value, time.monotonic() + cache_time)
+    stats_buffer = get_stats_buffer()
+    if stats_buffer and stats_buffer.get_increment(counter_name):
+        # Add the increments of this process, that are not written yet
+        value = (value or 0) + stats_buffer.get_increment(counter_name)
+    return value
@@ -42,6 +42,7 @@ calling function handle the data.
 
 This lib.crypto is tested in tests/test_lib_crypto.py
 """
+import functools
 import hmac
 import logging
 from hashlib import sha256
@@ -52,17 +53,19 @@ import binascii
 import ctypes
 
 import base64
+import os
 import traceback
 from passlib.context import CryptContext
 from privacyidea.lib.log import log_with
 from privacyidea.lib.error import HSMException, ParameterError
 from privacyidea.lib.framework import (get_app_local_store, get_app_config_value,
-                                       get_app_config)
+                                       get_app_config, get_request_local_store,
+                                       get_thread_pool)
 from privacyidea.lib.utils import (to_unicode, to_bytes, hexlify_and_unicode,
                                    b64encode_and_unicode)
 
 from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.asymmetric import rsa, ec, ed25519
 from cryptography.hazmat.primitives import serialization
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from cryptography.hazmat.primitives import padding
@@ -167,6 +170,28 @@ def hash(val, seed, algo=None):
     return hexlify_and_unicode(m.digest())
 
 
+def get_pass_context():
+    """
+    Return the CryptContext for hashing and verifying passwords and PINs.
+    The context is built from ``PI_HASH_ALGO_LIST`` and ``PI_HASH_ALGO_PARAMS``
+    and kept in the app-local store. It is only rebuilt, if one of the two
+    config values changes.
+    :return: a CryptContext
+    """
+    algo_list = list(get_app_config_value("PI_HASH_ALGO_LIST",
+                                          default=DEFAULT_HASH_ALGO_LIST))
+    algo_params = DEFAULT_HASH_ALGO_PARAMS.copy()
+    algo_params.update(get_app_config_value("PI_HASH_ALGO_PARAMS", default={}))
+    key = (tuple(algo_list), tuple(sorted(algo_params.items())))
+    app_store = get_app_local_store()
+    cached = app_store.get("pass_context")
+    if cached is None or cached[0] != key:
+        log.debug("Creating the password hash context for {0!s}".format(algo_list))
+        cached = (key, CryptContext(algo_list, **algo_params))
+        app_store["pass_context"] = cached
+    return cached[1]
+
+
 @log_with(log, log_entry=False, log_exit=False)
 def pass_hash(password):
     """
@@ -175,19 +200,16 @@ def pass_hash(password):
     :type password: str
     :return: The hash string of the password
     """
-    DEFAULT_HASH_ALGO_PARAMS.update(get_app_config_value("PI_HASH_ALGO_PARAMS",
-                                                         default={}))
-    pass_ctx = CryptContext(get_app_config_value("PI_HASH_ALGO_LIST",
-                                                 default=DEFAULT_HASH_ALGO_LIST),
-                            **DEFAULT_HASH_ALGO_PARAMS)
-    pw_dig = pass_ctx.hash(password)
+    pw_dig = get_pass_context().hash(password)
     return pw_dig
 
 
 @log_with(log, log_entry=False, log_exit=False)
 def verify_pass_hash(password, hvalue):
     """
-    Verify the hashed password value
+    Verify the hashed password value.
+    If the verification was already done by ``verify_pass_hashes`` in the
+    current request, the result is taken from the request-local store.
     :param password: The plaintext password to verify
     :type password: str
     :param hvalue: The hashed password
@@ -195,9 +217,70 @@ def verify_pass_hash(password, hvalue):
     :return: True if the password matches
     :rtype: bool
     """
-    pass_ctx = CryptContext(get_app_config_value("PI_HASH_ALGO_LIST",
-                                                 default=DEFAULT_HASH_ALGO_LIST))
-    return pass_ctx.verify(password, hvalue)
+    results = get_request_local_store().get("pass_hash_results")
+    if results and (password, hvalue) in results:
+        return results[(password, hvalue)]
+    return get_pass_context().verify(password, hvalue)
+
+
+def get_pass_hash_executor():
+    """
+    Return the process-wide thread pool for verifying password hashes
+    concurrently or None, if ``PI_PIN_VERIFY_WORKERS`` is not set to more
+    than one worker.
+    """
+    workers = int(get_app_config_value("PI_PIN_VERIFY_WORKERS", 1))
+    if workers <= 1:
+        return None
+    return get_thread_pool("pass-hash", workers)
+
+
+def verify_pass_hashes(candidates):
+    """
+    Verify several passwords against their hashes at the same time in the
+    thread pool of ``get_pass_hash_executor``. The hash algorithms like
+    argon2 release the GIL, so that the verifications run in parallel.
+
+    The results are kept in the request-local store, so that subsequent calls
+    of ``verify_pass_hash`` with the same arguments do not compute the hash
+    again. Use ``forget_pass_hashes`` to remove them.
+    Hashes, which are not known to the hash context, are skipped.
+
+    :param candidates: iterable of tuples (password, hashed password)
+    :return: dictionary with the tuples as keys and the results as values
+    """
+    pass_ctx = get_pass_context()
+    candidates = [(password, hvalue) for password, hvalue in set(candidates)
+                  if password is not None and hvalue and pass_ctx.identify(hvalue, required=False)]
+    executor = get_pass_hash_executor()
+    if executor and len(candidates) > 1:
+        futures = [(candidate, executor.submit(pass_ctx.verify, *candidate)) for candidate in candidates]
+        results = {candidate: future.result() for candidate, future in futures}
+    else:
+        results = {candidate: pass_ctx.verify(*candidate) for candidate in candidates}
+    get_request_local_store().setdefault("pass_hash_results", {}).update(results)
+    return results
+
+
+def forget_pass_hashes():
+    """
+    Remove the results of ``verify_pass_hashes`` from the request-local store.
+    """
+    get_request_local_store().pop("pass_hash_results", None)
+
+
+def forgets_pass_hashes(func):
+    """
+    Decorator, which removes the results of ``verify_pass_hashes`` from the
+    request-local store, when the decorated function returns or raises.
+    """
+    @functools.wraps(func)
+    def forget_wrapper(*args, **kwds):
+        try:
+            return func(*args, **kwds)
+        finally:
+            forget_pass_hashes()
+    return forget_wrapper
 
 
 def hash_with_pepper(password):
@@ -685,11 +768,22 @@ def _slow_rsa_verify_raw(key, sig, msg):
     return msg == pow(sig, pn.e, pn.n)
 
 
+class SIGNATURE(object):
+    __doc__ = """The versions of the signatures, which depend on the type of the key"""
+    RSA = 'rsa_sha256_pss'
+    ED25519 = 'ed25519'
+    ECDSA = 'ecdsa_sha256'
+
+
 class Sign(object):
     """
     Signing class that is used to sign Audit Entries and to sign API responses.
+
+    The signature algorithm depends on the type of the keys. RSA keys create
+    RSA-PSS signatures, Ed25519 keys Ed25519 signatures and EC keys ECDSA
+    signatures with SHA256. Ed25519 and ECDSA are a lot faster than RSA.
     """
-    sig_ver = 'rsa_sha256_pss'
+    sig_ver = SIGNATURE.RSA
 
     def __init__(self, private_key=None, public_key=None, check_private_key=True):
         """
@@ -727,6 +821,11 @@ class Sign(object):
                 log.debug(traceback.format_exc())
                 raise e
 
+        if isinstance(self.private, ed25519.Ed25519PrivateKey):
+            self.sig_ver = SIGNATURE.ED25519
+        elif isinstance(self.private, ec.EllipticCurvePrivateKey):
+            self.sig_ver = SIGNATURE.ECDSA
+
     def sign(self, s):
         """
         Create a signature of the string s
@@ -741,12 +840,17 @@ class Sign(object):
             # TODO: should we throw an exception in this case?
             return ''
 
-        signature = self.private.sign(
-            to_bytes(s),
-            asym_padding.PSS(
-                mgf=asym_padding.MGF1(hashes.SHA256()),
-                salt_length=asym_padding.PSS.MAX_LENGTH),
-            hashes.SHA256())
+        if self.sig_ver == SIGNATURE.ED25519:
+            signature = self.private.sign(to_bytes(s))
+        elif self.sig_ver == SIGNATURE.ECDSA:
+            signature = self.private.sign(to_bytes(s), ec.ECDSA(hashes.SHA256()))
+        else:
+            signature = self.private.sign(
+                to_bytes(s),
+                asym_padding.PSS(
+                    mgf=asym_padding.MGF1(hashes.SHA256()),
+                    salt_length=asym_padding.PSS.MAX_LENGTH),
+                hashes.SHA256())
         res = ':'.join([self.sig_ver, hexlify_and_unicode(signature)])
         return res
 
@@ -777,7 +881,14 @@ class Sign(object):
             pass
 
         try:
-            if sver == self.sig_ver:
+            if sver == SIGNATURE.ED25519 and isinstance(self.public, ed25519.Ed25519PublicKey):
+                self.public.verify(binascii.unhexlify(signature), to_bytes(s))
+                r = True
+            elif sver == SIGNATURE.ECDSA and isinstance(self.public, ec.EllipticCurvePublicKey):
+                self.public.verify(binascii.unhexlify(signature), to_bytes(s),
+                                   ec.ECDSA(hashes.SHA256()))
+                r = True
+            elif sver == SIGNATURE.RSA and isinstance(self.public, rsa.RSAPublicKey):
                 self.public.verify(
                     binascii.unhexlify(signature),
                     to_bytes(s),
@@ -800,6 +911,49 @@ class Sign(object):
         return r
 
 
+def _get_file_signature(filename):
+    if not filename:
+        return None
+    stat = os.stat(filename)
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+def get_sign_object(private_key_file=None, public_key_file=None, check_private_key=True):
+    """
+    Return a ``Sign`` object for the given key files. The keys are loaded
+    once per process and loaded again, if a key file changes.
+
+    :param private_key_file: The name of the file with the private key in PEM format
+    :param public_key_file: The name of the file with the public key in PEM format
+    :param check_private_key: Check the private key when loading
+    :return: a Sign object
+    """
+    cache_key = (private_key_file, public_key_file, check_private_key)
+    file_signature = (_get_file_signature(private_key_file),
+                      _get_file_signature(public_key_file))
+    sign_objects = get_app_local_store().setdefault("sign_objects", {})
+    entry = sign_objects.get(cache_key)
+    if entry is None or entry[0] != file_signature:
+        private_key = public_key = None
+        try:
+            if private_key_file:
+                with open(private_key_file, "rb") as privkey_file:
+                    private_key = privkey_file.read()
+            if public_key_file:
+                with open(public_key_file, "rb") as pubkey_file:
+                    public_key = pubkey_file.read()
+        except Exception as e:
+            log.error("Error reading key file: {0!r})".format(e))
+            log.debug(traceback.format_exc())
+            raise e
+        log.debug("Loading the signing keys {0!s} and {1!s}.".format(private_key_file,
+                                                                     public_key_file))
+        entry = (file_signature, Sign(private_key, public_key,
+                                      check_private_key=check_private_key))
+        sign_objects[cache_key] = entry
+    return entry[1]
+
+
 def create_hsm_object(config):
     """
     This creates an HSM object from the given config dictionary.
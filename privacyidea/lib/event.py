@@ -24,6 +24,7 @@ from privacyidea.lib.config import get_config_object
 from privacyidea.lib.utils import fetch_one_resource
 from privacyidea.models import EventHandler, EventHandlerOption, db
 from privacyidea.lib.audit import getAudit
+from privacyidea.lib.profiling import profiled, excluded, PHASE
 from privacyidea.lib.utils.export import (register_import, register_export)
 import functools
 import logging
@@ -55,6 +56,7 @@ class event(object):
         :return: function
         """
         @functools.wraps(func)
+        @profiled(PHASE.EVENT)
         def event_wrapper(*args, **kwds):
             # here we have to evaluate the event configuration from the
             # DB table eventhandler and based on the self.eventname etc...
@@ -98,7 +100,9 @@ class event(object):
                     event_audit.log({"success": result})
                     event_audit.finalize_log()
 
-            f_result = func(*args, **kwds)
+            # The decorated function itself is not part of the event handling
+            with excluded(PHASE.EVENT):
+                f_result = func(*args, **kwds)
 
             # Post-Event Handling
             e_handles = self.g.event_config.get_handled_events(self.eventname)
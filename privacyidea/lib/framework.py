@@ -14,10 +14,16 @@
 # You should have received a copy of the GNU Affero General Public
 # License along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
 from flask import current_app, g
 # We import the gettext function here and export it as ``_``.
 from flask_babel import gettext as _
 
+log = logging.getLogger(__name__)
+
 
 def get_app_local_store():
     """
@@ -57,5 +63,43 @@ def get_app_config_value(key, default=None):
     return get_app_config().get(key, default)
 
 
+def get_thread_pool(name, workers):
+    """
+    Get the process-wide thread pool with the given name. It is created with
+    the given number of worker threads, if it does not exist yet.
+    :param name: a string, which is also used as prefix of the thread names
+    :param workers: the number of worker threads
+    :return: a ``ThreadPoolExecutor``
+    """
+    app_store = get_app_local_store()
+    pools = app_store.setdefault('thread_pools', {})
+    try:
+        return pools[name]
+    except KeyError:
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        log.info("Created the thread pool {0!s} with {1!s} workers".format(name, workers))
+        return pools.setdefault(name, executor)
+
+
+def with_app_context(func):
+    """
+    Wrap ``func``, so that it is called in an application context of the
+    current app. This is needed for functions, which are run in a worker
+    thread and read the app config or the app-local store.
+    The request-local store of the worker thread is not shared with the
+    request, so finalizers registered in the worker thread are not called.
+    :param func: the function to wrap
+    :return: the wrapped function
+    """
+    app = current_app._get_current_object()
+
+    @functools.wraps(func)
+    def app_context_wrapper(*args, **kwds):
+        with app.app_context():
+            return func(*args, **kwds)
+    return app_context_wrapper
+
+
 __all__ = ['get_app_local_store', 'get_request_local_store',
-           'get_app_config', 'get_app_config_value', '_']
+           'get_app_config', 'get_app_config_value', 'get_thread_pool',
+           'with_app_context', '_']
@@ -17,6 +17,8 @@
 # License along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 import logging
+from contextlib import contextmanager
+from flask import has_request_context
 from privacyidea.lib.framework import get_request_local_store
 
 log = logging.getLogger(__name__)
@@ -49,3 +51,28 @@ def call_finalizers():
                 log.warning("Caught exception in finalizer: {!r}".format(exx))
                 log.debug("Exception in finalizer:", exc_info=True)
         store['call_on_teardown'] = []
+
+
+@contextmanager
+def finalizer_scope():
+    """
+    Call the finalizers, which are registered within the block, at its end.
+    This is used in worker threads, which only have an application context,
+    so that resources borrowed by the worker are released.
+    """
+    store = get_request_local_store()
+    store['finalizer_scope'] = store.get('finalizer_scope', 0) + 1
+    try:
+        yield
+    finally:
+        store['finalizer_scope'] -= 1
+        if not store['finalizer_scope']:
+            call_finalizers()
+
+
+def finalizers_are_called():
+    """
+    :return: True, if finalizers, that are registered now, are called later,
+        i.e. within a request or a ``finalizer_scope``
+    """
+    return has_request_context() or bool(get_request_local_store().get('finalizer_scope'))
@@ -33,17 +33,51 @@ from privacyidea.models import (MachineToken, db, MachineTokenOptions,
                                 get_machineresolver_id,
                                 get_machinetoken_ids)
 from privacyidea.lib.utils import fetch_one_resource
+from privacyidea.lib.framework import get_app_local_store, get_app_config_value
+from privacyidea.lib.cache.lru import TTLLRUCache
 from netaddr import IPAddress
 from sqlalchemy import and_
+from sqlalchemy.orm import joinedload, selectinload
+import copy
 import logging
 import re
 
 log = logging.getLogger(__name__)
 from privacyidea.lib.log import log_with
-from privacyidea.lib.applications.base import get_auth_item
+from privacyidea.lib.applications.base import (get_auth_item,
+                                               get_machine_application_class_dict)
 
 ANY_MACHINE = "any machine"
 NO_RESOLVER = "no resolver"
+DEFAULT_AUTH_ITEM_CACHE_SIZE = 10000
+
+
+def get_auth_item_cache():
+    """
+    Return the process-wide cache of the authentication items or None, if
+    ``PI_AUTHITEM_CACHE_TTL`` is not set.
+    The cache holds ``PI_AUTHITEM_CACHE_SIZE`` entries.
+    """
+    ttl = int(get_app_config_value("PI_AUTHITEM_CACHE_TTL", 0))
+    if ttl <= 0:
+        return None
+    app_store = get_app_local_store()
+    try:
+        return app_store["auth_item_cache"]
+    except KeyError:
+        size = int(get_app_config_value("PI_AUTHITEM_CACHE_SIZE", DEFAULT_AUTH_ITEM_CACHE_SIZE))
+        return app_store.setdefault("auth_item_cache", TTLLRUCache(size, ttl))
+
+
+def invalidate_auth_item_cache():
+    """
+    Remove all cached authentication items. This is called, if tokens are
+    attached to or detached from machines or if tokens change.
+    Other processes keep their cached authentication items until they expire.
+    """
+    cache = get_auth_item_cache()
+    if cache is not None:
+        cache.clear()
 
 
 @log_with(log)
@@ -174,6 +208,7 @@ def attach_token(serial, application, hostname=None, machine_id=None,
     if options:
         add_option(machinetoken_id=machinetoken.id,
                    options=options)
+    invalidate_auth_item_cache()
 
     return machinetoken
 
@@ -234,6 +269,7 @@ def detach_token(serial, application, hostname=None, machine_id=None,
                     # Delete MachineToken
                     r = MachineToken.query.filter(MachineToken.id == mt.get("id")).delete()
     db.session.commit()
+    invalidate_auth_item_cache()
     return r
 
 
@@ -268,6 +304,7 @@ def add_option(machinetoken_id=None, machine_id=None, resolver_name=None,
     for option_name, option_value in options.items():
         for mtid in machinetoken_ids:
             MachineTokenOptions(mtid, option_name, option_value)
+    invalidate_auth_item_cache()
     return len(options)
 
 
@@ -301,6 +338,7 @@ def delete_option(machinetoken_id=None, machine_id=None, resolver_name=None,
             MachineTokenOptions.machinetoken_id == mtid,
             MachineTokenOptions.mt_key == key)).delete()
     db.session.commit()
+    invalidate_auth_item_cache()
     return r
 
 
@@ -311,10 +349,14 @@ def list_machine_tokens(hostname=None,
                         serial=None,
                         application=None,
                         filter_params=None,
-                        serial_pattern=None):
+                        serial_pattern=None,
+                        db_tokens=False):
     """
     Returns a list of tokens assigned to the given machine.
 
+    :param db_tokens: If True, the database token is added to each entry
+        as "db_token", so that it does not need to be read again.
+
     :return: JSON of all tokens connected to machines with the corresponding
              application.
     """
@@ -339,7 +381,19 @@ def list_machine_tokens(hostname=None,
         token_id = get_token_id(serial)
         sql_query = sql_query.filter(MachineToken.token_id == token_id)
 
-    for row in sql_query.all():
+    # Compile the patterns once for all rows
+    serial_regex = re.compile(serial_pattern, re.I) if serial_pattern else None
+    filters = []
+    for key, value in filter_params.items():
+        if "*" in value:
+            # Simple wildcard matching. We do a case insensitive match
+            filters.append((key, re.compile(value.replace("*", ".*"), re.I)))
+        else:
+            filters.append((key, value))
+
+    # The tokens are joined and the options of all rows are loaded in one query
+    for row in sql_query.options(joinedload(MachineToken.token),
+                                 selectinload(MachineToken.option_list)).all():
         # row.token contains the database token
         option_list = row.option_list
         options = {}
@@ -347,29 +401,29 @@ def list_machine_tokens(hostname=None,
             options[option.mt_key] = option.mt_value
         include_mt = True
         # check serial_pattern
-        if serial_pattern:
-            if not re.match(serial_pattern, row.token.serial, re.I):
+        if serial_regex:
+            if not serial_regex.match(row.token.serial):
                 include_mt = False
         # we still think, it should be included
         if include_mt:
-            for key, value in filter_params.items():
+            for key, value in filters:
                 tokenoptionvalue = options.get(key, "")
-                if "*" in value:
-                    # Simple wildcard matching
-                    pattern = value.replace("*", ".*")
-                    # We do a case insensitive match
-                    if not re.match(pattern, tokenoptionvalue, re.I):
+                if isinstance(value, str):
+                    if tokenoptionvalue != value:
                         include_mt = False
-                elif tokenoptionvalue != value:
+                elif not value.match(tokenoptionvalue):
                     include_mt = False
         if include_mt:
-            res.append({"serial": row.token.serial,
-                        "machine_id": machine_id,
-                        "resolver": resolver_name,
-                        "type": row.token.tokentype,
-                        "application": row.application,
-                        "id": row.id,
-                        "options": options})
+            entry = {"serial": row.token.serial,
+                     "machine_id": machine_id,
+                     "resolver": resolver_name,
+                     "type": row.token.tokentype,
+                     "application": row.application,
+                     "id": row.id,
+                     "options": options}
+            if db_tokens:
+                entry["db_token"] = row.token
+            res.append(entry)
 
     return res
 
@@ -472,11 +526,23 @@ def get_auth_items(hostname=None, ip=None, application=None,
                     "sshkey": "...." }
                  ] }
     """
+    cache = None
+    application_class = get_machine_application_class_dict().get(application)
+    if not challenge and application_class and application_class.cache_auth_items:
+        cache = get_auth_item_cache()
+    if cache is not None:
+        cache_key = (hostname, application, serial,
+                     tuple(sorted((filter_param or {}).items())))
+        auth_items = cache.get(cache_key, None)
+        if auth_items is not None:
+            return copy.deepcopy(auth_items)
+
     auth_items = {}
     machine_tokens = list_machine_tokens(hostname=hostname,
                                          serial=serial,
                                          application=application,
-                                         filter_params=filter_param)
+                                         filter_params=filter_param,
+                                         db_tokens=True)
 
     for mtoken in machine_tokens:
         auth_item = get_auth_item(mtoken.get("application"),
@@ -485,7 +551,8 @@ def get_auth_items(hostname=None, ip=None, application=None,
                                   challenge,
                                   options=mtoken.get("options"),
                                   filter_param=filter_param,
-                                  user_agent=user_agent)
+                                  user_agent=user_agent,
+                                  db_token=mtoken.get("db_token"))
         if auth_item:
             if mtoken.get("application") not in auth_items:
                 # we create a new empty list for the new application type
@@ -499,4 +566,6 @@ def get_auth_items(hostname=None, ip=None, application=None,
             # append the auth_item to the list
             auth_items[mtoken.get("application")].append(auth_item)
 
+    if cache is not None:
+        cache.set(cache_key, copy.deepcopy(auth_items))
     return auth_items
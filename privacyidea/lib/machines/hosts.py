@@ -28,14 +28,82 @@ HostsMachineTestCase
 from .base import Machine
 from .base import BaseMachineResolver
 from .base import MachineResolverError
+from privacyidea.lib.framework import get_app_local_store
 
+import logging
 import netaddr
+import os
+
+log = logging.getLogger(__name__)
+
+
+class HostsFileIndex(object):
+    """
+    The parsed entries of a hosts file, indexed by the machine id, the
+    hostname and the IP address.
+    """
+
+    def __init__(self, filename):
+        stat = os.stat(filename)
+        self.filename = filename
+        self.signature = (stat.st_mtime_ns, stat.st_size)
+        # list of tuples (machine id, IP address, list of hostnames)
+        self.entries = []
+        self.by_id = {}
+        self.by_hostname = {}
+        self.by_ip = {}
+        with open(filename, "r") as f:
+            for line in f:
+                split_line = line.split()
+                if len(split_line) < 2:
+                    # skip lines with less than 2 columns
+                    continue
+                if split_line[0][0] == "#":
+                    # skip comments
+                    continue
+                entry = (split_line[0], netaddr.IPAddress(split_line[0]), split_line[1:])
+                self.entries.append(entry)
+                # Keep the order of the file, the first entry wins
+                self.by_id.setdefault(entry[0], entry)
+                self.by_ip.setdefault(entry[1], []).append(entry)
+                for hostname in entry[2]:
+                    self.by_hostname.setdefault(hostname, []).append(entry)
+        log.debug("Read {0!s} entries from the hosts file {1!s}".format(len(self.entries),
+                                                                         filename))
+
+    def is_current(self):
+        """
+        :return: True, if the file has not been modified since it was read
+        """
+        stat = os.stat(self.filename)
+        return self.signature == (stat.st_mtime_ns, stat.st_size)
+
+
+def get_hosts_file_index(filename):
+    """
+    Return the index of the given hosts file. The index is shared between
+    the requests of a process and is only read again, if the modification
+    time or the size of the file changes.
+
+    :param filename: The name of the hosts file
+    :return: a HostsFileIndex
+    """
+    indexes = get_app_local_store().setdefault("hosts_file_indexes", {})
+    index = indexes.get(filename)
+    if index is None or not index.is_current():
+        index = HostsFileIndex(filename)
+        indexes[filename] = index
+    return index
 
 
 class HostsMachineResolver(BaseMachineResolver):
 
     type = "hosts"
 
+    def _get_machine(self, entry):
+        line_id, line_ip, line_hostname = entry
+        return Machine(self.name, line_id, hostname=list(line_hostname), ip=line_ip)
+
     def get_machines(self, machine_id=None, hostname=None, ip=None, any=None,
                      substring=False):
         """
@@ -51,54 +119,52 @@ class HostsMachineResolver(BaseMachineResolver):
         :return: list of Machine Objects
         """
         machines = []
+        index = get_hosts_file_index(self.filename)
+        entries = index.entries
+
+        if not any and not substring:
+            # Use the index for exact matches
+            if machine_id and machine_id in index.by_id:
+                return [self._get_machine(index.by_id[machine_id])]
+            if hostname:
+                entries = index.by_hostname.get(hostname, [])
+            elif ip:
+                try:
+                    entries = index.by_ip.get(netaddr.IPAddress(ip), [])
+                except (netaddr.AddrFormatError, ValueError, TypeError):
+                    entries = []
+
+        for entry in entries:
+            line_id, line_ip, line_hostname = entry
+            # check if machine_id, ip or hostname matches a substring
+            if (any and any not in line_id and
+                    len([x for x in line_hostname if any in x]) <= 0 and
+                    any not in "{0!s}".format(line_ip)):
+                # "any" was provided but did not match either
+                # hostname, ip or machine_id
+                continue
+
+            else:
+                if machine_id:
+                    if not substring and machine_id == line_id:
+                        return [self._get_machine(entry)]
+                    if substring and machine_id not in line_id:
+                        # do not append this machine!
+                        continue
+                if hostname:
+                    if substring:
+                        h_match = len([x for x in line_hostname if hostname in x])
+                    else:
+                        h_match = hostname in line_hostname
+                    if not h_match:
+                        # do not append this machine!
+                        continue
 
-        f = open(self.filename, "r")
-        try:
-            for line in f:
-                split_line = line.split()
-                if len(split_line) < 2:
-                    # skip lines with less than 2 columns
+                if ip and ip != line_ip:
+                    # Do not append this machine!
                     continue
-                if split_line[0][0] == "#":
-                    # skip comments
-                    continue
-                line_id = split_line[0]
-                line_ip = netaddr.IPAddress(split_line[0])
-                line_hostname = split_line[1:]
-                # check if machine_id, ip or hostname matches a substring
-                if (any and any not in line_id and
-                        len([x for x in line_hostname if any in x]) <= 0 and
-                        any not in "{0!s}".format(line_ip)):
-                    # "any" was provided but did not match either
-                    # hostname, ip or machine_id
-                    continue
-
-                else:
-                    if machine_id:
-                        if not substring and machine_id == line_id:
-                            return [Machine(self.name, line_id,
-                                            hostname=line_hostname, ip=line_ip)]
-                        if substring and machine_id not in line_id:
-                            # do not append this machine!
-                            continue
-                    if hostname:
-                        if substring:
-                            h_match = len([x for x in line_hostname if hostname in x])
-                        else:
-                            h_match = hostname in line_hostname
-                        if not h_match:
-                            # do not append this machine!
-                            continue
-
-                    if ip and ip != line_ip:
-                        # Do not append this machine!
-                        continue
 
-                machines.append(Machine(self.name, line_id,
-                                        hostname=line_hostname,
-                                        ip=line_ip))
-        finally:
-            f.close()
+            machines.append(self._get_machine(entry))
         return machines
 
     def get_machine_id(self, hostname=None, ip=None):
@@ -116,8 +182,13 @@ class HostsMachineResolver(BaseMachineResolver):
         :return: The machine ID, which depends on the resolver
         :rtype: basestring
         """
-        machines = self.get_machines()
-        for machine in machines:
+        index = get_hosts_file_index(self.filename)
+        if hostname:
+            entries = index.by_hostname.get(hostname, [])
+        else:
+            entries = index.entries
+        for entry in entries:
+            machine = self._get_machine(entry)
             h_match = not hostname or machine.has_hostname(hostname)
             i_match = not ip or machine.has_ip(ip)
             if h_match and i_match:
@@ -34,6 +34,7 @@ LdapMachineTestCase
 """
 
 import netaddr
+import threading
 import traceback
 import logging
 
@@ -44,12 +45,18 @@ import ssl
 from .base import Machine
 from .base import BaseMachineResolver
 from .base import MachineResolverError
+from privacyidea.lib.cache.lru import TTLLRUCache, MISSING
 from privacyidea.lib.utils import is_true
 from privacyidea.lib.resolvers.LDAPIdResolver import AUTHTYPE, DEFAULT_CA_FILE, IdResolver
 from privacyidea.lib import _
 
 log = logging.getLogger(__name__)
 
+# The per process caches of the search results of the machine resolvers
+CACHE = {}
+CACHE_LOCK = threading.Lock()
+DEFAULT_CACHE_SIZE = 1000
+
 
 class LdapMachineResolver(BaseMachineResolver):
 
@@ -138,6 +145,42 @@ class LdapMachineResolver(BaseMachineResolver):
         :type any: basestring
         :return: list of Machine Objects
         """
+        if self.cache_timeout > 0:
+            r_cache = self._get_cache()
+            cache_key = (machine_id, hostname, "{0!s}".format(ip) if ip else None,
+                         any, substring)
+            entries = r_cache.get(cache_key)
+            if entries is MISSING:
+                entries = self._search_machines(machine_id, hostname, ip, any, substring)
+                r_cache.set(cache_key, entries)
+            else:
+                log.debug("Reading machines for {0!r} from cache".format(cache_key))
+        else:
+            entries = self._search_machines(machine_id, hostname, ip, any, substring)
+        return [Machine(self.name, m_id, hostname=m_hostname, ip=m_ip)
+                for m_id, m_hostname, m_ip in entries]
+
+    def _get_cache(self):
+        """
+        Return the cache of the search results of this resolver. The cache is
+        shared by all resolver objects with the same configuration.
+        """
+        cache_id = (self.uri, self.basedn, self.binddn, self.search_filter,
+                    self.id_attribute, self.hostname_attribute, self.ip_attribute)
+        r_cache = CACHE.get(cache_id)
+        if r_cache is None:
+            with CACHE_LOCK:
+                r_cache = CACHE.setdefault(cache_id, TTLLRUCache(DEFAULT_CACHE_SIZE,
+                                                                 self.cache_timeout))
+        return r_cache
+
+    def _search_machines(self, machine_id=None, hostname=None, ip=None, any=None,
+                         substring=False):
+        """
+        Search the machines in the LDAP directory.
+
+        :return: list of tuples (machine id, hostname, ip)
+        """
         machines = []
         self._bind()
         attributes = []
@@ -188,10 +231,9 @@ class LdapMachineResolver(BaseMachineResolver):
                     if machine['ip']:
                         machine['ip'] = netaddr.IPAddress(machine['ip'])
 
-                    machines.append(Machine(self.name,
-                                            machine['machineid'],
-                                            hostname=machine['hostname'],
-                                            ip=machine['ip']))
+                    machines.append((machine['machineid'],
+                                     machine['hostname'],
+                                     machine['ip']))
             except Exception as exx:  # pragma: no cover
                 log.error("Error during fetching LDAP objects: {0!r}".format(exx))
                 log.debug("{0!s}".format(traceback.format_exc()))
@@ -249,6 +291,7 @@ class LdapMachineResolver(BaseMachineResolver):
         self.bindpw = config.get("BINDPW")
         self.timeout = float(config.get("TIMEOUT", 5))
         self.sizelimit = config.get("SIZELIMIT", 500)
+        self.cache_timeout = int(config.get("CACHE_TIMEOUT") or 0)
         self.hostname_attribute = config.get("HOSTNAMEATTRIBUTE")
         self.id_attribute = config.get("IDATTRIBUTE", "DN")
         self.ip_attribute = config.get("IPATTRIBUTE")
@@ -276,6 +319,7 @@ class LdapMachineResolver(BaseMachineResolver):
                                              "BINDPW": "password",
                                              "TIMEOUT": "int",
                                              "SIZELIMIT": "int",
+                                             "CACHE_TIMEOUT": "int",
                                              "HOSTNAMEATTRIBUTE": "string",
                                              "IDATTRIBUTE": "string",
                                              "IPATTRIBUTE": "string",
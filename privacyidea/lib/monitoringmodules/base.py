@@ -92,6 +92,20 @@ class Monitoring(object):
         """
         pass
 
+    def add_values(self, values):
+        """
+        This method adds several measurement points at once.
+        Monitoring modules should overwrite this method, if they can write
+        several values more efficiently.
+
+        :param values: list of tuples (stats_key, stats_value, timestamp, reset_values)
+        :return: None
+        :raises Exception: if the values could not be written, so that the
+            caller can keep them
+        """
+        for stats_key, stats_value, timestamp, reset_values in values:
+            self.add_value(stats_key, stats_value, timestamp, reset_values)
+
 
 
 
@@ -95,6 +95,28 @@ class Monitoring(MonitoringBase):
         finally:
             self.session.close()
 
+    def add_values(self, values):
+        try:
+            for stats_key, stats_value, timestamp, reset_values in values:
+                utc_timestamp = convert_timestamp_to_utc(timestamp)
+                self.session.add(MonitoringStats(utc_timestamp, stats_key, stats_value))
+                if reset_values:
+                    self.session.query(MonitoringStats).filter(
+                        and_(MonitoringStats.stats_key == stats_key,
+                             MonitoringStats.timestamp < utc_timestamp)).delete()
+            # Write all values in one transaction
+            self.session.commit()
+        except Exception as exx:
+            log.error("exception {0!r}".format(exx))
+            log.error("could not write {0!s} statistics values".format(len(values)))
+            log.debug("{0!s}".format(traceback.format_exc()))
+            self.session.rollback()
+            # The caller keeps the values to write them again
+            raise
+
+        finally:
+            self.session.close()
+
     def delete(self, stats_key, start_timestamp, end_timestamp):
         r = None
         conditions = [MonitoringStats.stats_key == stats_key]
@@ -22,17 +22,165 @@ database table "monitoringstats". This can be arbitrary data for time series of
   
    timestamp, key, value
 
+If ``PI_MONITORING_BUFFER`` is set, statistics values and event counter
+increments are collected in a process-wide buffer and written in batches.
+
 This module is tested in tests/test_lib_monitoringstats.py
 """
+import atexit
 import logging
+import time
+from threading import Lock
 from dateutil.tz import tzlocal
+from flask import current_app
 from privacyidea.lib.log import log_with
 from privacyidea.lib.utils import get_module_class
-from privacyidea.lib.framework import get_app_config, get_request_local_store
+from privacyidea.lib.framework import (get_app_config, get_app_config_value,
+                                       get_request_local_store, get_app_local_store)
 import datetime
 
 log = logging.getLogger(__name__)
 
+DEFAULT_BUFFER_SIZE = 100
+DEFAULT_BUFFER_INTERVAL = 60
+
+
+class StatsBuffer(object):
+    """
+    A process-wide buffer for statistics values and event counter increments.
+
+    Statistics values are time series: All buffered values are kept in the
+    order they were added and are written with their own timestamps.
+    Counter increments are summed up per counter name and reset generation.
+    The reset generation is an arbitrary value given by the caller, which
+    changes whenever the counter is reset, so that increments counted before
+    and after a reset are kept apart.
+
+    The buffer should be flushed, if it contains more than ``max_size`` entries
+    or if the last flush is older than ``interval`` seconds.
+    """
+
+    def __init__(self, max_size=DEFAULT_BUFFER_SIZE, interval=DEFAULT_BUFFER_INTERVAL):
+        self.max_size = max_size
+        self.interval = interval
+        self._lock = Lock()
+        # list of (stats_key, stats_value, timestamp, reset_values)
+        self._values = []
+        # counter name -> {reset generation: increment}
+        self._increments = {}
+        self._last_flush = time.monotonic()
+
+    def add_value(self, stats_key, stats_value, timestamp, reset_values=False):
+        with self._lock:
+            self._values.append((stats_key, stats_value, timestamp, reset_values))
+
+    def add_increment(self, counter_name, increment=1, generation=None):
+        with self._lock:
+            generations = self._increments.setdefault(counter_name, {})
+            generations[generation] = generations.get(generation, 0) + increment
+
+    def get_increment(self, counter_name):
+        """
+        Return the not yet written increment of the given counter
+        """
+        with self._lock:
+            return sum(self._increments.get(counter_name, {}).values())
+
+    def discard_increment(self, counter_name):
+        with self._lock:
+            self._increments.pop(counter_name, None)
+
+    def restore_values(self, values):
+        """
+        Put statistics values back into the buffer, which could not be
+        written. They are written before the values, which were added
+        in the meantime.
+
+        :param values: list of (stats_key, stats_value, timestamp, reset_values)
+        """
+        with self._lock:
+            self._values = list(values) + self._values
+
+    def needs_flush(self):
+        with self._lock:
+            size = len(self._values) + len(self._increments)
+        return size >= self.max_size or time.monotonic() - self._last_flush >= self.interval
+
+    def pop_all(self):
+        """
+        Empty the buffer.
+
+        :return: tuple of a list of (stats_key, stats_value, timestamp, reset_values)
+            and a list of (counter_name, increment, generation)
+        """
+        with self._lock:
+            values, self._values = self._values, []
+            increments, self._increments = self._increments, {}
+            self._last_flush = time.monotonic()
+        return values, [(counter_name, increment, generation)
+                        for counter_name, generations in increments.items()
+                        for generation, increment in generations.items()]
+
+
+def get_stats_buffer():
+    """
+    Return the process-wide statistics buffer or None, if buffering is not
+    enabled with ``PI_MONITORING_BUFFER``.
+    The buffer is flushed when the process exits.
+    """
+    if not get_app_config_value("PI_MONITORING_BUFFER", False):
+        return None
+    app_store = get_app_local_store()
+    try:
+        return app_store["stats_buffer"]
+    except KeyError:
+        stats_buffer = StatsBuffer(int(get_app_config_value("PI_MONITORING_BUFFER_SIZE", DEFAULT_BUFFER_SIZE)),
+                                   int(get_app_config_value("PI_MONITORING_BUFFER_INTERVAL",
+                                                            DEFAULT_BUFFER_INTERVAL)))
+        stats_buffer = app_store.setdefault("stats_buffer", stats_buffer)
+        atexit.register(_flush_at_exit, current_app._get_current_object())
+        return stats_buffer
+
+
+def _flush_at_exit(app):
+    with app.app_context():
+        flush_stats()
+
+
+def flush_stats():
+    """
+    Write all buffered statistics values and counter increments.
+    Values and increments, which could not be written, are put back into
+    the buffer and written with the next flush.
+    """
+    stats_buffer = get_app_local_store().get("stats_buffer")
+    if stats_buffer is None:
+        return
+    values, increments = stats_buffer.pop_all()
+    if values:
+        try:
+            _get_monitoring().add_values(values)
+        except Exception as e:
+            log.warning("Could not write {0!s} statistics values, they are kept "
+                        "in the buffer: {1!r}".format(len(values), e))
+            stats_buffer.restore_values(values)
+    if increments:
+        # avoid a circular import
+        from privacyidea.lib.counter import add_to_counters
+        failed = add_to_counters(increments)
+        for counter_name, increment, generation in failed:
+            stats_buffer.add_increment(counter_name, increment, generation)
+    log.debug("Flushed {0!s} statistics values and {1!s} counters".format(len(values), len(increments)))
+
+
+def flush_stats_if_needed():
+    """
+    Flush the statistics buffer, if it is full or the flush interval is exceeded.
+    """
+    stats_buffer = get_stats_buffer()
+    if stats_buffer and stats_buffer.needs_flush():
+        flush_stats()
+
 
 @log_with(log, log_entry=False)
 def _get_monitoring():
@@ -70,8 +218,35 @@ def write_stats(stats_key, stats_value, timestamp=None, reset_values=False):
     :return: id of the database entry
     """
     timestamp = timestamp or datetime.datetime.now(tzlocal())
-    monitoring_obj = _get_monitoring()
-    monitoring_obj.add_value(stats_key, stats_value, timestamp, reset_values)
+    stats_buffer = get_stats_buffer()
+    if stats_buffer:
+        stats_buffer.add_value(stats_key, stats_value, timestamp, reset_values)
+        flush_stats_if_needed()
+    else:
+        monitoring_obj = _get_monitoring()
+        monitoring_obj.add_value(stats_key, stats_value, timestamp, reset_values)
+
+
+def write_multiple_stats(stats_values, timestamp=None, reset_values=False):
+    """
+    Write several statistics values with the same timestamp at once
+
+    :param stats_values: The measured values
+    :type stats_values: dict of stats keys and values
+    :param timestamp: The time, when the values were measured
+    :type timestamp: timezone-aware datetime object
+    :param reset_values: Whether old entries should be deleted
+    :return: None
+    """
+    timestamp = timestamp or datetime.datetime.now(tzlocal())
+    stats_buffer = get_stats_buffer()
+    if stats_buffer:
+        for stats_key, stats_value in stats_values.items():
+            stats_buffer.add_value(stats_key, stats_value, timestamp, reset_values)
+        flush_stats_if_needed()
+    elif stats_values:
+        _get_monitoring().add_values([(stats_key, stats_value, timestamp, reset_values)
+                                      for stats_key, stats_value in stats_values.items()])
 
 
 def delete_stats(stats_key, start_timestamp=None, end_timestamp=None):
@@ -86,6 +261,8 @@ def delete_stats(stats_key, start_timestamp=None, end_timestamp=None):
     :type end_timestamp: timezone-aware datetime object
     :return: The number of deleted entries
     """
+    # Buffered values need to be written before they can be read or deleted
+    flush_stats()
     monitoring_obj = _get_monitoring()
     r = monitoring_obj.delete(stats_key, start_timestamp, end_timestamp)
     return r
@@ -97,6 +274,8 @@ def get_stats_keys():
 
     :return: list of keys
     """
+    # Buffered values need to be written before they can be read or deleted
+    flush_stats()
     monitoring_obj = _get_monitoring()
     return monitoring_obj.get_keys()
 
@@ -112,6 +291,8 @@ def get_values(stats_key, start_timestamp=None, end_timestamp=None):
     :type end_timestamp: timezone-aware datetime object
     :return: list of tuples, with timestamps being timezone-aware UTC datetime objects
     """
+    # Buffered values need to be written before they can be read or deleted
+    flush_stats()
     monitoring_obj = _get_monitoring()
     return monitoring_obj.get_values(stats_key, start_timestamp, end_timestamp)
 
@@ -123,6 +304,8 @@ def get_last_value(stats_key):
     :param stats_key:
     :return: The value as a scalar or None
     """
+    # Buffered values need to be written before they can be read or deleted
+    flush_stats()
     monitoring_obj = _get_monitoring()
     return monitoring_obj.get_last_value(stats_key)
 
@@ -0,0 +1,271 @@
+#
+#
+# This code is free software; you can redistribute it and/or
+# modify it under the terms of the GNU AFFERO GENERAL PUBLIC LICENSE
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or any later version.
+#
+# This code is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU AFFERO GENERAL PUBLIC LICENSE for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+This module searches the token, which generated a given OTP value. It is used
+by the endpoint /token/getserial.
+
+The tokens are read page by page, so that not all tokens are loaded into the
+memory at once. With ``PI_GETSERIAL_WORKERS`` the OTP values of the tokens are
+checked in a pool of worker threads. The search stops as soon as enough
+matching tokens are found or the time in ``PI_GETSERIAL_TIMEOUT`` has passed.
+
+With ``PI_GETSERIAL_OTP_INDEX`` the next OTP values of unassigned HOTP tokens
+are kept in an index in the memory of the process, so that searching in these
+tokens does not calculate the OTP values again and again.
+
+The module is tested in tests/test_lib_otpsearch.py
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import wait, FIRST_COMPLETED
+
+from privacyidea.lib.framework import (get_app_local_store, get_app_config_value,
+                                       get_thread_pool, with_app_context)
+from privacyidea.lib.token import (get_tokens_paginated_generator, create_tokenclass_object,
+                                   _create_token_query)
+from privacyidea.lib.utils import is_true
+from privacyidea.models import Token
+
+log = logging.getLogger(__name__)
+
+# The number of tokens, which are read from the database at once
+PAGE_SIZE = 1000
+# The number of tokens, which are checked by a worker thread at once
+CHUNK_SIZE = 50
+
+
+def _check_token(token_obj, otp, window):
+    """
+    Check, if the token generates the OTP value. As with the authentication,
+    the OTP counter of a matching token is increased, so that the OTP value
+    can not be used again.
+
+    :return: True or False
+    """
+    try:
+        return token_obj.check_otp_exist(otp=otp, window=window) >= 0
+    except Exception as err:
+        # A flaw in a single token should not stop privacyidea from finding
+        # the right token
+        log.warning("error in calculating OTP for token {0!s}: "
+                    "{1!s}".format(token_obj.token.serial, err))
+        return False
+
+
+def _check_token_ids(token_ids, otp, window):
+    """
+    Check the tokens with the given database ids. This runs in a worker thread
+    with its own database session.
+
+    :return: list of the serials of the matching tokens
+    """
+    serials = []
+    for db_token in Token.query.filter(Token.id.in_(token_ids)).all():
+        token_obj = create_tokenclass_object(db_token)
+        if token_obj is not None and _check_token(token_obj, otp, window):
+            serials.append(db_token.serial)
+    return serials
+
+
+def _get_token_id_pages(tokentype=None, serial_wildcard=None, assigned=None):
+    """
+    Read the database ids of the matching tokens page by page, without
+    loading the tokens.
+
+    :return: generator of non-empty lists of token ids
+    """
+    main_sql_query = _create_token_query(tokentype=tokentype, serial_wildcard=serial_wildcard,
+                                         assigned=assigned).with_entities(Token.id).order_by(Token.id)
+    sql_query = main_sql_query.limit(PAGE_SIZE)
+    while True:
+        token_ids = [token_id for token_id, in sql_query.all()]
+        if not token_ids:
+            break
+        yield token_ids
+        if len(token_ids) < PAGE_SIZE:
+            break
+        sql_query = main_sql_query.filter(Token.id > token_ids[-1]).limit(PAGE_SIZE)
+
+
+class HotpOtpIndex(object):
+    """
+    An index of the next OTP values of HOTP tokens. Only the tokens, whose
+    counter has changed since the last search, are calculated again.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # token id -> (counter, window, set of OTP values)
+        self._entries = {}
+        # OTP value -> set of token ids
+        self._otps = {}
+
+    def _remove(self, token_id):
+        entry = self._entries.pop(token_id, None)
+        if entry:
+            for otp in entry[2]:
+                token_ids = self._otps[otp]
+                token_ids.discard(token_id)
+                if not token_ids:
+                    del self._otps[otp]
+
+    def _add(self, token_obj, window):
+        _res, _err, otp_dict = token_obj.get_multi_otp(count=window)
+        otps = set(otp_dict.get("otp", {}).values())
+        self._entries[token_obj.token.id] = (token_obj.token.count, window, otps)
+        for otp in otps:
+            self._otps.setdefault(otp, set()).add(token_obj.token.id)
+
+    def find(self, otp, window, serial_wildcard=None, deadline=None):
+        """
+        Update the index for the unassigned HOTP tokens, which match the
+        serial wildcard, and return the ids of the tokens, which may generate
+        the OTP value.
+
+        :return: tuple of the list of candidate token ids, the number of
+            searched tokens and whether the index is complete
+        """
+        rows = _create_token_query(tokentype="hotp", assigned=False,
+                                   serial_wildcard=serial_wildcard).with_entities(
+            Token.id, Token.count).all()
+        with self._lock:
+            stale = [token_id for token_id, count in rows
+                     if self._entries.get(token_id, (None, None))[:2] != (count, window)]
+            if not serial_wildcard or not serial_wildcard.strip("*"):
+                # remove the deleted and assigned tokens
+                current = {token_id for token_id, _count in rows}
+                for token_id in [t for t in self._entries if t not in current]:
+                    self._remove(token_id)
+            complete = True
+            for i in range(0, len(stale), PAGE_SIZE):
+                if deadline and time.monotonic() >= deadline:
+                    complete = False
+                    break
+                for db_token in Token.query.filter(Token.id.in_(stale[i:i + PAGE_SIZE])).all():
+                    token_obj = create_tokenclass_object(db_token)
+                    self._remove(db_token.id)
+                    if token_obj is not None:
+                        self._add(token_obj, window)
+            token_ids = {token_id for token_id, _count in rows}
+            candidates = [t for t in self._otps.get(otp, ()) if t in token_ids]
+        log.debug("Updated the OTP values of {0!s} of {1!s} tokens in the "
+                  "index.".format(len(stale), len(rows)))
+        return candidates, len(rows), complete
+
+
+def get_hotp_otp_index():
+    """
+    Return the OTP index of this process.
+    """
+    app_store = get_app_local_store()
+    try:
+        return app_store["hotp_otp_index"]
+    except KeyError:
+        return app_store.setdefault("hotp_otp_index", HotpOtpIndex())
+
+
+def find_serials_by_otp(otp, window=10, tokentype=None, serial_wildcard=None,
+                        assigned=None, max_matches=2):
+    """
+    Search the tokens, which generate the given OTP value. The search stops,
+    if ``max_matches`` tokens are found or the time in ``PI_GETSERIAL_TIMEOUT``
+    has passed.
+
+    :param otp: the OTP value
+    :param window: the number of OTP values to check for each token
+    :param tokentype: only search tokens of this type
+    :param serial_wildcard: only search tokens, whose serial matches
+    :param assigned: only search assigned (True) or unassigned (False) tokens
+    :param max_matches: stop after this number of matching tokens
+    :return: dictionary with the list of the matching ``serials``, the number
+        of ``searched`` tokens and whether the search was ``complete``
+    """
+    timeout = float(get_app_config_value("PI_GETSERIAL_TIMEOUT", 0))
+    deadline = time.monotonic() + timeout if timeout else None
+    serials = []
+    searched = 0
+    complete = True
+
+    if assigned is False and (tokentype or "").lower() == "hotp" and \
+            is_true(get_app_config_value("PI_GETSERIAL_OTP_INDEX", False)):
+        candidates, searched, complete = get_hotp_otp_index().find(otp, window,
+                                                                    serial_wildcard, deadline)
+        if complete:
+            serials = _check_token_ids(candidates, otp, window)[:max_matches]
+            return {"serials": serials, "searched": searched, "complete": True}
+        # The index could not be updated in time, so we search the tokens
+        searched = 0
+
+    workers = int(get_app_config_value("PI_GETSERIAL_WORKERS", 1))
+    if workers <= 1:
+        pages = get_tokens_paginated_generator(tokentype=tokentype, serial_wildcard=serial_wildcard,
+                                               assigned=assigned, psize=PAGE_SIZE)
+        for page in pages:
+            for token_obj in page:
+                if _check_token(token_obj, otp, window):
+                    serials.append(token_obj.token.serial)
+            searched += len(page)
+            log.debug("Searched the OTP value in {0!s} tokens.".format(searched))
+            if len(serials) >= max_matches:
+                break
+            if deadline and time.monotonic() >= deadline:
+                complete = False
+                break
+    else:
+        executor = get_thread_pool("otp-search", workers)
+        check = with_app_context(_check_token_ids)
+        pending = {}
+
+        def collect(done):
+            nonlocal searched
+            for future in done:
+                serials.extend(future.result())
+                searched += pending.pop(future)
+
+        # The workers read the tokens, so only their ids are read here
+        for token_ids in _get_token_id_pages(tokentype=tokentype, serial_wildcard=serial_wildcard,
+                                             assigned=assigned):
+            for i in range(0, len(token_ids), CHUNK_SIZE):
+                chunk = token_ids[i:i + CHUNK_SIZE]
+                pending[executor.submit(check, chunk, otp, window)] = len(chunk)
+            # Do not read more tokens, than the workers can check
+            while len(pending) > 2 * workers and len(serials) < max_matches:
+                remaining = deadline - time.monotonic() if deadline else None
+                done, _not_done = wait(list(pending), timeout=remaining,
+                                       return_when=FIRST_COMPLETED)
+                collect(done)
+                if deadline and time.monotonic() >= deadline:
+                    complete = False
+                    break
+            log.debug("Searched the OTP value in {0!s} tokens.".format(searched))
+            if len(serials) >= max_matches or not complete:
+                break
+        if complete and len(serials) < max_matches:
+            remaining = deadline - time.monotonic() if deadline else None
+            done, not_done = wait(list(pending), timeout=remaining)
+            collect(done)
+            complete = not not_done
+        for future in pending:
+            future.cancel()
+        if len(serials) >= max_matches:
+            complete = True
+
+    if not complete:
+        log.warning("The OTP value was searched in {0!s} tokens, before the time "
+                    "limit was reached.".format(searched))
+    return {"serials": serials[:max_matches], "searched": searched, "complete": complete}
@@ -0,0 +1,212 @@
+#
+#
+# This code is free software; you can redistribute it and/or
+# modify it under the terms of the GNU AFFERO GENERAL PUBLIC LICENSE
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or any later version.
+#
+# This code is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU AFFERO GENERAL PUBLIC LICENSE for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+__doc__ = """This module provides a resident scheduler for periodic tasks, which is
+started with ``privacyidea-cron run_daemon``.
+
+Instead of starting the application every minute, the scheduler keeps the
+application in memory. The periodic tasks of the node are read from the database
+every ``refresh`` seconds and the next runs are calculated in memory. Due tasks
+are run concurrently in a thread pool. Before a task is started, the run is
+claimed in the database with ``claim_periodic_task_run``, so that the task only
+runs once, even if several schedulers use the same node name.
+
+Python threads can not be stopped, so a task, which exceeds its timeout, is
+reported as failed and not started again, until it has returned.
+
+The module is tested in tests/test_lib_periodicscheduler.py
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from dateutil.tz import tzutc
+
+from privacyidea.lib.framework import with_app_context
+from privacyidea.lib.periodictask import (get_periodic_tasks, calculate_next_timestamp,
+                                          claim_periodic_task_run, release_periodic_task_run,
+                                          execute_task, set_periodic_task_last_run)
+
+log = logging.getLogger(__name__)
+
+
+class PeriodicTaskScheduler(object):
+    """
+    Run the periodic tasks of a node, when they are due.
+
+    :param app: The privacyIDEA application
+    :param node: Node name
+    :param workers: The number of tasks, which can run at the same time
+    :param timeout: The number of seconds, after which a running task is
+        reported as failed
+    :param refresh: The number of seconds, after which the periodic tasks are
+        read from the database again. A failed task is also retried after this
+        time at the earliest.
+    """
+
+    def __init__(self, app, node, workers=4, timeout=3600, refresh=60):
+        self.app = app
+        self.node = node
+        self.timeout = timeout
+        self.refresh = refresh
+        self.executor = ThreadPoolExecutor(max_workers=workers,
+                                           thread_name_prefix="periodic-task")
+        # task id -> (task dictionary, next run)
+        self._schedule = {}
+        # task id -> (task name, future, start in seconds of time.monotonic)
+        self._running = {}
+        # task id -> time.monotonic, before which a failed task is not retried
+        self._retry_after = {}
+        # ids of the tasks, which exceeded the timeout
+        self._overdue = set()
+        self._last_refresh = None
+        self._stop = threading.Event()
+
+    def load_tasks(self):
+        """
+        Read the active periodic tasks of the node from the database and
+        calculate their next runs.
+        """
+        schedule = {}
+        for ptask in get_periodic_tasks(node=self.node, active=True):
+            try:
+                schedule[ptask["id"]] = (ptask, calculate_next_timestamp(ptask, self.node))
+            except Exception as e:
+                log.warning("Ignoring periodic task {!r}: {!r}".format(ptask["name"], e))
+        self._schedule = schedule
+        self._last_refresh = time.monotonic()
+
+    def _run_task(self, ptask, claimed_run):
+        """
+        Run the task in a worker thread and record the run in the database.
+        If the task fails and should be retried, the claimed run is released.
+
+        :return: the result of the task
+        """
+        try:
+            result = execute_task(ptask["taskmodule"], ptask["options"])
+        except Exception as e:
+            log.error("Caught exception when running {!r}: {!r}".format(ptask["name"], e))
+            log.debug("", exc_info=True)
+            result = False
+        if result or not ptask.get("retry_if_failed"):
+            set_periodic_task_last_run(ptask["id"], self.node, datetime.now(tzutc()))
+        else:
+            log.warning("Task {!r} on node {!r} did not run successfully.".format(ptask["name"], self.node))
+            release_periodic_task_run(ptask, self.node, claimed_run)
+        return result
+
+    def _check_running(self):
+        """
+        Remove the finished tasks and report the tasks, which exceed the timeout.
+
+        :return: dictionary of the names and results of the finished tasks.
+            The result of a task, which exceeds the timeout, is False.
+        """
+        finished = {}
+        for ptask_id, (name, future, started) in list(self._running.items()):
+            if future.done():
+                del self._running[ptask_id]
+                self._overdue.discard(ptask_id)
+                finished[name] = not future.exception() and future.result()
+                if not finished[name]:
+                    self._retry_after[ptask_id] = time.monotonic() + self.refresh
+                log.info("Task {!r} finished after {:.1f} seconds.".format(
+                    name, time.monotonic() - started))
+                # The next run depends on the new last run
+                self._last_refresh = None
+            elif ptask_id not in self._overdue and time.monotonic() - started > self.timeout:
+                log.error("Task {!r} is running longer than {!s} seconds. It is not started "
+                          "again, until it has finished.".format(name, self.timeout))
+                self._overdue.add(ptask_id)
+                finished[name] = False
+        return finished
+
+    def run_pending(self, now=None):
+        """
+        Start all due tasks, which are not running.
+
+        :param now: The current time, defaults to the current time
+        :type now: timezone-aware datetime
+        :return: tuple of the list of the names of the started tasks and the
+            dictionary of the names and results of the finished tasks
+        """
+        finished = self._check_running()
+        if self._last_refresh is None or time.monotonic() - self._last_refresh >= self.refresh:
+            self.load_tasks()
+        now = now or datetime.now(tzutc())
+        started = []
+        for ptask_id, (ptask, next_run) in sorted(self._schedule.items(),
+                                                  key=lambda item: item[1][0]["ordering"]):
+            if next_run > now or ptask_id in self._running or \
+                    self._retry_after.get(ptask_id, 0) > time.monotonic():
+                continue
+            self._retry_after.pop(ptask_id, None)
+            claimed_run = claim_periodic_task_run(ptask, self.node, now)
+            # Do not run the task again, before the tasks are read again
+            self._schedule[ptask_id] = (ptask, now + timedelta(seconds=self.refresh))
+            if claimed_run is None:
+                log.info("Task {!r} is already run by another scheduler.".format(ptask["name"]))
+                continue
+            future = self.executor.submit(with_app_context(self._run_task), ptask, claimed_run)
+            self._running[ptask_id] = (ptask["name"], future, time.monotonic())
+            started.append(ptask["name"])
+        if started:
+            log.info("Started the tasks {!s} on node {!r}.".format(started, self.node))
+        return started, finished
+
+    def seconds_to_next_run(self, now=None):
+        """
+        Return the number of seconds until the next task is due or the tasks
+        need to be read again.
+        """
+        now = now or datetime.now(tzutc())
+        seconds = [self.refresh]
+        if self._last_refresh is not None:
+            seconds.append(self.refresh - (time.monotonic() - self._last_refresh))
+        seconds.extend((next_run - now).total_seconds()
+                       for ptask_id, (_ptask, next_run) in self._schedule.items()
+                       if ptask_id not in self._running)
+        # Do not check the overdue tasks in a busy loop
+        return max(1, min(seconds))
+
+    def run(self):
+        """
+        Run the scheduler, until ``stop`` is called. Each check runs in a new
+        application context, so that changes to the configuration are read.
+        """
+        log.info("Starting the scheduler for periodic tasks on node {!r}.".format(self.node))
+        while not self._stop.is_set():
+            with self.app.app_context():
+                try:
+                    self.run_pending()
+                except Exception as e:
+                    log.error("Could not run the periodic tasks: {!r}".format(e))
+                    log.debug("", exc_info=True)
+                    # Read the tasks again at the next check
+                    self._last_refresh = None
+                wait = self.seconds_to_next_run()
+            self._stop.wait(wait)
+        log.info("Waiting for {!s} running tasks.".format(len(self._running)))
+        self.executor.shutdown(wait=True)
+
+    def stop(self):
+        """
+        Stop the scheduler. The running tasks are finished.
+        """
+        self._stop.set()
@@ -25,18 +25,21 @@ from privacyidea.lib.tokenclass import DATE_FORMAT
 
 from croniter import croniter
 from dateutil.tz import tzutc, tzlocal
+from sqlalchemy.exc import IntegrityError
 
 from privacyidea.lib.error import ParameterError, ResourceNotFoundError
 from privacyidea.lib.utils import fetch_one_resource, parse_date
+from privacyidea.lib.task.certificaterollout import CertificateRolloutTask
+from privacyidea.lib.task.cleanup import CleanupTask
 from privacyidea.lib.task.eventcounter import EventCounterTask
 from privacyidea.lib.task.simplestats import SimpleStatsTask
-from privacyidea.models import PeriodicTask
+from privacyidea.models import PeriodicTask, PeriodicTaskLastRun, db
 from privacyidea.lib.framework import get_app_config
 from privacyidea.lib.utils.export import (register_import, register_export)
 
 log = logging.getLogger(__name__)
 
-TASK_CLASSES = [EventCounterTask, SimpleStatsTask]
+TASK_CLASSES = [EventCounterTask, SimpleStatsTask, CleanupTask, CertificateRolloutTask]
 #: TASK_MODULES maps task module identifiers to subclasses of BaseTask
 TASK_MODULES = dict((cls.identifier, cls) for cls in TASK_CLASSES)
 
@@ -233,6 +236,63 @@ def set_periodic_task_last_run(ptask_id, node, last_run_timestamp):
     periodic_task.set_last_run(node, utc_last_run)
 
 
+def claim_periodic_task_run(ptask, node, timestamp):
+    """
+    Record the start of a run of the periodic task on the given node, if the
+    last run is still the one in ``ptask``. If several schedulers use the same
+    node name, only one of them can claim a run, so that the task only runs
+    once.
+
+    :param ptask: task as a dictionary
+    :param node: Node name
+    :param timestamp: Start of the run
+    :type timestamp: timezone-aware datetime object
+    :return: the claimed run as UTC datetime (without timezone information) or
+        None, if another scheduler has already run the task
+    """
+    # Some databases do not store the microseconds
+    utc_timestamp = timestamp.astimezone(tzutc()).replace(tzinfo=None, microsecond=0)
+    last_run = ptask["last_runs"].get(node)
+    if last_run is None:
+        try:
+            db.session.execute(PeriodicTaskLastRun.__table__.insert().values(
+                periodictask_id=ptask["id"], node=node, timestamp=utc_timestamp))
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return None
+    else:
+        r = PeriodicTaskLastRun.query.filter_by(
+            periodictask_id=ptask["id"], node=node,
+            timestamp=last_run.astimezone(tzutc()).replace(tzinfo=None)).update(
+            {"timestamp": utc_timestamp}, synchronize_session=False)
+        db.session.commit()
+        if r != 1:
+            return None
+    return utc_timestamp
+
+
+def release_periodic_task_run(ptask, node, claimed_run):
+    """
+    Restore the last run of the periodic task on the given node, which was
+    replaced by ``claim_periodic_task_run``. This is used, if a failed task
+    should run again.
+
+    :param ptask: task as a dictionary, as it was passed to ``claim_periodic_task_run``
+    :param node: Node name
+    :param claimed_run: The return value of ``claim_periodic_task_run``
+    """
+    query = PeriodicTaskLastRun.query.filter_by(periodictask_id=ptask["id"], node=node,
+                                                timestamp=claimed_run)
+    last_run = ptask["last_runs"].get(node)
+    if last_run is None:
+        query.delete(synchronize_session=False)
+    else:
+        query.update({"timestamp": last_run.astimezone(tzutc()).replace(tzinfo=None)},
+                     synchronize_session=False)
+    db.session.commit()
+
+
 def get_scheduled_periodic_tasks(node, current_timestamp=None, interval_tzinfo=None):
     """
     Collect all periodic tasks that should be run on a specific node, ordered by
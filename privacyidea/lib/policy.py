@@ -177,6 +177,7 @@ from privacyidea.lib.config import (get_token_classes, get_token_types,
                                     get_email_validators)
 from privacyidea.lib.error import ParameterError, PolicyError, ResourceNotFoundError, ServerError
 from privacyidea.lib.realm import get_realms
+from privacyidea.lib.profiling import profiled, PHASE
 from privacyidea.lib.resolver import get_resolver_list
 from privacyidea.lib.smtpserver import get_smtpservers
 from privacyidea.lib.radiusserver import get_radiusservers
@@ -727,6 +728,7 @@ class PolicyClass(object):
         return reduced_policies
 
     @log_with(log)
+    @profiled(PHASE.POLICY)
     def match_policies(self, name=None, scope=None, realm=None, active=None,
                        resolver=None, user=None, user_object=None, pinode=None,
                        client=None, action=None, adminrealm=None, adminuser=None, time=None,
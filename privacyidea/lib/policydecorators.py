@@ -50,6 +50,7 @@ from privacyidea.lib.policy import ACTION, SCOPE, ACTIONVALUE, LOGINMODE
 from privacyidea.lib.user import User
 from privacyidea.lib.utils import parse_timelimit, parse_timedelta, split_pin_pass
 from privacyidea.lib.authcache import verify_in_cache, add_to_cache
+from privacyidea.lib.authcounter import get_auth_counter_store
 import datetime
 from dateutil.tz import tzlocal
 from privacyidea.lib.radiusserver import get_radius
@@ -115,11 +116,7 @@ def challenge_response_allowed(func):
         token = args[0]
         user_object = kwds.get("user") or User()
         if g:
-            allowed_tokentypes_dict = Match.user(g, scope=SCOPE.AUTH,
-                                                 action=ACTION.CHALLENGERESPONSE, user_object=user_object)\
-                .action_values(unique=False, write_to_audit_log=False)
-            log.debug("Found these allowed tokentypes: {0!s}".format(list(allowed_tokentypes_dict)))
-            allowed_tokentypes_dict = {k.lower(): v for k, v in allowed_tokentypes_dict.items()}
+            allowed_tokentypes_dict = get_challenge_response_tokentypes(g, user_object)
             token = token.get_tokentype().lower()
             chal_resp_found = False
             if token in allowed_tokentypes_dict:
@@ -134,9 +131,27 @@ def challenge_response_allowed(func):
         f_result = func(*args, **kwds)
         return f_result
 
+    # Tokens, whose challenges can only be triggered if the policy allows it
+    challenge_response_wrapper.checks_challenge_response_policy = True
     return challenge_response_wrapper
 
 
+def get_challenge_response_tokentypes(g, user_object):
+    """
+    Return the token types, which are allowed to do challenge-response by the
+    policy ``challenge_response``.
+
+    :param g: context object with the policy object
+    :param user_object: the user, who authenticates
+    :return: dictionary of the lowercase token types and the policies
+    """
+    allowed_tokentypes_dict = Match.user(g, scope=SCOPE.AUTH,
+                                         action=ACTION.CHALLENGERESPONSE, user_object=user_object)\
+        .action_values(unique=False, write_to_audit_log=False)
+    log.debug("Found these allowed tokentypes: {0!s}".format(list(allowed_tokentypes_dict)))
+    return {k.lower(): v for k, v in allowed_tokentypes_dict.items()}
+
+
 def auth_cache(wrapped_function, user_object, passw, options=None):
     """
     Decorate lib.token:check_user_pass. Verify, if the authentication can 
@@ -332,6 +347,25 @@ def auth_user_passthru(wrapped_function, user_object, passw, options=None):
     return wrapped_function(user_object, passw, options)
 
 
+def _count_audit_authentications(g, user_object, success, tdelta):
+    """
+    Count the successful or failed authentications of the user with
+    /validate/check and /auth (loginmode privacyIDEA) in the audit log.
+    """
+    count = g.audit_object.get_count({"user": user_object.login,
+                                      "realm": user_object.realm,
+                                      "action": "%/validate/check"},
+                                     success=success,
+                                     timedelta=tdelta)
+    count += g.audit_object.get_count({"user": user_object.login,
+                                       "realm": user_object.realm,
+                                       "info": "%loginmode=privacyIDEA%",
+                                       "action": "%/auth"},
+                                      success=success,
+                                      timedelta=tdelta)
+    return count
+
+
 def auth_user_timelimit(wrapped_function, user_object, passw, options=None):
     """
     This decorator checks the policy settings of
@@ -342,6 +376,9 @@ def auth_user_timelimit(wrapped_function, user_object, passw, options=None):
 
     If the AUTHMAXFAIL is exceed it denies even a successful authentication.
 
+    The authentications are counted in the audit log or, if
+    ``PI_AUTH_COUNTER_STORE`` is set, in the authentication counter store.
+
     The wrapped function is usually token.check_user_pass, which takes the
     arguments (user, passw, options={})
 
@@ -361,63 +398,47 @@ def auth_user_timelimit(wrapped_function, user_object, passw, options=None):
                                       user_object=user_object).action_values(unique=True, write_to_audit_log=False)
         max_fail_dict = Match.user(g, scope=SCOPE.AUTHZ, action=ACTION.AUTHMAXFAIL,
                                    user_object=user_object).action_values(unique=True, write_to_audit_log=False)
+        counter_store = get_auth_counter_store()
+        fail_window = success_window = None
         # Check for maximum failed authentications
         # Always - also in case of unsuccessful authentication
         if len(max_fail_dict) == 1:
-            policy_count, tdelta = parse_timelimit(list(max_fail_dict)[0])
-            fail_c = g.audit_object.get_count({"user": user_object.login,
-                                               "realm": user_object.realm,
-                                               "action":
-                                                   "%/validate/check"},
-                                              success=False,
-                                              timedelta=tdelta)
-            log.debug("Checking users timelimit %s: %s "
-                      "failed authentications with /validate/check" %
-                      (list(max_fail_dict)[0], fail_c))
-            fail_auth_c = g.audit_object.get_count({"user": user_object.login,
-                                                    "realm": user_object.realm,
-                                                    "info": "%loginmode=privacyIDEA%",
-                                                    "action": "%/auth"},
-                                                    success=False,
-                                                    timedelta=tdelta)
+            policy_count, fail_window = parse_timelimit(list(max_fail_dict)[0])
+            if counter_store:
+                fail_c = counter_store.count(user_object, False, fail_window)
+            else:
+                fail_c = _count_audit_authentications(g, user_object, False, fail_window)
             log.debug("Checking users timelimit %s: %s "
-                      "failed authentications with /auth" %
-                      (list(max_fail_dict)[0], fail_auth_c))
-            if fail_c + fail_auth_c >= policy_count:
+                      "failed authentications" % (list(max_fail_dict)[0], fail_c))
+            if fail_c >= policy_count:
                 res = False
                 reply_dict["message"] = ("Only %s failed authentications "
-                                         "per %s" % (policy_count, tdelta))
+                                         "per %s" % (policy_count, fail_window))
                 g.audit_object.add_policy(next(iter(max_fail_dict.values())))
 
         if res:
             # Check for maximum successful authentications
             # Only in case of a successful authentication
             if len(max_success_dict) == 1:
-                policy_count, tdelta = parse_timelimit(list(max_success_dict)[0])
+                policy_count, success_window = parse_timelimit(list(max_success_dict)[0])
                 # check the successful authentications for this user
-                succ_c = g.audit_object.get_count({"user": user_object.login,
-                                                   "realm": user_object.realm,
-                                                   "action":
-                                                       "%/validate/check"},
-                                                  success=True,
-                                                  timedelta=tdelta)
-                log.debug("Checking users timelimit %s: %s "
-                          "successful authentications with /validate/check" %
-                          (list(max_success_dict)[0], succ_c))
-                succ_auth_c = g.audit_object.get_count({"user": user_object.login,
-                                                   "realm": user_object.realm,
-                                                   "info": "%loginmode=privacyIDEA%",
-                                                   "action": "%/auth"},
-                                                  success=True,
-                                                  timedelta=tdelta)
+                if counter_store:
+                    succ_c = counter_store.count(user_object, True, success_window)
+                else:
+                    succ_c = _count_audit_authentications(g, user_object, True, success_window)
                 log.debug("Checking users timelimit %s: %s "
-                          "successful authentications with /auth" %
-                          (list(max_success_dict)[0], succ_auth_c))
-                if succ_c + succ_auth_c >= policy_count:
+                          "successful authentications" % (list(max_success_dict)[0], succ_c))
+                if succ_c >= policy_count:
                     res = False
                     reply_dict["message"] = ("Only %s successful "
                                              "authentications per %s"
-                                             % (policy_count, tdelta))
+                                             % (policy_count, success_window))
+
+        # Count this authentication, if a policy needs the counter
+        if counter_store:
+            window = success_window if res else fail_window
+            if window:
+                counter_store.increment(user_object, res, window)
 
     return res, reply_dict
 
@@ -536,43 +557,56 @@ def auth_otppin(wrapped_function, *args, **kwds):
     # if tokenclass.check_pin is called in any other way, options may be None
     #  or it might have no element "g".
     options = kwds.get("options") or {}
-    g = options.get("g")
-    if g:
-        token = args[0]
-        pin = args[1]
-        clientip = options.get("clientip")
-        user_object = kwds.get("user")
-        if not user_object:
-            # No user in the parameters, so we need to determine the owner of
-            #  the token
-            user_object = token.user
-            realms = token.get_realms()
-            if not user_object and len(realms):
-                # if the token has not owner, we take a realm.
-                user_object = User("", realm=realms[0])
-        if not user_object:
-            # If we still have no user and no tokenrealm, we create an empty
-            # user object.
-            user_object=User("", realm="")
-        # get the policy
-        otppin_dict = Match.user(g, scope=SCOPE.AUTH, action=ACTION.OTPPIN,
-                                 user_object=user_object).action_values(unique=True)
-        if otppin_dict:
-            if list(otppin_dict)[0] == ACTIONVALUE.NONE:
-                if pin == "":
-                    # No PIN checking, we expect an empty PIN!
-                    return True
-                else:
-                    return False
+    otppin, user_object = get_otppin_policy(args[0], options, kwds.get("user"))
+    if otppin == ACTIONVALUE.NONE:
+        if args[1] == "":
+            # No PIN checking, we expect an empty PIN!
+            return True
+        else:
+            return False
 
-            if list(otppin_dict)[0] == ACTIONVALUE.USERSTORE:
-                rv = user_object.check_password(pin)
-                return rv is not None
+    if otppin == ACTIONVALUE.USERSTORE:
+        rv = user_object.check_password(args[1])
+        return rv is not None
 
     # call and return the original check_pin function
     return wrapped_function(*args, **kwds)
 
 
+def get_otppin_policy(token, options, user_object=None):
+    """
+    Return the value of the policy ACTION.OTPPIN, which applies to the PIN
+    check of the given token.
+
+    :param token: The token object
+    :param options: The options, which contain the flask g
+    :param user_object: The user from the authentication request
+    :return: tuple of ACTIONVALUE.NONE, ACTIONVALUE.USERSTORE or None, if the
+        token PIN is checked, and the user object, which the policy matched
+    """
+    g = options.get("g")
+    if not g:
+        return None, user_object
+    if not user_object:
+        # No user in the parameters, so we need to determine the owner of
+        #  the token
+        user_object = token.user
+        realms = token.get_realms()
+        if not user_object and len(realms):
+            # if the token has not owner, we take a realm.
+            user_object = User("", realm=realms[0])
+    if not user_object:
+        # If we still have no user and no tokenrealm, we create an empty
+        # user object.
+        user_object = User("", realm="")
+    # get the policy
+    otppin_dict = Match.user(g, scope=SCOPE.AUTH, action=ACTION.OTPPIN,
+                             user_object=user_object).action_values(unique=True)
+    if otppin_dict and list(otppin_dict)[0] in [ACTIONVALUE.NONE, ACTIONVALUE.USERSTORE]:
+        return list(otppin_dict)[0], user_object
+    return None, user_object
+
+
 def config_lost_token(wrapped_function, *args, **kwds):
     """
     Decorator to decorate the lib.token.lost_token function.
@@ -0,0 +1,310 @@
+# SPDX-License-Identifier: AGPL-3.0-or-later
+#
+# Info: https://privacyidea.org
+#
+# This code is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public License
+# as published by the Free Software Foundation, either
+# version 3 of the License, or any later version.
+#
+# This code is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+__doc__ = """This module measures where the time of a request is spent.
+
+If ``PI_PROFILING`` is set, each request gets a ``RequestProfile``, which
+collects the time spent in certain phases like policy matching, resolver
+lookups, event handlers and the audit log, as well as the number and the
+duration of SQL queries. At the end of the request the profile is added to
+process-wide histograms, which can be read at ``/monitoring/profiling``.
+
+If ``PI_PROFILING`` is not set, the instrumented functions only check for the
+request profile and no SQL event listeners are registered.
+
+This module is tested in tests/test_lib_profiling.py
+"""
+import bisect
+import functools
+import logging
+import time
+from collections import deque
+from contextlib import contextmanager
+from threading import Lock
+
+from flask import has_app_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from privacyidea.lib.framework import (get_request_local_store, get_app_local_store,
+                                       get_app_config_value)
+
+log = logging.getLogger(__name__)
+
+# Upper bounds of the histogram buckets in milliseconds
+HISTOGRAM_BUCKETS = [1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+DEFAULT_SLOW_SAMPLES = 20
+
+
+class PHASE(object):
+    __doc__ = """The phases of a request, that are measured"""
+    POLICY = "policy"
+    RESOLVER = "resolver"
+    EVENT = "event"
+    AUDIT = "audit"
+    DB = "db"
+    TOTAL = "total"
+
+
+class RequestProfile(object):
+    """
+    The timings of a single request.
+    Nested measurements of the same phase are only counted once.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.duration = None
+        self.phases = {}
+        self.calls = {}
+        self.db_queries = 0
+        self._active = {}
+        self._excluded = {}
+
+    @contextmanager
+    def measure(self, phase):
+        outermost = not self._active.get(phase)
+        self._active[phase] = self._active.get(phase, 0) + 1
+        start = time.perf_counter()
+        excluded_before = self._excluded.get(phase, 0)
+        try:
+            yield
+        finally:
+            self._active[phase] -= 1
+            if outermost:
+                excluded = self._excluded.get(phase, 0) - excluded_before
+                self.add(phase, time.perf_counter() - start - excluded)
+
+    @contextmanager
+    def exclude(self, phase):
+        """
+        Do not count the elapsed time to a running measurement of the phase.
+        Measurements of the phase within the excluded block are counted again.
+        """
+        active = self._active.pop(phase, 0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._active[phase] = active
+            if active:
+                self._excluded[phase] = self._excluded.get(phase, 0) + time.perf_counter() - start
+
+    def add(self, phase, elapsed):
+        self.phases[phase] = self.phases.get(phase, 0) + elapsed
+        self.calls[phase] = self.calls.get(phase, 0) + 1
+
+    def add_query(self, elapsed):
+        self.db_queries += 1
+        self.add(PHASE.DB, elapsed)
+
+    def finish(self):
+        if self.duration is None:
+            self.duration = time.perf_counter() - self.start
+        return self.duration
+
+    def get_timings(self):
+        """
+        :return: dictionary of the phases and their duration in milliseconds
+        """
+        timings = {phase: round(elapsed * 1000, 3) for phase, elapsed in self.phases.items()}
+        timings[PHASE.TOTAL] = round((self.duration or time.perf_counter() - self.start) * 1000, 3)
+        return timings
+
+    def get_server_timing(self):
+        """
+        :return: the value of the ``Server-Timing`` HTTP header
+        """
+        entries = []
+        for phase, duration in sorted(self.get_timings().items()):
+            entry = "{0!s};dur={1!s}".format(phase, duration)
+            if phase == PHASE.DB:
+                entry += ';desc="{0!s} queries"'.format(self.db_queries)
+            entries.append(entry)
+        return ", ".join(entries)
+
+
+class ProfileStatistics(object):
+    """
+    Process-wide histograms of the request timings per endpoint and phase.
+    Requests that take longer than ``slow_request`` milliseconds are kept as
+    samples.
+    """
+
+    def __init__(self, slow_request=None, slow_samples=DEFAULT_SLOW_SAMPLES):
+        self.slow_request = slow_request
+        self._lock = Lock()
+        self._endpoints = {}
+        self.slow_samples = deque(maxlen=slow_samples)
+
+    def add(self, endpoint, profile):
+        timings = profile.get_timings()
+        with self._lock:
+            stats = self._endpoints.setdefault(endpoint, {"count": 0, "db_queries": 0, "phases": {}})
+            stats["count"] += 1
+            stats["db_queries"] += profile.db_queries
+            for phase, duration in timings.items():
+                phase_stats = stats["phases"].setdefault(
+                    phase, {"sum": 0, "max": 0, "buckets": [0] * (len(HISTOGRAM_BUCKETS) + 1)})
+                phase_stats["sum"] += duration
+                phase_stats["max"] = max(phase_stats["max"], duration)
+                phase_stats["buckets"][bisect.bisect_left(HISTOGRAM_BUCKETS, duration)] += 1
+            if self.slow_request is not None and timings[PHASE.TOTAL] >= self.slow_request:
+                self.slow_samples.append({"endpoint": endpoint,
+                                          "timestamp": time.time(),
+                                          "db_queries": profile.db_queries,
+                                          "timings": timings})
+                log.warning("Slow request {0!s}: {1!s}".format(endpoint, timings))
+
+    def get(self):
+        """
+        :return: a dictionary with the histograms per endpoint and the slow request samples
+        """
+        with self._lock:
+            endpoints = {}
+            for endpoint, stats in self._endpoints.items():
+                endpoints[endpoint] = {
+                    "count": stats["count"],
+                    "db_queries": stats["db_queries"],
+                    "phases": {phase: {"sum": round(p["sum"], 3),
+                                       "max": p["max"],
+                                       "buckets": dict(zip([str(b) for b in HISTOGRAM_BUCKETS] + ["inf"],
+                                                           p["buckets"]))}
+                               for phase, p in stats["phases"].items()}}
+            return {"endpoints": endpoints,
+                    "slow_requests": list(self.slow_samples)}
+
+    def reset(self):
+        with self._lock:
+            self._endpoints = {}
+            self.slow_samples.clear()
+
+
+def get_profile_statistics():
+    """
+    Return the process-wide profiling statistics.
+    ``PI_PROFILING_SLOW_REQUEST`` (milliseconds) defines, which requests are
+    kept as samples, ``PI_PROFILING_SLOW_SAMPLES`` the number of samples.
+    """
+    app_store = get_app_local_store()
+    try:
+        return app_store["profile_statistics"]
+    except KeyError:
+        slow_request = get_app_config_value("PI_PROFILING_SLOW_REQUEST")
+        statistics = ProfileStatistics(float(slow_request) if slow_request is not None else None,
+                                       int(get_app_config_value("PI_PROFILING_SLOW_SAMPLES",
+                                                                DEFAULT_SLOW_SAMPLES)))
+        return app_store.setdefault("profile_statistics", statistics)
+
+
+def start_request_profile():
+    """
+    Start the profile of the current request, if ``PI_PROFILING`` is set.
+    """
+    if get_app_config_value("PI_PROFILING", False):
+        get_request_local_store()["request_profile"] = RequestProfile()
+
+
+def get_request_profile():
+    """
+    :return: the profile of the current request or None
+    """
+    if not has_app_context():
+        return None
+    return get_request_local_store().get("request_profile")
+
+
+def finish_request_profile(endpoint):
+    """
+    Finish the profile of the current request and add it to the statistics.
+
+    :param endpoint: The name of the endpoint, like "POST /validate/check"
+    """
+    profile = get_request_local_store().pop("request_profile", None)
+    if profile:
+        profile.finish()
+        get_profile_statistics().add(endpoint, profile)
+
+
+@contextmanager
+def measure(phase):
+    """
+    Context manager, that adds the elapsed time to the given phase of the
+    current request profile.
+    """
+    profile = get_request_profile()
+    if profile is None:
+        yield
+    else:
+        with profile.measure(phase):
+            yield
+
+
+@contextmanager
+def excluded(phase):
+    """
+    Context manager, that excludes the elapsed time from a running
+    measurement of the given phase of the current request profile.
+    """
+    profile = get_request_profile()
+    if profile is None:
+        yield
+    else:
+        with profile.exclude(phase):
+            yield
+
+
+def profiled(phase):
+    """
+    Decorator, that adds the time spent in the decorated function to the
+    given phase of the current request profile.
+
+    :param phase: The name of the phase
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def profiled_wrapper(*args, **kwds):
+            profile = get_request_profile()
+            if profile is None:
+                return func(*args, **kwds)
+            with profile.measure(phase):
+                return func(*args, **kwds)
+        return profiled_wrapper
+    return decorator
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info["query_start_time"] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start_time = conn.info.pop("query_start_time", None)
+    if start_time is None:
+        return
+    profile = get_request_profile()
+    if profile is not None:
+        profile.add_query(time.perf_counter() - start_time)
+
+
+def register_sql_events():
+    """
+    Count and measure the SQL queries of all SQLAlchemy engines, i.e. the
+    privacyIDEA database, SQL resolvers, SQL audit and monitoring.
+    """
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
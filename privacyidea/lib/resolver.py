@@ -49,11 +49,12 @@ from .log import log_with
 from .config import (get_resolver_types, get_resolver_classes, get_config_object)
 from privacyidea.lib.usercache import delete_user_cache
 from privacyidea.lib.framework import get_request_local_store
+from privacyidea.lib.profiling import profiled, PHASE
 from ..models import (Resolver,
                       ResolverConfig)
 from ..api.lib.utils import required
 from ..api.lib.utils import getParam
-from .error import ConfigAdminError
+from .error import ConfigAdminError, ResourceNotFoundError
 from sqlalchemy import func
 from .crypto import encryptPassword
 from privacyidea.lib.utils import (sanity_name_check, get_data_from_params,
@@ -140,6 +141,7 @@ def save_resolver(params):
 
     # Remove corresponding entries from the user cache
     delete_user_cache(resolver=resolvername)
+    get_resolver_class(resolvertype).flush_cache()
 
     return resolver_id
 
@@ -226,6 +228,9 @@ def delete_resolver(resolvername):
                                    "realm %r." % (resolvername, realmname))
         reso.delete()
         ret = reso.id
+        resolver_class = get_resolver_class(reso.rtype)
+        if resolver_class:
+            resolver_class.flush_cache()
     # Delete resolver object from cache
     store = get_request_local_store()
     if 'resolver_objects' in store:
@@ -311,6 +316,7 @@ def get_resolver_type(resolvername):
 
 @log_with(log)
 #@cache.memoize(10)
+@profiled(PHASE.RESOLVER)
 def get_resolver_object(resolvername):
     """
     Return the cached resolver object for the given resolver name (stored in the request context).
@@ -367,6 +373,36 @@ def pretestresolver(resolvertype, params):
     return success, desc
 
 
+@log_with(log)
+def get_resolver_cache_statistics(resolvername):
+    """
+    Return the statistics of the per-process caches of the given resolver.
+
+    :param resolvername: The name of the resolver
+    :return: dictionary with the statistics, e.g. per cached function
+    """
+    r_obj = get_resolver_object(resolvername)
+    if r_obj is None:
+        raise ResourceNotFoundError("The resolver {0!r} does not exist.".format(resolvername))
+    return r_obj.get_cache_statistics()
+
+
+@log_with(log)
+def clear_resolver_cache(resolvername):
+    """
+    Drop the cached users of the given resolver in this process. Entries of
+    the database user cache are deleted as well.
+
+    :param resolvername: The name of the resolver
+    """
+    r_obj = get_resolver_object(resolvername)
+    if r_obj is None:
+        raise ResourceNotFoundError("The resolver {0!r} does not exist.".format(resolvername))
+    r_obj.clear_cache()
+    delete_user_cache(resolver=resolvername)
+    return True
+
+
 @register_export('resolver')
 def export_resolver(name=None, censor=False):
     """ Export given or all resolver configuration """
@@ -60,13 +60,16 @@ import logging
 import yaml
 import threading
 import functools
+import time
+from collections import deque
 
 from .UserIdResolver import UserIdResolver
 
 import ldap3
 from ldap3 import MODIFY_REPLACE, MODIFY_ADD, MODIFY_DELETE
 from ldap3 import Tls
-from ldap3.core.exceptions import LDAPOperationResult
+from ldap3.core.exceptions import (LDAPOperationResult, LDAPException, LDAPBindError,
+                                   LDAPPasswordIsMandatoryError)
 from ldap3.core.results import RESULT_SIZE_LIMIT_EXCEEDED
 import ssl
 
@@ -76,13 +79,16 @@ import traceback
 from passlib.hash import ldap_salted_sha1
 import hashlib
 import binascii
-from privacyidea.lib.framework import get_app_local_store, get_app_config_value
+from privacyidea.lib.framework import (get_app_local_store, get_app_config_value,
+                                       get_request_local_store)
+from privacyidea.lib.lifecycle import register_finalizer, finalizers_are_called
 import datetime
 
 from privacyidea.lib import _
 from privacyidea.lib.utils import (is_true, to_bytes, to_unicode,
                                    convert_column_to_unicode)
 from privacyidea.lib.error import privacyIDEAError
+from privacyidea.lib.cache.lru import TTLLRUCache, MISSING
 import uuid
 from ldap3.utils.conv import escape_bytes
 from operator import itemgetter
@@ -96,7 +102,11 @@ except ImportError:
     log.info('Could not import gssapi package. Kerberos authentication not available')
     have_gssapi = False
 
+# The caches of the LDAP resolvers per resolver ID and function
 CACHE = {}
+CACHE_LOCK = threading.Lock()
+# The maximum number of entries per resolver and function
+DEFAULT_CACHE_SIZE = 10000
 
 ENCODING = "utf-8"
 # The number of rounds the resolver tries to reach a responding server in the
@@ -108,6 +118,14 @@ SERVERPOOL_SKIP = 30
 LDAP_STRATEGY = {"ROUND_ROBIN": ldap3.ROUND_ROBIN, "FIRST": ldap3.FIRST, "RANDOM": ldap3.RANDOM}
 SERVERPOOL_STRATEGY = "ROUND_ROBIN"
 
+# The maximum number of seconds a pooled LDAP connection is used
+CONNECTION_POOL_LIFETIME = 600
+# The number of seconds a request waits for a free connection of the pool
+CONNECTION_POOL_TIMEOUT = 10
+# Pooled connections, that have been idle for this number of seconds, are
+# checked with a search for the root DSE before they are used again.
+CONNECTION_POOL_CHECK_INTERVAL = 30
+
 # 1 sec == 10^9 nano secs == 10^7 * (100 nano secs)
 MS_AD_MULTIPLYER = 10 ** 7
 MS_AD_START = datetime.datetime(1601, 1, 1)
@@ -155,6 +173,142 @@ class LockingServerPool(ldap3.ServerPool):
             return ldap3.ServerPool.get_current_server(self, connection)
 
 
+class LDAPConnectionPool(object):
+    """
+    A per-process pool of open LDAP connections, which are reused across
+    requests. At most ``size`` connections are handed out at the same time.
+    Connections are closed after ``lifetime`` seconds. Connections, which
+    have been idle for ``CONNECTION_POOL_CHECK_INTERVAL`` seconds, are
+    checked with the function ``check`` before they are handed out again.
+    """
+
+    def __init__(self, creator, size, lifetime=CONNECTION_POOL_LIFETIME,
+                 timeout=CONNECTION_POOL_TIMEOUT, check=None):
+        """
+        :param creator: function without arguments, which returns a new connection
+        :param size: the maximum number of connections
+        :param lifetime: the maximum age of a connection in seconds
+        :param timeout: the number of seconds to wait for a free connection
+        :param check: function, which takes an idle connection and returns
+            whether it is still usable
+        """
+        self.creator = creator
+        self.size = size
+        self.lifetime = lifetime
+        self.timeout = timeout
+        self.check = check
+        self._semaphore = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        # tuples of the connection, its creation time and the time it was returned
+        self._idle = deque()
+        self._created = {}
+        self._closed = False
+        self.statistics = {"created": 0, "reused": 0, "discarded": 0,
+                           "timeouts": 0, "in_use": 0}
+
+    def _is_usable(self, conn, now, last_used):
+        if getattr(conn, "closed", False):
+            return False
+        if now - self._created.get(id(conn), now) > self.lifetime:
+            return False
+        if self.check and now - last_used > CONNECTION_POOL_CHECK_INTERVAL:
+            try:
+                return self.check(conn)
+            except Exception as e:  # pragma: no cover
+                log.info("Pooled LDAP connection failed the health check: {0!r}".format(e))
+                return False
+        return True
+
+    def _forget(self, conn):
+        """
+        Remove the connection from the bookkeeping of the pool. The caller
+        holds the lock and closes the connection after releasing it.
+        """
+        self._created.pop(id(conn), None)
+        self.statistics["discarded"] += 1
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.unbind()
+        except Exception as e:  # pragma: no cover
+            log.debug("Could not unbind the LDAP connection: {0!r}".format(e))
+
+    def acquire(self):
+        """
+        Return an idle connection or create a new one.
+        Raises a ``privacyIDEAError``, if no connection is available within
+        ``timeout`` seconds.
+        """
+        if not self._semaphore.acquire(timeout=self.timeout):
+            with self._lock:
+                self.statistics["timeouts"] += 1
+            raise privacyIDEAError("No free LDAP connection available.")
+        try:
+            while True:
+                with self._lock:
+                    entry = self._idle.popleft() if self._idle else None
+                if entry is None:
+                    break
+                conn, last_used = entry
+                if self._is_usable(conn, time.monotonic(), last_used):
+                    with self._lock:
+                        self.statistics["reused"] += 1
+                        self.statistics["in_use"] += 1
+                    return conn
+                with self._lock:
+                    self._forget(conn)
+                self._close(conn)
+            conn = self.creator()
+        except Exception:
+            self._semaphore.release()
+            raise
+        with self._lock:
+            self._created[id(conn)] = time.monotonic()
+            self.statistics["created"] += 1
+            self.statistics["in_use"] += 1
+        return conn
+
+    def release(self, conn, discard=False):
+        """
+        Return the connection to the pool.
+
+        :param discard: close the connection instead, e.g. after an error
+        """
+        discard = discard or getattr(conn, "closed", False)
+        with self._lock:
+            self.statistics["in_use"] -= 1
+            discard = discard or self._closed
+            if discard:
+                self._forget(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+        self._semaphore.release()
+        if discard:
+            self._close(conn)
+
+    def close(self):
+        """
+        Close all idle connections. Connections in use are closed when they
+        are returned and the pool is not used anymore.
+        """
+        with self._lock:
+            self._closed = True
+            idle = [conn for conn, _last_used in self._idle]
+            self._idle.clear()
+            for conn in idle:
+                self._forget(conn)
+        for conn in idle:
+            self._close(conn)
+
+    def get_statistics(self):
+        with self._lock:
+            statistics = dict(self.statistics)
+            statistics["idle"] = len(self._idle)
+            statistics["size"] = self.size
+        return statistics
+
+
 def get_ad_timestamp_now():
     """
     returns the current UTC time as it is used in Active Directory in the
@@ -232,53 +386,29 @@ def ignore_sizelimit_exception(conn, generator):
 def cache(func):
     """
     cache the user with his loginname, resolver and UID in a local
-    dictionary cache.
+    bounded cache. Users, that are not found, are only cached, if
+    ``negative_cache_timeout`` is set.
     This is a per process cache.
     """
     @functools.wraps(func)
     def cache_wrapper(self, *args, **kwds):
         # Only run the code, in case we have a configured cache!
-        if self.cache_timeout > 0:
-            # If it does not exist, create the node for this instance
-            resolver_id = self.getResolverId()
-            now = datetime.datetime.now()
-            tdelta = datetime.timedelta(seconds=self.cache_timeout)
-            if not resolver_id in CACHE:
-                CACHE[resolver_id] = {"getUserId": {},
-                                      "getUserInfo": {},
-                                      "_getDN": {}}
-            else:
-                # Clean up the cache in the current resolver and the current function
-                _to_be_deleted = []
-                try:
-                    for user, cached_result in CACHE[resolver_id].get(func.__name__).items():
-                        if now > cached_result.get("timestamp") + tdelta:
-                            _to_be_deleted.append(user)
-                except RuntimeError:
-                    # This might happen if thread A evicts an expired
-                    # cache entry while thread B looks for expired cache entries
-                    pass
-                for user in _to_be_deleted:
-                    try:
-                        del CACHE[resolver_id][func.__name__][user]
-                    except KeyError:
-                        pass
-                del _to_be_deleted
-
-            # get the portion of the cache for this very LDAP resolver
-            r_cache = CACHE.get(resolver_id).get(func.__name__)
-            entry = r_cache.get(args[0])
-            if entry and now < entry.get("timestamp") + tdelta:
-                log.debug("Reading {0!r} from cache for {1!r}".format(args[0], func.__name__))
-                return entry.get("value")
+        if self.cache_timeout <= 0:
+            return func(self, *args, **kwds)
+
+        r_cache = self._get_cache(func.__name__)
+        f_result = r_cache.get(args[0])
+        if f_result is not MISSING:
+            log.debug("Reading {0!r} from cache for {1!r}".format(args[0], func.__name__))
+            return f_result
 
         f_result = func(self, *args, **kwds)
 
-        if self.cache_timeout > 0:
-            # now we cache the result
-            CACHE[resolver_id][func.__name__][args[0]] = {
-                "value": f_result,
-                "timestamp": now}
+        # now we cache the result
+        if f_result:
+            r_cache.set(args[0], f_result)
+        elif self.negative_cache_timeout > 0:
+            r_cache.set(args[0], f_result, ttl=self.negative_cache_timeout)
 
         return f_result
 
@@ -317,6 +447,8 @@ class IdResolver (UserIdResolver):
         self.resolverId = self.uri
         self.scope = ldap3.SUBTREE
         self.cache_timeout = 120
+        self.negative_cache_timeout = 0
+        self.cache_size = DEFAULT_CACHE_SIZE
         self.tls_context = None
         self.start_tls = False
         self.serverpool_persistent = False
@@ -324,6 +456,9 @@ class IdResolver (UserIdResolver):
         self.serverpool_skip = SERVERPOOL_SKIP
         self.serverpool_strategy = SERVERPOOL_STRATEGY
         self.serverpool = None
+        self.connection_pool_size = 0
+        self.connection_pool_lifetime = CONNECTION_POOL_LIFETIME
+        self.connection_pool_timeout = CONNECTION_POOL_TIMEOUT
         self.keytabfile = None
         # The number of seconds that ldap3 waits if no server is left in the pool, before
         # starting the next round
@@ -375,6 +510,8 @@ class IdResolver (UserIdResolver):
             # since we must avoid anonymous binds!
             if not bind_user or len(bind_user) < 1:
                 raise Exception("No valid user. Empty bind_user.")
+            if self.connection_pool_size > 0 and self.authtype == AUTHTYPE.SIMPLE:
+                return self._check_pass_pooled(bind_user, password)
             l = self.create_connection(authtype=self.authtype,
                                        server=self.serverpool,
                                        user=bind_user,
@@ -396,6 +533,30 @@ class IdResolver (UserIdResolver):
 
         return True
 
+    def _check_pass_pooled(self, bind_user, password):
+        """
+        Check the password with a bind on a pooled connection. If the pooled
+        connection fails, the bind is repeated once with a new connection.
+        """
+        pool = self.get_connection_pool("user")
+        for attempt in range(2):
+            l = pool.acquire()
+            try:
+                r = l.rebind(user=bind_user, password=to_unicode(password))
+            except (LDAPBindError, LDAPPasswordIsMandatoryError) as e:
+                pool.release(l)
+                log.warning("failed to check password for {0!r}: {1!r}".format(bind_user, e))
+                return False
+            except LDAPException as e:
+                pool.release(l, discard=True)
+                log.info("Pooled LDAP connection failed: {0!r}".format(e))
+                if attempt:
+                    raise
+                continue
+            pool.release(l)
+            log.debug("bind result: {0!r}".format(r))
+            return bool(r)
+
     def _trim_result(self, result_list):
         """
         The resultlist can contain entries of type:searchResEntry and of
@@ -515,23 +676,183 @@ class IdResolver (UserIdResolver):
 
         return dn
 
+    def _get_cache(self, function_name):
+        """
+        Return the cache of this resolver for the given function.
+        """
+        resolver_id = self.getResolverId()
+        caches = CACHE.get(resolver_id)
+        if caches is None:
+            with CACHE_LOCK:
+                caches = CACHE.setdefault(resolver_id, {})
+        r_cache = caches.get(function_name)
+        if r_cache is None:
+            with CACHE_LOCK:
+                r_cache = caches.setdefault(function_name,
+                                            TTLLRUCache(self.cache_size, self.cache_timeout))
+        return r_cache
+
+    def _invalidate_cache(self, uid=None, login_name=None):
+        """
+        Drop the cached entries of a user, which has been added, changed or
+        deleted in the LDAP directory by this process.
+
+        :param uid: The user ID of the user
+        :param login_name: The login name of the user
+        """
+        caches = CACHE.get(self.getResolverId(), {})
+        if login_name and "getUserId" in caches:
+            caches["getUserId"].delete(login_name)
+        if uid:
+            for function_name in ["getUserInfo", "_getDN"]:
+                if function_name in caches:
+                    caches[function_name].delete(uid)
+
+    def get_cache_statistics(self):
+        """
+        :return: the hits, misses and evictions of the caches of this resolver
+            per function
+        """
+        caches = CACHE.get(self.getResolverId(), {})
+        statistics = {function_name: r_cache.get_statistics()
+                      for function_name, r_cache in list(caches.items())}
+        for description, pool in self._get_connection_pools().items():
+            statistics["{0!s}_connections".format(description[0])] = pool.get_statistics()
+        return statistics
+
+    def clear_cache(self):
+        """
+        Drop the cached users and close the pooled connections of this resolver.
+        """
+        with CACHE_LOCK:
+            CACHE.pop(self.getResolverId(), None)
+        pools = get_app_local_store().get('ldap_connection_pools', {})
+        for description, pool in self._get_connection_pools().items():
+            pools.pop(description, None)
+            pool.close()
+
+    @staticmethod
+    def flush_cache():
+        """
+        Drop the caches and the connection pools of all LDAP resolvers, since
+        the resolver ID does not contain all settings, which change the results.
+        """
+        with CACHE_LOCK:
+            CACHE.clear()
+        pools = get_app_local_store().get('ldap_connection_pools', {})
+        for description in list(pools):
+            pool = pools.pop(description, None)
+            if pool:
+                pool.close()
+
     def _bind(self):
         if not self.i_am_bound:
             if not self.serverpool:
                 self.serverpool = self.get_serverpool_instance(self.get_info)
-            self.l = self.create_connection(authtype=self.authtype,
-                                            server=self.serverpool,
-                                            user=self.binddn,
-                                            password=self.bindpw,
-                                            receive_timeout=self.timeout,
-                                            auto_referrals=not
-                                            self.noreferrals,
-                                            start_tls=self.start_tls,
-                                            keytabfile=self.keytabfile)
-            if not self.l.bind():
-                raise Exception("Wrong credentials")
+            if self.connection_pool_size > 0 and finalizers_are_called():
+                # Borrow a bound connection, which is returned at the end of the
+                # request or the worker task. Resolver objects of the same configuration share the
+                # connection, which has already been borrowed in this request.
+                pool = self.get_connection_pool("service")
+                borrowed = get_request_local_store().setdefault("ldap_connections", {})
+                if pool not in borrowed:
+                    borrowed[pool] = pool.acquire()
+                    register_finalizer(functools.partial(self._return_connection, pool))
+                self.l = borrowed[pool]
+            else:
+                self.l = self._create_service_connection()
             self.i_am_bound = True
 
+    @staticmethod
+    def _return_connection(pool):
+        """
+        Return the connection, which has been borrowed in this request, to the pool.
+        """
+        conn = get_request_local_store().get("ldap_connections", {}).pop(pool, None)
+        if conn is not None:
+            pool.release(conn)
+
+    def _create_service_connection(self):
+        """
+        Create a connection, which is bound with the service account.
+        """
+        l = self.create_connection(authtype=self.authtype,
+                                   server=self.serverpool,
+                                   user=self.binddn,
+                                   password=self.bindpw,
+                                   receive_timeout=self.timeout,
+                                   auto_referrals=not
+                                   self.noreferrals,
+                                   start_tls=self.start_tls,
+                                   keytabfile=self.keytabfile)
+        if not l.bind():
+            raise Exception("Wrong credentials")
+        return l
+
+    def _create_user_connection(self):
+        """
+        Create an anonymous connection, which is used to verify the passwords
+        of users with a bind.
+        """
+        return self.create_connection(authtype=self.authtype,
+                                      server=self.serverpool,
+                                      receive_timeout=self.timeout,
+                                      auto_referrals=not self.noreferrals,
+                                      start_tls=self.start_tls)
+
+    @staticmethod
+    def _check_connection(conn):
+        """
+        Check a pooled connection with a search for the root DSE.
+        """
+        return conn.search(search_base="", search_filter="(objectClass=*)",
+                           search_scope=ldap3.BASE, attributes=["1.1"])
+
+    def get_connection_pool(self, kind):
+        """
+        Return the process-wide pool of connections of this resolver
+        configuration. Pools of the kind "service" hold connections bound with
+        the service account, pools of the kind "user" hold connections, which
+        are bound with the credentials of users to check their passwords.
+
+        :param kind: "service" or "user"
+        :return: a ``LDAPConnectionPool`` instance
+        """
+        pools = get_app_local_store().setdefault('ldap_connection_pools', {})
+        pool_description = (kind,
+                            self.getResolverId(),
+                            self.binddn,
+                            hashlib.sha256(to_bytes(self.bindpw or "")).hexdigest(),
+                            self.authtype,
+                            self.keytabfile,
+                            self.timeout,
+                            repr(self.tls_context),
+                            self.start_tls,
+                            self.noreferrals,
+                            self.serverpool_persistent,
+                            self.connection_pool_size,
+                            self.connection_pool_lifetime,
+                            self.connection_pool_timeout)
+        pool = pools.get(pool_description)
+        if pool is None:
+            log.debug("Creating a LDAP connection pool for {0!r}.".format(pool_description[:3]))
+            creator = self._create_service_connection if kind == "service" else self._create_user_connection
+            pool = LDAPConnectionPool(creator, self.connection_pool_size,
+                                      lifetime=self.connection_pool_lifetime,
+                                      timeout=self.connection_pool_timeout,
+                                      check=self._check_connection)
+            pool = pools.setdefault(pool_description, pool)
+        return pool
+
+    def _get_connection_pools(self):
+        """
+        :return: dictionary of the descriptions and connection pools of this resolver
+        """
+        pools = get_app_local_store().get('ldap_connection_pools', {})
+        resolver_id = self.getResolverId()
+        return {description: pool for description, pool in list(pools.items())
+                if description[1] == resolver_id}
+
     @staticmethod
     def _get_tls_context(ldap_uri=None, start_tls=False, tls_version=None, tls_verify=None,
                          tls_ca_file=None, tls_options=None):
@@ -824,6 +1145,8 @@ class IdResolver (UserIdResolver):
         self.bindpw = config.get("BINDPW")
         self.timeout = int(config.get("TIMEOUT", 5))
         self.cache_timeout = int(config.get("CACHE_TIMEOUT", 120))
+        self.negative_cache_timeout = int(config.get("CACHE_NEGATIVE_TIMEOUT") or 0)
+        self.cache_size = int(config.get("CACHE_SIZE") or DEFAULT_CACHE_SIZE)
         self.sizelimit = int(config.get("SIZELIMIT", 500))
         self.loginname_attribute = [la.strip() for la in config.get("LOGINNAMEATTRIBUTE","").split(",")]
         self.searchfilter = config.get("LDAPSEARCHFILTER")
@@ -854,6 +1177,9 @@ class IdResolver (UserIdResolver):
         self.serverpool_rounds = int(config.get("SERVERPOOL_ROUNDS") or SERVERPOOL_ROUNDS)
         self.serverpool_skip = int(config.get("SERVERPOOL_SKIP") or SERVERPOOL_SKIP)
         self.serverpool_strategy = config.get("SERVERPOOL_STRATEGY") or SERVERPOOL_STRATEGY
+        self.connection_pool_size = int(config.get("CONNECTION_POOL_SIZE") or 0)
+        self.connection_pool_lifetime = int(config.get("CONNECTION_POOL_LIFETIME") or CONNECTION_POOL_LIFETIME)
+        self.connection_pool_timeout = int(config.get("CONNECTION_POOL_TIMEOUT") or CONNECTION_POOL_TIMEOUT)
         # The configuration might have changed. We reset the serverpool
         self.serverpool = None
         self.i_am_bound = False
@@ -1036,10 +1362,15 @@ class IdResolver (UserIdResolver):
                                 'TLS_CA_FILE': 'string',
                                 'START_TLS': 'bool',
                                 'CACHE_TIMEOUT': 'int',
+                                'CACHE_NEGATIVE_TIMEOUT': 'int',
+                                'CACHE_SIZE': 'int',
                                 'SERVERPOOL_STRATEGY': 'string',
                                 'SERVERPOOL_ROUNDS': 'int',
                                 'SERVERPOOL_SKIP': 'int',
                                 'SERVERPOOL_PERSISTENT': 'bool',
+                                'CONNECTION_POOL_SIZE': 'int',
+                                'CONNECTION_POOL_LIFETIME': 'int',
+                                'CONNECTION_POOL_TIMEOUT': 'int',
                                 'OBJECT_CLASSES': 'string',
                                 'DN_TEMPLATE': 'string',
                                 'MULTIVALUEATTRIBUTES': 'string'}
@@ -1181,6 +1512,8 @@ class IdResolver (UserIdResolver):
                       "{1!r}".format(dn, self.l.result.get('message')))
             raise privacyIDEAError(self.l.result.get('message'))
 
+        # The new user may have been cached as an unknown user
+        self._invalidate_cache(login_name=attributes.get("username"))
         return self.getUserId(attributes.get("username"))
 
     def delete_user(self, uid):
@@ -1197,7 +1530,9 @@ class IdResolver (UserIdResolver):
         try:
             self._bind()
 
+            login_name = self.getUsername(uid)
             self.l.delete(self._getDN(uid))
+            self._invalidate_cache(uid=uid, login_name=login_name)
         except Exception as exx:
             log.error("Error deleting user: {0!r}".format(exx))
             res = False
@@ -1270,9 +1605,11 @@ class IdResolver (UserIdResolver):
         :return: True in case of success
         """
         attributes = attributes or {}
+        login_name = None
         try:
             self._bind()
 
+            login_name = self.getUsername(uid)
             mapped = self._create_ldap_modify_changes(attributes, uid)
             params = self._attributes_to_ldap_attributes(mapped)
             self.l.modify(self._getDN(uid), params)
@@ -1280,6 +1617,10 @@ class IdResolver (UserIdResolver):
             log.error("Error accessing LDAP server: {0!r}".format(e))
             log.debug("{0!s}".format(traceback.format_exc()))
             return False
+        finally:
+            # Also drop the new login name, which may have been cached as an unknown user
+            self._invalidate_cache(uid=uid, login_name=login_name)
+            self._invalidate_cache(login_name=attributes.get("username"))
 
         if self.l.result.get('result') != 0:
             log.error("Error during update of user {0!r}: "
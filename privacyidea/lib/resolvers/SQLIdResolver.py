@@ -32,17 +32,20 @@ import logging
 import yaml
 import binascii
 import re
+import time
+from threading import Lock
 
 from privacyidea.lib.resolvers.UserIdResolver import UserIdResolver
 
 from sqlalchemy import (Integer, cast, String, MetaData, Table, and_,
-                        create_engine, select, insert, delete)
-from sqlalchemy.orm import sessionmaker, scoped_session
+                        create_engine, select, insert, delete, bindparam)
+from sqlalchemy.orm import Session, sessionmaker, scoped_session
 
 import traceback
 import hashlib
 from privacyidea.lib.pooling import get_engine
 from privacyidea.lib.lifecycle import register_finalizer
+from privacyidea.lib.framework import get_app_local_store, get_app_config_value
 from privacyidea.lib.utils import (is_true, censor_connect_string,
                                    convert_column_to_unicode)
 from passlib.context import CryptContext
@@ -154,6 +157,95 @@ hash_type_dict = {"PHPASS": 'phpass',
 log = logging.getLogger(__name__)
 
 
+DEFAULT_SCHEMA_CACHE_TTL = 3600
+
+
+class SQLSchemaCache(object):
+    """
+    A process-wide cache of the reflected tables of the SQL resolvers and the
+    select statements, which are built on these tables.
+    The tables are stored per connect string and table name. After ``ttl``
+    seconds the table is reflected again, so that changes of the schema of
+    the user database are noticed. A ``ttl`` of 0 disables the cache.
+    """
+
+    def __init__(self, ttl=DEFAULT_SCHEMA_CACHE_TTL):
+        self.ttl = ttl
+        self._lock = Lock()
+        self._tables = {}
+        self._statements = {}
+
+    def get_table(self, connect_string, table, engine):
+        """
+        Return the reflected table. The table is reflected with the given
+        engine, if it is not contained in the cache or if it is expired.
+        """
+        key = (connect_string, table)
+        entry = self._tables.get(key)
+        if entry and time.monotonic() - entry[1] < self.ttl:
+            return entry[0]
+        log.debug("Reflecting the table {0!s}.".format(table))
+        table_object = Table(table, MetaData(), autoload_with=engine)
+        if self.ttl:
+            with self._lock:
+                self._tables[key] = (table_object, time.monotonic())
+                # the statements of an expired table are built again
+                self._statements.pop(key, None)
+        return table_object
+
+    def get_statement(self, connect_string, table, statement_key, creator):
+        """
+        Return the statement with the given key or create it with the
+        ``creator``, which is called without arguments.
+        The statements are dropped together with their table.
+        """
+        key = (connect_string, table)
+        statements = self._statements.get(key, {})
+        statement = statements.get(statement_key)
+        if statement is None:
+            statement = creator()
+            if key in self._tables:
+                with self._lock:
+                    self._statements.setdefault(key, {})[statement_key] = statement
+        return statement
+
+    def invalidate(self):
+        with self._lock:
+            self._tables = {}
+            self._statements = {}
+
+
+def get_schema_cache():
+    """
+    Return the process-wide schema cache of the SQL resolvers.
+    ``PI_SQLRESOLVER_SCHEMA_CACHE`` defines the seconds, after which a table
+    is reflected again.
+    """
+    app_store = get_app_local_store()
+    try:
+        return app_store["sqlresolver_schema_cache"]
+    except KeyError:
+        ttl = int(get_app_config_value("PI_SQLRESOLVER_SCHEMA_CACHE", DEFAULT_SCHEMA_CACHE_TTL))
+        return app_store.setdefault("sqlresolver_schema_cache", SQLSchemaCache(ttl))
+
+
+_map_cache = {}
+
+
+def _parse_map(usermap):
+    """
+    Parse the attribute mapping of the resolver. The parsed YAML is cached,
+    the caller gets its own copy.
+    """
+    if not isinstance(usermap, str):
+        return yaml.safe_load(usermap)
+    if usermap not in _map_cache:
+        if len(_map_cache) > 100:
+            _map_cache.clear()
+        _map_cache[usermap] = yaml.safe_load(usermap)
+    return dict(_map_cache[usermap])
+
+
 class IdResolver (UserIdResolver):
 
     searchFields = {"username": "text",
@@ -209,6 +301,14 @@ class IdResolver (UserIdResolver):
     def getSearchFields(self):
         return self.searchFields
 
+    @staticmethod
+    def flush_cache():
+        """
+        Drop the reflected tables and the prepared statements, so that they
+        are created again with the changed resolver configuration.
+        """
+        get_schema_cache().invalidate()
+
     @staticmethod
     def _append_where_filter(conditions, table, where):
         """
@@ -280,11 +380,8 @@ class IdResolver (UserIdResolver):
         userinfo = {}
 
         try:
-            conditions = [self._get_userid_filter(userId)]
-            conditions = self._append_where_filter(conditions, self.TABLE,
-                                                   self.where)
-            filter_condition = and_(*conditions)
-            result = self.session.execute(select(self.TABLE).filter(filter_condition))
+            statement, value = self._get_userid_statement(userId)
+            result = self.session.execute(statement, {"userid": value})
 
             for r in result.mappings():
                 if userinfo:  # pragma: no cover
@@ -306,6 +403,41 @@ class IdResolver (UserIdResolver):
         # otherwise we cast the column to string (in case of postgres UUIDs)
         return cast(column, String).like(userId)
 
+    def _get_statement(self, kind, column, creator):
+        """
+        Return the cached select statement of the given kind for the column.
+        The statements contain the WHERE clause of the resolver and take the
+        searched value as bound parameter.
+        """
+        return get_schema_cache().get_statement(self.connect_string, self.table,
+                                                (kind, column, self.where), creator)
+
+    def _get_userid_statement(self, userId):
+        """
+        :return: tuple of the select statement for the user ID and the value
+            of the parameter ``userid``
+        """
+        column_name = self.map.get("userid")
+        column = self.TABLE.columns[column_name]
+        if isinstance(column.type, String):
+            kind, value = "userid_string", str(userId)
+        elif isinstance(column.type, Integer):
+            # since our user ID is usually a string we need to cast
+            kind, value = "userid_integer", int(userId)
+        else:
+            # otherwise we cast the column to string (in case of postgres UUIDs)
+            kind, value = "userid_cast", userId
+
+        def create_statement():
+            if kind == "userid_cast":
+                condition = cast(column, String).like(bindparam("userid"))
+            else:
+                condition = column == bindparam("userid")
+            conditions = self._append_where_filter([condition], self.TABLE, self.where)
+            return select(self.TABLE).filter(and_(*conditions))
+
+        return self._get_statement(kind, column_name, create_statement), value
+
     def getUsername(self, userId):
         """
         Returns the username/loginname for a given userid
@@ -330,13 +462,16 @@ class IdResolver (UserIdResolver):
         userid = ""
 
         try:
-            conditions = []
             column = self.map.get("username")
-            conditions.append(self.TABLE.columns[column].like(LoginName))
-            conditions = self._append_where_filter(conditions, self.TABLE,
-                                                   self.where)
-            filter_condition = and_(*conditions)
-            result = self.session.execute(select(self.TABLE).filter(filter_condition))
+
+            def create_statement():
+                conditions = [self.TABLE.columns[column].like(bindparam("username"))]
+                conditions = self._append_where_filter(conditions, self.TABLE,
+                                                       self.where)
+                return select(self.TABLE).filter(and_(*conditions))
+
+            statement = self._get_statement("username", column, create_statement)
+            result = self.session.execute(statement, {"username": LoginName})
 
             for r in result.mappings():
                 if userid != "":    # pragma: no cover
@@ -460,7 +595,7 @@ class IdResolver (UserIdResolver):
         self._editable = config.get("Editable", False)
         self.password_hash_type = config.get("Password_Hash_Type", "SSHA256")
         usermap = config.get('Map', {})
-        self.map = yaml.safe_load(usermap)
+        self.map = _parse_map(usermap)
         self.reverse_map = {v: k for k, v in self.map.items()}
         self.where = config.get('Where', "")
         self.encoding = str(config.get('Encoding') or "latin1")
@@ -484,12 +619,12 @@ class IdResolver (UserIdResolver):
         # get an engine from the engine registry, using self.getResolverId() as the key,
         # which involves the connect-string and the pool settings.
         self.engine = get_engine(self.getResolverId(), self._create_engine)
-        # We use ``scoped_session``.
-        self.session = scoped_session(sessionmaker(bind=self.engine))()
+        self.session = Session(bind=self.engine)
         # Session should be closed on teardown
         register_finalizer(self.session.close)
         self.session._model_changes = {}
-        self.TABLE = Table(self.table, MetaData(), autoload_with=self.engine)
+        # The table is only reflected, if it is not contained in the schema cache
+        self.TABLE = get_schema_cache().get_table(self.connect_string, self.table, self.engine)
 
         return self
 
@@ -68,6 +68,29 @@ class UserIdResolver(object):
         """
         return
 
+    @staticmethod
+    def flush_cache():
+        """
+        Hook to drop the process-wide caches of the resolver type.
+        It is called, when a resolver of this type is saved or deleted.
+        """
+        return
+
+    def get_cache_statistics(self):
+        """
+        Return the statistics of the caches of this resolver like the number
+        of hits and misses.
+
+        :rtype: dict
+        """
+        return {}
+
+    def clear_cache(self):
+        """
+        Hook to drop the cached users of this resolver
+        """
+        return
+
     @staticmethod
     def getResolverClassType():
         """
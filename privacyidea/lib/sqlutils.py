@@ -16,6 +16,8 @@
 #
 #
 
+import time
+
 from sqlalchemy import select
 from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.sql.expression import ClauseElement, Delete
@@ -79,7 +81,7 @@ def visit_delete_limit_mysql(element, compiler, **kw):
         compiler.process(element.filter), element.limit)
 
 
-def delete_chunked(session, table, filter, limit=1000):
+def delete_chunked(session, table, filter, limit=1000, pace=None):
     """
     Delete all rows matching a given filter criterion from a table,
     but only delete *limit* rows at a time. Commit after each DELETE.
@@ -88,16 +90,26 @@ def delete_chunked(session, table, filter, limit=1000):
     :param table: SQLAlchemy table object (e.g. ``LogEntry.__table__``)
     :param filter: A filter criterion (e.g. ``LogEntry.age < now``)
     :param limit: Number of rows to delete in one chunk
+    :param pace: Optional function, which is called after each chunk with the
+        number of deleted rows and the duration of the chunk in seconds. It
+        returns the limit of the next chunk or None to stop deleting.
     :return: total number of deleted rows
     """
     deleted = 0
     statement = DeleteLimit(table, filter, limit)
     while True:
+        start = time.monotonic()
         result = session.execute(statement)
         deleted += result.rowcount
         session.commit()
-        if result.rowcount < limit:
+        if result.rowcount < statement.limit:
             return deleted
+        if pace is not None:
+            limit = pace(result.rowcount, time.monotonic() - start)
+            if not limit:
+                return deleted
+            if limit != statement.limit:
+                statement = DeleteLimit(table, filter, limit)
 
 
 def delete_matching_rows(session, table, filter, chunksize=None):
@@ -0,0 +1,58 @@
+#
+#
+# This code is free software; you can redistribute it and/or
+# modify it under the terms of the GNU AFFERO GENERAL PUBLIC LICENSE
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or any later version.
+#
+# This code is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU AFFERO GENERAL PUBLIC LICENSE for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import logging
+
+from privacyidea.lib.task.base import BaseTask
+from privacyidea.lib.tokens.certificatetoken import update_pending_certificates
+from privacyidea.lib import _
+
+__doc__ = """This task module checks the pending certificate requests of
+certificate tokens at the CA and updates the tokens, whose certificates have
+been issued or denied.
+
+This module is tested in tests/test_lib_tokens_certificate.py"""
+
+log = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_TIME_LIMIT = 300
+
+
+class CertificateRolloutTask(BaseTask):
+    identifier = "CertificateRollout"
+    description = "Update certificate tokens with pending certificate requests."
+
+    @property
+    def options(self):
+        return {
+            "batch_size": {
+                "type": "str",
+                "description": _("The number of tokens, that are read from the database "
+                                 "at once. (Default: {0!s})").format(DEFAULT_BATCH_SIZE)},
+            "time_limit": {
+                "type": "str",
+                "description": _("Stop after these seconds. The remaining tokens are "
+                                 "checked during the next run. "
+                                 "(Default: {0!s})").format(DEFAULT_TIME_LIMIT)}
+        }
+
+    def do(self, params):
+        result = update_pending_certificates(
+            batch_size=int(params.get("batch_size") or DEFAULT_BATCH_SIZE),
+            time_limit=int(params.get("time_limit") or DEFAULT_TIME_LIMIT))
+        log.info("Checked {checked!s} pending certificate requests: {enrolled!s} enrolled, "
+                 "{denied!s} denied, {failed!s} failed.".format(**result))
+        return True
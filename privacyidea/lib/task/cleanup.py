@@ -0,0 +1,167 @@
+#
+#
+# This code is free software; you can redistribute it and/or
+# modify it under the terms of the GNU AFFERO GENERAL PUBLIC LICENSE
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or any later version.
+#
+# This code is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU AFFERO GENERAL PUBLIC LICENSE for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import datetime
+import logging
+import time
+
+from privacyidea.lib.authcache import get_memory_cache
+from privacyidea.lib.authcounter import BUCKETS
+from privacyidea.lib.challenge import get_challenge_store, SQLChallengeStore
+from privacyidea.lib.monitoringstats import write_stats
+from privacyidea.lib.sqlutils import delete_chunked
+from privacyidea.lib.task.base import BaseTask
+from privacyidea.lib.usercache import create_filter, is_cache_enabled
+from privacyidea.lib.utils import is_true
+from privacyidea.models import AuthCache, AuthCounter, Challenge, UserCache, db
+from privacyidea.lib import _
+
+__doc__ = """This task module deletes expired challenges, authentication cache
+entries, authentication counters and user cache entries in small chunks.
+
+The size of the chunks adapts to the database: If a chunk takes longer than
+the given duration, e.g. because of the replication, the next chunk is
+smaller and the task pauses before it is deleted.
+
+This module is tested in tests/test_lib_task_cleanup.py"""
+
+log = logging.getLogger(__name__)
+
+DEFAULT_CHUNKSIZE = 1000
+MIN_CHUNKSIZE = 10
+DEFAULT_CHUNK_DURATION = 0.5
+DEFAULT_TIME_LIMIT = 60
+
+
+class ChunkPacer(object):
+    """
+    Determines the size of the next chunk from the duration of the last
+    chunk. This is passed as ``pace`` to ``delete_chunked``.
+    """
+
+    def __init__(self, chunksize, chunk_duration, deadline):
+        """
+        :param chunksize: The maximum number of rows in a chunk
+        :param chunk_duration: The desired duration of a chunk in seconds
+        :param deadline: The time (``time.monotonic``), after which no more
+            chunks are deleted
+        """
+        self.max_chunksize = chunksize
+        self.chunksize = chunksize
+        self.chunk_duration = chunk_duration
+        self.deadline = deadline
+
+    def __call__(self, rowcount, duration):
+        if time.monotonic() >= self.deadline:
+            return None
+        if duration > self.chunk_duration:
+            # The database is busy, give it time to catch up
+            self.chunksize = max(self.chunksize // 2, MIN_CHUNKSIZE)
+            time.sleep(duration)
+        elif duration < self.chunk_duration / 2:
+            self.chunksize = min(self.chunksize * 2, self.max_chunksize)
+        return self.chunksize
+
+
+class CleanupTask(BaseTask):
+    identifier = "Cleanup"
+    description = ("Delete expired challenges, authentication cache entries, "
+                   "authentication counters and user cache entries.")
+
+    @property
+    def options(self):
+        return {
+            "challenges": {
+                "type": "bool",
+                "description": _("Delete expired challenges.")},
+            "usercache": {
+                "type": "bool",
+                "description": _("Delete expired user cache entries.")},
+            "authcache_minutes": {
+                "type": "str",
+                "description": _("Delete authentication cache entries, whose last "
+                                 "authentication is older than these number of minutes.")},
+            "chunksize": {
+                "type": "str",
+                "description": _("The maximum number of entries deleted in one "
+                                 "statement. (Default: {0!s})").format(DEFAULT_CHUNKSIZE)},
+            "chunk_duration": {
+                "type": "str",
+                "description": _("If deleting a chunk takes longer than these seconds, "
+                                 "the chunks get smaller and the task pauses. "
+                                 "(Default: {0!s})").format(DEFAULT_CHUNK_DURATION)},
+            "time_limit": {
+                "type": "str",
+                "description": _("Stop deleting after these seconds. The remaining entries "
+                                 "are deleted during the next run. "
+                                 "(Default: {0!s})").format(DEFAULT_TIME_LIMIT)},
+            "authcounter": {
+                "type": "bool",
+                "description": _("Delete expired authentication counters of users, who "
+                                 "did not authenticate anymore.")},
+            "stats_key": {
+                "type": "str",
+                "description": _("Write the number of deleted and remaining entries and the "
+                                 "deleted entries per second to the MonitoringStats table "
+                                 "with this prefix.")}
+        }
+
+    def _get_tables(self, params):
+        """
+        :return: list of tuples (name, table, filter criterion)
+        """
+        tables = []
+        if is_true(params.get("challenges")):
+            if isinstance(get_challenge_store(), SQLChallengeStore):
+                tables.append(("challenge", Challenge,
+                               Challenge.expiration < datetime.datetime.utcnow()))
+            else:
+                log.debug("The challenges are not stored in the database.")
+        if is_true(params.get("usercache")) and is_cache_enabled():
+            tables.append(("usercache", UserCache, create_filter(expired=True)))
+        if params.get("authcache_minutes"):
+            cleanup_time = datetime.datetime.utcnow() - datetime.timedelta(
+                minutes=int(params.get("authcache_minutes")))
+            tables.append(("authcache", AuthCache, AuthCache.last_auth < cleanup_time))
+        if is_true(params.get("authcounter")):
+            tables.append(("authcounter", AuthCounter,
+                           (AuthCounter.bucket + 2 * BUCKETS) * AuthCounter.resolution < int(time.time())))
+        return tables
+
+    def do(self, params):
+        chunksize = int(params.get("chunksize") or DEFAULT_CHUNKSIZE)
+        chunk_duration = float(params.get("chunk_duration") or DEFAULT_CHUNK_DURATION)
+        time_limit = int(params.get("time_limit") or DEFAULT_TIME_LIMIT)
+        stats_key = params.get("stats_key")
+        pacer = ChunkPacer(chunksize, chunk_duration, time.monotonic() + time_limit)
+
+        for name, model, criterion in self._get_tables(params):
+            start = time.monotonic()
+            deleted = delete_chunked(db.session, model.__table__, criterion,
+                                     pacer.chunksize, pace=pacer)
+            duration = time.monotonic() - start
+            log.info("Deleted {0!s} expired entries from the table {1!s} in {2:.3f} "
+                     "seconds.".format(deleted, name, duration))
+            if name == "authcache" and deleted:
+                memory_cache = get_memory_cache()
+                if memory_cache is not None:
+                    memory_cache.clear()
+            if stats_key:
+                write_stats("{0!s}_{1!s}_deleted".format(stats_key, name), deleted)
+                write_stats("{0!s}_{1!s}_rate".format(stats_key, name),
+                            int(deleted / duration) if duration else deleted)
+                write_stats("{0!s}_{1!s}_rows".format(stats_key, name),
+                            db.session.query(model).count())
+        return True
@@ -60,7 +60,7 @@ class EventCounterTask(BaseTask):
         stats_key = params.get("stats_key")
         reset_event_counter = params.get("reset_event_counter")
 
-        counter_value = read(event_counter)
+        counter_value = read(event_counter, cached=False)
         if is_true(reset_event_counter) and counter_value:
             reset(event_counter)
 
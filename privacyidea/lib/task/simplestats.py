@@ -17,22 +17,62 @@
 #
 import logging
 
+from sqlalchemy import and_, case, func, literal_column
+
 from privacyidea.lib.utils import is_true
 from privacyidea.lib.tokenclass import TOKENKIND
-from privacyidea.lib.token import get_tokens
-from privacyidea.lib.monitoringstats import write_stats
+from privacyidea.lib.token import clob_to_varchar
+from privacyidea.lib.monitoringstats import write_multiple_stats, get_last_value
 from privacyidea.lib.subscriptions import get_users_with_active_tokens
 from privacyidea.lib.task.base import BaseTask
+from privacyidea.models import Token, TokenInfo, TokenOwner, db
 # from privacyidea.lib.user import get_user_list
 from privacyidea.lib import _
 
 __doc__ = """This is a statistics task which collects simple statistics from the database.
 If You want to add more statistic points, simply add them to the options method and add a
 corresponding property function (beginning with a '_').
-The entry in the monitoringstats table will have the same key as the property name."""
+The entry in the monitoringstats table will have the same key as the property name.
+
+The token counters in ``TOKEN_COUNTERS`` are calculated together in a single grouped
+query by ``get_token_counters``. All values of a run are written in one batch."""
 
 log = logging.getLogger(__name__)
 
+# The statistics, which are calculated by ``get_token_counters``
+TOKEN_COUNTERS = ["total_tokens", "hardware_tokens", "software_tokens",
+                  "unassigned_hardware_tokens", "assigned_tokens"]
+
+
+def get_token_counters():
+    """
+    Count the tokens grouped by their token kind and whether they are assigned
+    to a user. Instead of one query for each counter, this only needs a single
+    pass over the token and tokeninfo tables.
+
+    :return: dictionary with the values of the ``TOKEN_COUNTERS``
+    """
+    owners = db.session.query(TokenOwner.token_id).distinct().subquery()
+    tokenkind = clob_to_varchar(TokenInfo.Value)
+    # Use literal values, so that the expression is the same in the GROUP BY clause
+    assigned = case((owners.c.token_id.is_(None), literal_column("0")),
+                    else_=literal_column("1"))
+    rows = db.session.query(tokenkind, assigned, func.count(Token.id)).select_from(Token).outerjoin(
+        TokenInfo, and_(TokenInfo.token_id == Token.id, TokenInfo.Key == "tokenkind")).outerjoin(
+        owners, owners.c.token_id == Token.id).group_by(tokenkind, assigned).all()
+    counters = dict.fromkeys(TOKEN_COUNTERS, 0)
+    for kind, is_assigned, count in rows:
+        counters["total_tokens"] += count
+        if is_assigned:
+            counters["assigned_tokens"] += count
+        if kind == TOKENKIND.HARDWARE:
+            counters["hardware_tokens"] += count
+            if not is_assigned:
+                counters["unassigned_hardware_tokens"] += count
+        elif kind == TOKENKIND.SOFTWARE:
+            counters["software_tokens"] += count
+    return counters
+
 
 class SimpleStatsTask(BaseTask):
     identifier = "SimpleStats"
@@ -58,37 +98,28 @@ class SimpleStatsTask(BaseTask):
                 "description": _("Number of tokens assigned to users")},
             "user_with_token": {
                 "type": "bool",
-                "description": _("Number of users with tokens assigned")}
+                "description": _("Number of users with tokens assigned")},
+            "only_changed": {
+                "type": "bool",
+                "description": _("Only write the values, which changed since the last run")}
             }
 
     @property
     def _user_with_token(self):
         return get_users_with_active_tokens()
 
-    @property
-    def _total_tokens(self):
-        return get_tokens(count=True)
-
-    @property
-    def _hardware_tokens(self):
-        return get_tokens(count=True, tokeninfo={'tokenkind': TOKENKIND.HARDWARE})
-
-    @property
-    def _software_tokens(self):
-        return get_tokens(count=True, tokeninfo={'tokenkind': TOKENKIND.SOFTWARE})
-
-    @property
-    def _unassigned_hardware_tokens(self):
-        return get_tokens(count=True, tokeninfo={'tokenkind': 'hardware'}, assigned=False)
-
-    @property
-    def _assigned_tokens(self):
-        return get_tokens(count=True, assigned=True)
-
     def do(self, params):
-        for opt in self.options.keys():
-            if is_true(params.get(opt)):
-                log.debug("Got param {0}".format(opt))
-                write_stats(opt, getattr(self, '_' + opt))
+        stats_keys = [opt for opt in self.options.keys()
+                      if opt != "only_changed" and is_true(params.get(opt))]
+        log.debug("Got params {0!s}".format(stats_keys))
+        values = {}
+        if set(stats_keys) & set(TOKEN_COUNTERS):
+            values = get_token_counters()
+        values = {key: values[key] if key in values else getattr(self, '_' + key)
+                  for key in stats_keys}
+        if is_true(params.get("only_changed")):
+            values = {key: value for key, value in values.items()
+                      if get_last_value(key) != value}
+        write_multiple_stats(values)
 
         return True
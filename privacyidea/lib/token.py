@@ -61,11 +61,15 @@ This is the middleware/glue between the HTTP API and the database
 
 import traceback
 import string
+import copy
 import datetime
 import os
 import logging
+import threading
+from concurrent.futures import wait
 
-from sqlalchemy import (and_, func)
+from sqlalchemy import (and_, func, insert, inspect, select, update)
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.sql.expression import FunctionElement
 from privacyidea.lib.error import (TokenAdminError,
@@ -73,12 +77,18 @@ from privacyidea.lib.error import (TokenAdminError,
                                    privacyIDEAError, ResourceNotFoundError)
 from privacyidea.lib.decorators import (check_user_or_serial,
                                         check_copy_serials)
-from privacyidea.lib.tokenclass import TokenClass
-from privacyidea.lib.utils import is_true, BASE58, hexlify_and_unicode, check_serial_valid
-from privacyidea.lib.crypto import generate_password
+from privacyidea.lib.tokenclass import TokenClass, AUTHENTICATIONMODE
+from privacyidea.lib.utils import (is_true, BASE58, hexlify_and_unicode, check_serial_valid,
+                                   to_unicode)
+from privacyidea.lib.crypto import (generate_password, generate_otpkey, get_pass_hash_executor,
+                                    verify_pass_hashes, forgets_pass_hashes)
+from privacyidea.lib.machine import invalidate_auth_item_cache
 from privacyidea.lib.log import log_with
+from privacyidea.lib.framework import (get_request_local_store, get_app_local_store,
+                                       get_app_config_value, get_thread_pool, with_app_context)
 from privacyidea.models import (Token, Realm, TokenRealm, Challenge,
-                                MachineToken, TokenInfo, TokenOwner, TokenTokengroup, Tokengroup)
+                                MachineToken, TokenInfo, TokenOwner, TokenTokengroup, Tokengroup,
+                                SerialCounter, db)
 from privacyidea.lib.config import (get_token_class, get_token_prefix,
                                     get_token_types, get_from_config,
                                     get_inc_fail_count_on_false_pin, SYSCONF)
@@ -94,13 +104,17 @@ from privacyidea.lib.policydecorators import (libpolicy,
                                               auth_lastauth,
                                               auth_cache,
                                               config_lost_token,
-                                              reset_all_user_tokens)
+                                              reset_all_user_tokens,
+                                              get_otppin_policy,
+                                              get_challenge_response_tokentypes)
+from privacyidea.lib.challenge import delete_challenges
 from privacyidea.lib.challengeresponsedecorators import (generic_challenge_response_reset_pin,
                                                          generic_challenge_response_resync)
 from privacyidea.lib.tokenclass import DATE_FORMAT
 from privacyidea.lib.tokenclass import TOKENKIND
 from privacyidea.lib.user import get_username
 from dateutil.tz import tzlocal
+from werkzeug.local import LocalProxy
 
 log = logging.getLogger(__name__)
 
@@ -109,6 +123,11 @@ required = False
 
 ENCODING = "utf-8"
 
+# The token types, which can be enrolled with init_tokens_bulk
+BULK_TOKEN_TYPES = ["hotp", "totp"]
+# The number of tokens, which init_tokens_bulk writes in one transaction
+BULK_BATCH_SIZE = 500
+
 
 # Define function to convert Oracle CLOBs to VARCHAR before using them in a
 # compare operation.
@@ -157,6 +176,36 @@ def create_tokenclass_object(db_token):
     return token_object
 
 
+def enable_token_identity_map():
+    """
+    Start a new token identity map for the current request. Within the
+    request, ``get_tokens`` returns the same token object for a serial
+    number, so that the token is not loaded again by the helper functions,
+    the policies and the event handlers.
+    """
+    get_request_local_store()["token_identity_map"] = {}
+
+
+def disable_token_identity_map():
+    get_request_local_store().pop("token_identity_map", None)
+
+
+def _get_token_identity_map():
+    """
+    :return: the token identity map of the current request or None
+    """
+    return get_request_local_store().get("token_identity_map")
+
+
+def _forget_token(serial):
+    """
+    Remove the token from the identity map of the current request.
+    """
+    identity_map = _get_token_identity_map()
+    if identity_map is not None:
+        identity_map.pop(serial, None)
+
+
 def _create_token_query(tokentype=None, realm=None, assigned=None, user=None,
                         serial_exact=None, serial_wildcard=None, active=None, resolver=None,
                         rollout_state=None, description=None, revoked=None,
@@ -409,6 +458,16 @@ def get_tokens(tokentype=None, realm=None, assigned=None, user=None,
     :rtype: list
     """
     token_list = []
+    identity_map = _get_token_identity_map()
+    if identity_map is not None and serial and count is not True and all(
+            param is None for param in [tokentype, realm, assigned, user, serial_wildcard,
+                                        active, resolver, rollout_state, revoked,
+                                        locked, tokeninfo, maxfail]):
+        # The token was already loaded during this request
+        tokenobject = identity_map.get(serial)
+        if tokenobject is not None and inspect(tokenobject.token).persistent:
+            return [tokenobject]
+
     sql_query = _create_token_query(tokentype=tokentype, realm=realm,
                                     assigned=assigned, user=user,
                                     serial_exact=serial, serial_wildcard=serial_wildcard,
@@ -432,7 +491,11 @@ def get_tokens(tokentype=None, realm=None, assigned=None, user=None,
         for token in sql_query.all():
             # the token is the database object, but we want an instance of the
             # tokenclass!
-            tokenobject = create_tokenclass_object(token)
+            tokenobject = identity_map.get(token.serial) if identity_map is not None else None
+            if tokenobject is None or tokenobject.token is not token:
+                tokenobject = create_tokenclass_object(token)
+                if identity_map is not None and isinstance(tokenobject, TokenClass):
+                    identity_map[token.serial] = tokenobject
             if isinstance(tokenobject, TokenClass):
                 # A database token, that has a non existing type, will
                 # return None, and not a TokenClass. We do not want to
@@ -630,15 +693,17 @@ def check_serial(serial):
     :result: result of check and (new) serial number
     :rtype: tuple(bool, str)
     """
+    # Read all serials, which start with the given serial, at once
+    existing = {row.serial for row in Token.query.filter(
+        Token.serial.startswith(serial, autoescape=True)).with_entities(Token.serial)}
     # serial does not exist, yet
-    result = True
+    result = serial not in existing
     new_serial = serial
 
     i = 0
-    while get_tokens(serial=new_serial):
+    while new_serial in existing:
         # as long as we find a token, modify the serial:
         i += 1
-        result = False
         new_serial = "{0!s}_{1:02d}".format(serial, i)
 
     return result, new_serial
@@ -916,11 +981,97 @@ def get_serial_by_otp(token_list, otp="", window=10):
     return serial
 
 
+def _format_serial(prefix, tokennum, serial_len):
+    """
+    Return a serial of the prefix, the token number and random characters,
+    which fill the serial up to ``serial_len`` characters.
+    """
+    h_serial = ''
+    num_str = '{:04d}'.format(tokennum)
+    h_len = serial_len - len(num_str)
+    if h_len > 0:
+        h_serial = hexlify_and_unicode(os.urandom(h_len)).upper()[0:h_len]
+    return "{0!s}{1!s}{2!s}".format(prefix, num_str, h_serial)
+
+
+def _reserve_serial_numbers(prefix, tokentype, count):
+    """
+    Reserve ``count`` consecutive numbers for serials with the given prefix
+    in the table serialcounter. The numbers are reserved with one atomic
+    update, so that concurrent processes never get the same numbers.
+
+    If the prefix is used for the first time, the numbers continue after the
+    number of existing tokens of the tokentype.
+
+    :param prefix: The prefix of the serials
+    :param tokentype: The tokentype, which is counted for a new prefix
+    :param count: The number of serial numbers to reserve
+    :return: the first reserved number
+    :rtype: int
+    """
+    # The numbers are reserved on a separate connection, so that the
+    # reservation is committed independently of the request
+    try:
+        with db.engine.begin() as connection:
+            return _update_serial_counter(connection, prefix, tokentype, count)
+    except IntegrityError:
+        # Another process has created the counter in the meantime
+        log.debug("Serial counter for prefix {0!s} already exists.".format(prefix))
+        with db.engine.begin() as connection:
+            return _update_serial_counter(connection, prefix, tokentype, count)
+
+
+def _update_serial_counter(connection, prefix, tokentype, count):
+    """
+    Increase the serial counter of the prefix by ``count`` or create it.
+
+    :param connection: the database connection to use
+    :return: the first reserved number
+    :rtype: int
+    """
+    counters = SerialCounter.__table__
+    if connection.execute(update(counters).where(counters.c.prefix == prefix)
+                          .values(value=counters.c.value + count)).rowcount:
+        # The updated row is locked until the end of the transaction
+        value = connection.execute(select(counters.c.value)
+                                   .where(counters.c.prefix == prefix)).scalar()
+        return value - count
+    tokens = Token.__table__
+    start = connection.execute(select(func.count()).select_from(tokens)
+                               .where(tokens.c.tokentype == tokentype)).scalar()
+    connection.execute(insert(counters).values(prefix=prefix, value=start + count))
+    return start
+
+
+def _next_serial_number(prefix, tokentype, block_size):
+    """
+    Return the next serial number of the block of numbers, which this
+    process has reserved for the prefix. If the block is used up, a new
+    block of ``block_size`` numbers is reserved.
+    """
+    app_store = get_app_local_store()
+    try:
+        blocks, lock = app_store["serial_blocks"]
+    except KeyError:
+        blocks, lock = app_store.setdefault("serial_blocks", ({}, threading.Lock()))
+    with lock:
+        next_number, end = blocks.get(prefix, (0, 0))
+        if next_number >= end:
+            next_number = _reserve_serial_numbers(prefix, tokentype, block_size)
+            end = next_number + block_size
+        blocks[prefix] = (next_number + 1, end)
+    return next_number
+
+
 @log_with(log)
 def gen_serial(tokentype=None, prefix=None):
     """
     generate a serial for a given tokentype
 
+    If ``PI_SERIAL_BLOCK_SIZE`` is set, the number in the serial is taken from
+    a block of numbers, which the process has reserved in the database.
+    Otherwise the tokens of the tokentype are counted.
+
     :param tokentype: the token type prefix is done by a lookup on the tokens
     :type tokentype: str
     :param prefix: A prefix to the serial number
@@ -930,24 +1081,20 @@ def gen_serial(tokentype=None, prefix=None):
     """
     serial_len = int(get_from_config("SerialLength") or 8)
 
-    def _gen_serial(_prefix, _tokennum):
-        h_serial = ''
-        num_str = '{:04d}'.format(_tokennum)
-        h_len = serial_len - len(num_str)
-        if h_len > 0:
-            h_serial = hexlify_and_unicode(os.urandom(h_len)).upper()[0:h_len]
-        return "{0!s}{1!s}{2!s}".format(_prefix, num_str, h_serial)
-
     if not tokentype:
         tokentype = 'PIUN'
     if not prefix:
         prefix = get_token_prefix(tokentype.lower(), tokentype.upper())
 
-    # now search the number of tokens of tokenytype in the token database
-    tokennum = Token.query.filter(Token.tokentype == tokentype).count()
+    block_size = int(get_app_config_value("PI_SERIAL_BLOCK_SIZE", 0))
+    if block_size > 0:
+        tokennum = _next_serial_number(prefix, tokentype, block_size)
+    else:
+        # now search the number of tokens of tokenytype in the token database
+        tokennum = Token.query.filter(Token.tokentype == tokentype).count()
 
     # Now create the serial
-    serial = _gen_serial(prefix, tokennum)
+    serial = _format_serial(prefix, tokennum, serial_len)
 
     # now test if serial already exists
     while True:
@@ -955,7 +1102,7 @@ def gen_serial(tokentype=None, prefix=None):
         if numtokens == 0:
             # ok, there is no such token, so we're done
             break
-        serial = _gen_serial(prefix, tokennum + numtokens)  # pragma: no cover
+        serial = _format_serial(prefix, tokennum + numtokens, serial_len)  # pragma: no cover
 
     return serial
 
@@ -1127,9 +1274,104 @@ def init_token(param, user=None, tokenrealms=None,
 
     # Safe the token object to make sure all changes are persisted in the db
     tokenobject.save()
+    invalidate_auth_item_cache()
     return tokenobject
 
 
+def _new_serials(prefix, tokentype, count, serial_len):
+    """
+    Return ``count`` serials, which are not used by existing tokens. The
+    numbers of the serials are reserved in the table serialcounter.
+    """
+    first_number = _reserve_serial_numbers(prefix, tokentype, count)
+    serials = [_format_serial(prefix, number, serial_len)
+               for number in range(first_number, first_number + count)]
+    existing = {row.serial for row in Token.query.filter(
+        Token.serial.in_(serials)).with_entities(Token.serial)}
+    if existing:
+        serials = [serial for serial in serials if serial not in existing]
+        serials.extend(_new_serials(prefix, tokentype, len(existing), serial_len))
+    return serials
+
+
+@log_with(log, log_exit=False, hide_kwargs=["param"])
+def init_tokens_bulk(count, param=None, tokenrealms=None, tokenkind=None,
+                     batch_size=BULK_BATCH_SIZE):
+    """
+    Enroll a number of unassigned tokens of the same type with generated OTP
+    keys, e.g. to create the tokens of new hardware.
+
+    The first token is enrolled with ``init_token``. The other tokens get the
+    settings, token info and realms of the first token, but their own serials
+    and OTP keys. They are written to the database in batches of
+    ``batch_size`` tokens. The serial numbers are reserved in the table
+    serialcounter, so the tokens do not need to be counted.
+
+    :param count: The number of tokens to enroll
+    :type count: int
+    :param param: The enrollment parameters like ``type``, ``prefix``,
+        ``otplen``, ``hashlib``, ``timeStep`` or ``description``. The
+        parameters ``serial``, ``otpkey``, ``pin`` and ``user`` are ignored.
+    :type param: dict
+    :param tokenrealms: The realms of the tokens
+    :type tokenrealms: list
+    :param tokenkind: The kind of the tokens like "hardware" or "software"
+    :param batch_size: The number of tokens, which are written in one transaction
+    :return: list of tuples of the serial and the OTP key of the tokens
+    :rtype: list
+    """
+    param = {key: value for key, value in (param or {}).items()
+             if key not in ["serial", "otpkey", "pin", "user"]}
+    tokentype = (param.get("type") or "hotp").lower()
+    if tokentype not in BULK_TOKEN_TYPES:
+        raise ParameterError(_("Tokens of type {0!s} can not be enrolled in bulk.").format(tokentype))
+    if count < 1:
+        raise ParameterError(_("The number of tokens must be greater than 0."))
+    prefix = param.pop("prefix", None) or get_token_prefix(tokentype, tokentype.upper())
+    serial_len = int(get_from_config("SerialLength") or 8)
+
+    # The first token is enrolled like any other token
+    param.update({"type": tokentype, "genkey": 1,
+                  "serial": _new_serials(prefix, tokentype, 1, serial_len)[0]})
+    template = init_token(param, tokenrealms=tokenrealms, tokenkind=tokenkind).token
+    otpkey = to_unicode(template.get_otpkey().getKey())
+    tokens = [(template.serial, otpkey)]
+    key_size = len(otpkey) // 2
+    tokeninfo = [(ti.Key, ti.Value, ti.Type, ti.Description) for ti in template.info_list]
+    realm_ids = [tr.realm_id for tr in template.realm_list]
+
+    for offset in range(1, count, batch_size):
+        db_tokens = []
+        for serial in _new_serials(prefix, tokentype, min(batch_size, count - offset),
+                                   serial_len):
+            otpkey = generate_otpkey(key_size)
+            db_token = Token(serial, tokentype=tokentype, isactive=template.active,
+                             otplen=template.otplen, otpkey=otpkey)
+            db_token.maxfail = template.maxfail
+            db_token.count_window = template.count_window
+            db_token.sync_window = template.sync_window
+            db_token.description = template.description
+            db_tokens.append(db_token)
+            tokens.append((serial, otpkey))
+        db.session.add_all(db_tokens)
+        # The database ids of the tokens are needed for the token info and realms
+        db.session.flush()
+        if tokeninfo:
+            db.session.execute(TokenInfo.__table__.insert(),
+                               [{"token_id": db_token.id, "Key": key, "Value": value,
+                                 "Type": info_type, "Description": description}
+                                for db_token in db_tokens
+                                for key, value, info_type, description in tokeninfo])
+        if realm_ids:
+            db.session.execute(TokenRealm.__table__.insert(),
+                               [{"token_id": db_token.id, "realm_id": realm_id}
+                                for db_token in db_tokens for realm_id in realm_ids])
+        db.session.commit()
+        log.debug("Enrolled {0!s} of {1!s} tokens.".format(len(tokens), count))
+
+    return tokens
+
+
 @log_with(log)
 @check_user_or_serial
 def remove_token(serial=None, user=None):
@@ -1150,7 +1392,9 @@ def remove_token(serial=None, user=None):
 
     # Delete challenges of such a token
     for tokenobject in tokenobject_list:
+        _forget_token(tokenobject.token.serial)
         tokenobject.delete_token()
+    invalidate_auth_item_cache()
 
     return token_count
 
@@ -1245,6 +1489,7 @@ def assign_token(serial, user, pin=None, encrypt_pin=False, err_message=None):
 
     log.debug("successfully assigned token with serial "
               "{0!r} to user {1!r}".format(serial, user))
+    invalidate_auth_item_cache()
     return True
 
 
@@ -1272,6 +1517,7 @@ def unassign_token(serial, user=None):
             raise TokenAdminError(_("Token unassign failed for {0!r}/{1!r}: {2!r}").format(serial, user, e), id=1105)
 
         log.debug("successfully unassigned token with serial {0!r}".format(tokenobject))
+    invalidate_auth_item_cache()
     # TODO: test with more than 1 token
     return len(tokenobject_list)
 
@@ -1420,6 +1666,7 @@ def revoke_token(serial, user=None):
     for tokenobject in tokenobject_list:
         tokenobject.revoke()
         tokenobject.save()
+    invalidate_auth_item_cache()
 
     return len(tokenobject_list)
 
@@ -1452,6 +1699,8 @@ def enable_token(serial, enable=True, user=None):
             tokenobject.enable(enable)
             tokenobject.save()
             count += 1
+    if count:
+        invalidate_auth_item_cache()
 
     return count
 
@@ -2075,12 +2324,129 @@ def check_user_pass(user, passw, options=None):
     return res, reply_dict
 
 
+def get_challenge_dispatch_executor():
+    """
+    Return the process-wide thread pool for creating the challenges of several
+    tokens concurrently or None, if ``PI_CHALLENGE_DISPATCH_WORKERS`` is not
+    set to more than one worker.
+    """
+    workers = int(get_app_config_value("PI_CHALLENGE_DISPATCH_WORKERS", 1))
+    if workers <= 1:
+        return None
+    return get_thread_pool("challenge-dispatch", workers)
+
+
+def _create_challenges(token_list, message_list, options):
+    """
+    Create the challenges of the tokens one after another. All challenges get
+    the transaction id of the first challenge.
+
+    :return: generator of tuples of the token object and the result of
+        ``create_challenge``
+    """
+    transaction_id = None
+    for token_obj in token_list:
+        # Check if the max auth is succeeded
+        if token_obj.check_all(message_list):
+            challenge = token_obj.create_challenge(transactionid=transaction_id,
+                                                   options=options)
+            transaction_id = challenge[2]
+            yield token_obj, challenge
+
+
+def _create_challenge_by_id(token_id, transaction_id, options):
+    """
+    Create the challenge of the token with the given database id. This runs
+    in a worker thread with its own database session.
+    """
+    token_obj = create_tokenclass_object(Token.query.filter_by(id=token_id).first())
+    return token_obj.create_challenge(transactionid=transaction_id, options=options)
+
+
+def _copy_request_globals(g):
+    """
+    Return a copy of the request globals for a worker thread, with its own
+    audit object and policy object, so that the worker threads do not change
+    the objects of the request.
+    """
+    if isinstance(g, LocalProxy):
+        # The worker threads can not access the request context
+        g = g._get_current_object()
+    worker_g = copy.copy(g)
+    if getattr(g, "audit_object", None) is not None:
+        worker_g.audit_object = copy.copy(g.audit_object)
+        worker_g.audit_object.audit_data = copy.deepcopy(g.audit_object.audit_data)
+    if getattr(g, "policy_object", None) is not None:
+        worker_g.policy_object = copy.copy(g.policy_object)
+    return worker_g
+
+
+def _dispatch_challenges(executor, token_list, options):
+    """
+    Create the challenges of the tokens at the same time in the given thread
+    pool, so that sending the SMS, the email and the push notification do not
+    wait for each other. All challenges get the same transaction id.
+
+    If ``PI_CHALLENGE_DISPATCH_TIMEOUT`` is set, this waits at most the given
+    number of seconds for the tokens, which send their challenges in the
+    background (``send_challenge_in_background``). Their challenges, which are
+    not created by then, are reported as being sent. The challenges of the
+    other tokens contain data, which the client needs, so these are awaited.
+
+    :return: list of tuples of the token object and the result of
+        ``create_challenge``
+    """
+    if not token_list:
+        return []
+    transaction_id = Challenge.create_transaction_id()
+    g = options.get("g")
+    audit_data = g.audit_object.audit_data if getattr(g, "audit_object", None) is not None else None
+    known_policies = len(audit_data.get("policies", [])) if audit_data is not None else 0
+    # The workers use their own database sessions
+    db.session.commit()
+    create_challenge = with_app_context(_create_challenge_by_id)
+    futures = []
+    worker_globals = []
+    for token_obj in token_list:
+        worker_options = options.copy()
+        if g is not None:
+            worker_options["g"] = _copy_request_globals(g)
+        worker_globals.append(worker_options.get("g"))
+        futures.append(executor.submit(create_challenge, token_obj.token.id, transaction_id,
+                                       worker_options))
+    timeout = float(get_app_config_value("PI_CHALLENGE_DISPATCH_TIMEOUT", 0))
+    _done, not_done = wait(futures, timeout=timeout or None)
+    # Only the challenges, which are sent in the background, are not awaited
+    wait([future for token_obj, future in zip(token_list, futures)
+          if future in not_done and not token_obj.send_challenge_in_background])
+    challenges = []
+    for token_obj, future, worker_g in zip(token_list, futures, worker_globals):
+        if not future.done():
+            log.warning("The challenge of token {0!s} was not created within {1!s} "
+                        "seconds.".format(token_obj.token.serial, timeout))
+            challenge = (True, _("The challenge is being sent."), transaction_id, {})
+        else:
+            challenge = future.result()
+            # The worker may have changed the token, e.g. the OTP counter
+            db.session.expire(token_obj.token)
+            if audit_data is not None:
+                # Add the policies, which were used by the worker, to the audit log
+                worker_policies = worker_g.audit_object.audit_data.get("policies", [])
+                if worker_policies[known_policies:]:
+                    audit_data.setdefault("policies", []).extend(worker_policies[known_policies:])
+        challenges.append((token_obj, challenge))
+    return challenges
+
+
 def create_challenges_from_tokens(token_list, reply_dict, options=None):
     """
     Get a list of active tokens and create challenges for these tokens.
     The reply_dict is modified accordingly. The transaction_id and
     the messages are added to the reply_dict.
 
+    If ``PI_CHALLENGE_DISPATCH_WORKERS`` is set, the challenges of several
+    tokens are created concurrently (see ``_dispatch_challenges``).
+
     :param token_list: The list of the token objects, that can do challenge response
     :param reply_dict: The dictionary that is passed to the API response
     :param options: Additional options. Passed from the upper layer
@@ -2088,40 +2454,41 @@ def create_challenges_from_tokens(token_list, reply_dict, options=None):
     """
     options = options or {}
     reply_dict["multi_challenge"] = []
-    transaction_id = None
     message_list = []
-    for token_obj in token_list:
-        # Check if the max auth is succeeded
-        if token_obj.check_all(message_list):
-            r_chal, message, transaction_id, challenge_info = \
-                token_obj.create_challenge(
-                    transactionid=transaction_id, options=options)
-            # Add the reply to the response
-            message_list.append(message)
-            if r_chal:
-                challenge_info = challenge_info or {}
-                challenge_info["transaction_id"] = transaction_id
-                challenge_info["serial"] = token_obj.token.serial
-                challenge_info["type"] = token_obj.get_tokentype()
-                challenge_info["client_mode"] = token_obj.client_mode
-                challenge_info["message"] = message
-                # If exist, add next pin and next password change
-                next_pin = token_obj.get_tokeninfo(
-                        "next_pin_change")
-                if next_pin:
-                    challenge_info["next_pin_change"] = next_pin
-                    challenge_info["pin_change"] = \
-                        token_obj.is_pin_change()
-                next_passw = token_obj.get_tokeninfo(
-                        "next_password_change")
-                if next_passw:
-                    challenge_info["next_password_change"] = next_passw
-                    challenge_info["password_change"] = \
-                        token_obj.is_pin_change(
-                            password=True)
-                # FIXME: This is deprecated and should be remove one day
-                reply_dict.update(challenge_info)
-                reply_dict["multi_challenge"].append(challenge_info)
+    executor = get_challenge_dispatch_executor()
+    if executor and len(token_list) > 1:
+        challenges = _dispatch_challenges(executor, [token_obj for token_obj in token_list
+                                                     if token_obj.check_all(message_list)],
+                                          options)
+    else:
+        challenges = _create_challenges(token_list, message_list, options)
+    for token_obj, (r_chal, message, transaction_id, challenge_info) in challenges:
+        # Add the reply to the response
+        message_list.append(message)
+        if r_chal:
+            challenge_info = challenge_info or {}
+            challenge_info["transaction_id"] = transaction_id
+            challenge_info["serial"] = token_obj.token.serial
+            challenge_info["type"] = token_obj.get_tokentype()
+            challenge_info["client_mode"] = token_obj.client_mode
+            challenge_info["message"] = message
+            # If exist, add next pin and next password change
+            next_pin = token_obj.get_tokeninfo(
+                    "next_pin_change")
+            if next_pin:
+                challenge_info["next_pin_change"] = next_pin
+                challenge_info["pin_change"] = \
+                    token_obj.is_pin_change()
+            next_passw = token_obj.get_tokeninfo(
+                    "next_password_change")
+            if next_passw:
+                challenge_info["next_password_change"] = next_passw
+                challenge_info["password_change"] = \
+                    token_obj.is_pin_change(
+                        password=True)
+            # FIXME: This is deprecated and should be remove one day
+            reply_dict.update(challenge_info)
+            reply_dict["multi_challenge"].append(challenge_info)
     if message_list:
         reply_dict["message"] = ", ".join(message_list)
     # The "messages" element is needed by some decorators
@@ -2147,10 +2514,57 @@ def weigh_token_type(token_obj):
         return ord(token_obj.type[0])
 
 
+def verify_token_pins(tokenobject_list, passw, user=None, options=None):
+    """
+    Verify the possible PINs of all given tokens at the same time in the
+    thread pool for password hashes. A PIN is either the whole password (to
+    detect a challenge request of tokens, which support challenge-response)
+    or the PIN part of the password.
+    The results are kept in the request-local store, so that the subsequent
+    ``check_pin`` calls of the tokens do not need to compute the hashes again.
+    Tokens, whose PIN is not checked due to the policy ``otppin``, are skipped.
+
+    :param tokenobject_list: list of token objects
+    :param passw: the provided password
+    :param user: the user from the authentication request
+    :param options: the additional request parameters
+    :return: the number of verified PIN hashes
+    """
+    candidates = []
+    g = (options or {}).get("g")
+    chalresp_tokentypes = None
+    for tokenobject in tokenobject_list:
+        pin_hash = tokenobject.token.pin_hash
+        if not pin_hash or tokenobject.token.is_pin_encrypted():
+            continue
+        if get_otppin_policy(tokenobject, options or {}, user)[0]:
+            # The PIN is checked against the user store or not at all
+            continue
+        # The whole password is only compared to the PIN of tokens, which
+        # can be triggered by the PIN to send a challenge
+        if AUTHENTICATIONMODE.CHALLENGE in tokenobject.mode:
+            if g and getattr(type(tokenobject).is_challenge_request,
+                             "checks_challenge_response_policy", False):
+                if chalresp_tokentypes is None:
+                    chalresp_tokentypes = get_challenge_response_tokentypes(g, user or User())
+                if tokenobject.get_tokentype().lower() in chalresp_tokentypes:
+                    candidates.append((passw, pin_hash))
+            else:
+                candidates.append((passw, pin_hash))
+        try:
+            _res, pin, _otpval = tokenobject.split_pin_pass(passw, user=user, options=options)
+            candidates.append((pin, pin_hash))
+        except Exception as exx:  # pragma: no cover
+            log.debug("Could not split the password for token {0!s}: {1!r}".format(
+                tokenobject.token.serial, exx))
+    return len(verify_pass_hashes(candidates))
+
+
 @log_with(log, hide_args=[1])
 @libpolicy(reset_all_user_tokens)
 @libpolicy(generic_challenge_response_reset_pin)
 @libpolicy(generic_challenge_response_resync)
+@forgets_pass_hashes
 def check_token_list(tokenobject_list, passw, user=None, options=None, allow_reset_all_tokens=False):
     """
     this takes a list of token objects and tries to find the matching token
@@ -2204,6 +2618,11 @@ def check_token_list(tokenobject_list, passw, user=None, options=None, allow_res
     if len(tokenobject_list) > 0:
         tokenobject_list = [token for token in tokenobject_list if token.use_for_authentication(options)]
 
+    if len(tokenobject_list) > 1 and get_pass_hash_executor() \
+            and not (options.get("transaction_id") or options.get("state")):
+        # Verify the PINs of all tokens in parallel instead of one token after another
+        verify_token_pins(tokenobject_list, passw, user, options)
+
     for tokenobject in sorted(tokenobject_list, key=weigh_token_type):
         if log.isEnabledFor(logging.DEBUG):
             # Avoid a SQL query triggered by ``tokenobject.user`` in case
@@ -2368,8 +2787,7 @@ def check_token_list(tokenobject_list, passw, user=None, options=None, allow_res
                     # all challenges with this very transaction_id!
                     transaction_id = options.get("transaction_id") or \
                                      options.get("state")
-                    Challenge.query.filter(Challenge.transaction_id == '' +
-                                           transaction_id).delete()
+                    delete_challenges(transaction_id)
                     # We have one successful authentication, so we bail out
                     break
 
@@ -89,8 +89,8 @@ from .log import log_with
 from .config import (get_from_config, get_prepend_pin)
 from .user import (User,
                    get_username)
-from ..models import (TokenOwner, TokenTokengroup, Tokengroup, Challenge, cleanup_challenges)
-from .challenge import get_challenges
+from ..models import (TokenOwner, TokenTokengroup, Tokengroup, Challenge)
+from .challenge import get_challenges, cleanup_challenges, delete_token_challenges
 from privacyidea.lib.crypto import (encryptPassword, decryptPassword,
                                     generate_otpkey)
 from .policydecorators import libpolicy, auth_otppin, challenge_response_allowed
@@ -173,6 +173,9 @@ class TokenClass(object):
     can_verify_enrollment = False
     # If the token is enrollable via multichallenge
     is_multichallenge_enrollable = False
+    # If the challenge only sends a message to the user and the client needs no
+    # data of the challenge, so that the challenge can be sent in the background
+    send_challenge_in_background = False
 
 
     @log_with(log)
@@ -194,6 +197,8 @@ class TokenClass(object):
         # These are temporary details to store during authentication
         # like the "matched_otp_counter".
         self.auth_details = {}
+        # The owner of the token, once it is resolved
+        self._owner = None
 
     def set_type(self, tokentype):
         """
@@ -297,10 +302,15 @@ class TokenClass(object):
         user_object = None
         tokenowner = self.token.first_owner
         if tokenowner:
+            # The user is only resolved again, if the owner changes
+            owner_key = (tokenowner.user_id, tokenowner.resolver, tokenowner.realm_id)
+            if self._owner is not None and self._owner[0] == owner_key:
+                return self._owner[1]
             username = get_username(tokenowner.user_id, tokenowner.resolver)
             user_object = User(login=username,
                                resolver=tokenowner.resolver,
                                realm=tokenowner.realm.name)
+            self._owner = (owner_key, user_object)
         return user_object
 
     def is_orphaned(self):
@@ -703,8 +713,9 @@ class TokenClass(object):
 
     def delete_token(self):
         """
-        delete the database token
+        delete the database token and its challenges
         """
+        delete_token_challenges(self.token.serial)
         self.token.delete()
 
     def save(self):
@@ -48,6 +48,8 @@ from privacyidea.lib.decorators import check_token_locked
 from privacyidea.lib import _
 from privacyidea.lib.policy import SCOPE, ACTION as BASE_ACTION, GROUP, Match
 from privacyidea.lib.error import privacyIDEAError, CSRError, CSRPending
+from privacyidea.models import Token, db
+import time
 import traceback
 
 optional = True
@@ -249,10 +251,6 @@ class CertificateTokenClass(TokenClass):
         TokenClass.__init__(self, aToken)
         self.set_type("certificate")
         self.otp_len = 0
-        try:
-            self._update_rollout_state()
-        except Exception as e:
-            log.warning("Failed to check for pending update. {0!s}".format(e))
 
     @staticmethod
     def get_class_type():
@@ -377,7 +375,7 @@ class CertificateTokenClass(TokenClass):
 
         return ret
 
-    def _update_rollout_state(self):
+    def _update_rollout_state(self, caconnectors=None):
         """
         This is a certificate specific method, that communicates to the CA and checks,
         if a pending certificate has been enrolled, yet.
@@ -386,6 +384,8 @@ class CertificateTokenClass(TokenClass):
 
         A return code of -1 means that the status is unchanged.
 
+        :param caconnectors: Optional dictionary of CA connector objects by
+            their name, which are used instead of creating a new CA connector
         :return: the status of the rollout
         """
         status = -1
@@ -394,7 +394,12 @@ class CertificateTokenClass(TokenClass):
             ca = self.get_tokeninfo("CA")
             if ca and request_id:
                 request_id = int(request_id)
-                cacon = get_caconnector_object(ca)
+                if caconnectors is None:
+                    cacon = get_caconnector_object(ca)
+                else:
+                    cacon = caconnectors.get(ca)
+                    if cacon is None:
+                        cacon = caconnectors[ca] = get_caconnector_object(ca, cached=True)
                 status = cacon.get_cr_status(request_id)
                 # TODO: Later we need to make the status CA dependent. Different CAs could return
                 # different codes. So each CA Connector needs a mapper for its specific codes.
@@ -635,3 +640,46 @@ class CertificateTokenClass(TokenClass):
         log.info("CRL {0!s} created.".format(crl))
 
         return revoked
+
+
+def update_pending_certificates(batch_size=100, time_limit=None):
+    """
+    Check the certificate requests of all certificate tokens in the rollout
+    state "pending" at their CA and update the tokens, whose certificates were
+    issued or denied. The tokens are read in batches and the CA connectors
+    are reused for all tokens and between the calls.
+
+    :param batch_size: The number of tokens, that are read at once
+    :param time_limit: Stop after these seconds. The remaining tokens are
+        checked during the next call.
+    :return: dictionary with the number of checked, enrolled, denied and
+        failed tokens
+    """
+    deadline = time.monotonic() + time_limit if time_limit else None
+    caconnectors = {}
+    result = {"checked": 0, "enrolled": 0, "denied": 0, "failed": 0}
+    last_id = 0
+    while deadline is None or time.monotonic() < deadline:
+        tokens = Token.query.filter(Token.tokentype == "certificate",
+                                    Token.rollout_state == ROLLOUTSTATE.PENDING,
+                                    Token.id > last_id).order_by(Token.id).limit(batch_size).all()
+        for token in tokens:
+            last_id = token.id
+            token_obj = CertificateTokenClass(token)
+            result["checked"] += 1
+            try:
+                token_obj._update_rollout_state(caconnectors)
+            except Exception as e:
+                log.warning("Failed to check the pending certificate of token {0!s}: "
+                            "{1!s}".format(token.serial, e))
+                log.debug(traceback.format_exc())
+                result["failed"] += 1
+                continue
+            if token.rollout_state == ROLLOUTSTATE.ENROLLED:
+                result["enrolled"] += 1
+            elif token.rollout_state == ROLLOUTSTATE.DENIED:
+                result["denied"] += 1
+        db.session.commit()
+        if len(tokens) < batch_size:
+            break
+    return result
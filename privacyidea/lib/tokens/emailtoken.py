@@ -104,6 +104,7 @@ class EmailTokenClass(HotpTokenClass):
     # The HOTP token provides means to verify the enrollment
     can_verify_enrollment = True
     mode = [AUTHENTICATIONMODE.CHALLENGE]
+    send_challenge_in_background = True
 
     def __init__(self, aToken):
         HotpTokenClass.__init__(self, aToken)
@@ -585,5 +586,5 @@ class EmailTokenClass(HotpTokenClass):
             # Dynamically we remember that we need to do another challenge
             self.currently_in_challenge = True
         else:
-            self.token.delete()
+            self.delete_token()
             raise ValidateError(_("The email address is not valid!"))
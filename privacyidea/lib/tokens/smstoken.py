@@ -163,6 +163,7 @@ class SmsTokenClass(HotpTokenClass):
 
     """
     mode = [AUTHENTICATIONMODE.CHALLENGE]
+    send_challenge_in_background = True
 
     def __init__(self, db_token):
         HotpTokenClass.__init__(self, db_token)
@@ -59,11 +59,42 @@ from .realm import (get_realms, realm_is_defined,
                     get_realm, get_realm_id)
 from .config import get_from_config, SYSCONF
 from .usercache import (user_cache, cache_username, user_init, delete_user_cache)
+from .profiling import profiled, PHASE
+from .framework import get_app_config_value, get_thread_pool, with_app_context
+from .lifecycle import finalizer_scope
 from privacyidea.models import CustomUserAttribute, db
 
 log = logging.getLogger(__name__)
 
 
+def get_resolver_executor():
+    """
+    Return the process-wide thread pool for querying several resolvers
+    concurrently or None, if ``PI_RESOLVER_WORKERS`` is not set to more than
+    one worker.
+    """
+    workers = int(get_app_config_value("PI_RESOLVER_WORKERS", 1))
+    if workers <= 1:
+        return None
+    return get_thread_pool("resolver", workers)
+
+
+def _call_resolver(resolvername, method, *args):
+    """
+    Call a method of a resolver in a worker thread. The resolver object is
+    loaded in the worker, since resolver objects hold the connections of the
+    context, which loaded them. Resources, which the resolver borrows, like
+    pooled LDAP connections, are returned when the call is done.
+
+    :param resolvername: The name of the resolver
+    :param method: The name of the method, like "getUserId"
+    :return: the result of the method
+    """
+    with finalizer_scope():
+        y = get_resolver_object(resolvername)
+        return getattr(y, method)(*args)
+
+
 class User(object):
     """
     The user has the attributes
@@ -232,14 +263,20 @@ class User(object):
             return [self.resolver]
         
         resolvers = []
-        for resolvername in self.get_ordererd_resolvers():
-            # test, if the user is contained in this resolver
-            if self._locate_user_in_resolver(resolvername):
-                break
+        resolvernames = self.get_ordererd_resolvers()
+        executor = get_resolver_executor()
+        if executor and len(resolvernames) > 1:
+            self._locate_user_concurrently(resolvernames, executor)
+        else:
+            for resolvername in resolvernames:
+                # test, if the user is contained in this resolver
+                if self._locate_user_in_resolver(resolvername):
+                    break
         if self.resolver:
             resolvers = [self.resolver]
         return resolvers
 
+    @profiled(PHASE.RESOLVER)
     def _locate_user_in_resolver(self, resolvername):
         """
         Try to locate the user (by self.login) in the resolver with the given name.
@@ -254,19 +291,55 @@ class User(object):
             log.info("Resolver {0!r} not found!".format(resolvername))
             return False
         else:
-            uid = y.getUserId(self.login)
-            if uid not in ["", None]:
-                log.info("user {0!r} found in resolver {1!r}".format(self.login,
-                                                                     resolvername))
-                log.info("userid resolved to {0!r} ".format(uid))
-                self.resolver = resolvername
-                self.uid = uid
-                # We do not need to search other resolvers!
+            return self._set_located_user(resolvername, y.getUserId(self.login))
+
+    def _set_located_user(self, resolvername, uid):
+        """
+        Set `self.resolver` and `self.uid`, if the user was found in the
+        resolver, i.e. if the uid is not empty.
+        :return: boolean
+        """
+        if uid not in ["", None]:
+            log.info("user {0!r} found in resolver {1!r}".format(self.login,
+                                                                 resolvername))
+            log.info("userid resolved to {0!r} ".format(uid))
+            self.resolver = resolvername
+            self.uid = uid
+            # We do not need to search other resolvers!
+            return True
+        else:
+            log.debug("user {0!r} not found"
+                      " in resolver {1!r}".format(self.login, resolvername))
+            return False
+
+    @profiled(PHASE.RESOLVER)
+    def _locate_user_concurrently(self, resolvernames, executor):
+        """
+        Look up the user (by self.login) in all given resolvers at the same
+        time. The resolvers are evaluated in the given order, so that the
+        user is located in the first resolver, that contains the user, like
+        with ``_locate_user_in_resolver``. An exception of a resolver is only
+        raised, if the user is not found in a resolver with a higher priority.
+        :param resolvernames: list of resolver names ordered by priority
+        :param executor: the thread pool
+        :return: boolean
+        """
+        lookups = []
+        for resolvername in resolvernames:
+            y = get_resolver_object(resolvername)
+            if y is None:  # pragma: no cover
+                log.info("Resolver {0!r} not found!".format(resolvername))
+                continue
+            lookups.append((resolvername,
+                            executor.submit(with_app_context(_call_resolver),
+                                            resolvername, "getUserId", self.login)))
+        for i, (resolvername, future) in enumerate(lookups):
+            if self._set_located_user(resolvername, future.result()):
+                # The lookups in resolvers with a lower priority are not needed
+                for _resolvername, pending in lookups[i + 1:]:
+                    pending.cancel()
                 return True
-            else:
-                log.debug("user {0!r} not found"
-                          " in resolver {1!r}".format(self.login, resolvername))
-                return False
+        return False
 
     def get_user_identifiers(self):
         """
@@ -291,6 +364,7 @@ class User(object):
         return bool(self.uid)
 
     @property
+    @profiled(PHASE.RESOLVER)
     def info(self):
         """
         return the detailed information for the user
@@ -415,6 +489,7 @@ class User(object):
         return Realms
     
     @log_with(log, log_entry=False)
+    @profiled(PHASE.RESOLVER)
     def check_password(self, password):
         """
         The password of the user is checked against the user source
@@ -661,6 +736,7 @@ def get_user_from_param(param, optionalOrRequired=optional):
 
 
 @log_with(log)
+@profiled(PHASE.RESOLVER)
 def get_user_list(param=None, user=None, custom_attributes=False):
     """
     This function returns a list of user dictionaries.
@@ -674,7 +750,26 @@ def get_user_list(param=None, user=None, custom_attributes=False):
     :type custom_attributes: bool
     :return: list of dictionaries
     """
-    users = []
+    return list(iter_user_list(param, user, custom_attributes))
+
+
+def iter_user_list(param=None, user=None, custom_attributes=False):
+    """
+    This function yields the user dictionaries of ``get_user_list`` resolver
+    by resolver, so that the users of all resolvers are not held in memory
+    at the same time.
+    If ``PI_RESOLVER_WORKERS`` is set, the next resolver is already queried,
+    while the users of the current resolver are yielded.
+
+    :param param: search parameters
+    :type param: dict
+    :param user:  a specific user object to return
+    :type user: User object
+    :param custom_attributes:  Set to True, if you want to receive custom attributes
+        of external users.
+    :type custom_attributes: bool
+    :return: generator of dictionaries
+    """
     resolvers = []
     searchDict = {"username": "*"}
     param = param or {}
@@ -725,12 +820,32 @@ def get_user_list(param=None, user=None, custom_attributes=False):
             for resolver_entry in res_list.get("resolver"):
                 resolvers.append(resolver_entry.get("name"))
 
-    for resolver_name in set(resolvers):
+    resolvers = list(set(resolvers))
+    executor = get_resolver_executor() if len(resolvers) > 1 else None
+    lookups = {}
+
+    def start_lookup(index):
+        # Only the next resolver is searched in advance, so that at most the
+        # users of two resolvers are held in memory
+        if executor and index < len(resolvers):
+            try:
+                lookups[resolvers[index]] = executor.submit(with_app_context(_call_resolver),
+                                                            resolvers[index], "getUserList", searchDict)
+            except Exception as exx:  # pragma: no cover
+                log.debug("Could not start the search in {0!r}: {1!r}".format(resolvers[index], exx))
+
+    start_lookup(0)
+    for index, resolver_name in enumerate(resolvers):
+        # Search the next resolver, while the users of this resolver are processed
+        start_lookup(index + 1)
         try:
             log.debug("Check for resolver class: {0!r}".format(resolver_name))
             y = get_resolver_object(resolver_name)
             log.debug("with this search dictionary: {0!r} ".format(searchDict))
-            ulist = y.getUserList(searchDict)
+            if resolver_name in lookups:
+                ulist = lookups.pop(resolver_name).result()
+            else:
+                ulist = y.getUserList(searchDict)
             # Add resolvername to the list
             realm_id = get_realm_id(param_realm or user_realm)
             for ue in ulist:
@@ -741,8 +856,9 @@ def get_user_list(param=None, user=None, custom_attributes=False):
                     # Add the custom attributes, by class method from User
                     # with uid, resolvername and realm_id, which we need to determine by the realm name
                     ue.update(get_attributes(ue.get("userid"), ue.get("resolver"), realm_id))
-            log.debug("Found this userlist: {0!r}".format(ulist))
-            users.extend(ulist)
+            log.debug("Found {0!s} users in resolver {1!r}".format(len(ulist), resolver_name))
+            for ue in ulist:
+                yield ue
 
         except KeyError as exx:  # pragma: no cover
             log.error("{0!r}".format((exx)))
@@ -754,11 +870,10 @@ def get_user_list(param=None, user=None, custom_attributes=False):
             log.debug("{0!s}".format(traceback.format_exc()))
             continue
 
-    return users
-
 
 @log_with(log)
 @user_cache(cache_username)
+@profiled(PHASE.RESOLVER)
 def get_username(userid, resolvername):
     """
     Determine the username for a given id and a resolvername.
@@ -277,9 +277,6 @@ class Token(MethodsMixin, db.Model):
         db.session.query(MachineToken)\
                   .filter(MachineToken.token_id == self.id)\
                   .delete()
-        db.session.query(Challenge)\
-                  .filter(Challenge.serial == self.serial)\
-                  .delete()
         db.session.query(TokenInfo)\
                   .filter(TokenInfo.token_id == self.id)\
                   .delete()
@@ -1402,6 +1399,9 @@ class Challenge(MethodsMixin, db.Model):
     expiration = db.Column(db.DateTime, index=True)
     received_count = db.Column(db.Integer(), default=0)
     otp_valid = db.Column(db.Boolean, default=False)
+    # The challenge store, if the challenge was read from a store other
+    # than the database. Changes are written back to this store.
+    store = None
 
     @log_with(log)
     def __init__(self, serial, transaction_id=None,
@@ -1421,6 +1421,19 @@ class Challenge(MethodsMixin, db.Model):
     def create_transaction_id(length=20):
         return get_rand_digit_str(length)
 
+    def save(self):
+        from privacyidea.lib.challenge import get_challenge_store
+        return (self.store or get_challenge_store()).save(self)
+
+    def delete(self):
+        from privacyidea.lib.challenge import get_challenge_store
+        return (self.store or get_challenge_store()).delete(self)
+
+    def _changed(self):
+        # Challenges in the database are written with the session
+        if self.store is not None:
+            self.store.save(self)
+
     def is_valid(self):
         """
         Returns true, if the expiration time has not passed, yet.
@@ -1443,6 +1456,7 @@ class Challenge(MethodsMixin, db.Model):
             self.data = dumps(data)
         else:
             self.data = convert_column_to_unicode(data)
+        self._changed()
 
     def get_data(self):
         data = {}
@@ -1457,9 +1471,11 @@ class Challenge(MethodsMixin, db.Model):
 
     def set_session(self, session):
         self.session = convert_column_to_unicode(session)
+        self._changed()
 
     def set_challenge(self, challenge):
         self.challenge = convert_column_to_unicode(challenge)
+        self._changed()
 
     def get_challenge(self):
         return self.challenge
@@ -1467,6 +1483,7 @@ class Challenge(MethodsMixin, db.Model):
     def set_otp_status(self, valid=False):
         self.received_count += 1
         self.otp_valid = valid
+        self._changed()
 
     def get_otp_status(self):
         """
@@ -2761,6 +2778,8 @@ class EventCounter(db.Model):
     counter_name = db.Column(db.Unicode(80), nullable=False)
     counter_value = db.Column(db.Integer, default=0)
     node = db.Column(db.Unicode(255), nullable=False)
+    # The UTC time of the last reset of the counter
+    last_reset = db.Column(db.DateTime, nullable=True)
     __table_args__ = (db.UniqueConstraint('counter_name',
                                           'node',
                                           name='evctr_1'),
@@ -2941,17 +2960,70 @@ class AuthCache(MethodsMixin, db.Model):
     # We can hash the password like this:
     # binascii.hexlify(hashlib.sha256("secret123456").digest())
     authentication = db.Column(db.Unicode(255), default="")
+    # Keyed digest of the user and the password to find the entry without
+    # verifying the slow hash of each entry of the user
+    auth_digest = db.Column(db.Unicode(64), index=True)
 
     def __init__(self, username, realm, resolver, authentication,
-                 first_auth=None, last_auth=None):
+                 first_auth=None, last_auth=None, auth_digest=None):
         self.username = username
         self.realm = realm
         self.resolver = resolver
         self.authentication = authentication
+        self.auth_digest = auth_digest
         self.first_auth = first_auth if first_auth else datetime.utcnow()
         self.last_auth = last_auth if last_auth else self.first_auth
 
 
+class AuthCounter(MethodsMixin, db.Model):
+    """
+    This table counts the successful and failed authentications of a user in
+    time buckets. It is used by the policies auth_max_success and
+    auth_max_fail, if PI_AUTH_COUNTER_STORE is set to ``sql``.
+    The bucket is the number of ``resolution`` seconds since the epoch.
+    """
+    __tablename__ = 'authcounter'
+    __table_args__ = (db.UniqueConstraint('username', 'realm', 'resolver',
+                                          'success', 'resolution', 'bucket',
+                                          name='acix_1'),
+                      {'mysql_row_format': 'DYNAMIC'})
+    id = db.Column(db.Integer, Sequence("authcounter_seq"), primary_key=True)
+    username = db.Column(db.Unicode(64), default="", nullable=False)
+    realm = db.Column(db.Unicode(120), default='', nullable=False)
+    resolver = db.Column(db.Unicode(120), default='', nullable=False)
+    success = db.Column(db.Boolean, default=False, nullable=False)
+    resolution = db.Column(db.Integer, default=1, nullable=False)
+    bucket = db.Column(db.BigInteger, default=0, nullable=False)
+    count = db.Column(db.Integer, default=0, nullable=False)
+
+    def __init__(self, username, realm, resolver, success, resolution, bucket,
+                 count=1):
+        self.username = username
+        self.realm = realm
+        self.resolver = resolver
+        self.success = success
+        self.resolution = resolution
+        self.bucket = bucket
+        self.count = count
+
+
+class SerialCounter(db.Model):
+    """
+    This table contains the next number of the generated serials of a serial
+    prefix. It is used by gen_serial, if PI_SERIAL_BLOCK_SIZE is set. The
+    processes reserve blocks of numbers by increasing the value.
+    """
+    __tablename__ = 'serialcounter'
+    __table_args__ = {'mysql_row_format': 'DYNAMIC'}
+    id = db.Column(db.Integer, Sequence("serialcounter_seq"), primary_key=True)
+    prefix = db.Column(db.Unicode(40), nullable=False, unique=True)
+    value = db.Column(db.BigInteger, default=0, nullable=False)
+
+    def __init__(self, prefix, value=0):
+        self.prefix = prefix
+        self.value = value
+
+
 ### Periodic Tasks
 
 class PeriodicTask(MethodsMixin, db.Model):
@@ -31,3 +31,5 @@ class PICronTestCase(CliTestCase):
                       result.output, result)
         self.assertIn("Manually run a periodic task",
                       result.output, result)
+        self.assertIn("Run the scheduled periodic tasks in a resident process",
+                      result.output, result)
@@ -17,8 +17,13 @@
 # You should have received a copy of the GNU Affero General Public
 # License along with this program. If not, see <http://www.gnu.org/licenses/>.
 
+import mock
+import os
+import tempfile
 from privacyidea.cli.pimanage import cli as pi_manage
 from privacyidea.lib.resolver import save_resolver, delete_resolver
+from privacyidea.lib.importotp import parseOATHcsv
+from privacyidea.lib.token import get_one_token, remove_token
 from .base import CliTestCase
 from ..base import PWFILE
 
@@ -47,6 +52,28 @@ class PIManageAuditTestCase(CliTestCase):
         self.assertIn("Clean the SQL audit log.", result.output, result)
 
 
+class PIManageBenchmarkTestCase(CliTestCase):
+    def test_01_pimanage_benchmark_offline(self):
+        runner = self.app.test_cli_runner()
+        result = runner.invoke(pi_manage, ["benchmark", "offline", "-a", "2", "-r", "1000"])
+        self.assertIn("amount=     2 rounds=    1000:", result.output, result)
+
+    def test_02_pimanage_benchmark_pin(self):
+        runner = self.app.test_cli_runner()
+        result = runner.invoke(pi_manage, ["benchmark", "pin", "-t", "2", "-r", "1",
+                                           "-m", "64", "-w", "2"])
+        self.app.config.pop("PI_PIN_VERIFY_WORKERS", None)
+        self.assertIn("tokens=   2 rounds=   1 memory=      64: sequential", result.output, result)
+        self.assertIn("parallel", result.output, result)
+
+    def test_03_pimanage_benchmark_sign(self):
+        runner = self.app.test_cli_runner()
+        result = runner.invoke(pi_manage, ["benchmark", "sign", "-n", "2"])
+        for keytype in ["rsa", "ed25519", "ecdsa"]:
+            self.assertIn("{0:<8s}: load".format(keytype), result.output, result)
+        self.assertIn("2 x sign and verify", result.output, result)
+
+
 class PIManageBackupTestCase(CliTestCase):
     def test_01_pimanage_backup_help(self):
         runner = self.app.test_cli_runner()
@@ -98,6 +125,29 @@ class PIManageRealmTestCase(CliTestCase):
         delete_resolver("resolver1")
 
 
+class PIManageSetupTestCase(CliTestCase):
+    def test_01_pimanage_setup_create_audit_keys(self):
+        runner = self.app.test_cli_runner()
+        with tempfile.TemporaryDirectory() as key_dir:
+            priv_key = os.path.join(key_dir, "private.pem")
+            pub_key = os.path.join(key_dir, "public.pem")
+            with mock.patch.dict(self.app.config, {"PI_AUDIT_KEY_PRIVATE": priv_key,
+                                                   "PI_AUDIT_KEY_PUBLIC": pub_key}):
+                # The key size is only allowed for RSA keys
+                result = runner.invoke(pi_manage, ["setup", "create_audit_keys",
+                                                   "--keytype", "ed25519", "--keysize", "4096"])
+                self.assertEqual(result.exit_code, 1, result)
+                self.assertIn("The key size can only be given for RSA keys.", result.output, result)
+                self.assertFalse(os.path.exists(priv_key))
+                # A warning is shown, since the key also signs the responses
+                result = runner.invoke(pi_manage, ["setup", "create_audit_keys",
+                                                   "--keytype", "ed25519"])
+                self.assertEqual(result.exit_code, 0, result)
+                self.assertIn("Please ensure, that your clients can verify ED25519 signatures.",
+                              result.output, result)
+                self.assertTrue(os.path.exists(pub_key))
+
+
 class PIManageBaseTestCase(CliTestCase):
     def test_01_pimanage_help(self):
         runner = self.app.test_cli_runner()
@@ -145,3 +195,20 @@ class PIManageTokenTestCase(CliTestCase):
         result = runner.invoke(pi_manage, ["token"])
         self.assertIn("Commands to manage token in privacyIDEA", result.output, result)
         self.assertIn("Import tokens from a file", result.output, result)
+        self.assertIn("Enroll a number of tokens with generated keys", result.output, result)
+
+    def test_02_pimanage_token_enroll(self):
+        runner = self.app.test_cli_runner(mix_stderr=False)
+        result = runner.invoke(pi_manage, ["token", "enroll", "-c", "3", "--type", "totp",
+                                           "--prefix", "CLIBULK", "--timestep", "60"])
+        self.assertEqual(result.exit_code, 0, result)
+        self.assertIn("Enrolled 3 tokens.", result.stderr, result)
+        # The output can be imported as OATH CSV
+        tokens = parseOATHcsv(result.stdout)
+        self.assertEqual(len(tokens), 3, result.stdout)
+        for serial, token in tokens.items():
+            self.assertTrue(serial.startswith("CLIBULK"), serial)
+            self.assertEqual(token["type"], "totp")
+            self.assertEqual(token["timeStep"], 60)
+            self.assertEqual(get_one_token(serial=serial).get_tokeninfo("timeStep"), "60")
+            remove_token(serial)
@@ -63,6 +63,21 @@ def wrapper%(signature)s:
 """
 
 
+def _check_password(directory, user, password):
+    correct_password = False
+    for entry in directory:
+        if to_unicode(entry.get("dn")) == user:
+            pw = entry.get("attributes").get("userPassword")
+            # password can be unicode
+            if to_bytes(pw) == to_bytes(password):
+                correct_password = True
+            elif pw.startswith('{SSHA}'):
+                correct_password = ldap_salted_sha1.verify(password, pw)
+            else:
+                correct_password = False
+    return correct_password
+
+
 def _convert_objectGUID(item):
     item = uuid.UUID("{{{0!s}}}".format(item)).bytes_le
     item = escape_bytes(item)
@@ -144,6 +159,12 @@ class Connection(object):
     def bind(self, read_server_info=True):
         return self.bound
 
+    def rebind(self, user=None, password=None, authentication=None,
+               sasl_mechanism=None, sasl_credentials=None,
+               read_server_info=True, controls=None):
+        self.bound = _check_password(self.directory, user, password)
+        return self.bound
+
     def start_tls(self, read_server_info=True):
         self.start_tls_called = True
 
@@ -731,16 +752,8 @@ class Ldap3Mock(object):
         self.directory = self._load_data(DIRECTORY)
         if authentication == ldap3.ANONYMOUS and user is None:
             correct_password = True
-        for entry in self.directory:
-            if to_unicode(entry.get("dn")) == user:
-                pw = entry.get("attributes").get("userPassword")
-                # password can be unicode
-                if to_bytes(pw) == to_bytes(password):
-                    correct_password = True
-                elif pw.startswith('{SSHA}'):
-                    correct_password = ldap_salted_sha1.verify(password, pw)
-                else:
-                    correct_password = False
+        else:
+            correct_password = _check_password(self.directory, user, password)
         self.con_obj = Connection(self.directory)
         self.con_obj.bound = correct_password
         return self.con_obj
@@ -1,5 +1,7 @@
 from .base import MyApiTestCase
 from privacyidea.lib.monitoringstats import write_stats
+from privacyidea.lib.profiling import register_sql_events
+from privacyidea.lib.framework import get_app_local_store
 from privacyidea.lib.tokenclass import AUTH_DATE_FORMAT
 from privacyidea.models import db
 import datetime
@@ -118,3 +120,52 @@ class APIMonitoringTestCase(MyApiTestCase):
             result = res.json.get("result")
             # Number of remaining values
             self.assertEqual(1, len(result.get("value")), result)
+
+    def test_03_profiling(self):
+        self.app.config["PI_PROFILING"] = True
+        self.app.config["PI_PROFILING_SERVER_TIMING"] = True
+        self.app.config["PI_PROFILING_SLOW_REQUEST"] = 0
+        register_sql_events()
+        try:
+            with self.app.test_request_context('/monitoring/',
+                                               method='GET',
+                                               headers={'Authorization': self.at}):
+                res = self.app.full_dispatch_request()
+                self.assertEqual(200, res.status_code, res)
+                self.assertIn("policy;dur=", res.headers.get("Server-Timing"))
+                self.assertIn("total;dur=", res.headers.get("Server-Timing"))
+
+            with self.app.test_request_context('/monitoring/profiling/requests',
+                                               method='GET',
+                                               headers={'Authorization': self.at}):
+                res = self.app.full_dispatch_request()
+                self.assertEqual(200, res.status_code, res)
+                value = res.json.get("result").get("value")
+                endpoint = value.get("endpoints").get("GET /monitoring/")
+                self.assertEqual(endpoint.get("count"), 1)
+                self.assertIn("policy", endpoint.get("phases"))
+                self.assertIn("audit", endpoint.get("phases"))
+                self.assertGreater(endpoint.get("db_queries"), 0)
+                self.assertEqual(value.get("slow_requests")[0].get("endpoint"), "GET /monitoring/")
+        finally:
+            self.app.config.pop("PI_PROFILING")
+            self.app.config.pop("PI_PROFILING_SERVER_TIMING")
+            self.app.config.pop("PI_PROFILING_SLOW_REQUEST")
+            get_app_local_store().pop("profile_statistics", None)
+
+        # A statistics key "profiling" is not shadowed by the profiling endpoint
+        write_stats("profiling", 3)
+        with self.app.test_request_context('/monitoring/profiling',
+                                           method='GET',
+                                           headers={'Authorization': self.at}):
+            res = self.app.full_dispatch_request()
+            self.assertEqual(200, res.status_code, res)
+            self.assertEqual(res.json.get("result").get("value")[0][1], 3)
+
+        # Without PI_PROFILING there is no Server-Timing header
+        with self.app.test_request_context('/monitoring/',
+                                           method='GET',
+                                           headers={'Authorization': self.at}):
+            res = self.app.full_dispatch_request()
+            self.assertEqual(200, res.status_code, res)
+            self.assertNotIn("Server-Timing", res.headers)
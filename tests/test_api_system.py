@@ -338,6 +338,59 @@ class APIConfigTestCase(MyApiTestCase):
         r = delete_resolver(params.get("resolver"))
         self.assertTrue(r)
 
+    @ldap3mock.activate
+    def test_08_resolver_cache(self):
+        ldap3mock.setLDAPDirectory(LDAPDirectory)
+        params = {'LDAPURI': 'ldap://localhost',
+                  'LDAPBASE': 'o=test',
+                  'BINDDN': 'cn=manager,ou=example,o=test',
+                  'BINDPW': 'ldaptest',
+                  'LOGINNAMEATTRIBUTE': 'cn',
+                  'LDAPSEARCHFILTER': '(cn=*)',
+                  'USERINFO': '{ "username": "cn", "email": "mail" }',
+                  'UIDTYPE': 'DN',
+                  'CACHE_TIMEOUT': 120,
+                  'type': 'ldapresolver',
+                  'resolver': 'testLcache'}
+        r = save_resolver(params)
+        self.assertTrue(r)
+        with self.app.test_request_context('/'):
+            from privacyidea.lib.resolver import get_resolver_object
+            self.assertTrue(get_resolver_object("testLcache").getUserId("bob"))
+
+        with self.app.test_request_context('/resolver/testLcache/cache',
+                                           method='GET',
+                                           headers={'Authorization': self.at}):
+            res = self.app.full_dispatch_request()
+            self.assertEqual(res.status_code, 200, res)
+            value = res.json["result"]["value"]
+            self.assertEqual(value["getUserId"]["size"], 1, value)
+            self.assertEqual(value["getUserId"]["misses"], 1, value)
+
+        with self.app.test_request_context('/resolver/testLcache/cache',
+                                           method='DELETE',
+                                           headers={'Authorization': self.at}):
+            res = self.app.full_dispatch_request()
+            self.assertEqual(res.status_code, 200, res)
+            self.assertTrue(res.json["result"]["value"])
+
+        with self.app.test_request_context('/resolver/testLcache/cache',
+                                           method='GET',
+                                           headers={'Authorization': self.at}):
+            res = self.app.full_dispatch_request()
+            self.assertEqual(res.status_code, 200, res)
+            self.assertEqual(res.json["result"]["value"], {})
+
+        # unknown resolver
+        with self.app.test_request_context('/resolver/unknown/cache',
+                                           method='DELETE',
+                                           headers={'Authorization': self.at}):
+            res = self.app.full_dispatch_request()
+            self.assertEqual(res.status_code, 404, res)
+
+        r = delete_resolver(params.get("resolver"))
+        self.assertTrue(r)
+
     def test_08_resolvers(self):
         with self.app.test_request_context('/resolver/resolver1',
                                            data={'type': 'passwdresolver',
@@ -10,7 +10,8 @@ from privacyidea.lib.policy import (set_policy, delete_policy, SCOPE, ACTION,
 from privacyidea.lib.token import (get_tokens, init_token, remove_token,
                                    get_tokens_from_serial_or_user, enable_token,
                                    check_serial_pass, get_realms_of_token,
-                                   assign_token, token_exist, add_tokeninfo)
+                                   assign_token, unassign_token, token_exist, add_tokeninfo,
+                                   get_one_token)
 from privacyidea.lib.resolver import save_resolver
 from privacyidea.lib.realm import set_realm
 from privacyidea.lib.user import User
@@ -31,6 +32,11 @@ from privacyidea.lib.caconnectors.msca import MSCAConnector
 from .mscamock import CAServiceMock
 from privacyidea.lib.caconnectors.msca import ATTR as MS_ATTR
 from privacyidea.lib.token import init_token
+from privacyidea.lib.tokens.certificatetoken import update_pending_certificates
+from privacyidea.lib.framework import get_app_local_store
+from privacyidea.models import db
+from sqlalchemy import event
+import contextlib
 
 # Mock for certificate from MSCA
 MY_CA_NAME = "192.168.47.11"
@@ -2974,6 +2980,90 @@ class APITokenTestCase(MyApiTestCase):
 
         delete_policy("require_description")
 
+    def test_51_bulk_init(self):
+        with self.app.test_request_context('/token/bulkinit',
+                                           method='POST',
+                                           data={"count": 3, "type": "hotp", "prefix": "BULK",
+                                                 "otplen": 8, "tokenrealms": self.realm1},
+                                           headers={'Authorization': self.at}):
+            res = self.app.full_dispatch_request()
+            self.assertEqual(res.status_code, 200, res)
+            value = res.json["result"]["value"]
+            self.assertEqual(value["count"], 3)
+            serials = [token["serial"] for token in value["tokens"]]
+        for serial in serials:
+            token_obj = get_one_token(serial=serial)
+            self.assertEqual(token_obj.token.otplen, 8)
+            self.assertEqual(token_obj.get_realms(), [self.realm1])
+        entry = self.find_most_recent_audit_entry(action='POST /token/bulkinit')
+        self.assertEqual(entry['success'], 1, entry)
+
+        # Only HOTP and TOTP tokens can be enrolled in bulk
+        with self.app.test_request_context('/token/bulkinit',
+                                           method='POST',
+                                           data={"count": 3, "type": "spass"},
+                                           headers={'Authorization': self.at}):
+            res = self.app.full_dispatch_request()
+            self.assertEqual(res.status_code, 400, res)
+
+        # The number of tokens is limited
+        self.app.config["PI_BULKINIT_MAX_TOKENS"] = 2
+        with self.app.test_request_context('/token/bulkinit',
+                                           method='POST',
+                                           data={"count": 3},
+                                           headers={'Authorization': self.at}):
+            res = self.app.full_dispatch_request()
+            self.assertEqual(res.status_code, 400, res)
+            self.assertEqual(res.json["result"]["error"]["message"],
+                             "ERR905: At most 2 tokens can be enrolled at once.")
+        self.app.config.pop("PI_BULKINIT_MAX_TOKENS")
+
+        # The admin needs the right to import tokens
+        set_policy("admin_enroll", scope=SCOPE.ADMIN, action="enrollHOTP")
+        with self.app.test_request_context('/token/bulkinit',
+                                           method='POST',
+                                           data={"count": 3},
+                                           headers={'Authorization': self.at}):
+            res = self.app.full_dispatch_request()
+            self.assertEqual(res.status_code, 403, res)
+        delete_policy("admin_enroll")
+
+        # The same enrollment policies apply as for /token/init
+        set_policy("max_realm", scope=SCOPE.ENROLL, realm=self.realm1,
+                   action="{0!s}=5".format(ACTION.MAXTOKENREALM))
+        with self.app.test_request_context('/token/bulkinit',
+                                           method='POST',
+                                           data={"count": 3, "tokenrealms": self.realm1},
+                                           headers={'Authorization': self.at}):
+            res = self.app.full_dispatch_request()
+            self.assertEqual(res.status_code, 403, res)
+            self.assertEqual(res.json["result"]["error"]["message"],
+                             "The number of tokens in this realm is limited!")
+        delete_policy("max_realm")
+        set_policy("require_description", scope=SCOPE.ENROLL,
+                   action="{0!s}=hotp".format(ACTION.REQUIRE_DESCRIPTION))
+        with self.app.test_request_context('/token/bulkinit',
+                                           method='POST',
+                                           data={"count": 2},
+                                           headers={'Authorization': self.at}):
+            res = self.app.full_dispatch_request()
+            self.assertEqual(res.status_code, 403, res)
+        delete_policy("require_description")
+        set_policy("hotp_defaults", scope=SCOPE.ADMIN,
+                   action="hotp_hashlib=sha256, enrollHOTP, {0!s}".format(ACTION.IMPORT))
+        with self.app.test_request_context('/token/bulkinit',
+                                           method='POST',
+                                           data={"count": 2},
+                                           headers={'Authorization': self.at}):
+            res = self.app.full_dispatch_request()
+            self.assertEqual(res.status_code, 200, res)
+            default_serials = [token["serial"] for token in res.json["result"]["value"]["tokens"]]
+        for serial in default_serials:
+            self.assertEqual(get_one_token(serial=serial).get_tokeninfo("hashlib"), "sha256")
+        delete_policy("hotp_defaults")
+        for serial in serials + default_serials:
+            remove_token(serial)
+
 
 class API00TokenPerformance(MyApiTestCase):
 
@@ -3262,6 +3352,46 @@ class API00TokenPerformance(MyApiTestCase):
             # Of course there is no exact token "perf*", it does not match perf001
             self.assertFalse(result["status"])
 
+    def _count_token_queries(self, url, method, data, identity_map=True):
+        """
+        Run the request and return the number of SQL statements, that select
+        tokens by serial.
+        """
+        statements = []
+
+        def count(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        with mock.patch("privacyidea.lib.token._get_token_identity_map",
+                        return_value=None) if not identity_map else contextlib.nullcontext():
+            event.listen(db.engine, "before_cursor_execute", count)
+            try:
+                with self.app.test_request_context(url, method=method, data=data,
+                                                   headers={'Authorization': self.at}):
+                    res = self.app.full_dispatch_request()
+                    self.assertEqual(res.status_code, 200, res.json)
+            finally:
+                event.remove(db.engine, "before_cursor_execute", count)
+        return len([st for st in statements if "FROM token" in st and "token.serial = " in st])
+
+    def test_03_token_identity_map(self):
+        self.setUp_user_realms()
+        assign_token("perf001", User("cornelius", self.realm1))
+        # The token is loaded once per request. Only the lookups with the serial
+        # and the owner of the token query the database again.
+        for url, method, data, loads in [("/token/", "GET", {"serial": "perf001"}, 1),
+                                         ("/token/disable", "POST", {"serial": "perf001"}, 2),
+                                         ("/token/enable", "POST", {"serial": "perf001"}, 2),
+                                         ("/token/info/perf001/key", "POST", {"value": "v"}, 1),
+                                         ("/validate/check", "POST", {"serial": "perf001",
+                                                                      "pass": "123456"}, 1)]:
+            self.assertEqual(self._count_token_queries(url, method, data), loads, url)
+            self.assertGreaterEqual(self._count_token_queries(url, method, data,
+                                                              identity_map=False), loads, url)
+        self.assertEqual(self._count_token_queries("/token/info/perf001/key", "POST",
+                                                   {"value": "v"}, identity_map=False), 4)
+        unassign_token("perf001")
+
 
 class APIDetermine_User_from_Serial_for_Policies(MyApiTestCase):
     """
@@ -3436,6 +3566,9 @@ class APIMSCACertTestCase(MyApiTestCase):
 
             # Enroll the certificated
             mock_conncect_worker.return_value.disposition = 3
+            # The rollout state is updated in the background
+            get_app_local_store().pop("caconnector_objects", None)
+            update_pending_certificates()
 
             # Fetch the rolloutstate again, now the token is enrolled
             with self.app.test_request_context('/token/?serial={0!s}'.format(cert_tok.token.serial),
@@ -3482,6 +3615,9 @@ class APIMSCACertTestCase(MyApiTestCase):
 
             # Enroll the certificated
             mock_conncect_worker.return_value.disposition = 2
+            # The rollout state is updated in the background
+            get_app_local_store().pop("caconnector_objects", None)
+            update_pending_certificates()
 
             # Fetch the rolloutstate again, now the token is enrolled
             with self.app.test_request_context('/token/?serial={0!s}'.format(cert_tok.token.serial),
@@ -1,8 +1,10 @@
 from .base import MyApiTestCase
 import json
+import mock
 from privacyidea.lib.resolver import (save_resolver)
 from privacyidea.lib.realm import (set_realm)
 from privacyidea.lib.user import User
+from privacyidea.lib.error import UserError
 from privacyidea.lib.token import init_token, remove_token
 from privacyidea.lib.policy import set_policy, delete_policy, SCOPE, ACTION
 from urllib.parse import urlencode
@@ -156,6 +158,67 @@ class APIUsersTestCase(MyApiTestCase):
             self.assertNotIn("cornelius", unames, value)
             self.assertNotIn("corny", unames, value)
 
+        # get the user list as a stream
+        with self.app.test_request_context('/user/',
+                                           query_string=urlencode({"realm": realm}),
+                                           method='GET',
+                                           headers={"Authorization": self.at}):
+            res = self.app.full_dispatch_request()
+            self.assertTrue(res.status_code == 200, res)
+            userlist = res.json.get("result").get("value")
+        with self.app.test_request_context('/user/',
+                                           query_string=urlencode({"realm": realm,
+                                                                   "stream": 1}),
+                                           method='GET',
+                                           headers={"Authorization": self.at}):
+            res = self.app.full_dispatch_request()
+            self.assertTrue(res.status_code == 200, res)
+            # The response signature needs the complete document
+            self.assertFalse(res.is_streamed)
+            result = res.json
+            self.assertTrue(result.get("result").get("status"), result)
+            self.assertEqual(result.get("result").get("value"), userlist)
+            self.assertIn("signature", result)
+        self.app.config["PI_NO_RESPONSE_SIGN"] = True
+        with self.app.test_request_context('/user/',
+                                           query_string=urlencode({"realm": realm,
+                                                                   "stream": 1}),
+                                           method='GET',
+                                           headers={"Authorization": self.at}):
+            res = self.app.full_dispatch_request()
+            self.assertTrue(res.status_code == 200, res)
+            self.assertTrue(res.is_streamed)
+            self.assertEqual(res.mimetype, "application/json")
+            result = json.loads(res.get_data(as_text=True))
+            self.assertTrue(result.get("result").get("status"), result)
+            self.assertEqual(result.get("result").get("value"), userlist)
+            self.assertNotIn("signature", result)
+        # The request is audited as successful after the list has been written
+        entry = self.find_most_recent_audit_entry(action="GET /user/")
+        self.assertEqual(entry.get("success"), 1, entry)
+
+        # An error while the list is written is reported in the document
+        def failing_user_list(param, custom_attributes=False):
+            yield userlist[0]
+            raise UserError("The resolver failed.")
+
+        with mock.patch("privacyidea.api.user.iter_user_list", failing_user_list):
+            with self.app.test_request_context('/user/',
+                                               query_string=urlencode({"realm": realm,
+                                                                       "stream": 1}),
+                                               method='GET',
+                                               headers={"Authorization": self.at}):
+                res = self.app.full_dispatch_request()
+                self.assertTrue(res.is_streamed)
+                result = json.loads(res.get_data(as_text=True))
+                self.assertFalse(result.get("result").get("status"), result)
+                self.assertEqual(result.get("result").get("value"), userlist[:1])
+                self.assertEqual(result.get("result").get("error").get("message"),
+                                 "ERR904: The resolver failed.")
+        entry = self.find_most_recent_audit_entry(action="GET /user/")
+        self.assertEqual(entry.get("success"), 0, entry)
+        self.app.config.pop("PI_NO_RESPONSE_SIGN")
+
     def test_02_create_update_delete_user(self):
         realm = "sqlrealm"
         resolver = "SQL1"
@@ -11,7 +11,9 @@ from privacyidea.lib.applications.luks import (MachineApplication as
                                                LUKSApplication)
 from privacyidea.lib.applications.offline import (MachineApplication as
                                                   OfflineApplication,
-                                                  REFILLTOKEN_LENGTH)
+                                                  REFILLTOKEN_LENGTH,
+                                                  OfflineOTPCache,
+                                                  get_offline_otp_cache)
 from privacyidea.lib.applications import (get_auth_item,
                                           is_application_allow_bulk_call,
                                           get_application_types)
@@ -179,6 +181,53 @@ class OfflineApplicationTestCase(MyTestCase):
                                                                "s")
         self.assertEqual(auth_item, {})
 
+    def test_04_parallel_hashing_and_precompute(self):
+        serial = "OATH2"
+        init_token({"serial": serial, "type": "hotp", "otpkey": OTPKEY})
+        tok = get_tokens(serial=serial)[0]
+        self.app.config["PI_OFFLINE_HASH_WORKERS"] = 4
+        self.app.config["PI_OFFLINE_PRECOMPUTE"] = True
+        try:
+            otps = OfflineApplication.get_offline_otps(tok, "pin", 5, 1000)
+            self.assertEqual(tok.token.count, 5)
+            self.assertEqual(len(otps), 5)
+            self.assertTrue(passlib.hash.pbkdf2_sha512.verify("pin" + self.valid_otp_values[0], otps[0]))
+            self.assertTrue(passlib.hash.pbkdf2_sha512.verify("pin" + self.valid_otp_values[4], otps[4]))
+            # The next five values have been precomputed
+            cache = get_offline_otp_cache()
+            with mock.patch("privacyidea.lib.applications.offline.hash_offline_otp") as mock_hash:
+                otps = OfflineApplication.get_offline_otps(tok, "pin", 3, 1000)
+                mock_hash.assert_not_called()
+            self.assertEqual(tok.token.count, 8)
+            self.assertTrue(passlib.hash.pbkdf2_sha512.verify("pin" + self.valid_otp_values[5], otps[5]))
+            self.assertTrue(passlib.hash.pbkdf2_sha512.verify("pin" + self.valid_otp_values[7], otps[7]))
+            # A different PIN does not use the precomputed values
+            otps = OfflineApplication.get_offline_otps(tok, "other", 1, 1000)
+            self.assertTrue(passlib.hash.pbkdf2_sha512.verify("other" + self.valid_otp_values[8], otps[8]))
+            cache.invalidate()
+        finally:
+            self.app.config.pop("PI_OFFLINE_HASH_WORKERS")
+            self.app.config.pop("PI_OFFLINE_PRECOMPUTE")
+
+    def test_05_offline_otp_cache(self):
+        cache = OfflineOTPCache(max_tokens=2)
+        cache.put("S1", 1, "pin123456", 1000, "hash1")
+        cache.put("S1", 2, "pin234567", 1000, "hash2")
+        cache.put("S1", 3, "pin345678", 1000, "hash3")
+        # wrong password or wrong rounds
+        self.assertIsNone(cache.pop("S1", 2, "pin000000", 1000))
+        self.assertIsNone(cache.pop("S1", 3, "pin345678", 2000))
+        cache.put("S1", 4, "pin456789", 1000, "hash4")
+        # The counter moved, so entry 3 is gone
+        self.assertEqual(cache.pop("S1", 4, "pin456789", 1000), "hash4")
+        self.assertIsNone(cache.pop("S1", 3, "pin345678", 1000))
+        # The least recently used token is evicted
+        cache.put("S1", 5, "pin5", 1000, "hash5")
+        cache.put("S2", 1, "pin1", 1000, "hash1")
+        cache.put("S3", 1, "pin1", 1000, "hash1")
+        self.assertIsNone(cache.pop("S1", 5, "pin5", 1000))
+        self.assertEqual(cache.pop("S3", 1, "pin1", 1000), "hash1")
+
 
 class BaseApplicationTestCase(MyTestCase):
 
@@ -5,6 +5,8 @@ This tests the files
 """
 import datetime
 import os
+import threading
+import time
 import types
 
 import sqlalchemy.engine
@@ -14,6 +16,7 @@ from privacyidea.config import TestingConfig
 from privacyidea.lib.audit import getAudit, search
 from privacyidea.lib.auditmodules.containeraudit import Audit as ContainerAudit
 from privacyidea.lib.auditmodules.loggeraudit import Audit as LoggerAudit
+from privacyidea.lib.auditmodules import sqlaudit
 from privacyidea.lib.auditmodules.sqlaudit import column_length
 from .base import MyTestCase, OverrideConfigTestCase
 from testfixtures import log_capture
@@ -345,6 +348,65 @@ class AuditTestCase(MyTestCase):
                          set(self.Audit.available_audit_columns),
                          audit_log.auditdata[0].keys())
 
+    def test_12_parallel_and_cached_verification(self):
+        for i in range(5):
+            self.Audit.log({"action": "test12", "serial": "S{0!s}".format(i)})
+            self.Audit.finalize_log()
+        self.app.config["PI_AUDIT_VERIFY_WORKERS"] = 2
+        self.app.config["PI_AUDIT_VERIFY_CACHE_SIZE"] = 3
+        try:
+            audit = getAudit(self.app.config)
+            with mock.patch("privacyidea.lib.auditmodules.sqlaudit._verify_signatures",
+                            wraps=sqlaudit._verify_signatures) as mock_verify:
+                audit_log = audit.search({"action": "test12"})
+                self.assertEqual([entry["sig_check"] for entry in audit_log.auditdata],
+                                 ["OK"] * 5)
+                # The entries are distributed on both workers
+                self.assertEqual(mock_verify.call_count, 2)
+                # The results of the last three entries are cached
+                mock_verify.reset_mock()
+                audit_log = audit.search({"action": "test12"}, sortorder="desc", page_size=3)
+                self.assertEqual([entry["sig_check"] for entry in audit_log.auditdata],
+                                 ["OK"] * 3)
+                mock_verify.assert_not_called()
+
+            # A modified entry is verified again
+            db_entry = next(audit.search_query({"serial": "S4"}))
+            db_entry.realm = "realm1"
+            audit.session.merge(db_entry)
+            audit.session.commit()
+            audit_log = audit.search({"serial": "S4"})
+            self.assertEqual(audit_log.auditdata[0]["sig_check"], "FAIL")
+
+            # The lazy search does not wait for the verification
+            release = threading.Event()
+            verify_signatures = sqlaudit._verify_signatures
+
+            def slow_verify_signatures(*args):
+                release.wait(5)
+                return verify_signatures(*args)
+
+            with mock.patch("privacyidea.lib.auditmodules.sqlaudit._verify_signatures",
+                            side_effect=slow_verify_signatures):
+                audit_log = audit.search({"action": "test12"}, sortorder="desc", page_size=3,
+                                         page=2, lazy_verify=True)
+                self.assertEqual([entry["sig_check"] for entry in audit_log.auditdata],
+                                 ["PENDING"] * 2)
+                release.set()
+            # The results of the background verification are returned later
+            for _i in range(50):
+                audit_log = search(self.app.config, {"action": "test12", "sortorder": "desc",
+                                                     "page_size": 3, "page": 2,
+                                                     "lazy_verify": "1"})
+                sig_checks = [entry["sig_check"] for entry in audit_log["auditdata"]]
+                if "PENDING" not in sig_checks:
+                    break
+                time.sleep(0.1)
+            self.assertEqual(sig_checks, ["OK"] * 2)
+        finally:
+            self.app.config.pop("PI_AUDIT_VERIFY_WORKERS")
+            self.app.config.pop("PI_AUDIT_VERIFY_CACHE_SIZE")
+
 
 class AuditColumnLengthTestCase(OverrideConfigTestCase):
     class Config(TestingConfig):
@@ -7,11 +7,13 @@ from .base import MyTestCase
 
 from privacyidea.lib.authcache import (add_to_cache, delete_from_cache,
                                        update_cache, verify_in_cache,
-                                       _hash_password,
+                                       _hash_password, get_memory_cache,
                                        cleanup)
 from passlib.hash import argon2
-from privacyidea.models import AuthCache
+from privacyidea.models import AuthCache, db
 import datetime
+import mock
+import time
 
 
 class AuthCacheTestCase(MyTestCase):
@@ -181,3 +183,87 @@ class AuthCacheTestCase(MyTestCase):
 
         auth = AuthCache.query.filter(AuthCache.username == self.username).first()
         self.assertEqual(auth, None)
+
+    def test_07_single_hash_verification(self):
+        cleanup(100000000)
+        for i in range(5):
+            add_to_cache(self.username, self.realm, self.resolver, "password{0!s}".format(i))
+        auth = AuthCache.query.filter(AuthCache.username == self.username).first()
+        self.assertEqual(len(auth.auth_digest), 64)
+        self.assertNotIn("password", auth.auth_digest)
+
+        with mock.patch("privacyidea.lib.authcache.argon2.verify",
+                        wraps=argon2.verify) as mock_verify:
+            # Only the entry of the password is verified
+            self.assertTrue(verify_in_cache(self.username, self.realm, self.resolver, "password3"))
+            self.assertEqual(mock_verify.call_count, 1)
+            # A wrong password does not verify any entry and deletes nothing else
+            self.assertFalse(verify_in_cache(self.username, self.realm, self.resolver, "wrong"))
+            self.assertEqual(mock_verify.call_count, 1)
+        self.assertEqual(AuthCache.query.filter(AuthCache.username == self.username).count(), 5)
+        # The same password of a different user does not match
+        self.assertFalse(verify_in_cache("other", self.realm, self.resolver, "password3"))
+
+        # Entries of older versions without a digest get the digest
+        ac_id = AuthCache("legacy", self.realm, self.resolver, _hash_password(self.password)).save()
+        self.assertTrue(verify_in_cache("legacy", self.realm, self.resolver, self.password))
+        auth = AuthCache.query.filter(AuthCache.id == ac_id).first()
+        self.assertEqual(len(auth.auth_digest), 64)
+        self.assertEqual(auth.auth_count, 1)
+        cleanup(100000000)
+
+    def test_08_memory_tier(self):
+        cleanup(100000000)
+        self.app.config["PI_AUTHCACHE_MEMORY_SIZE"] = 10
+        try:
+            ac_id = add_to_cache(self.username, self.realm, self.resolver, self.password)
+            first_auth = datetime.datetime.utcnow() - datetime.timedelta(hours=4)
+            self.assertTrue(verify_in_cache(self.username, self.realm, self.resolver,
+                                            self.password, first_auth=first_auth))
+            self.assertEqual(len(get_memory_cache()), 1)
+            # The following authentications are checked in memory
+            with mock.patch("privacyidea.lib.authcache.AuthCache") as mock_model:
+                self.assertTrue(verify_in_cache(self.username, self.realm, self.resolver,
+                                                self.password, first_auth=first_auth))
+                self.assertTrue(verify_in_cache(self.username, self.realm, self.resolver,
+                                                self.password, first_auth=first_auth))
+                mock_model.query.filter.assert_not_called()
+            self.assertEqual(AuthCache.query.filter(AuthCache.id == ac_id).first().auth_count, 1)
+            # ... and written back to the database after the write interval
+            now = time.monotonic()
+            with mock.patch("privacyidea.lib.authcache.time.monotonic", return_value=now + 11):
+                self.assertTrue(verify_in_cache(self.username, self.realm, self.resolver,
+                                                self.password, first_auth=first_auth))
+            auth = AuthCache.query.filter(AuthCache.id == ac_id).first()
+            db.session.refresh(auth)
+            self.assertEqual(auth.auth_count, 4)
+
+            # An entry, which was deleted by another process, is removed from memory
+            AuthCache.query.filter(AuthCache.id == ac_id).delete()
+            db.session.commit()
+            with mock.patch("privacyidea.lib.authcache.time.monotonic", return_value=now + 22):
+                self.assertFalse(verify_in_cache(self.username, self.realm, self.resolver,
+                                                 self.password, first_auth=first_auth))
+            self.assertEqual(len(get_memory_cache()), 0)
+
+            # Entries with a maximum number of authentications are not kept in memory
+            ac_id = add_to_cache(self.username, self.realm, self.resolver, self.password)
+            for _i in range(3):
+                self.assertTrue(verify_in_cache(self.username, self.realm, self.resolver,
+                                                self.password, first_auth=first_auth, max_auths=3))
+            self.assertEqual(len(get_memory_cache()), 0)
+            self.assertFalse(verify_in_cache(self.username, self.realm, self.resolver,
+                                             self.password, first_auth=first_auth, max_auths=3))
+            self.assertIsNone(AuthCache.query.filter(AuthCache.id == ac_id).first())
+
+            # The entry expires with the first_auth of the policy
+            add_to_cache(self.username, self.realm, self.resolver, self.password)
+            self.assertTrue(verify_in_cache(self.username, self.realm, self.resolver,
+                                            self.password, first_auth=first_auth))
+            self.assertFalse(verify_in_cache(self.username, self.realm, self.resolver,
+                                             self.password, first_auth=datetime.datetime.utcnow()))
+            self.assertEqual(len(get_memory_cache()), 0)
+        finally:
+            self.app.config.pop("PI_AUTHCACHE_MEMORY_SIZE")
+        self.assertIsNone(get_memory_cache())
+        cleanup(100000000)
@@ -0,0 +1,133 @@
+"""
+This tests the file lib/authcounter.py
+"""
+from datetime import timedelta
+
+import mock
+from flask import current_app
+
+from .base import MyTestCase, FakeFlaskG, FakeAudit
+from privacyidea.lib.authcounter import (get_buckets, get_auth_counter_store,
+                                         SQLAuthCounterStore, KeyValueAuthCounterStore)
+from privacyidea.lib.framework import get_app_local_store
+from privacyidea.lib.policy import set_policy, delete_policy, PolicyClass, SCOPE, ACTION
+from privacyidea.lib.policydecorators import auth_user_timelimit
+from privacyidea.lib.user import User
+from privacyidea.models import AuthCounter, db
+
+
+class AuthCounterTestCase(MyTestCase):
+
+    def test_00_get_buckets(self):
+        self.assertEqual(get_buckets(timedelta(seconds=20), now=1000), (1, 1000, 980))
+        self.assertEqual(get_buckets(timedelta(minutes=10), now=1000), (30, 33, 13))
+        self.assertEqual(get_buckets(timedelta(minutes=10), now=1019), (30, 33, 13))
+
+    def _check_store(self, store):
+        self.setUp_user_realms()
+        user = User("cornelius", self.realm1)
+        other_user = User("selfservice", self.realm1)
+        window = timedelta(minutes=10)
+        with mock.patch("privacyidea.lib.authcounter.time") as mock_time:
+            mock_time.time.return_value = 1000
+            self.assertEqual(store.count(user, False, window), 0)
+            for _i in range(3):
+                store.increment(user, False, window)
+            store.increment(user, True, window)
+            store.increment(other_user, False, window)
+            self.assertEqual(store.count(user, False, window), 3)
+            self.assertEqual(store.count(user, True, window), 1)
+            self.assertEqual(store.count(other_user, False, window), 1)
+
+            # the authentications move out of the window
+            mock_time.time.return_value = 1000 + 300
+            store.increment(user, False, window)
+            self.assertEqual(store.count(user, False, window), 4)
+            mock_time.time.return_value = 1000 + 630
+            self.assertEqual(store.count(user, False, window), 1)
+            mock_time.time.return_value = 1000 + 930
+            self.assertEqual(store.count(user, False, window), 0)
+
+            # a new bucket removes the old buckets of the user
+            mock_time.time.return_value = 1000 + 3600
+            store.increment(user, False, window)
+            self.assertEqual(store.count(user, False, window), 1)
+
+    def test_01_sql_store(self):
+        store = SQLAuthCounterStore()
+        self._check_store(store)
+        # only the new bucket and the buckets of the other counters are left
+        self.assertEqual(AuthCounter.query.filter_by(username="cornelius",
+                                                     success=False).count(), 1)
+        # Another request creates the bucket between the update and the insert
+        user = User("cornelius", self.realm1)
+        window = timedelta(minutes=10)
+        store.increment(user, True, window)
+        update_bucket = SQLAuthCounterStore._update
+        calls = []
+
+        def update_missing_bucket_once(*args):
+            calls.append(args)
+            return 0 if len(calls) == 1 else update_bucket(*args)
+
+        with mock.patch.object(SQLAuthCounterStore, "_update",
+                               side_effect=update_missing_bucket_once):
+            store.increment(user, True, window)
+        # The update is repeated after the failed insert
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(store.count(user, True, window), 2)
+        AuthCounter.query.delete()
+        db.session.commit()
+
+    def test_02_memory_store(self):
+        store = KeyValueAuthCounterStore()
+        self._check_store(store)
+        self.assertEqual(len(store.kv_store.keys("authcounter:")), 3)
+
+    def test_03_get_store(self):
+        get_app_local_store().pop("auth_counter_store", None)
+        self.assertIsNone(get_auth_counter_store())
+        get_app_local_store().pop("auth_counter_store", None)
+        current_app.config["PI_AUTH_COUNTER_STORE"] = "memory"
+        self.assertIsInstance(get_auth_counter_store(), KeyValueAuthCounterStore)
+        get_app_local_store().pop("auth_counter_store", None)
+        current_app.config["PI_AUTH_COUNTER_STORE"] = "privacyidea.lib.authcounter.SQLAuthCounterStore"
+        self.assertIsInstance(get_auth_counter_store(), SQLAuthCounterStore)
+        get_app_local_store().pop("auth_counter_store", None)
+        current_app.config.pop("PI_AUTH_COUNTER_STORE")
+
+    def test_04_auth_user_timelimit(self):
+        self.setUp_user_realms()
+        user = User("cornelius", self.realm1)
+        set_policy(name="pol_max_fail", scope=SCOPE.AUTHZ,
+                   action="{0!s}=2/1m".format(ACTION.AUTHMAXFAIL))
+        set_policy(name="pol_max_success", scope=SCOPE.AUTHZ,
+                   action="{0!s}=3/1m".format(ACTION.AUTHMAXSUCCESS))
+        g = FakeFlaskG()
+        g.policy_object = PolicyClass()
+        g.audit_object = FakeAudit()
+        options = {"g": g}
+        get_app_local_store()["auth_counter_store"] = KeyValueAuthCounterStore()
+
+        def check(result):
+            return lambda user_object, passw, options: (result, {})
+
+        # The audit log is not used
+        with mock.patch.object(FakeAudit, "get_count") as mock_count:
+            for _i in range(3):
+                res, _reply = auth_user_timelimit(check(True), user, "test", options)
+                self.assertTrue(res)
+            res, reply = auth_user_timelimit(check(True), user, "test", options)
+            self.assertFalse(res)
+            self.assertIn("Only 3 successful authentications", reply["message"])
+            # the denied authentication counts as failed
+            res, _reply = auth_user_timelimit(check(False), user, "test", options)
+            self.assertFalse(res)
+            res, reply = auth_user_timelimit(check(True), user, "test", options)
+            self.assertFalse(res)
+            self.assertIn("Only 2 failed authentications", reply["message"])
+            mock_count.assert_not_called()
+
+        get_app_local_store().pop("auth_counter_store")
+        delete_policy("pol_max_fail")
+        delete_policy("pol_max_success")
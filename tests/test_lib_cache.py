@@ -0,0 +1,60 @@
+"""
+This file tests the module lib.cache.lru
+"""
+import time
+
+import mock
+
+from privacyidea.lib.cache.lru import TTLLRUCache, MISSING
+from .base import MyTestCase
+
+
+class TTLLRUCacheTestCase(MyTestCase):
+
+    def test_01_get_set(self):
+        cache = TTLLRUCache(maxsize=3, ttl=60)
+        self.assertIs(cache.get("a"), MISSING)
+        self.assertIsNone(cache.get("a", None))
+        cache.set("a", 1)
+        cache.set("b", "")
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("b"), "")
+        self.assertIn("a", cache)
+        self.assertEqual(len(cache), 2)
+        cache.delete("a")
+        self.assertNotIn("a", cache)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        statistics = cache.get_statistics()
+        self.assertEqual(statistics["hits"], 2)
+        self.assertEqual(statistics["misses"], 2)
+
+    def test_02_evict_least_recently_used(self):
+        cache = TTLLRUCache(maxsize=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        # "a" is used, so "b" is the least recently used entry
+        self.assertEqual(cache.get("a"), 1)
+        cache.set("c", 3)
+        self.assertNotIn("b", cache)
+        self.assertIn("a", cache)
+        self.assertIn("c", cache)
+        self.assertEqual(cache.get_statistics()["evictions"], 1)
+        # updating an entry does not evict anything
+        cache.set("a", 4)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get("a"), 4)
+
+    def test_03_expiration(self):
+        cache = TTLLRUCache(maxsize=10, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2, ttl=5)
+        now = time.monotonic()
+        with mock.patch('privacyidea.lib.cache.lru.time.monotonic') as mock_monotonic:
+            mock_monotonic.return_value = now + 10
+            self.assertIs(cache.get("b"), MISSING)
+            self.assertEqual(cache.get("a"), 1)
+            mock_monotonic.return_value = now + 61
+            self.assertIs(cache.get("a"), MISSING)
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.get_statistics()["expirations"], 2)
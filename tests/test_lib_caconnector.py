@@ -27,6 +27,7 @@ from privacyidea.lib.caconnector import (get_caconnector_list,
                                          get_caconnector_types,
                                          save_caconnector, delete_caconnector)
 from privacyidea.lib.caconnectors.baseca import AvailableCAConnectors
+from privacyidea.lib.framework import get_app_local_store
 from .mscamock import CAServiceMock
 
 
@@ -202,6 +203,31 @@ class CAConnectorTestCase(MyTestCase):
         caobj = get_caconnector_object("not-existing")
         self.assertEqual(caobj, None)
 
+    def test_04_cached_caconnector_object(self):
+        save_caconnector({"caconnector": "cachedCA",
+                          "type": "local",
+                          "cakey": "/opt/ca/key.pem",
+                          "cacert": "/opt/ca/cert.pem",
+                          "Password": "secret",
+                          "type.Password": "password"})
+        ca_obj = get_caconnector_object("cachedCA", cached=True)
+        self.assertIs(get_caconnector_object("cachedCA", cached=True), ca_obj)
+        # The cache does not contain the decrypted password
+        c_objects = get_app_local_store()["caconnector_objects"]
+        self.assertNotIn("secret", repr(c_objects))
+        # Changing the CA connector removes the object from the cache
+        save_caconnector({"caconnector": "cachedCA",
+                          "type": "local",
+                          "cakey": "/opt/ca/key2.pem"})
+        self.assertNotIn("cachedca", c_objects)
+        ca_obj2 = get_caconnector_object("cachedCA", cached=True)
+        self.assertIsNot(ca_obj2, ca_obj)
+        self.assertIs(get_caconnector_object("cachedCA", cached=True), ca_obj2)
+        # Deleting the CA connector removes the object from the cache
+        delete_caconnector("cachedCA")
+        self.assertNotIn("cachedca", c_objects)
+        self.assertIsNone(get_caconnector_object("cachedCA", cached=True))
+
 
 class LocalCATestCase(MyTestCase):
     """
@@ -5,11 +5,19 @@ This tests the token functions on an interface level
 """
 from .base import MyTestCase
 from privacyidea.lib.error import (TokenAdminError, ParameterError)
-from privacyidea.lib.challenge import get_challenges, extract_answered_challenges
+import mock
+import json
+import time
+from privacyidea.lib.challenge import (get_challenges, extract_answered_challenges,
+                                       get_challenge_store, get_challenges_paginate,
+                                       KeyValueChallengeStore, LocalKeyValueStore,
+                                       BaseChallengeStore)
+from privacyidea.lib.framework import get_app_local_store
 from privacyidea.lib.policy import (set_policy, delete_policy, SCOPE,
                                     ACTION)
 from privacyidea.models import Challenge, db
 from privacyidea.lib.token import init_token
+import datetime
 from privacyidea.lib import _
 
 
@@ -71,3 +79,136 @@ class ChallengeTestCase(MyTestCase):
         self.assertEqual(len(challenges), 2)
         self.assertEqual(len(answered), 1)
         self.assertEqual(answered[0].transaction_id, transaction_id1)
+
+    def test_03_local_key_value_store(self):
+        kv_store = LocalKeyValueStore()
+        kv_store.set("key1", "value1", 100)
+        kv_store.set("key2", "value2", 100)
+        self.assertEqual(kv_store.get("key1"), "value1")
+        self.assertEqual(sorted(kv_store.keys("key")), ["key1", "key2"])
+        self.assertEqual(kv_store.update("key1", lambda v: v + "x", lambda v: 100), "value1x")
+        self.assertEqual(kv_store.get("key1"), "value1x")
+        kv_store.update("key1", lambda v: None, lambda v: 100)
+        self.assertIsNone(kv_store.get("key1"))
+        kv_store.delete("key2")
+        self.assertEqual(kv_store.keys(), [])
+        # expired entries are not returned and are removed during the next write
+        with mock.patch("privacyidea.lib.challenge.time.monotonic") as mock_time:
+            mock_time.return_value = 1000
+            kv_store.set("key3", "value3", 10)
+            mock_time.return_value = 1011
+            self.assertIsNone(kv_store.get("key3"))
+            self.assertEqual(kv_store.keys(), [])
+            kv_store.set("key4", "value4", 10)
+        self.assertEqual(list(kv_store._entries), ["key4"])
+
+    def test_04_memory_challenge_store(self):
+        self.app.config["PI_CHALLENGE_STORE"] = "memory"
+        get_app_local_store().pop("challenge_store", None)
+        set_policy("chalresp", scope=SCOPE.AUTHZ,
+                   action="{0!s}=hotp".format(ACTION.CHALLENGERESPONSE))
+        try:
+            store = get_challenge_store()
+            self.assertIsInstance(store, KeyValueChallengeStore)
+            token = init_token({"otpkey": self.otpkey, "serial": "CHAL3", "pin": "pin"})
+            from privacyidea.lib.token import check_serial_pass
+            r = check_serial_pass("CHAL3", "pin")
+            self.assertFalse(r[0])
+            transaction_id = r[1].get("transaction_id")
+            r = check_serial_pass("CHAL3", "pin")
+            transaction_id2 = r[1].get("transaction_id")
+            # The challenges are not written to the database
+            self.assertEqual(Challenge.query.filter_by(serial="CHAL3").count(), 0)
+            chals = get_challenges(serial="CHAL3")
+            self.assertEqual([c.transaction_id for c in chals], [transaction_id, transaction_id2])
+            self.assertTrue(chals[0].is_valid())
+            self.assertEqual(len(get_challenges(transaction_id=transaction_id)), 1)
+            self.assertEqual(get_challenges(serial="CHAL3", challenge="nothing"), [])
+            paginated = get_challenges_paginate(serial="CHAL*", sortdir="desc", psize=1)
+            self.assertEqual(paginated["count"], 2)
+            self.assertEqual(paginated["next"], 2)
+            self.assertEqual(paginated["challenges"][0]["transaction_id"], transaction_id2)
+
+            # A wrong response is counted in the store
+            r = check_serial_pass("CHAL3", "287081", options={"transaction_id": transaction_id})
+            self.assertFalse(r[0])
+            self.assertEqual(get_challenges(transaction_id=transaction_id)[0].received_count, 1)
+            # The right response deletes the challenges of the transaction
+            r = check_serial_pass("CHAL3", self.valid_otp_values[1],
+                                  options={"transaction_id": transaction_id})
+            self.assertTrue(r[0])
+            self.assertEqual(get_challenges(transaction_id=transaction_id), [])
+            self.assertEqual(len(get_challenges(serial="CHAL3")), 1)
+
+            # The challenges expire without a cleanup
+            later = time.monotonic() + 121
+            with mock.patch("privacyidea.lib.challenge.time.monotonic") as mock_time:
+                mock_time.return_value = later
+                self.assertEqual(get_challenges(serial="CHAL3"), [])
+            token.delete_token()
+        finally:
+            delete_policy("chalresp")
+            self.app.config.pop("PI_CHALLENGE_STORE")
+            get_app_local_store().pop("challenge_store", None)
+
+    def test_05_challenge_store_ids_and_deletion(self):
+        # The interface can not be instantiated
+        self.assertRaises(TypeError, BaseChallengeStore)
+        # Two processes, which share the key-value store, count the ids in the store
+        kv_store = LocalKeyValueStore()
+        store1 = KeyValueChallengeStore(kv_store)
+        store2 = KeyValueChallengeStore(kv_store)
+        chal1 = Challenge("CHAL5", transaction_id="t1", challenge="c1")
+        chal2 = Challenge("CHAL5", transaction_id="t1", challenge="c2")
+        chal3 = Challenge("CHAL6", transaction_id="t2", challenge="c3")
+        self.assertEqual(store1.save(chal1), 1)
+        self.assertEqual(store2.save(chal2), 2)
+        self.assertEqual(store1.save(chal3), 3)
+        self.assertEqual([c.challenge for c in store2.find(transaction_id="t1")], ["c1", "c2"])
+        self.assertEqual(kv_store.keys("challenge:"), ["challenge:t1", "challenge:t2"])
+
+        # The transaction is removed from the index of the token with its last challenge
+        chal4 = Challenge("CHAL6", transaction_id="t4", challenge="c4")
+        store1.save(chal4)
+        self.assertEqual(len(json.loads(kv_store.get("serial:CHAL6"))), 2)
+        store2.delete(chal4)
+        self.assertEqual([t["transaction_id"] for t in json.loads(kv_store.get("serial:CHAL6"))],
+                         ["t2"])
+        store1.delete(chal1)
+        self.assertEqual(len(json.loads(kv_store.get("serial:CHAL5"))), 1)
+        store1.save(chal1)
+
+        # Delete the challenges of a token
+        store2.delete_serial("CHAL5")
+        self.assertEqual(store1.find(serial="CHAL5"), [])
+        self.assertEqual(len(store1.find(serial="CHAL6")), 1)
+
+        # Delete the old and the expired challenges
+        created_before = datetime.datetime.utcnow() + datetime.timedelta(minutes=1)
+        self.assertEqual(store1.delete_expired(created_before=created_before, dryrun=True), 1)
+        self.assertEqual(len(store1.find()), 1)
+        self.assertEqual(store1.delete_expired(), 0)
+        self.assertEqual(store1.delete_expired(created_before=created_before), 1)
+        self.assertEqual(store1.find(), [])
+
+    def test_06_delete_token_challenges(self):
+        set_policy("chalresp", scope=SCOPE.AUTHZ,
+                   action="{0!s}=hotp".format(ACTION.CHALLENGERESPONSE))
+        token = init_token({"otpkey": self.otpkey, "serial": "CHAL7", "pin": "pin"})
+        from privacyidea.lib.token import check_serial_pass
+        self.assertFalse(check_serial_pass("CHAL7", "pin")[0])
+        self.assertEqual(len(get_challenges(serial="CHAL7")), 1)
+        # The challenges of a deleted token are deleted from the store
+        with mock.patch.object(get_challenge_store(), "delete_serial",
+                               wraps=get_challenge_store().delete_serial) as mock_delete:
+            token.delete_token()
+            mock_delete.assert_called_once_with("CHAL7")
+        self.assertEqual(get_challenges(serial="CHAL7"), [])
+
+        # Expired challenges are deleted by the store
+        Challenge("CHAL8", transaction_id="t8", challenge="c8", validitytime=-10).save()
+        store = get_challenge_store()
+        self.assertEqual(store.delete_expired(dryrun=True), 1)
+        self.assertEqual(store.delete_expired(), 1)
+        self.assertEqual(get_challenges(serial="CHAL8"), [])
+        delete_policy("chalresp")
@@ -5,10 +5,15 @@ import mock
 from datetime import datetime, timedelta
 from contextlib import contextmanager
 
-from privacyidea.models import ClientApplication
+from sqlalchemy.exc import IntegrityError
+from privacyidea.models import ClientApplication, db
 from .base import MyTestCase
 from privacyidea.lib.clientapplication import (get_clientapplication,
-                                               save_clientapplication)
+                                               save_clientapplication,
+                                               flush_clientapplications,
+                                               LastSeenTable,
+                                               _write_clientapplications)
+from privacyidea.lib.framework import get_app_local_store
 
 
 class ClientApplicationTestCase(MyTestCase):
@@ -124,4 +129,77 @@ class ClientApplicationTestCase(MyTestCase):
         self.assertIn({"clienttype": "RADIUS", "hostname": None, "lastseen": t2}, apps["1.2.3.4"])
         self.assertEqual(apps["2.3.4.5"], [{"clienttype": "PAM", "hostname": None, "lastseen": t1}])
 
-
+    def test_03_last_seen_table(self):
+        ClientApplication.query.delete()
+        db.session.commit()
+        self.app.config["PI_CLIENTAPPLICATION_RESOLUTION"] = 60
+        try:
+            save_clientapplication("1.2.3.4", "PAM")
+            save_clientapplication("1.2.3.4", "PAM")
+            save_clientapplication("1.2.3.4", "RADIUS")
+            # Nothing is written within the resolution interval
+            self.assertEqual(ClientApplication.query.count(), 0)
+            self.assertEqual(flush_clientapplications(force=True), 2)
+            self.assertEqual(ClientApplication.query.count(), 2)
+            t1 = ClientApplication.query.filter_by(ip="1.2.3.4", clienttype="PAM").one().lastseen
+            # A client, that is seen again, is updated
+            save_clientapplication("1.2.3.4", "PAM")
+            save_clientapplication("2.3.4.5", "PAM")
+            # ... but not within the resolution interval
+            self.assertEqual(flush_clientapplications(), 1)
+            self.assertEqual(ClientApplication.query.count(), 3)
+            # get_clientapplication writes all pending clients
+            apps = get_clientapplication(clienttype="PAM")
+            self.assertEqual(len(apps["PAM"]), 2)
+            self.assertGreaterEqual(
+                ClientApplication.query.filter_by(ip="1.2.3.4", clienttype="PAM").one().lastseen, t1)
+            self.assertEqual(flush_clientapplications(force=True), 0)
+        finally:
+            self.app.config.pop("PI_CLIENTAPPLICATION_RESOLUTION")
+            get_app_local_store().pop("clientapplication_table")
+
+    def test_04_last_seen_resolution(self):
+        table = LastSeenTable(resolution=60)
+        now = datetime.now()
+        table.add("1.2.3.4", "PAM", now - timedelta(seconds=2))
+        table.add("1.2.3.4", "PAM", now)
+        self.assertFalse(table.needs_flush())
+        self.assertEqual(table.pop_pending(), {("1.2.3.4", "PAM"): now})
+        table.add("1.2.3.4", "PAM", now)
+        self.assertEqual(table.pop_pending(), {})
+        with mock.patch("privacyidea.lib.clientapplication.time.monotonic",
+                        return_value=table._last_flush + 61):
+            self.assertTrue(table.needs_flush())
+            self.assertEqual(table.pop_pending(), {("1.2.3.4", "PAM"): now})
+
+    def test_05_flush_conflicts(self):
+        ClientApplication.query.delete()
+        db.session.commit()
+        self.app.config["PI_CLIENTAPPLICATION_RESOLUTION"] = 60
+        calls = []
+
+        def conflicting_write(connection, node, pending):
+            # Another process inserts the clients of the first bulk write
+            calls.append(pending)
+            if len(calls) == 1:
+                raise IntegrityError("INSERT", {}, Exception("caix"))
+            _write_clientapplications(connection, node, pending)
+
+        try:
+            save_clientapplication("1.2.3.4", "PAM")
+            save_clientapplication("2.3.4.5", "PAM")
+            with mock.patch("privacyidea.lib.clientapplication._write_clientapplications",
+                            side_effect=conflicting_write):
+                self.assertEqual(flush_clientapplications(force=True), 2)
+            # The clients are written one by one after the failed bulk write
+            self.assertEqual([len(pending) for pending in calls], [2, 1, 1])
+            # The session of the caller is not committed
+            db.session.add(ClientApplication(ip="3.4.5.6", clienttype="PAM", node="Node1"))
+            save_clientapplication("4.5.6.7", "PAM")
+            self.assertEqual(flush_clientapplications(force=True), 1)
+            db.session.rollback()
+            self.assertEqual(ClientApplication.query.count(), 3)
+            self.assertIsNone(ClientApplication.query.filter_by(ip="3.4.5.6").first())
+        finally:
+            self.app.config.pop("PI_CLIENTAPPLICATION_RESOLUTION")
+            get_app_local_store().pop("clientapplication_table")
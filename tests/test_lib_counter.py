@@ -2,12 +2,15 @@
 This tests the files
   lib/counter.py
 """
+import datetime
 import mock
 from contextlib import contextmanager
 
 from .base import MyTestCase
 from privacyidea.lib.counter import increase, decrease, reset, read
-from privacyidea.models import EventCounter
+from privacyidea.lib.framework import get_app_local_store
+from privacyidea.lib.monitoringstats import flush_stats
+from privacyidea.models import EventCounter, db
 
 
 def increase_and_read(name):
@@ -152,4 +155,100 @@ class CounterTestCase(MyTestCase):
         reset("ctrB")
         self.assertEqual(read("ctrB"), 0)
         self.assertEqual(EventCounter.query.filter_by(counter_name="ctrB", node="node1").one().counter_value, 0)
-        self.assertEqual(EventCounter.query.filter_by(counter_name="ctrB", node="node2").one().counter_value, 0)
\ No newline at end of file
+        self.assertEqual(EventCounter.query.filter_by(counter_name="ctrB", node="node2").one().counter_value, 0)
+
+    def test_06_buffered_increments(self):
+        self.app.config["PI_MONITORING_BUFFER"] = True
+        try:
+            for _ in range(3):
+                increase("buffered_ctr")
+            decrease("buffered_ctr", allow_negative=True)
+            # The counter is not written yet, but read returns the buffered value
+            self.assertEqual(EventCounter.query.filter_by(counter_name="buffered_ctr").count(), 0)
+            self.assertEqual(read("buffered_ctr"), 2)
+            flush_stats()
+            counter = EventCounter.query.filter_by(counter_name="buffered_ctr").one()
+            self.assertEqual(counter.counter_value, 2)
+            # decrease without allow_negative writes the buffer first
+            increase("buffered_ctr")
+            decrease("buffered_ctr")
+            self.assertEqual(read("buffered_ctr"), 2)
+            self.assertEqual(EventCounter.query.filter_by(counter_name="buffered_ctr").one().counter_value, 2)
+            # reset discards the buffered increments
+            increase("buffered_ctr")
+            reset("buffered_ctr")
+            self.assertEqual(read("buffered_ctr"), 0)
+            flush_stats()
+            self.assertEqual(read("buffered_ctr"), 0)
+            # Another process resets the counter after the increments were counted
+            increase("buffered_ctr")
+            EventCounter.query.filter_by(counter_name="buffered_ctr").update(
+                {"last_reset": datetime.datetime.utcnow()})
+            # Increments, which were counted after the reset, are kept
+            increase("buffered_ctr")
+            increase("buffered_ctr")
+            self.assertEqual(get_app_local_store()["stats_buffer"].get_increment("buffered_ctr"), 3)
+            flush_stats()
+            self.assertEqual(read("buffered_ctr"), 2)
+        finally:
+            self.app.config.pop("PI_MONITORING_BUFFER")
+            get_app_local_store().pop("stats_buffer")
+
+    def test_07_sharded_counter(self):
+        self.app.config["PI_COUNTER_SHARDS"] = 4
+        try:
+            increase("sharded_ctr")
+            increase("sharded_ctr")
+            # The current thread always writes to the same shard
+            rows = EventCounter.query.filter_by(counter_name="sharded_ctr").all()
+            self.assertEqual(len(rows), 1)
+            self.assertRegex(rows[0].node, r"^Node1#[0-3]$")
+            # Another shard of the same node
+            shard_node = "Node1#5" if rows[0].node != "Node1#5" else "Node1#6"
+            EventCounter("sharded_ctr", 3, node=shard_node)
+            self.assertEqual(read("sharded_ctr"), 5)
+            decrease("sharded_ctr")
+            self.assertEqual(read("sharded_ctr"), 4)
+            reset("sharded_ctr")
+            self.assertEqual(read("sharded_ctr"), 0)
+            self.assertEqual(EventCounter.query.filter_by(counter_name="sharded_ctr").count(), 2)
+        finally:
+            self.app.config.pop("PI_COUNTER_SHARDS")
+
+    def test_08_cached_read(self):
+        self.app.config["PI_COUNTER_READ_CACHE"] = 60
+        try:
+            self.assertEqual(increase_and_read("cached_ctr"), 1)
+            # A change of another node is not visible ...
+            EventCounter("cached_ctr", 5, node="otherNode")
+            self.assertEqual(read("cached_ctr"), 1)
+            # ... but changes of the current process are
+            self.assertEqual(increase_and_read("cached_ctr"), 2)
+            self.assertEqual(read("cached_ctr", cached=False), 7)
+            self.assertEqual(read("cached_ctr"), 7)
+            reset("cached_ctr")
+            self.assertEqual(read("cached_ctr"), 0)
+        finally:
+            self.app.config.pop("PI_COUNTER_READ_CACHE")
+            get_app_local_store().pop("counter_read_cache")
+
+    def test_09_concurrent_creation(self):
+        # Another request creates the counter row between the update and the insert
+        increase("race_ctr")
+        query_update = EventCounter.query.__class__.update
+        calls = []
+
+        def update_missing_row_once(query, *args, **kwargs):
+            calls.append(query)
+            return 0 if len(calls) == 1 else query_update(query, *args, **kwargs)
+
+        # Uncommitted changes of the request are not rolled back by the failed insert
+        db.session.execute(EventCounter.__table__.insert().values(
+            counter_name="race_other", counter_value=7, node="otherNode"))
+        with mock.patch.object(EventCounter.query.__class__, "update", autospec=True,
+                               side_effect=update_missing_row_once) as mock_update:
+            increase("race_ctr")
+            # The update is repeated after the failed insert
+            self.assertEqual(mock_update.call_count, 2)
+        self.assertEqual(read("race_ctr"), 2)
+        self.assertEqual(read("race_other"), 7)
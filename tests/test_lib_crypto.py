@@ -1,8 +1,14 @@
 """
 This test file tests the lib.crypto and lib.security.default
 """
+import mock
 from mock import call
 import binascii
+import os
+import shutil
+import tempfile
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519
 
 from privacyidea.config import TestingConfig
 from privacyidea.lib.error import HSMException
@@ -15,7 +21,10 @@ from privacyidea.lib.crypto import (encryptPin, encryptPassword, decryptPin,
                                     verify_with_pepper, aes_encrypt_b64, aes_decrypt_b64,
                                     get_hsm, init_hsm, set_hsm_password, hash,
                                     encrypt, decrypt, Sign, generate_keypair,
-                                    generate_password, pass_hash, verify_pass_hash)
+                                    generate_password, pass_hash, verify_pass_hash,
+                                    get_pass_context, get_pass_hash_executor,
+                                    verify_pass_hashes, forget_pass_hashes,
+                                    get_sign_object, SIGNATURE)
 from privacyidea.lib.utils import to_bytes, to_unicode
 from privacyidea.lib.security.default import (SecurityModule,
                                               DefaultSecurityModule)
@@ -702,6 +711,65 @@ class SignObjectTestCase(MyTestCase):
         long_data = b'\x01\x02' * 5000
         self.assertTrue(so.verify(long_data, long_data_sig, verify_old_sigs=True))
 
+    def test_02_ed25519_and_ecdsa(self):
+        rsa_priv_key = open(current_app.config.get("PI_AUDIT_KEY_PRIVATE"), 'rb').read()
+        rsa_pub_key = open(current_app.config.get("PI_AUDIT_KEY_PUBLIC"), 'rb').read()
+        rsa_so = Sign(rsa_priv_key, rsa_pub_key)
+        rsa_sig = rsa_so.sign('short text')
+        for private_key, sig_ver in [(ed25519.Ed25519PrivateKey.generate(), SIGNATURE.ED25519),
+                                     (ec.generate_private_key(ec.SECP256R1()), SIGNATURE.ECDSA)]:
+            priv_key = private_key.private_bytes(encoding=serialization.Encoding.PEM,
+                                                 format=serialization.PrivateFormat.PKCS8,
+                                                 encryption_algorithm=serialization.NoEncryption())
+            pub_key = private_key.public_key().public_bytes(
+                encoding=serialization.Encoding.PEM,
+                format=serialization.PublicFormat.SubjectPublicKeyInfo)
+            so = Sign(priv_key, pub_key)
+            self.assertEqual(so.sig_ver, sig_ver)
+            sig = so.sign('short text')
+            self.assertTrue(sig.startswith(sig_ver + ':'), sig)
+            self.assertTrue(so.verify('short text', sig))
+            self.assertTrue(Sign(public_key=pub_key).verify('short text', sig))
+            self.assertFalse(so.verify('other text', sig))
+            # signatures of other key types are not valid
+            self.assertFalse(so.verify('short text', rsa_sig))
+            self.assertFalse(rsa_so.verify('short text', sig))
+
+    def test_03_get_sign_object(self):
+        tmpdir = tempfile.mkdtemp()
+        priv_file = os.path.join(tmpdir, "private.pem")
+        pub_file = os.path.join(tmpdir, "public.pem")
+        shutil.copy(current_app.config.get("PI_AUDIT_KEY_PRIVATE"), priv_file)
+        shutil.copy(current_app.config.get("PI_AUDIT_KEY_PUBLIC"), pub_file)
+        try:
+            so = get_sign_object(priv_file, pub_file)
+            self.assertEqual(so.sig_ver, SIGNATURE.RSA)
+            # The keys are only loaded once
+            self.assertIs(get_sign_object(priv_file, pub_file), so)
+            self.assertIsNot(get_sign_object(priv_file, pub_file, check_private_key=False), so)
+            self.assertIsNot(get_sign_object(priv_file), so)
+
+            # The keys are loaded again, if the files change
+            private_key = ed25519.Ed25519PrivateKey.generate()
+            with open(priv_file, "wb") as f:
+                f.write(private_key.private_bytes(encoding=serialization.Encoding.PEM,
+                                                  format=serialization.PrivateFormat.PKCS8,
+                                                  encryption_algorithm=serialization.NoEncryption()))
+            with open(pub_file, "wb") as f:
+                f.write(private_key.public_key().public_bytes(
+                    encoding=serialization.Encoding.PEM,
+                    format=serialization.PublicFormat.SubjectPublicKeyInfo))
+            so2 = get_sign_object(priv_file, pub_file)
+            self.assertIsNot(so2, so)
+            self.assertEqual(so2.sig_ver, SIGNATURE.ED25519)
+            self.assertTrue(so2.verify("data", so2.sign("data")))
+
+            # missing key files raise an error
+            os.remove(pub_file)
+            self.assertRaises(IOError, get_sign_object, priv_file, pub_file)
+        finally:
+            shutil.rmtree(tmpdir)
+
 
 class DefaultHashAlgoListTestCase(MyTestCase):
     """Check if the default hash algorithm list is used."""
@@ -727,6 +795,57 @@ class DefaultHashAlgoListTestCase(MyTestCase):
         self.assertFalse(verify_pass_hash(password, argon2_fail_hash))
 
 
+class PassContextTestCase(MyTestCase):
+    """Check the caching of the hash context and the parallel verification."""
+
+    def test_01_cached_pass_context(self):
+        pass_ctx = get_pass_context()
+        self.assertIs(get_pass_context(), pass_ctx)
+        # The context is rebuilt, if the config changes
+        current_app.config["PI_HASH_ALGO_PARAMS"] = {'argon2__rounds': 2}
+        try:
+            pass_ctx2 = get_pass_context()
+            self.assertIsNot(pass_ctx2, pass_ctx)
+            self.assertIs(get_pass_context(), pass_ctx2)
+            self.assertIn('t=2', pass_hash("password").split('$')[3])
+        finally:
+            current_app.config.pop("PI_HASH_ALGO_PARAMS")
+        self.assertIn('t=9', pass_hash("password").split('$')[3])
+        current_app.config["PI_HASH_ALGO_LIST"] = ['pbkdf2_sha512']
+        try:
+            self.assertTrue(pass_hash("password").startswith('$pbkdf2-sha512$'))
+        finally:
+            current_app.config.pop("PI_HASH_ALGO_LIST")
+        self.assertTrue(pass_hash("password").startswith('$argon2'))
+
+    def test_02_verify_pass_hashes(self):
+        hash1 = pass_hash("pin1")
+        hash2 = pass_hash("pin2")
+        candidates = [("pin1", hash1), ("pin2", hash1), ("pin2", hash2),
+                      ("pin1", None), ("pin1", "unknown hash format")]
+        self.assertIsNone(get_pass_hash_executor())
+        results = verify_pass_hashes(candidates)
+        self.assertEqual(results, {("pin1", hash1): True,
+                                   ("pin2", hash1): False,
+                                   ("pin2", hash2): True})
+
+        current_app.config["PI_PIN_VERIFY_WORKERS"] = 3
+        try:
+            self.assertIsNotNone(get_pass_hash_executor())
+            self.assertEqual(verify_pass_hashes(candidates), results)
+            # The results are used by verify_pass_hash
+            with mock.patch.object(get_pass_context(), "verify") as mock_verify:
+                self.assertTrue(verify_pass_hash("pin1", hash1))
+                self.assertFalse(verify_pass_hash("pin2", hash1))
+                mock_verify.assert_not_called()
+            forget_pass_hashes()
+            with mock.patch.object(get_pass_context(), "verify", return_value=True) as mock_verify:
+                self.assertTrue(verify_pass_hash("pin2", hash1))
+                mock_verify.assert_called_once_with("pin2", hash1)
+        finally:
+            current_app.config.pop("PI_PIN_VERIFY_WORKERS")
+
+
 class CustomParamsDefaultHashAlgoListTestCase(OverrideConfigTestCase):
     """Check if the default hash algorithm list is used with params from config."""
 
@@ -4,7 +4,8 @@ This file contains the tests for the lifecycle module lib/lifecycle.py
 import json
 from mock import mock
 
-from privacyidea.lib.lifecycle import register_finalizer, call_finalizers
+from privacyidea.lib.lifecycle import (register_finalizer, call_finalizers,
+                                       finalizer_scope, finalizers_are_called)
 from .base import MyTestCase
 
 
@@ -70,3 +71,15 @@ class LifecycleTestCase(MyTestCase):
         finalizer1.assert_called_once()
         finalizer2.assert_called_once()
 
+    def test_04_finalizer_scope(self):
+        finalizer = mock.MagicMock()
+        # Without a request context finalizers are only called in a scope
+        self.assertFalse(finalizers_are_called())
+        with finalizer_scope():
+            self.assertTrue(finalizers_are_called())
+            with finalizer_scope():
+                register_finalizer(finalizer)
+            # The finalizers are called at the end of the outermost scope
+            finalizer.assert_not_called()
+        finalizer.assert_called_once()
+        self.assertFalse(finalizers_are_called())
@@ -169,4 +169,30 @@ class LdapMachineTestCase(MyTestCase):
         # We check that all Server objects were constructed with a non-None TLS context and use_ssl=True
         for _, kwargs in ldap3mock.get_server_mock().call_args_list:
             self.assertIsNotNone(kwargs['tls'])
-            self.assertTrue(kwargs['use_ssl'])
\ No newline at end of file
+            self.assertTrue(kwargs['use_ssl'])
+    @ldap3mock.activate
+    def test_10_cache(self):
+        ldap3mock.setLDAPDirectory(LDAPDirectory)
+        config = MYCONFIG.copy()
+        config["LDAPURI"] = "ldap://cache.example.test"
+        config["CACHE_TIMEOUT"] = "120"
+        cached_resolver = LdapMachineResolver("cachedResolver", config=config)
+        machines = cached_resolver.get_machines(hostname="machine1.example.test")
+        self.assertEqual(len(machines), 1)
+
+        # The search result is read from the cache, even by a new resolver object
+        ldap3mock.setLDAPDirectory(LDAPDirectory[:1])
+        cached_resolver = LdapMachineResolver("cachedResolver", config=config)
+        self.assertEqual(cached_resolver.get_machine_id(hostname="machine1.example.test"),
+                         "cn=machine1,ou=example,o=test")
+        # other searches are not cached
+        self.assertEqual(cached_resolver.get_machines(), [])
+        statistics = cached_resolver._get_cache().get_statistics()
+        self.assertEqual(statistics["hits"], 1)
+        self.assertEqual(statistics["misses"], 2)
+
+        # Without a cache timeout the directory is searched each time
+        config["CACHE_TIMEOUT"] = "0"
+        uncached_resolver = LdapMachineResolver("cachedResolver", config=config)
+        self.assertEqual(uncached_resolver.get_machines(hostname="machine1.example.test"), [])
+        cached_resolver._get_cache().clear()
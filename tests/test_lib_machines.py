@@ -8,9 +8,13 @@ lib.machines.hosts
 """
 
 HOSTSFILE = "tests/testdata/hosts"
+import mock
+import os
+import shutil
+import tempfile
 from .base import MyTestCase
 from privacyidea.lib.machines import BaseMachineResolver
-from privacyidea.lib.machines.hosts import HostsMachineResolver
+from privacyidea.lib.machines.hosts import HostsMachineResolver, get_hosts_file_index
 from privacyidea.lib.machines.base import Machine, MachineResolverError
 import netaddr
 from privacyidea.lib.machineresolver import (get_resolver_list, save_resolver,
@@ -225,3 +229,36 @@ class HostsMachineTestCase(MyTestCase):
         self.assertRaises(MachineResolverError,
                           self.mreso.load_config,
                           {"name": "nothing"})
+
+    def test_06_hosts_file_index(self):
+        hostsfile = os.path.join(self.app.config.get("PI_TMP_DIR", tempfile.gettempdir()),
+                                 "hosts-index-test")
+        shutil.copyfile(HOSTSFILE, hostsfile)
+        mreso = HostsMachineResolver("indexResolver", config={"filename": hostsfile})
+        self.assertEqual(mreso.get_machine_id(hostname="whitewizard"), "192.168.0.1")
+        index = get_hosts_file_index(hostsfile)
+        self.assertEqual(len(index.entries), 5)
+        self.assertEqual(len(index.by_hostname.get("gandalf")), 1)
+        self.assertEqual(index.by_ip.get(netaddr.IPAddress("192.168.0.2"))[0][0], "192.168.0.2")
+
+        # The file is only read once
+        with mock.patch("privacyidea.lib.machines.hosts.HostsFileIndex") as mock_index:
+            machines = mreso.get_machines(ip=netaddr.IPAddress("192.168.0.2"))
+            self.assertEqual([m.id for m in machines], ["192.168.0.2"])
+            self.assertEqual(mreso.get_machines(hostname="pippin")[0].id, "192.168.0.2")
+            self.assertEqual(mreso.get_machines(machine_id="192.168.0.1")[0].hostname,
+                             ["gandalf", "whitewizard"])
+            self.assertEqual(mreso.get_machines(ip=netaddr.IPAddress("10.0.0.1")), [])
+            mock_index.assert_not_called()
+
+        # The returned machines do not change the index
+        mreso.get_machines(hostname="pippin")[0].hostname.append("merry")
+        self.assertEqual(mreso.get_machines(hostname="merry"), [])
+
+        # If the file changes, it is read again
+        with open(hostsfile, "a") as f:
+            f.write("192.168.0.3\tmerry\n")
+        self.assertEqual(mreso.get_machine_id(hostname="merry"), "192.168.0.3")
+        self.assertIsNot(get_hosts_file_index(hostsfile), index)
+        self.assertEqual(len(mreso.get_machines()), 6)
+        os.remove(hostsfile)
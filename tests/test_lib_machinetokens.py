@@ -6,8 +6,10 @@ HOSTSFILE = "tests/testdata/hosts"
 from .base import MyTestCase
 from privacyidea.lib.machine import (attach_token, detach_token, add_option,
                                      delete_option, list_machine_tokens,
-                                     list_token_machines, get_auth_items)
-from privacyidea.lib.token import init_token, get_tokens
+                                     list_token_machines, get_auth_items,
+                                     get_auth_item_cache)
+from privacyidea.lib.token import init_token, get_tokens, enable_token, remove_token
+import mock
 from privacyidea.lib.machineresolver import save_resolver
 
 
@@ -207,3 +209,72 @@ class MachineTokenTestCase(MyTestCase):
         detach_token(self.serial2, "ssh")
         mt = list_token_machines(self.serial2)
         self.assertEqual(0, len(mt))
+
+    def test_16_cached_auth_items(self):
+        self.app.config["PI_AUTHITEM_CACHE_TTL"] = 60
+        try:
+            init_token({"serial": self.serial2, "type": "sshkey", "sshkey": sshkey})
+            attach_token(serial=self.serial2, application="ssh",
+                         options={"user": "testuser", "service_id": "webserver"})
+            filter_param = {"service_id": "webserver", "user": "testuser"}
+            ai = get_auth_items(application="ssh", filter_param=filter_param)
+            self.assertEqual(len(ai.get("ssh")), 1)
+            self.assertEqual(len(get_auth_item_cache()), 1)
+
+            # The cached auth items are returned without database queries
+            with mock.patch("privacyidea.lib.machine.list_machine_tokens") as mock_list:
+                ai2 = get_auth_items(application="ssh", filter_param=filter_param)
+                mock_list.assert_not_called()
+            self.assertEqual(ai2, ai)
+            # The returned auth items are copies
+            ai2["ssh"].append({"sshkey": "modified"})
+            self.assertEqual(len(get_auth_items(application="ssh", filter_param=filter_param)["ssh"]), 1)
+
+            # Changing the options invalidates the cache
+            mt_id = list_token_machines(self.serial2)[0].get("id")
+            add_option(machinetoken_id=mt_id, options={"user": "root"})
+            self.assertEqual(len(get_auth_item_cache()), 0)
+            self.assertFalse(get_auth_items(application="ssh", filter_param=filter_param).get("ssh"))
+            delete_option(machinetoken_id=mt_id, key="user")
+            self.assertEqual(len(get_auth_item_cache()), 0)
+            add_option(machinetoken_id=mt_id, options={"user": "testuser"})
+
+            # Disabling the token invalidates the cache
+            self.assertEqual(len(get_auth_items(application="ssh", filter_param=filter_param)["ssh"]), 1)
+            enable_token(self.serial2, False)
+            self.assertFalse(get_auth_items(application="ssh", filter_param=filter_param).get("ssh"))
+            enable_token(self.serial2)
+            self.assertEqual(len(get_auth_items(application="ssh", filter_param=filter_param)["ssh"]), 1)
+
+            # Detaching the token invalidates the cache
+            detach_token(self.serial2, "ssh")
+            self.assertEqual(len(get_auth_item_cache()), 0)
+            self.assertFalse(get_auth_items(application="ssh", filter_param=filter_param).get("ssh"))
+
+            # Auth items of the offline application are not cached
+            attach_token(self.serialHotp, "offline")
+            get_auth_items(application="offline", serial=self.serialHotp)
+            self.assertEqual(len(get_auth_item_cache()), 0)
+            detach_token(self.serialHotp, "offline")
+        finally:
+            self.app.config.pop("PI_AUTHITEM_CACHE_TTL")
+        self.assertIsNone(get_auth_item_cache())
+        remove_token(self.serial2)
+
+    def test_17_auth_items_use_loaded_tokens(self):
+        init_token({"serial": self.serial2, "type": "sshkey", "sshkey": sshkey})
+        attach_token(serial=self.serial2, application="ssh",
+                     options={"user": "testuser", "service_id": "webserver"})
+        filter_param = {"service_id": "webserver"}
+        # The tokens are loaded with the machine tokens and not read again
+        with mock.patch("privacyidea.lib.applications.ssh.get_tokens") as mock_get:
+            ai = get_auth_items(application="ssh", filter_param=filter_param)
+            mock_get.assert_not_called()
+        self.assertEqual(len(ai.get("ssh")), 1)
+        self.assertTrue(ai["ssh"][0].get("sshkey").startswith("ssh-rsa"))
+        # A disabled token does not return an auth item
+        enable_token(self.serial2, False)
+        self.assertFalse(get_auth_items(application="ssh", filter_param=filter_param).get("ssh"))
+        # The entries of the API do not contain the database token
+        self.assertNotIn("db_token", list_machine_tokens(serial=self.serial2)[0])
+        remove_token(self.serial2)
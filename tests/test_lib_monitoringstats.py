@@ -1,7 +1,11 @@
 from privacyidea.models import MonitoringStats, db
-from privacyidea.lib.monitoringstats import (write_stats, delete_stats,
+from privacyidea.lib.monitoringstats import (write_stats, write_multiple_stats, delete_stats,
                                              get_stats_keys, get_values,
-                                             get_last_value)
+                                             get_last_value, get_stats_buffer,
+                                             flush_stats, StatsBuffer)
+from privacyidea.lib.framework import get_app_local_store
+from privacyidea.lib.counter import increase, read
+import mock
 
 from .base import MyTestCase
 import datetime
@@ -123,4 +127,89 @@ class TokenModelTestCase(MyTestCase):
 
         # Get the last value of key1
         r = get_last_value("key1")
-        self.assertEqual(r, 10)
\ No newline at end of file
+        self.assertEqual(r, 10)
+
+    def test_05_buffered_stats(self):
+        self.app.config["PI_MONITORING_BUFFER"] = True
+        self.app.config["PI_MONITORING_BUFFER_SIZE"] = 3
+        try:
+            stats_buffer = get_stats_buffer()
+            self.assertIsInstance(stats_buffer, StatsBuffer)
+            write_stats("buffered1", 1, reset_values=True)
+            write_stats("buffered1", 2)
+            # Nothing is written yet
+            self.assertEqual(MonitoringStats.query.filter_by(stats_key="buffered1").count(), 0)
+            # The third value triggers the flush. All values of a key are written.
+            write_stats("buffered2", 5)
+            db.session.commit()
+            self.assertEqual([v[1] for v in get_values("buffered1")], [1, 2])
+            self.assertEqual(MonitoringStats.query.filter_by(stats_key="buffered2").count(), 1)
+            # Reading values writes the buffer
+            write_stats("buffered1", 3)
+            self.assertEqual(get_last_value("buffered1"), 3)
+            # buffered1 was reset, but the new value is still there
+            write_stats("buffered1", 4, reset_values=True)
+            flush_stats()
+            self.assertEqual([v[1] for v in get_values("buffered1")], [4])
+        finally:
+            self.app.config.pop("PI_MONITORING_BUFFER")
+            self.app.config.pop("PI_MONITORING_BUFFER_SIZE")
+            get_app_local_store().pop("stats_buffer")
+
+    def test_06_stats_buffer_interval(self):
+        stats_buffer = StatsBuffer(max_size=10, interval=0)
+        self.assertTrue(stats_buffer.needs_flush())
+        stats_buffer = StatsBuffer(max_size=2, interval=3600)
+        self.assertFalse(stats_buffer.needs_flush())
+        stats_buffer.add_increment("ctr", 2, 1)
+        stats_buffer.add_increment("ctr", -1, 1)
+        # An increment of the next reset generation is kept apart
+        stats_buffer.add_increment("ctr", 3, 2)
+        self.assertEqual(stats_buffer.get_increment("ctr"), 4)
+        self.assertFalse(stats_buffer.needs_flush())
+        stats_buffer.add_value("key", 1, None)
+        self.assertTrue(stats_buffer.needs_flush())
+        values, increments = stats_buffer.pop_all()
+        self.assertEqual(values, [("key", 1, None, False)])
+        self.assertEqual(sorted(increments), [("ctr", 1, 1), ("ctr", 3, 2)])
+        self.assertFalse(stats_buffer.needs_flush())
+        # Values, which could not be written, are kept before the newer values
+        stats_buffer.add_value("key", 2, None)
+        stats_buffer.restore_values([("key", 1, None, True), ("other", 3, None, False)])
+        self.assertEqual(stats_buffer.pop_all()[0],
+                         [("key", 1, None, True), ("other", 3, None, False), ("key", 2, None, False)])
+
+    def test_07_write_multiple_stats(self):
+        write_multiple_stats({"multi_key1": 1, "multi_key2": 2})
+        write_multiple_stats({})
+        value1 = MonitoringStats.query.filter_by(stats_key="multi_key1").one()
+        value2 = MonitoringStats.query.filter_by(stats_key="multi_key2").one()
+        self.assertEqual((value1.stats_value, value2.stats_value), (1, 2))
+        # The values are written with the same timestamp
+        self.assertEqual(value1.timestamp, value2.timestamp)
+        write_multiple_stats({"multi_key1": 3}, reset_values=True)
+        db.session.commit()
+        self.assertEqual(get_values("multi_key1")[0][1], 3)
+        self.assertEqual(len(get_values("multi_key1")), 1)
+        delete_stats("multi_key1")
+        delete_stats("multi_key2")
+
+    def test_08_failed_flush_keeps_values(self):
+        self.app.config["PI_MONITORING_BUFFER"] = True
+        try:
+            write_stats("kept_key", 5)
+            increase("kept_ctr")
+            with mock.patch("privacyidea.lib.monitoringmodules.sqlstats.MonitoringStats",
+                            side_effect=Exception("database down")), \
+                    mock.patch("privacyidea.lib.counter._update_counter_row",
+                               side_effect=Exception("database down")):
+                flush_stats()
+            stats_buffer = get_app_local_store()["stats_buffer"]
+            self.assertEqual(stats_buffer.get_increment("kept_ctr"), 1)
+            flush_stats()
+            self.assertEqual([v[1] for v in get_values("kept_key")], [5])
+            self.assertEqual(read("kept_ctr"), 1)
+        finally:
+            self.app.config.pop("PI_MONITORING_BUFFER")
+            get_app_local_store().pop("stats_buffer")
+            delete_stats("kept_key")
@@ -0,0 +1,105 @@
+"""
+This tests the file lib/otpsearch.py
+"""
+import itertools
+
+import mock
+from flask import current_app
+
+from .base import MyTestCase
+from privacyidea.lib.framework import get_app_local_store
+from privacyidea.lib.otpsearch import find_serials_by_otp, get_hotp_otp_index
+from privacyidea.lib.token import init_token, remove_token, get_one_token
+
+OTPKEY = "3132333435363738393031323334353637383930"
+OTPS = ["755224", "287082", "359152", "969429", "338314",
+        "254676", "287922", "162583", "399871", "520489"]
+SERIALS = ["OSEARCH1", "OSEARCH2", "OSEARCH3", "OSEARCH4"]
+
+
+class OtpSearchTestCase(MyTestCase):
+
+    def _create_tokens(self):
+        init_token({"serial": "OSEARCH1", "type": "hotp", "otpkey": OTPKEY})
+        for serial in SERIALS[1:]:
+            init_token({"serial": serial, "type": "hotp", "genkey": 1})
+
+    def test_01_sequential_search(self):
+        self._create_tokens()
+        r = find_serials_by_otp(OTPS[1], serial_wildcard="OSEARCH*")
+        self.assertEqual(r, {"serials": ["OSEARCH1"], "searched": 4, "complete": True})
+        # the counter of the token was increased
+        self.assertEqual(get_one_token(serial="OSEARCH1").token.count, 2)
+        r = find_serials_by_otp(OTPS[1], serial_wildcard="OSEARCH*")
+        self.assertEqual(r["serials"], [])
+
+        # a second token with the same key
+        init_token({"serial": "OSEARCH5", "type": "hotp", "otpkey": OTPKEY})
+        with mock.patch("privacyidea.lib.otpsearch.PAGE_SIZE", 1):
+            # the search stops after the first matching token
+            r = find_serials_by_otp(OTPS[3], serial_wildcard="OSEARCH*", max_matches=1)
+            self.assertEqual(r, {"serials": ["OSEARCH1"], "searched": 1, "complete": True})
+            r = find_serials_by_otp(OTPS[5], serial_wildcard="OSEARCH*")
+            self.assertEqual(r["serials"], ["OSEARCH1", "OSEARCH5"])
+
+            # the search stops, when the time is over
+            current_app.config["PI_GETSERIAL_TIMEOUT"] = 1
+            with mock.patch("privacyidea.lib.otpsearch.time") as mock_time:
+                mock_time.monotonic.side_effect = itertools.count(0, 10)
+                r = find_serials_by_otp(OTPS[8], serial_wildcard="OSEARCH*")
+            self.assertEqual(r, {"serials": ["OSEARCH1"], "searched": 1, "complete": False})
+            current_app.config.pop("PI_GETSERIAL_TIMEOUT")
+
+        for serial in SERIALS + ["OSEARCH5"]:
+            remove_token(serial)
+
+    def test_02_parallel_search(self):
+        self._create_tokens()
+        current_app.config["PI_GETSERIAL_WORKERS"] = 2
+        try:
+            with mock.patch("privacyidea.lib.otpsearch.PAGE_SIZE", 2), \
+                    mock.patch("privacyidea.lib.otpsearch.CHUNK_SIZE", 1):
+                # Only the workers create the token objects
+                with mock.patch("privacyidea.lib.otpsearch.get_tokens_paginated_generator") as mock_pages:
+                    r = find_serials_by_otp(OTPS[2], serial_wildcard="OSEARCH*")
+                    mock_pages.assert_not_called()
+                self.assertEqual(r, {"serials": ["OSEARCH1"], "searched": 4, "complete": True})
+                r = find_serials_by_otp(OTPS[2], serial_wildcard="OSEARCH*")
+                self.assertEqual(r["serials"], [])
+                self.assertTrue(r["complete"])
+            # The worker increased the counter in the database
+            self.assertEqual(get_one_token(serial="OSEARCH1").token.count, 3)
+        finally:
+            current_app.config.pop("PI_GETSERIAL_WORKERS")
+            for serial in SERIALS:
+                remove_token(serial)
+
+    def test_03_hotp_otp_index(self):
+        self._create_tokens()
+        current_app.config["PI_GETSERIAL_OTP_INDEX"] = True
+        get_app_local_store().pop("hotp_otp_index", None)
+        index = get_hotp_otp_index()
+        token_id = get_one_token(serial="OSEARCH1").token.id
+        r = find_serials_by_otp(OTPS[1], tokentype="hotp", assigned=False,
+                                serial_wildcard="OSEARCH*")
+        self.assertEqual(r, {"serials": ["OSEARCH1"], "searched": 4, "complete": True})
+        self.assertEqual(index._entries[token_id][0], 0)
+        self.assertEqual(len(index._entries), 4)
+
+        # only the token with the changed counter is calculated again
+        with mock.patch.object(index, "_add", wraps=index._add) as mock_add:
+            r = find_serials_by_otp(OTPS[2], tokentype="hotp", assigned=False,
+                                    serial_wildcard="OSEARCH*")
+            self.assertEqual(r["serials"], ["OSEARCH1"])
+            mock_add.assert_called_once()
+        self.assertEqual(index._entries[token_id][0], 2)
+        self.assertNotIn(OTPS[1], index._otps)
+
+        # removed tokens are removed from the index
+        for serial in SERIALS:
+            remove_token(serial)
+        r = find_serials_by_otp(OTPS[5], tokentype="hotp", assigned=False)
+        self.assertEqual(r["serials"], [])
+        self.assertNotIn(token_id, index._entries)
+        current_app.config.pop("PI_GETSERIAL_OTP_INDEX")
+        get_app_local_store().pop("hotp_otp_index")
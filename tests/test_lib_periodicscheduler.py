@@ -0,0 +1,104 @@
+"""
+This file contains the tests for lib/periodicscheduler.py and the claiming of
+periodic task runs in lib/periodictask.py
+"""
+import threading
+from datetime import datetime, timedelta
+
+import mock
+from dateutil.tz import tzutc
+
+from privacyidea.lib.periodicscheduler import PeriodicTaskScheduler
+from privacyidea.lib.periodictask import (set_periodic_task, delete_periodic_task,
+                                          get_periodic_task_by_name, claim_periodic_task_run,
+                                          release_periodic_task_run, TASK_MODULES)
+from privacyidea.lib.task.base import BaseTask
+from .base import MyTestCase
+
+
+class _TestTask(BaseTask):
+    identifier = "SchedulerTest"
+    description = "Test task"
+    calls = []
+    release = threading.Event()
+
+    def do(self, params):
+        self.calls.append(params.get("name"))
+        if params.get("wait"):
+            self.release.wait(5)
+        return params.get("result") == "ok"
+
+
+class PeriodicSchedulerTestCase(MyTestCase):
+
+    def test_01_claim_run(self):
+        ptask_id = set_periodic_task("claim", "*/5 * * * *", ["pinode1", "pinode2"], "SchedulerTest")
+        ptask = initial_ptask = get_periodic_task_by_name("claim")
+        now = datetime(2024, 1, 1, 12, 0, 30, 1234, tzinfo=tzutc())
+        # The first claim wins, the second scheduler with the same task state loses
+        claimed_run = claim_periodic_task_run(ptask, "pinode1", now)
+        self.assertEqual(claimed_run, datetime(2024, 1, 1, 12, 0, 30))
+        self.assertIsNone(claim_periodic_task_run(ptask, "pinode1", now))
+        # The other node has its own runs
+        self.assertIsNotNone(claim_periodic_task_run(ptask, "pinode2", now))
+
+        ptask = get_periodic_task_by_name("claim")
+        self.assertEqual(ptask["last_runs"]["pinode1"], now.replace(microsecond=0))
+        later = now + timedelta(minutes=5)
+        claimed_run = claim_periodic_task_run(ptask, "pinode1", later)
+        self.assertIsNone(claim_periodic_task_run(ptask, "pinode1", later))
+        # Releasing restores the last run
+        release_periodic_task_run(ptask, "pinode1", claimed_run)
+        self.assertEqual(get_periodic_task_by_name("claim")["last_runs"]["pinode1"],
+                         now.replace(microsecond=0))
+        # The first run is released by removing it
+        release_periodic_task_run(initial_ptask, "pinode1", datetime(2024, 1, 1, 12, 0, 30))
+        self.assertNotIn("pinode1", get_periodic_task_by_name("claim")["last_runs"])
+        delete_periodic_task(ptask_id)
+
+    def test_02_scheduler(self):
+        _TestTask.calls.clear()
+        _TestTask.release.clear()
+        task_ids = [set_periodic_task("fast", "* * * * *", ["pinode1"], "SchedulerTest",
+                                      ordering=1, options={"name": "fast", "result": "ok"}),
+                    set_periodic_task("slow", "* * * * *", ["pinode1"], "SchedulerTest",
+                                      ordering=2, options={"name": "slow", "wait": "1",
+                                                           "result": "ok"}),
+                    set_periodic_task("failing", "* * * * *", ["pinode1"], "SchedulerTest",
+                                      ordering=3, options={"name": "failing", "wait": "1"}),
+                    set_periodic_task("other node", "* * * * *", ["pinode2"], "SchedulerTest")]
+        now = datetime.now(tzutc()) + timedelta(minutes=2)
+        with mock.patch.dict(TASK_MODULES, values={"SchedulerTest": _TestTask}):
+            scheduler = PeriodicTaskScheduler(self.app, "pinode1", workers=3, timeout=0)
+            other_scheduler = PeriodicTaskScheduler(self.app, "pinode1")
+            other_scheduler.load_tasks()
+            started, finished = scheduler.run_pending(now)
+            self.assertEqual(started, ["fast", "slow", "failing"])
+            self.assertEqual(finished, {})
+            # A second scheduler with the same node name does not run the tasks again
+            self.assertEqual(other_scheduler.run_pending(now)[0], [])
+            other_scheduler.executor.shutdown()
+
+            futures = {name: future for name, future, _started in scheduler._running.values()}
+            futures["fast"].result()
+            # The slow tasks exceed the timeout, but are not started again
+            started, finished = scheduler.run_pending()
+            self.assertEqual(started, [])
+            self.assertEqual(finished, {"fast": True, "slow": False, "failing": False})
+            self.assertEqual(sorted(r[0] for r in scheduler._running.values()), ["failing", "slow"])
+            self.assertEqual(_TestTask.calls, ["fast", "slow", "failing"])
+
+            _TestTask.release.set()
+            # Stopping the scheduler waits for the running tasks
+            scheduler.stop()
+            scheduler.run()
+            self.assertTrue(futures["slow"].result())
+            self.assertFalse(futures["failing"].result())
+
+        # The successful runs are recorded, the failed run is released for a retry
+        self.assertIn("pinode1", get_periodic_task_by_name("fast")["last_runs"])
+        self.assertIn("pinode1", get_periodic_task_by_name("slow")["last_runs"])
+        self.assertNotIn("pinode1", get_periodic_task_by_name("failing")["last_runs"])
+        self.assertEqual(get_periodic_task_by_name("other node")["last_runs"], {})
+        for task_id in task_ids:
+            delete_periodic_task(task_id)
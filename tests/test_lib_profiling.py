@@ -0,0 +1,104 @@
+"""
+This file tests the request profiling in lib/profiling.py
+"""
+import mock
+from flask import g
+
+from .base import MyTestCase
+from privacyidea.lib.profiling import (RequestProfile, ProfileStatistics, PHASE,
+                                       profiled, measure, start_request_profile,
+                                       get_request_profile, finish_request_profile,
+                                       get_profile_statistics, register_sql_events)
+from privacyidea.lib.framework import get_app_local_store
+from privacyidea.models import Token
+
+
+@profiled(PHASE.RESOLVER)
+def _nested_resolver_call(depth):
+    if depth:
+        return _nested_resolver_call(depth - 1)
+    return "done"
+
+
+class ProfilingTestCase(MyTestCase):
+
+    def test_01_request_profile(self):
+        profile = RequestProfile()
+        with profile.measure(PHASE.POLICY):
+            with profile.measure(PHASE.POLICY):
+                pass
+        profile.add_query(0.002)
+        profile.add_query(0.001)
+        profile.finish()
+        # nested measurements are only counted once
+        self.assertEqual(profile.calls[PHASE.POLICY], 1)
+        # excluded blocks do not count to the running measurement
+        with mock.patch("privacyidea.lib.profiling.time.perf_counter",
+                        side_effect=[10, 11, 15, 16, 17, 20]):
+            with profile.measure(PHASE.EVENT):
+                with profile.exclude(PHASE.EVENT):
+                    # a measurement within the excluded block is counted again
+                    with profile.measure(PHASE.EVENT):
+                        pass
+        self.assertEqual(profile.calls[PHASE.EVENT], 2)
+        self.assertEqual(profile.phases[PHASE.EVENT], 1 + (20 - 10 - 6))
+        self.assertEqual(profile.db_queries, 2)
+        timings = profile.get_timings()
+        self.assertEqual(timings[PHASE.DB], 3.0)
+        self.assertGreaterEqual(timings[PHASE.TOTAL], timings[PHASE.POLICY])
+        server_timing = profile.get_server_timing()
+        self.assertIn('db;dur=3.0;desc="2 queries"', server_timing)
+        self.assertIn("policy;dur=", server_timing)
+        self.assertIn("total;dur=", server_timing)
+
+    def test_02_statistics(self):
+        statistics = ProfileStatistics(slow_request=2, slow_samples=1)
+        fast = RequestProfile()
+        fast.duration = 0.0005
+        slow = RequestProfile()
+        slow.duration = 0.03
+        slow.add(PHASE.RESOLVER, 0.02)
+        statistics.add("POST /validate/check", fast)
+        statistics.add("POST /validate/check", slow)
+        statistics.add("GET /token/", slow)
+        stats = statistics.get()
+        check = stats["endpoints"]["POST /validate/check"]
+        self.assertEqual(check["count"], 2)
+        self.assertEqual(check["phases"][PHASE.TOTAL]["buckets"]["1"], 1)
+        self.assertEqual(check["phases"][PHASE.TOTAL]["buckets"]["50"], 1)
+        self.assertEqual(check["phases"][PHASE.TOTAL]["max"], 30.0)
+        self.assertEqual(check["phases"][PHASE.RESOLVER]["buckets"]["25"], 1)
+        # only the last slow request is kept
+        self.assertEqual(len(stats["slow_requests"]), 1)
+        self.assertEqual(stats["slow_requests"][0]["endpoint"], "GET /token/")
+        statistics.reset()
+        self.assertEqual(statistics.get(), {"endpoints": {}, "slow_requests": []})
+
+    def test_03_profiled_functions(self):
+        # Without PI_PROFILING there is no request profile
+        start_request_profile()
+        self.assertIsNone(get_request_profile())
+        self.assertEqual(_nested_resolver_call(2), "done")
+        with measure(PHASE.AUDIT):
+            pass
+
+        self.app.config["PI_PROFILING"] = True
+        try:
+            register_sql_events()
+            start_request_profile()
+            profile = get_request_profile()
+            self.assertIsInstance(profile, RequestProfile)
+            self.assertEqual(_nested_resolver_call(2), "done")
+            self.assertEqual(profile.calls[PHASE.RESOLVER], 1)
+            with measure(PHASE.AUDIT):
+                Token.query.count()
+            self.assertEqual(profile.calls[PHASE.AUDIT], 1)
+            self.assertGreaterEqual(profile.db_queries, 1)
+            finish_request_profile("GET /test")
+            self.assertIsNone(get_request_profile())
+            stats = get_profile_statistics().get()
+            self.assertEqual(stats["endpoints"]["GET /test"]["count"], 1)
+        finally:
+            self.app.config.pop("PI_PROFILING")
+            get_app_local_store().pop("profile_statistics", None)
+            g._request_local_store.pop("request_profile", None)
@@ -17,12 +17,15 @@ import mock
 import ldap3
 import responses
 import datetime
+import time
 import uuid
 import pytest
 import json
 import ssl
-from privacyidea.lib.resolvers.LDAPIdResolver import IdResolver as LDAPResolver, LockingServerPool
-from privacyidea.lib.resolvers.SQLIdResolver import IdResolver as SQLResolver
+from privacyidea.lib.resolvers.LDAPIdResolver import (IdResolver as LDAPResolver, LockingServerPool,
+                                                      LDAPConnectionPool)
+from privacyidea.lib.resolvers.SQLIdResolver import (IdResolver as SQLResolver,
+                                                     get_schema_cache)
 from privacyidea.lib.resolvers.SCIMIdResolver import IdResolver as SCIMResolver
 from privacyidea.lib.resolvers.UserIdResolver import UserIdResolver
 from privacyidea.lib.resolvers.LDAPIdResolver import (SERVERPOOL_ROUNDS, SERVERPOOL_SKIP)
@@ -35,6 +38,7 @@ from privacyidea.lib.resolver import (save_resolver,
                                       get_resolver_object, pretestresolver,
                                       CENSORED)
 from privacyidea.lib.realm import (set_realm, delete_realm)
+from privacyidea.lib.error import privacyIDEAError
 from privacyidea.models import ResolverConfig
 from privacyidea.lib.utils import to_bytes, to_unicode
 from requests import HTTPError
@@ -560,6 +564,53 @@ class SQLResolverTestCase(MyTestCase):
         user_info = y.getUserInfo(user)
         self.assertEqual(user_info.get("userid"), "cornelius")
 
+    def test_09_schema_cache(self):
+        from sqlalchemy import event
+        get_schema_cache().invalidate()
+        y = SQLResolver()
+        y.loadConfig(self.parameters)
+        # The table is only reflected once
+        y2 = SQLResolver()
+        y2.loadConfig(self.parameters)
+        self.assertIs(y.TABLE, y2.TABLE)
+        # the map is not shared between the resolver objects
+        self.assertIsNot(y.map, y2.map)
+
+        # A lookup of the user ID, the user info and the username needs one query
+        statements = []
+
+        def count_statements(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(y2.engine, "before_cursor_execute", count_statements)
+        try:
+            self.assertEqual(y2.getUserId("cornelius"), "3")
+            self.assertEqual(len(statements), 1)
+            self.assertEqual(y2.getUserInfo("3").get("username"), "cornelius")
+            self.assertEqual(y2.getUsername("3"), "cornelius")
+            self.assertEqual(y2.getUserId("does_not_exist"), "")
+            self.assertEqual(len(statements), 4)
+        finally:
+            event.remove(y2.engine, "before_cursor_execute", count_statements)
+
+        # The statements contain the WHERE clause of the resolver
+        y3 = SQLResolver()
+        d = self.parameters.copy()
+        d.update({"Where": "givenname == hans"})
+        y3.loadConfig(d)
+        self.assertEqual(y3.getUserId("cornelius"), "")
+        self.assertEqual(y.getUserId("cornelius"), "3")
+
+        # Saving a resolver drops the cache
+        params = self.parameters.copy()
+        params.update({"resolver": "sqlcache", "type": "sqlresolver"})
+        save_resolver(params)
+        y4 = SQLResolver()
+        y4.loadConfig(self.parameters)
+        self.assertIsNot(y.TABLE, y4.TABLE)
+        self.assertEqual(y4.getUserId("cornelius"), "3")
+        delete_resolver("sqlcache")
+
     def test_99_testconnection_fail(self):
         y = SQLResolver()
         self.parameters['Database'] = "does_not_exist"
@@ -1443,6 +1494,48 @@ class LDAPResolverTestCase(MyTestCase):
         user_id = y.getUserId("achmed")
         self.assertFalse(user_id)
 
+    @ldap3mock.activate
+    def test_13b_add_user_update_delete_cached(self):
+        ldap3mock.setLDAPDirectory(LDAPDirectory)
+        y = LDAPResolver()
+        config = {'LDAPURI': 'ldap://localhost',
+                  'LDAPBASE': 'o=test',
+                  'BINDDN': 'cn=manager,ou=example,o=test',
+                  'BINDPW': 'ldaptest',
+                  'LOGINNAMEATTRIBUTE': 'cn',
+                  'LDAPSEARCHFILTER': '(cn=*)',
+                  'USERINFO': '{ "username": "cn",'
+                              '"email" : "email",'
+                              '"surname" : "sn" }',
+                  'OBJECT_CLASSES': "top, inetOrgPerson",
+                  'DN_TEMPLATE': "cn=<username>,ou=example,o=test",
+                  'UIDTYPE': 'DN',
+                  'NOREFERRALS': True,
+                  'CACHE_TIMEOUT': 120}
+        # Unknown users are not cached by default
+        y.loadConfig(config)
+        self.assertEqual(y.negative_cache_timeout, 0)
+        config["CACHE_NEGATIVE_TIMEOUT"] = 10
+        y.loadConfig(config)
+        y.clear_cache()
+        self.assertEqual(y.getUserId("achmed"), "")
+
+        # The added user is found, although it was cached as an unknown user
+        user_id = y.add_user({"username": "achmed", "surname": "Ali",
+                              "email": "achmed@example.com"})
+        self.assertEqual(user_id, "cn=achmed,ou=example,o=test")
+        self.assertEqual(y.getUserInfo(user_id).get("email"), "achmed@example.com")
+
+        # Changed attributes are read again
+        self.assertTrue(y.update_user(user_id, {"email": "ali@example.com"}))
+        self.assertEqual(y.getUserInfo(user_id).get("email"), "ali@example.com")
+
+        # The deleted user is not found anymore
+        self.assertTrue(y.delete_user(user_id))
+        self.assertEqual(y.getUserId("achmed"), "")
+        self.assertEqual(y.getUserInfo(user_id), {})
+        y.clear_cache()
+
     @ldap3mock.activate
     def test_14_add_user_update_delete_objectGUID(self):
         ldap3mock.setLDAPDirectory(LDAPDirectory)
@@ -2071,7 +2164,7 @@ class LDAPResolverTestCase(MyTestCase):
         self.assertNotIn(y.getResolverId(), CACHE)
         bob_id = y.getUserId('bob')
         # assert the cache contains this entry
-        self.assertEqual(CACHE[y.getResolverId()]['getUserId']['bob']['value'], bob_id)
+        self.assertEqual(CACHE[y.getResolverId()]['getUserId'].get('bob'), bob_id)
         # assert subsequent requests for the same data hit the cache
         with mock.patch.object(ldap3mock.Connection, 'search') as mock_search:
             bob_id2 = y.getUserId('bob')
@@ -2079,26 +2172,23 @@ class LDAPResolverTestCase(MyTestCase):
             mock_search.assert_not_called()
         self.assertIn('bob', CACHE[y.getResolverId()]['getUserId'])
         # assert requests later than CACHE_TIMEOUT seconds query the directory again
-        now = datetime.datetime.now()
-        with mock.patch('privacyidea.lib.resolvers.LDAPIdResolver.datetime.datetime',
-                        wraps=datetime.datetime) as mock_datetime:
+        now = time.monotonic()
+        with mock.patch('privacyidea.lib.cache.lru.time.monotonic') as mock_monotonic:
             # we now live CACHE_TIMEOUT + 2 seconds in the future
-            mock_datetime.now.return_value = now + datetime.timedelta(seconds=cache_timeout + 2)
+            mock_monotonic.return_value = now + cache_timeout + 2
+            self.assertNotIn('bob', CACHE[y.getResolverId()]['getUserId'])
             with mock.patch.object(ldap3mock.Connection, 'search', wraps=y.l.search) as mock_search:
                 bob_id3 = y.getUserId('bob')
                 self.assertEqual(bob_id, bob_id3)
                 mock_search.assert_called_once()
-        # assert the cache contains this entry, with the updated timestamp
-        self.assertEqual(CACHE[y.getResolverId()]['getUserId']['bob'],
-                         {'value': bob_id,
-                          'timestamp': now + datetime.timedelta(seconds=cache_timeout + 2)})
-        # we now go 2 * (CACHE_TIMEOUT + 2) seconds to the future and query for someone else's user ID.
-        # This will cause bob's cache entry to be evicted.
-        with mock.patch('privacyidea.lib.resolvers.LDAPIdResolver.datetime.datetime',
-                        wraps=datetime.datetime) as mock_datetime:
-            mock_datetime.now.return_value = now + datetime.timedelta(seconds=2 * (cache_timeout + 2))
-            manager_id = y.getUserId('manager')
-        self.assertEqual(list(CACHE[y.getResolverId()]['getUserId'].keys()), ['manager'])
+            # assert the cache contains this entry again
+            self.assertIn('bob', CACHE[y.getResolverId()]['getUserId'])
+        statistics = y.get_cache_statistics()
+        # the lookup in this test and the second request hit the cache
+        self.assertEqual(statistics["getUserId"]["hits"], 2)
+        self.assertEqual(statistics["getUserId"]["misses"], 2)
+        self.assertEqual(statistics["getUserId"]["expirations"], 1)
+        self.assertEqual(statistics["getUserId"]["size"], 1)
 
     @ldap3mock.activate
     def test_33_cache_disabled(self):
@@ -2221,6 +2311,171 @@ class LDAPResolverTestCase(MyTestCase):
             pool.get_current_server(None)
             mock_method.assert_called_once()
 
+    @ldap3mock.activate
+    def test_37_negative_cache_and_size(self):
+        ldap3mock.setLDAPDirectory(LDAPDirectory_small)
+        y = LDAPResolver()
+        y.loadConfig({'LDAPURI': 'ldap://localhost',
+                      'LDAPBASE': 'o=test',
+                      'BINDDN': 'cn=manager,ou=example,o=test',
+                      'BINDPW': 'ldaptest',
+                      'LOGINNAMEATTRIBUTE': 'cn',
+                      'LDAPSEARCHFILTER': '(&(cn=*)(objectClass=*))',  # unique resolver ID
+                      'USERINFO': '{ "username": "cn", "email" : "mail" }',
+                      'UIDTYPE': 'objectGUID',
+                      'NOREFERRALS': True,
+                      'CACHE_TIMEOUT': 120,
+                      'CACHE_NEGATIVE_TIMEOUT': 10,
+                      'CACHE_SIZE': 2
+                      })
+        y.clear_cache()
+        # unknown users are cached
+        self.assertEqual(y.getUserId('unknown'), "")
+        with mock.patch.object(ldap3mock.Connection, 'search') as mock_search:
+            self.assertEqual(y.getUserId('unknown'), "")
+            mock_search.assert_not_called()
+        # ... but with the negative timeout
+        now = time.monotonic()
+        with mock.patch('privacyidea.lib.cache.lru.time.monotonic') as mock_monotonic:
+            mock_monotonic.return_value = now + 12
+            with mock.patch.object(ldap3mock.Connection, 'search', wraps=y.l.search) as mock_search:
+                self.assertEqual(y.getUserId('unknown'), "")
+                mock_search.assert_called_once()
+
+        # The cache of a function holds at most CACHE_SIZE entries
+        bob_id = y.getUserId('bob')
+        y.getUserId('manager')
+        statistics = y.get_cache_statistics()["getUserId"]
+        self.assertEqual(statistics["size"], 2)
+        self.assertEqual(statistics["maxsize"], 2)
+        self.assertEqual(statistics["evictions"], 1)
+        with mock.patch.object(ldap3mock.Connection, 'search') as mock_search:
+            self.assertEqual(y.getUserId('bob'), bob_id)
+            mock_search.assert_not_called()
+
+        y.clear_cache()
+        self.assertEqual(y.get_cache_statistics(), {})
+
+        # with a negative timeout of 0, unknown users are not cached
+        y.negative_cache_timeout = 0
+        self.assertEqual(y.getUserId('unknown'), "")
+        self.assertEqual(y.get_cache_statistics()["getUserId"]["size"], 0)
+        y.clear_cache()
+
+    def test_38_connection_pool(self):
+        created = []
+
+        def creator():
+            conn = mock.MagicMock(closed=False)
+            # Connections are not unbound while the pool is locked
+            conn.unbind.side_effect = lambda: self.assertFalse(pool._lock.locked())
+            created.append(conn)
+            return conn
+
+        pool = LDAPConnectionPool(creator, 2, lifetime=60, timeout=0.1)
+        conn1 = pool.acquire()
+        conn2 = pool.acquire()
+        self.assertEqual(len(created), 2)
+        # The pool is exhausted
+        self.assertRaises(privacyIDEAError, pool.acquire)
+        pool.release(conn1)
+        # the idle connection is reused
+        self.assertIs(pool.acquire(), conn1)
+        pool.release(conn1)
+        # a connection, that failed, is not reused
+        pool.release(conn2, discard=True)
+        conn2.unbind.assert_called_once()
+        statistics = pool.get_statistics()
+        self.assertEqual(statistics["created"], 2)
+        self.assertEqual(statistics["reused"], 1)
+        self.assertEqual(statistics["discarded"], 1)
+        self.assertEqual(statistics["timeouts"], 1)
+        self.assertEqual(statistics["in_use"], 0)
+        self.assertEqual(statistics["idle"], 1)
+
+        # connections are closed after their lifetime
+        now = time.monotonic()
+        with mock.patch('privacyidea.lib.resolvers.LDAPIdResolver.time.monotonic') as mock_monotonic:
+            mock_monotonic.return_value = now + 61
+            conn3 = pool.acquire()
+        self.assertIsNot(conn3, conn1)
+        conn1.unbind.assert_called_once()
+        pool.release(conn3)
+
+        # idle connections are checked before they are used again
+        pool.check = mock.Mock(return_value=False)
+        now = time.monotonic()
+        with mock.patch('privacyidea.lib.resolvers.LDAPIdResolver.time.monotonic') as mock_monotonic:
+            mock_monotonic.return_value = now + 31
+            conn4 = pool.acquire()
+        pool.check.assert_called_once_with(conn3)
+        self.assertIsNot(conn4, conn3)
+        pool.release(conn4)
+
+        pool.close()
+        conn4.unbind.assert_called_once()
+        self.assertEqual(pool.get_statistics()["idle"], 0)
+
+    @ldap3mock.activate
+    def test_39_pooled_ldap_connections(self):
+        ldap3mock.setLDAPDirectory(LDAPDirectory_small)
+        config = {'LDAPURI': 'ldap://localhost',
+                  'LDAPBASE': 'o=test',
+                  'BINDDN': 'cn=manager,ou=example,o=test',
+                  'BINDPW': 'ldaptest',
+                  'LOGINNAMEATTRIBUTE': 'cn',
+                  'LDAPSEARCHFILTER': '(&(cn=*)(sn=*))',  # unique resolver ID
+                  'USERINFO': '{ "username": "cn", "email" : "mail" }',
+                  'UIDTYPE': 'DN',
+                  'NOREFERRALS': True,
+                  'CACHE_TIMEOUT': 0,
+                  'CONNECTION_POOL_SIZE': 2}
+        # Two requests use the same bound connection
+        with self.app.test_request_context('/'):
+            y = LDAPResolver()
+            y.loadConfig(config)
+            self.assertEqual(y.getUserId("bob"), "cn=bob,ou=example,o=test")
+            first_connection = y.l
+        with self.app.test_request_context('/'):
+            y = LDAPResolver()
+            y.loadConfig(config)
+            self.assertEqual(y.getUserId("manager"), "cn=manager,ou=example,o=test")
+            self.assertIs(y.l, first_connection)
+            # The password check uses a pooled connection as well
+            self.assertTrue(y.checkPass("cn=bob,ou=example,o=test", "bobpwééé"))
+            self.assertFalse(y.checkPass("cn=bob,ou=example,o=test", "wrong"))
+            self.assertTrue(y.checkPass("cn=manager,ou=example,o=test", "ldaptest"))
+            statistics = y.get_cache_statistics()
+        self.assertEqual(statistics["service_connections"]["created"], 1)
+        self.assertEqual(statistics["service_connections"]["reused"], 1)
+        self.assertEqual(statistics["user_connections"]["created"], 1)
+        self.assertEqual(statistics["user_connections"]["reused"], 2)
+
+        # Loading the configuration twice in one request reuses the borrowed
+        # connection, even if the pool only holds one connection
+        config["CONNECTION_POOL_SIZE"] = 1
+        config["CONNECTION_POOL_TIMEOUT"] = 1
+        with self.app.test_request_context('/'):
+            y = LDAPResolver()
+            y.loadConfig(config)
+            self.assertEqual(y.getUserId("bob"), "cn=bob,ou=example,o=test")
+            first_connection = y.l
+            y.loadConfig(config)
+            self.assertEqual(y.getUserId("manager"), "cn=manager,ou=example,o=test")
+            self.assertIs(y.l, first_connection)
+            statistics = y.get_cache_statistics()
+            self.assertEqual(statistics["service_connections"]["in_use"], 1)
+        self.assertEqual(y.get_connection_pool("service").get_statistics()["in_use"], 0)
+        self.assertEqual(statistics["service_connections"]["timeouts"], 0)
+
+        with self.app.test_request_context('/'):
+            y = LDAPResolver()
+            y.loadConfig(config)
+            self.assertEqual(y.get_cache_statistics()["service_connections"]["idle"], 1)
+            # Flushing the cache closes the connections
+            y.clear_cache()
+            self.assertNotIn("service_connections", y.get_cache_statistics())
+
 class BaseResolverTestCase(MyTestCase):
 
     def test_00_basefunctions(self):
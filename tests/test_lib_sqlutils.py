@@ -6,7 +6,7 @@ from datetime import datetime
 from mock import MagicMock
 import warnings
 from sqlalchemy.testing import AssertsCompiledSQL
-from privacyidea.lib.sqlutils import DeleteLimit, delete_matching_rows
+from privacyidea.lib.sqlutils import DeleteLimit, delete_matching_rows, delete_chunked
 from privacyidea.models import Audit as LogEntry
 from .base import MyTestCase
 
@@ -85,4 +85,33 @@ class SQLUtilsCompilationTestCase(MyTestCase, AssertsCompiledSQL):
         # delete in one statement
         result = delete_matching_rows(session, LogEntry.__table__, LogEntry.id < 1234)
         self.assertEqual(len(session.execute.mock_calls), 1)
-        self.assertEqual(result, 2500)
\ No newline at end of file
+        self.assertEqual(result, 2500)
+
+    def test_04_delete_paced(self):
+        session = MagicMock()
+        fake_results = [100, 50, 50, 20]
+        limits = []
+
+        def fake_execute_delete(stmt):
+            limits.append(stmt.limit)
+            result = MagicMock()
+            result.rowcount = fake_results.pop(0)
+            return result
+
+        session.execute.side_effect = fake_execute_delete
+        pace = MagicMock(side_effect=[50, 50, 50])
+        result = delete_chunked(session, LogEntry.__table__, LogEntry.id < 1234, 100, pace=pace)
+        self.assertEqual(result, 220)
+        # The limit of the chunks is set by the pace function
+        self.assertEqual(limits, [100, 50, 50, 50])
+        self.assertEqual(pace.call_count, 3)
+        self.assertEqual(pace.call_args_list[0][0][0], 100)
+
+        # The pace function stops the deletion
+        session.execute.reset_mock()
+        fake_results = [100, 100]
+        session.execute.side_effect = fake_execute_delete
+        result = delete_chunked(session, LogEntry.__table__, LogEntry.id < 1234, 100,
+                                pace=lambda rowcount, duration: None)
+        self.assertEqual(result, 100)
+        self.assertEqual(len(session.execute.mock_calls), 1)
@@ -0,0 +1,88 @@
+"""
+This tests the files
+  lib/task/cleanup.py
+"""
+import time
+from datetime import datetime, timedelta
+
+import mock
+from flask import current_app
+
+from .base import MyTestCase
+from privacyidea.lib.config import set_privacyidea_config, delete_privacyidea_config
+from privacyidea.lib.monitoringstats import get_values, delete_stats
+from privacyidea.lib.periodictask import get_available_taskmodules
+from privacyidea.lib.task.cleanup import CleanupTask, ChunkPacer
+from privacyidea.lib.usercache import EXPIRATION_SECONDS
+from privacyidea.models import AuthCache, AuthCounter, Challenge, UserCache, db
+
+
+class TaskCleanupTestCase(MyTestCase):
+
+    def test_01_chunk_pacer(self):
+        with mock.patch("privacyidea.lib.task.cleanup.time") as mock_time:
+            mock_time.monotonic.return_value = 100
+            pacer = ChunkPacer(1000, 0.5, 110)
+            # fast chunks keep the maximum size
+            self.assertEqual(pacer(1000, 0.1), 1000)
+            # slow chunks get smaller and the task pauses
+            self.assertEqual(pacer(1000, 1), 500)
+            mock_time.sleep.assert_called_once_with(1)
+            self.assertEqual(pacer(500, 0.6), 250)
+            self.assertEqual(pacer(250, 0.3), 250)
+            self.assertEqual(pacer(250, 0.1), 500)
+            # no more chunks after the deadline
+            mock_time.monotonic.return_value = 110
+            self.assertIsNone(pacer(500, 0.1))
+
+    def test_02_cleanup(self):
+        self.assertIn("Cleanup", get_available_taskmodules())
+        now = datetime.utcnow()
+        for i in range(25):
+            Challenge("CLEANUP{0!s}".format(i), validitytime=-10).save()
+        Challenge("CLEANUP", validitytime=120).save()
+        set_privacyidea_config(EXPIRATION_SECONDS, 600)
+        for i in range(5):
+            UserCache("user{0!s}".format(i), "user{0!s}".format(i), "resolver", i,
+                      datetime.now() - timedelta(hours=1)).save()
+        UserCache("user", "user", "resolver", "uid", datetime.now()).save()
+        AuthCache("user", "realm", "resolver", "hash", now - timedelta(hours=2),
+                  now - timedelta(hours=2)).save()
+        AuthCache("user", "realm", "resolver", "hash", now, now).save()
+        # expired and current authentication counters
+        AuthCounter("user", "realm", "resolver", False, 30, int(time.time()) // 30 - 100).save()
+        AuthCounter("user", "realm", "resolver", False, 30, int(time.time()) // 30).save()
+
+        task = CleanupTask(current_app.config)
+        params = {"challenges": "True",
+                  "usercache": "True",
+                  "authcache_minutes": "60",
+                  "authcounter": "True",
+                  "chunksize": "10",
+                  "stats_key": "cleanup"}
+        self.assertTrue(task.do(params))
+
+        self.assertEqual(Challenge.query.count(), 1)
+        self.assertEqual(UserCache.query.count(), 1)
+        self.assertEqual(AuthCache.query.count(), 1)
+        self.assertEqual(AuthCounter.query.count(), 1)
+        self.assertEqual(get_values("cleanup_challenge_deleted")[-1][1], 25)
+        self.assertEqual(get_values("cleanup_challenge_rows")[-1][1], 1)
+        self.assertEqual(get_values("cleanup_usercache_deleted")[-1][1], 5)
+        self.assertEqual(get_values("cleanup_authcache_deleted")[-1][1], 1)
+        self.assertEqual(len(get_values("cleanup_authcache_rate")), 1)
+
+        # Nothing is deleted, if the options are not set
+        Challenge("CLEANUP", validitytime=-10).save()
+        self.assertTrue(task.do({}))
+        self.assertEqual(Challenge.query.count(), 2)
+
+        for key in ["challenge", "usercache", "authcache", "authcounter"]:
+            for value in ["deleted", "rate", "rows"]:
+                delete_stats("cleanup_{0!s}_{1!s}".format(key, value))
+        Challenge.query.delete()
+        UserCache.query.delete()
+        AuthCache.query.delete()
+        AuthCounter.query.delete()
+        db.session.commit()
+        delete_privacyidea_config(EXPIRATION_SECONDS)
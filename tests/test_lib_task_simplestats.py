@@ -4,13 +4,15 @@ This tests the files
 """
 from privacyidea.lib.user import User
 from privacyidea.lib.tokenclass import TOKENKIND
-from privacyidea.lib.token import init_token
+from privacyidea.lib.token import init_token, remove_token
 from privacyidea.models import db
 from .base import MyTestCase
-from privacyidea.lib.monitoringstats import get_values
+from privacyidea.lib.monitoringstats import get_values, delete_stats
 from flask import current_app
+from sqlalchemy import event
+import mock
 
-from privacyidea.lib.task.simplestats import SimpleStatsTask
+from privacyidea.lib.task.simplestats import SimpleStatsTask, get_token_counters
 
 simple_results = {'total_tokens': (1, 2, 3, 4),
                   'hardware_tokens': (0, 1, 2, 2),
@@ -33,7 +35,7 @@ class TaskSimpleStatsTestCase(MyTestCase):
         sst = SimpleStatsTask(current_app.config)
         # and set all parameters to 'true'
         params = {}
-        for o in sst.options.keys():
+        for o in simple_results.keys():
             params[o] = True
 
         # first we create a software token
@@ -41,7 +43,7 @@ class TaskSimpleStatsTestCase(MyTestCase):
 
         sst.do(params)
         db.session.commit()
-        for o in sst.options.keys():
+        for o in simple_results.keys():
             self.assertEqual(simple_results[o][0], get_values(o)[0][1],
                              msg="Current option: {0}".format(o))
 
@@ -51,7 +53,7 @@ class TaskSimpleStatsTestCase(MyTestCase):
 
         sst.do(params)
         db.session.commit()
-        for o in sst.options.keys():
+        for o in simple_results.keys():
             self.assertEqual(simple_results[o][1], get_values(o)[1][1],
                              msg="Current option: {0}".format(o))
 
@@ -65,7 +67,7 @@ class TaskSimpleStatsTestCase(MyTestCase):
 
         sst.do(params)
         db.session.commit()
-        for o in sst.options.keys():
+        for o in simple_results.keys():
             self.assertEqual(simple_results[o][2], get_values(o)[2][1],
                              msg="Current option: {0}".format(o))
 
@@ -82,10 +84,46 @@ class TaskSimpleStatsTestCase(MyTestCase):
         db.session.commit()
         self.assertEqual(3, len(get_values('assigned_tokens')))
         self.assertEqual(4, len(get_values('user_with_token')))
-        for o in sst.options.keys():
+        for o in simple_results.keys():
             if o != 'assigned_tokens':
                 self.assertEqual(simple_results[o][3], get_values(o)[3][1],
                                  msg="Current option: {0}".format(o))
         self.assertEqual(simple_results['assigned_tokens'][3],
                          get_values('assigned_tokens')[2][1])
 
+
+    def test_01_single_query_and_only_changed(self):
+        # The tokens of the previous test are still available
+        statements = []
+
+        def count_statement(conn, cursor, statement, parameters, context, executemany):
+            if "FROM token" in statement:
+                statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", count_statement)
+        try:
+            counters = get_token_counters()
+        finally:
+            event.remove(db.engine, "before_cursor_execute", count_statement)
+        self.assertEqual(len(statements), 1)
+        self.assertEqual(counters, {"total_tokens": 4, "hardware_tokens": 2,
+                                    "software_tokens": 2, "unassigned_hardware_tokens": 1,
+                                    "assigned_tokens": 2})
+
+        sst = SimpleStatsTask(current_app.config)
+        params = {o: True for o in simple_results}
+        params["only_changed"] = True
+        # All values are written in one batch
+        with mock.patch("privacyidea.lib.task.simplestats.write_multiple_stats") as mock_write:
+            sst.do(params)
+            mock_write.assert_called_once()
+            # Only the value, which was not written in the last run, has changed
+            self.assertEqual(mock_write.call_args[0][0], {"assigned_tokens": 2})
+        sst.do(params)
+        self.assertEqual(4, len(get_values('assigned_tokens')))
+        self.assertEqual(4, len(get_values('total_tokens')))
+
+        for serial in self.serials:
+            remove_token(serial)
+        for o in simple_results:
+            delete_stats(o)
@@ -19,18 +19,19 @@ from privacyidea.lib.tokenclass import (TokenClass, TOKENKIND,
                                         FAILCOUNTER_CLEAR_TIMEOUT)
 from privacyidea.lib.token import weigh_token_type
 from privacyidea.lib.tokens.totptoken import TotpTokenClass
-from privacyidea.models import (db, Token, Challenge, TokenRealm)
+from privacyidea.models import (db, Token, Challenge, TokenRealm, SerialCounter)
 from privacyidea.lib.config import (set_privacyidea_config, get_token_types,
                                     delete_privacyidea_config, SYSCONF)
 from privacyidea.lib.policy import (set_policy, SCOPE, ACTION, PolicyClass,
-                                    delete_policy)
-from privacyidea.lib.utils import b32encode_and_unicode, hexlify_and_unicode
+                                    delete_policy, ACTIONVALUE)
+from privacyidea.lib.utils import b32encode_and_unicode, hexlify_and_unicode, to_unicode
 from privacyidea.lib.error import PolicyError
 import datetime
 from dateutil import parser
 import hashlib
 import binascii
 import warnings
+import mock
 from privacyidea.lib.token import (create_tokenclass_object,
                                    get_tokens, list_tokengroups,
                                    get_token_type, check_serial,
@@ -61,8 +62,12 @@ from privacyidea.lib.token import (create_tokenclass_object,
                                    import_token, get_one_token,
                                    get_tokens_from_serial_or_user,
                                    get_tokens_paginated_generator,
-                                   assign_tokengroup, unassign_tokengroup)
+                                   assign_tokengroup, unassign_tokengroup,
+                                   enable_token_identity_map, disable_token_identity_map,
+                                   create_challenges_from_tokens, init_tokens_bulk,
+                                   _reserve_serial_numbers, verify_token_pins)
 from privacyidea.lib.tokengroup import set_tokengroup, delete_tokengroup
+from privacyidea.lib.framework import get_app_local_store
 from privacyidea.lib.error import (TokenAdminError, ParameterError,
                                    privacyIDEAError, ResourceNotFoundError)
 from privacyidea.lib.tokenclass import DATE_FORMAT
@@ -1609,6 +1614,218 @@ class TokenTestCase(MyTestCase):
         self.assertTrue(weigh_token_type(dummy_token("push")) > weigh_token_type(dummy_token("HOTP")))
         self.assertTrue(weigh_token_type(dummy_token("PUSH")) > weigh_token_type(dummy_token("hotp")))
 
+    def test_60_parallel_pin_verification(self):
+        from privacyidea.lib import crypto
+        from privacyidea.lib.framework import get_request_local_store
+        tokens = [init_token({"serial": "parallel{0!s}".format(i), "pin": "pin{0!s}".format(i),
+                              "otpkey": self.otpkey}) for i in range(3)]
+        self.app.config["PI_PIN_VERIFY_WORKERS"] = 3
+        try:
+            with mock.patch("privacyidea.lib.token.verify_pass_hashes",
+                            wraps=crypto.verify_pass_hashes) as mock_verify:
+                r, _reply = check_token_list(tokens, "pin1755224")
+                self.assertTrue(r)
+                # The whole password and the PIN part are checked for each token
+                candidates = mock_verify.call_args[0][0]
+                self.assertEqual(len(candidates), 6)
+                self.assertIn(("pin1", tokens[1].token.pin_hash), candidates)
+            self.assertNotIn("pass_hash_results", get_request_local_store())
+            # The whole password is only checked for tokens, which may do challenge-response
+            g = FakeFlaskG()
+            g.policy_object = PolicyClass()
+            g.audit_object = FakeAudit()
+            with mock.patch("privacyidea.lib.token.verify_pass_hashes",
+                            return_value=[]) as mock_verify:
+                verify_token_pins(tokens, "pin1755224", options={"g": g})
+                self.assertEqual(mock_verify.call_args[0][0],
+                                 [("pin1", token.token.pin_hash) for token in tokens])
+                set_policy("chalresp_hotp", scope=SCOPE.AUTH,
+                           action="{0!s}=hotp".format(ACTION.CHALLENGERESPONSE))
+                g.policy_object = PolicyClass()
+                verify_token_pins(tokens, "pin1755224", options={"g": g})
+                self.assertEqual(len(mock_verify.call_args[0][0]), 6)
+                delete_policy("chalresp_hotp")
+            self.assertEqual(tokens[1].token.count, 1)
+            r, _reply = check_token_list(tokens, "pin1755224")
+            self.assertFalse(r)
+            r, _reply = check_token_list(tokens, "wrong287082")
+            self.assertFalse(r)
+            r, _reply = check_token_list(tokens, "pin2287082")
+            self.assertTrue(r)
+            # The token PINs are not verified in advance, if the otppin policy
+            # checks the PIN against the user store
+            with mock.patch("privacyidea.lib.token.get_otppin_policy",
+                            return_value=(ACTIONVALUE.USERSTORE, None)), \
+                    mock.patch("privacyidea.lib.token.verify_pass_hashes",
+                               wraps=crypto.verify_pass_hashes) as mock_verify:
+                check_token_list(tokens, "pin0519450")
+                self.assertEqual(mock_verify.call_args[0][0], [])
+            # The results are removed, even if the token check fails
+            with mock.patch.object(TokenClass, "authenticate", side_effect=Exception("error")):
+                self.assertRaises(Exception, check_token_list, tokens, "pin0519450")
+            self.assertNotIn("pass_hash_results", get_request_local_store())
+        finally:
+            self.app.config.pop("PI_PIN_VERIFY_WORKERS")
+        # Without worker threads the PINs are checked one after another
+        with mock.patch("privacyidea.lib.token.verify_pass_hashes") as mock_verify:
+            r, _reply = check_token_list(tokens, "pin0287082")
+            self.assertTrue(r)
+            mock_verify.assert_not_called()
+        for token in tokens:
+            remove_token(token.token.serial)
+
+    def test_61_token_identity_map(self):
+        self.setUp_user_realms()
+        init_token({"serial": "IDMAP1", "type": "hotp", "otpkey": OTPKEY},
+                   user=User("cornelius", self.realm1))
+        # Without an identity map, each lookup creates a new token object
+        self.assertIsNot(get_one_token(serial="IDMAP1"), get_one_token(serial="IDMAP1"))
+        enable_token_identity_map()
+        try:
+            token = get_one_token(serial="IDMAP1")
+            self.assertIs(get_one_token(serial="IDMAP1"), token)
+            self.assertIs(get_tokens(user=User("cornelius", self.realm1))[0], token)
+            owner = get_token_owner("IDMAP1")
+            self.assertEqual(owner.login, "cornelius")
+            # The owner is only resolved once
+            with mock.patch("privacyidea.lib.tokenclass.get_username") as mock_username:
+                self.assertIs(get_token_owner("IDMAP1"), owner)
+                mock_username.assert_not_called()
+            # A changed owner is resolved again
+            unassign_token("IDMAP1")
+            self.assertIsNone(get_token_owner("IDMAP1"))
+            assign_token("IDMAP1", User("selfservice", self.realm1))
+            self.assertEqual(get_token_owner("IDMAP1").login, "selfservice")
+            # Deleted tokens are not returned anymore
+            remove_token("IDMAP1")
+            self.assertEqual(get_tokens(serial="IDMAP1"), [])
+        finally:
+            disable_token_identity_map()
+
+    def test_62_concurrent_challenge_dispatch(self):
+        import threading
+        import time
+        from privacyidea.lib import token as libtoken
+        tokens = [init_token({"serial": "CHALDISP{0!s}".format(i), "otpkey": OTPKEY})
+                  for i in range(3)]
+        tokens[2].enable(False)
+        g = FakeFlaskG()
+        g.policy_object = PolicyClass()
+        g.audit_object = FakeAudit()
+        self.app.config["PI_CHALLENGE_DISPATCH_WORKERS"] = 2
+        try:
+            with mock.patch("privacyidea.lib.token._create_challenge_by_id",
+                            wraps=libtoken._create_challenge_by_id) as mock_create:
+                reply = {}
+                create_challenges_from_tokens(tokens, reply, {"g": g})
+                self.assertEqual(mock_create.call_count, 2)
+            self.assertEqual([c["serial"] for c in reply["multi_challenge"]],
+                             ["CHALDISP0", "CHALDISP1"])
+            transaction_id = reply["transaction_id"]
+            self.assertEqual(reply["transaction_ids"], [transaction_id, transaction_id])
+            self.assertEqual(Challenge.query.filter_by(transaction_id=transaction_id).count(), 2)
+            self.assertIn("Token is disabled", reply["messages"])
+            # The workers use copies of the request globals
+            with mock.patch("privacyidea.lib.token._create_challenge_by_id") as mock_create:
+                mock_create.return_value = (True, "sent", "123", {})
+                create_challenges_from_tokens(tokens[:2], {}, {"g": g})
+                worker_globals = [c[0][2]["g"] for c in mock_create.call_args_list]
+            self.assertNotIn(g, worker_globals)
+            self.assertIsNot(worker_globals[0].audit_object, worker_globals[1].audit_object)
+            self.assertIsNot(worker_globals[0].audit_object.audit_data, g.audit_object.audit_data)
+
+            # Slow challenges are reported and created in the background
+            self.app.config["PI_CHALLENGE_DISPATCH_TIMEOUT"] = 0.1
+            release = threading.Event()
+            create_challenge = libtoken._create_challenge_by_id
+            slow_token_id = tokens[1].token.id
+
+            def slow_create_challenge(token_id, transaction_id, options):
+                if token_id == slow_token_id:
+                    release.wait(5)
+                return create_challenge(token_id, transaction_id, options)
+
+            # The challenges of HOTP tokens are awaited
+            threading.Timer(0.3, release.set).start()
+            with mock.patch("privacyidea.lib.token._create_challenge_by_id",
+                            side_effect=slow_create_challenge):
+                reply = {}
+                create_challenges_from_tokens(tokens[:2], reply)
+            self.assertEqual(reply["multi_challenge"][1]["message"], "please enter otp: ")
+            release.clear()
+            with mock.patch("privacyidea.lib.token._create_challenge_by_id",
+                            side_effect=slow_create_challenge), \
+                    mock.patch.object(tokens[1], "send_challenge_in_background", True):
+                reply = {}
+                create_challenges_from_tokens(tokens[:2], reply)
+                release.set()
+            self.assertEqual(len(reply["multi_challenge"]), 2)
+            self.assertEqual(reply["multi_challenge"][1]["message"],
+                             "The challenge is being sent.")
+            transaction_id = reply["multi_challenge"][1]["transaction_id"]
+            self.assertEqual(reply["multi_challenge"][0]["transaction_id"], transaction_id)
+            for _i in range(50):
+                if Challenge.query.filter_by(serial="CHALDISP1",
+                                             transaction_id=transaction_id).count():
+                    break
+                time.sleep(0.1)
+            self.assertEqual(Challenge.query.filter_by(transaction_id=transaction_id).count(), 2)
+        finally:
+            self.app.config.pop("PI_CHALLENGE_DISPATCH_WORKERS")
+            self.app.config.pop("PI_CHALLENGE_DISPATCH_TIMEOUT", None)
+        # Without worker threads the challenges are created one after another
+        with mock.patch("privacyidea.lib.token._create_challenge_by_id") as mock_create:
+            reply = {}
+            create_challenges_from_tokens(tokens[:2], reply)
+            mock_create.assert_not_called()
+            self.assertEqual(len(set(reply["transaction_ids"])), 1)
+        for token in tokens:
+            remove_token(token.token.serial)
+
+    def test_63_serial_blocks(self):
+        self.app.config["PI_SERIAL_BLOCK_SIZE"] = 3
+        try:
+            with mock.patch("privacyidea.lib.token._reserve_serial_numbers",
+                            wraps=_reserve_serial_numbers) as mock_reserve:
+                serials = [gen_serial(tokentype="hotp", prefix="BLOCK") for _i in range(4)]
+                # The first block continues after the existing HOTP tokens
+                hotp_count = Token.query.filter_by(tokentype="hotp").count()
+                self.assertEqual([serial[:9] for serial in serials],
+                                 ["BLOCK{0:04d}".format(hotp_count + i) for i in range(4)])
+                self.assertEqual(mock_reserve.call_count, 2)
+            # Another process reserves the next block
+            self.assertEqual(_reserve_serial_numbers("BLOCK", "hotp", 10), hotp_count + 6)
+            self.assertEqual(SerialCounter.query.filter_by(prefix="BLOCK").first().value,
+                             hotp_count + 16)
+            self.assertEqual(gen_serial(tokentype="hotp", prefix="BLOCK")[:9],
+                             "BLOCK{0:04d}".format(hotp_count + 4))
+        finally:
+            self.app.config.pop("PI_SERIAL_BLOCK_SIZE")
+            get_app_local_store().pop("serial_blocks", None)
+
+    def test_64_init_tokens_bulk(self):
+        self.assertRaises(ParameterError, init_tokens_bulk, 2, param={"type": "spass"})
+        self.assertRaises(ParameterError, init_tokens_bulk, 0)
+        tokens = init_tokens_bulk(5, param={"type": "totp", "prefix": "BULK", "hashlib": "sha256",
+                                            "timeStep": "60", "serial": "ignored"},
+                                  tokenrealms=[self.realm1], tokenkind="hardware", batch_size=2)
+        self.assertEqual(len(tokens), 5)
+        self.assertEqual(len(set(serial for serial, _otpkey in tokens)), 5)
+        for serial, otpkey in tokens:
+            self.assertTrue(serial.startswith("BULK"), serial)
+            # The keys are generated for each token
+            self.assertEqual(len(otpkey), 64)
+            token_obj = get_one_token(serial=serial)
+            self.assertEqual(token_obj.type, "totp")
+            self.assertEqual(token_obj.get_realms(), [self.realm1])
+            self.assertEqual(token_obj.get_tokeninfo("tokenkind"), "hardware")
+            self.assertEqual(token_obj.get_tokeninfo("timeStep"), "60")
+            self.assertEqual(token_obj.get_tokeninfo("hashlib"), "sha256")
+            self.assertEqual(to_unicode(token_obj.token.get_otpkey().getKey()), otpkey)
+        self.assertEqual(len(set(otpkey for _serial, otpkey in tokens)), 5)
+        self.assertEqual(check_serial(tokens[0][0]), (False, tokens[0][0] + "_01"))
+        for serial, _otpkey in tokens:
+            remove_token(serial)
 
 
 class TokenOutOfBandTestCase(MyTestCase):
@@ -9,7 +9,7 @@ from privacyidea.lib.token import get_tokens, remove_token
 from privacyidea.lib.error import ParameterError, privacyIDEAError
 from privacyidea.lib.utils import int_to_hex
 from privacyidea.lib.tokens.certificatetoken import (parse_chainfile, verify_certificate_path, ACTION,
-                                                     CertificateTokenClass)
+                                                     CertificateTokenClass, update_pending_certificates)
 from privacyidea.lib.policy import set_policy, delete_policy, PolicyClass, SCOPE
 import os
 import unittest
@@ -23,6 +23,7 @@ from privacyidea.lib.caconnectors.msca import ATTR as MS_ATTR
 from privacyidea.lib.token import init_token
 from privacyidea.lib.tokenclass import ROLLOUTSTATE
 from privacyidea.lib.user import User
+from privacyidea.lib.framework import get_app_local_store
 
 CERT = """-----BEGIN CERTIFICATE-----
 MIIGXDCCBUSgAwIBAgITYwAAAA27DqXl0fVdOAAAAAAADTANBgkqhkiG9w0BAQsF
@@ -694,3 +695,56 @@ class MSCACertTestCase(MyTestCase):
             r = cert_tok._update_rollout_state()
             self.assertEqual(-1, r)
             self.assertEqual(ROLLOUTSTATE.PENDING, cert_tok.rollout_state)
+
+    @unittest.skipUnless("privacyidea.lib.caconnectors.msca.MSCAConnector" in AvailableCAConnectors,
+                         "Can not test MSCA. grpc module seems not available.")
+    def test_04_msca_update_pending_certificates(self):
+        get_app_local_store().pop("caconnector_objects", None)
+        with mock.patch.object(MSCAConnector, "_connect_to_worker") as mock_conncect_worker:
+            # Mock the CA to simulate a Pending Request - disposition 5
+            mock_conncect_worker.return_value = CAServiceMock(CONF,
+                                                              {"available_cas": MOCK_AVAILABLE_CAS,
+                                                               "ca_templates": MOCK_CA_TEMPLATES,
+                                                               "csr_disposition": 5,
+                                                               "certificate": CERTIFICATE})
+            serials = []
+            for _i in range(3):
+                cert_tok = init_token({"type": "certificate",
+                                       "ca": "billCA",
+                                       "template": "ApprovalRequired",
+                                       "genkey": 1,
+                                       "user": "cornelius",
+                                       "realm": self.realm1
+                                       }, User("cornelius", self.realm1))
+                self.assertEqual(ROLLOUTSTATE.PENDING, cert_tok.rollout_state)
+                serials.append(cert_tok.token.serial)
+            mock_conncect_worker.reset_mock()
+
+            # Reading the tokens does not contact the CA
+            with mock.patch.object(MSCAConnector, "get_cr_status") as mock_status:
+                tokens = get_tokens(serial=serials[0])
+                self.assertEqual(ROLLOUTSTATE.PENDING, tokens[0].rollout_state)
+                mock_status.assert_not_called()
+
+            # The requests are still pending
+            r = update_pending_certificates(batch_size=2)
+            self.assertGreaterEqual(r.get("checked"), 3)
+            self.assertEqual(r.get("enrolled"), 0)
+            self.assertEqual(r.get("failed"), 0)
+            # The CA connector and its connection is created only once
+            self.assertEqual(mock_conncect_worker.call_count, 1)
+
+            mock_conncect_worker.return_value.disposition = 3
+            r = update_pending_certificates(batch_size=2)
+            self.assertEqual(r.get("enrolled"), 3)
+            # ...and reused in the next run
+            self.assertEqual(mock_conncect_worker.call_count, 1)
+            for serial in serials:
+                token = get_tokens(serial=serial)[0]
+                self.assertEqual(ROLLOUTSTATE.ENROLLED, token.rollout_state)
+                self.assertTrue(token.get_tokeninfo("certificate"))
+
+            # The enrolled tokens are not checked again
+            r = update_pending_certificates()
+            self.assertEqual(r.get("enrolled"), 0)
+        get_app_local_store().pop("caconnector_objects", None)
@@ -4,6 +4,7 @@ This test file tests the lib.user
 The lib.user.py only depends on the database model
 """
 import logging
+import mock
 
 from testfixtures import log_capture
 
@@ -14,6 +15,8 @@ from privacyidea.lib.realm import (set_realm, delete_realm)
 from privacyidea.lib.user import (User, create_user,
                                   get_username,
                                   get_user_list,
+                                  iter_user_list,
+                                  get_resolver_executor,
                                   split_user,
                                   get_user_from_param,
                                   UserError)
@@ -519,6 +522,54 @@ class UserTestCase(MyTestCase):
         delete_realm("ldap")
         delete_resolver("ldapresolver")
 
+    def test_20_concurrent_resolvers(self):
+        for name in ["double1", "double2", "double3"]:
+            save_resolver({"resolver": name,
+                           "type": "passwdresolver",
+                           "fileName": PWFILE})
+        set_realm("double", [{'name': "double1", 'priority': 2},
+                             {'name': "double2", 'priority': 1},
+                             {'name': "double3", 'priority': 3}])
+        self.app.config["PI_RESOLVER_WORKERS"] = 3
+        try:
+            self.assertIsNotNone(get_resolver_executor())
+            # The resolver with the highest priority wins, although all
+            # resolvers are queried at the same time
+            user = get_user_from_param({"user": "cornelius", "realm": "double"})
+            self.assertEqual(user.resolver, "double2")
+            # The worker threads load the resolvers and return their resources
+            with mock.patch("privacyidea.lib.lifecycle.call_finalizers") as mock_finalizers:
+                user = User("cornelius", realm="double")
+            self.assertEqual(user.resolver, "double2")
+            self.assertGreaterEqual(mock_finalizers.call_count, 1)
+            # An unknown user is not found in any resolver
+            self.assertFalse(User("unknown", realm="double").exist())
+
+            # The user list contains the users of all resolvers in the order
+            # of the resolvers
+            userlist = get_user_list({"realm": "double", "username": "cornelius"})
+            self.assertEqual(len(userlist), 3)
+            self.assertEqual({u.get("resolver") for u in userlist},
+                             {"double1", "double2", "double3"})
+            self.assertEqual(list(iter_user_list({"realm": "double", "username": "cornelius"})),
+                             userlist)
+            # Only the next resolver is searched in advance
+            executor = get_resolver_executor()
+            with mock.patch.object(executor, "submit", wraps=executor.submit) as mock_submit:
+                users = iter_user_list({"realm": "double", "username": "cornelius"})
+                next(users)
+                self.assertEqual(mock_submit.call_count, 2)
+                self.assertEqual(len(list(users)), 2)
+                self.assertEqual(mock_submit.call_count, 3)
+        finally:
+            self.app.config.pop("PI_RESOLVER_WORKERS")
+        self.assertIsNone(get_resolver_executor())
+        self.assertEqual(get_user_list({"realm": "double", "username": "cornelius"}),
+                         userlist)
+        delete_realm("double")
+        for name in ["double1", "double2", "double3"]:
+            delete_resolver(name)
+
     def test_50_user_attributes(self):
         user = User(login="root",
                     realm=self.realm1)